@@ -0,0 +1,76 @@
+'''
+Benchmark the diff used to record edit history against `difflib`, on large
+synthetic notes which look like logs, with many similar lines.
+
+Each note is edited by changing, inserting and deleting lines spread
+throughout it, and the time to produce a unified diff of the edit is
+measured with each implementation.
+
+Usage:
+    python benchmarks/history_diff.py --lines 2000 5000 --edits 50
+'''
+import sys
+import time
+import random
+import difflib
+import argparse
+
+from shorthand.utils.diff import unified_diff
+
+
+def get_log_note(line_count, rng):
+    levels = ['INFO', 'DEBUG', 'WARNING']
+    return [f'- [{levels[rng.randrange(3)]}] worker {rng.randrange(8)} '
+            f'processed batch {rng.randrange(50)}\n'
+            for _ in range(line_count)]
+
+
+def edit_note(lines, edit_count, rng):
+    lines = list(lines)
+    for idx in range(edit_count):
+        position = rng.randrange(len(lines))
+        action = idx % 3
+        if action == 0:
+            lines[position] = f'- [ERROR] edit {idx}\n'
+        elif action == 1:
+            lines.insert(position, f'- [INFO] inserted line {idx}\n')
+        else:
+            del lines[position]
+    return lines
+
+
+def time_diff(diff_function, old, new, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        diff = ''.join(diff_function(old, new, 'old', 'new'))
+    return (time.perf_counter() - start) / repeat, diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark edit history '
+                                                 'diffs against difflib')
+    parser.add_argument('--lines', type=int, nargs='+',
+                        default=[1000, 2000, 5000],
+                        help='Number of lines in each synthetic note')
+    parser.add_argument('--edits', type=int, default=50,
+                        help='Number of lines changed in each edit')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to time each diff')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f'{"lines":>8} {"difflib":>12} {"shorthand":>12} {"speedup":>9}')
+    for line_count in args.lines:
+        old = get_log_note(line_count, rng)
+        new = edit_note(old, args.edits, rng)
+        difflib_time, difflib_diff = time_diff(difflib.unified_diff,
+                                               old, new, args.repeat)
+        shorthand_time, shorthand_diff = time_diff(unified_diff,
+                                                   old, new, args.repeat)
+        print(f'{line_count:>8} {difflib_time * 1e3:>10.1f}ms '
+              f'{shorthand_time * 1e3:>10.1f}ms '
+              f'{difflib_time / shorthand_time:>8.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
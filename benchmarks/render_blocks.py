@@ -0,0 +1,73 @@
+'''
+Benchmark re-rendering a large note after small edits.
+
+Renders a synthetic journal note once with an empty block cache, then
+measures how long it takes to render it again after editing a line in
+the middle of the note, and after inserting a line at the top of the
+note, which shifts the line numbers of every block after it.
+
+Usage:
+    python benchmarks/render_blocks.py --lines 5000
+'''
+import sys
+import time
+import random
+import argparse
+
+from shorthand.frontend import render
+from shorthand.frontend.render import get_rendered_markdown
+
+
+WORDS = ['apple', 'pie', 'meeting', 'notes', 'follow', 'up', 'with', 'team',
+         'about', 'release', 'plan', 'and', 'the', 'project']
+
+
+def make_note(line_count, rng, headings=True):
+    lines = []
+    while len(lines) < line_count:
+        if headings and len(lines) % 100 == 0:
+            lines.append(f'# Day {len(lines) // 100}')
+        kind = rng.random()
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        if kind < 0.1:
+            lines.append(f'[ ] {text} :work:')
+        elif kind < 0.15:
+            lines.append(f'? {text}')
+        elif kind < 0.2:
+            lines.extend(['```', text, '```'])
+        else:
+            lines.append(f'- {text} [link](/other.note)')
+    return '\n'.join(lines)
+
+
+def time_render(content):
+    start = time.perf_counter()
+    get_rendered_markdown(content, '/journal.note')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark block-level '
+                                                 'rendering of large notes')
+    parser.add_argument('--lines', type=int, default=5000,
+                        help='Number of lines in the note')
+    parser.add_argument('--no-headings', action='store_true',
+                        help='Generate a note without any headings')
+    args = parser.parse_args()
+
+    content = make_note(args.lines, random.Random(0),
+                        headings=not args.no_headings)
+    render._rendered_block_cache.clear()
+    print(f'Full render:            {time_render(content) * 1e3:8.1f}ms')
+
+    lines = content.split('\n')
+    lines[len(lines) // 2] += ' edited'
+    content = '\n'.join(lines)
+    print(f'After editing a line:   {time_render(content) * 1e3:8.1f}ms')
+
+    content = 'New first line\n' + content
+    print(f'After inserting a line: {time_render(content) * 1e3:8.1f}ms')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+'''
+Benchmark the inverted search index against the scanning search backend.
+
+Builds the index for a synthetic set of notes, then measures how long the
+first query takes to load the index, how long a set of queries takes with
+each backend, and how long it takes to sync the index after a single note
+is edited.
+
+Usage:
+    python benchmarks/search_index.py --notes 5000 --lines 40
+'''
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from shorthand.search import _search_full_text
+from shorthand.search_index import _refresh_search_index, \
+                                   _search_full_text_indexed, \
+                                   _sync_search_index_path
+
+
+QUERIES = ['apple', 'ple', '"project meeting"', 'release plan', 'zzz',
+           'tea', '"follow up" team']
+
+
+def make_word(rng):
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                   for _ in range(rng.randint(3, 9)))
+
+
+def write_notes(notes_directory, note_count, line_count, rng):
+    words = [make_word(rng) for _ in range(20000)] + \
+        ['apple', 'pie', 'project', 'meeting', 'follow', 'up', 'team',
+         'release', 'plan']
+    for idx in range(note_count):
+        lines = [' '.join(rng.choice(words)
+                          for _ in range(rng.randint(3, 12)))
+                 for _ in range(line_count)]
+        with open(f'{notes_directory}/note-{idx}.note', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def time_queries(search):
+    start = time.perf_counter()
+    for query in QUERIES:
+        search(query)
+    return (time.perf_counter() - start) / len(QUERIES)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the search '
+                                                 'index backend')
+    parser.add_argument('--notes', type=int, default=5000,
+                        help='Number of synthetic notes')
+    parser.add_argument('--lines', type=int, default=40,
+                        help='Number of lines in each note')
+    args = parser.parse_args()
+
+    notes_directory = tempfile.mkdtemp()
+    try:
+        write_notes(notes_directory, args.notes, args.lines,
+                    random.Random(0))
+
+        start = time.perf_counter()
+        _refresh_search_index(notes_directory)
+        print(f'Build index:    {(time.perf_counter() - start) * 1e3:9.1f}ms')
+
+        # The first query loads the index into memory
+        start = time.perf_counter()
+        _search_full_text_indexed(notes_directory, 'apple')
+        print(f'First query:    {(time.perf_counter() - start) * 1e3:9.1f}ms')
+        indexed = time_queries(
+            lambda query: _search_full_text_indexed(notes_directory, query))
+        scanned = time_queries(
+            lambda query: _search_full_text(notes_directory, query))
+        print(f'Indexed query:  {indexed * 1e3:9.1f}ms')
+        print(f'Scanned query:  {scanned * 1e3:9.1f}ms')
+
+        with open(f'{notes_directory}/note-0.note', 'a') as f:
+            f.write('apple pie for the project meeting\n')
+        start = time.perf_counter()
+        _sync_search_index_path(notes_directory, '/note-0.note')
+        _search_full_text_indexed(notes_directory, 'apple')
+        print(f'Sync and query: {(time.perf_counter() - start) * 1e3:9.1f}ms')
+    finally:
+        shutil.rmtree(notes_directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+'''
+Benchmark the per-request overhead of the web app's server handling.
+
+Compares constructing a new ShorthandServer for every request (which
+re-reads and validates the config and re-creates the log handler) with
+re-using a single long-lived server which only checks whether the config
+file has changed.
+
+Usage:
+    python benchmarks/server_overhead.py /path/to/shorthand_config.json
+'''
+import sys
+import time
+import argparse
+
+from shorthand import ShorthandServer
+
+
+def time_requests(get_server, request_count):
+    start = time.perf_counter()
+    for _ in range(request_count):
+        server = get_server()
+        server.get_config()
+    return (time.perf_counter() - start) / request_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-request '
+                                                 'server overhead')
+    parser.add_argument('config_path', type=str,
+                        help='Path to the shorthand config file')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='Number of simulated requests')
+    args = parser.parse_args()
+
+    per_request = time_requests(
+        lambda: ShorthandServer(args.config_path), args.requests)
+
+    shared_server = ShorthandServer(args.config_path)
+
+    def get_shared_server():
+        shared_server.reload_config_if_changed()
+        return shared_server
+
+    shared = time_requests(get_shared_server, args.requests)
+
+    print(f'New server per request: {per_request * 1e6:10.1f} us/request')
+    print(f'Shared server:          {shared * 1e6:10.1f} us/request')
+    print(f'Speedup:                {per_request / shared:10.1f}x')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
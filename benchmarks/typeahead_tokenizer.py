@@ -0,0 +1,87 @@
+'''
+Benchmark the tokenizers used to build the typeahead n-gram database.
+
+Measures how long it takes to import the typeahead module, and how long a
+full rebuild of the n-gram database takes with each tokenizer on a
+synthetic set of notes. The `nltk` tokenizer requires NLTK and its punkt
+data to be installed, and is skipped if they aren't available.
+
+Usage:
+    python benchmarks/typeahead_tokenizer.py --notes 500 --lines 100
+'''
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from shorthand.frontend.typeahead import _update_ngram_database, \
+                                         get_ngram_db_dir
+
+
+WORDS = ['apple', 'pie', 'what', 'is', 'the', 'best', 'way', 'to', 'cook',
+         'dinner', 'for', 'this', 'week', 'project', 'meeting', 'notes',
+         'follow', 'up', 'with', 'team', 'about', 'release', 'plan']
+
+
+def time_import(module):
+    '''Time importing a module in a fresh interpreter
+    '''
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import {module}'], check=True)
+    return time.perf_counter() - start
+
+
+def write_notes(notes_directory, note_count, line_count, rng):
+    for idx in range(note_count):
+        lines = []
+        for _ in range(line_count):
+            sentences = [' '.join(rng.choice(WORDS)
+                                  for _ in range(rng.randint(3, 10))) + '.'
+                         for _ in range(rng.randint(1, 3))]
+            lines.append('- ' + ' '.join(sentences))
+        with open(f'{notes_directory}/note-{idx}.note', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def time_rebuild(notes_directory, tokenizer):
+    shutil.rmtree(get_ngram_db_dir(notes_directory), ignore_errors=True)
+    start = time.perf_counter()
+    _update_ngram_database(notes_directory, tokenizer=tokenizer)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark typeahead '
+                                                 'tokenizers')
+    parser.add_argument('--notes', type=int, default=500,
+                        help='Number of synthetic notes')
+    parser.add_argument('--lines', type=int, default=100,
+                        help='Number of lines in each note')
+    args = parser.parse_args()
+
+    print(f'Import shorthand.frontend.typeahead: '
+          f'{time_import("shorthand.frontend.typeahead") * 1e3:8.1f}ms')
+    print(f'Import nltk:                         '
+          f'{time_import("nltk") * 1e3:8.1f}ms')
+
+    notes_directory = tempfile.mkdtemp()
+    try:
+        write_notes(notes_directory, args.notes, args.lines,
+                    random.Random(0))
+        for tokenizer in ['regex', 'nltk']:
+            try:
+                rebuild_time = time_rebuild(notes_directory, tokenizer)
+            except (ImportError, LookupError) as e:
+                print(f'Rebuild with {tokenizer}: skipped ({type(e).__name__})')
+                continue
+            print(f'Rebuild with {tokenizer:5}:                 '
+                  f'{rebuild_time * 1e3:8.1f}ms')
+    finally:
+        shutil.rmtree(notes_directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
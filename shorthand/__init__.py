@@ -1,7 +1,8 @@
 import logging
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 
+from shorthand.blame import _get_note_blame
 from shorthand.edit_timeline import get_edit_timeline
 from shorthand.frontend import clear_open_files, close_file, get_open_files, open_file
 from shorthand.notes import _get_note, _update_note, \
@@ -14,18 +15,46 @@ from shorthand.toc import _get_toc
 from shorthand.stamping import _stamp_notes, _stamp_raw_note
 from shorthand.search import _search_full_text, _search_filenames, \
                              _record_file_view
+from shorthand.search_index import _search_full_text_indexed, \
+                                   _refresh_search_index, \
+                                   _sync_search_index_path
+from shorthand.search_sqlite import _search_full_text_sqlite, \
+                                    _refresh_sqlite_search_index, \
+                                    _sync_sqlite_search_path
 from shorthand.elements.todos import TodoStatus, _get_todos, _mark_todo
 from shorthand.elements.questions import QuestionStatus, _get_questions
 from shorthand.elements.definitions import _get_definitions
 from shorthand.elements.locations import _get_locations
 from shorthand.elements.record_sets import _get_record_sets, _get_record_set
+from shorthand.elements.combined import _get_elements
+from shorthand.element_index import _refresh_element_index, \
+                                    _sync_element_index_paths, \
+                                    _get_indexed_todos, \
+                                    _get_indexed_questions, \
+                                    _get_indexed_definitions, \
+                                    _get_indexed_locations, \
+                                    _get_indexed_record_sets, \
+                                    _get_indexed_tags, _get_indexed_calendar, \
+                                    _get_indexed_elements
+from shorthand.frontend.render import RenderedMarkdown
+from shorthand.frontend.render_cache import RenderCache, RenderCacheStats, \
+                                            _get_rendered_note, \
+                                            get_render_cache_dir
 from shorthand.frontend.typeahead import _update_ngram_database, \
                                          _get_typeahead_suggestions
+from shorthand.frontend.typeahead_sources import TypeaheadSource, \
+                                                 _get_typeahead_completions, \
+                                                 _sync_typeahead_sources
 from shorthand.types import InternalAbsoluteFilePath, InternalAbsolutePath, NotePath, Subdir
 from shorthand.utils.archive import _get_note_archive
 from shorthand.utils.config import _get_notes_config, _write_config, \
                                    _modify_config
-from shorthand.utils.paths import _get_subdirs, _is_note_path, get_full_path
+from shorthand.utils.paths import _get_subdirs, _is_note_path, \
+                                  get_full_path, get_relative_path
+from shorthand.watcher import ChangeEvent, NotesWatcher
+from shorthand.history_worker import HistoryWorker
+from shorthand.history_compaction import DEFAULT_HISTORY_RETENTION_DAYS, \
+                                         _compact_edit_history
 from shorthand.utils.logging import get_handler, log_level_from_string
 from shorthand.utils.buffers import BufferContent, BufferID, _new_buffer, _list_buffers, \
                                     _get_buffer_content, \
@@ -34,7 +63,8 @@ from shorthand.utils.buffers import BufferContent, BufferID, _new_buffer, _list_
 from shorthand.utils.filesystem import _create_file, _create_directory, \
                                        _move_file_or_directory, _delete_file, \
                                        _delete_directory, _upload_resource
-from shorthand.edit_history import NoteDiffTimestamp, NoteDiffType, \
+from shorthand.edit_history import HistoryProgressCallback, \
+                                   NoteDiffTimestamp, NoteDiffType, \
                                    NoteVersionTimestamp, \
                                    _store_history_for_note_create, \
                                    _store_history_for_note_edit, \
@@ -43,7 +73,9 @@ from shorthand.edit_history import NoteDiffTimestamp, NoteDiffType, \
                                    _list_note_versions, _get_note_version, \
                                    _list_diffs_for_note, _get_note_diff, \
                                    _store_history_for_directory_move, \
-                                   _store_history_for_directory_delete
+                                   _store_history_for_directory_delete, \
+                                   _migrate_edit_history, _get_note_at, \
+                                   _diff_note_versions
 
 # Set up the default module-level logger which the rest of the library
 #   will inherit. This will be updated with the settings specified in the
@@ -74,18 +106,34 @@ class ShorthandServer(object):
         self.log = log
 
         self.config_path = config_path
+        self.config_mtime = None
+        self.logging_config = None
+        self.watcher = None
+        self.watch_notes = None
+        self.history_worker = None
+        self.render_cache = None
+        self.render_cache_config = None
         self.reload_config()
 
     def setup_logging(self):
-        '''Setup logging handlers to match what is specified in config
+        '''Setup logging handlers to match what is specified in config.
+           The existing handlers are only replaced if the logging
+           config has changed since they were set up
         '''
+        logging_config = (self.config['log_file_path'],
+                          self.config['log_level'],
+                          self.config['log_format'])
         self.log.setLevel(log_level_from_string(self.config['log_level']))
+        if logging_config == self.logging_config and self.log.handlers:
+            return
+
         if self.log.handlers:
             for h in self.log.handlers:
                 h.close()
             self.log.handlers.clear()
         log_handler = get_handler(self.config)
         self.log.addHandler(log_handler)
+        self.logging_config = logging_config
 
     # -------------------------
     # --- Config Management ---
@@ -99,14 +147,75 @@ class ShorthandServer(object):
     def reload_config(self):
         '''Reload the config from the config file
         '''
+        config_mtime = self.get_config_mtime()
         self.config = _get_notes_config(self.config_path)
+        self.config_mtime = config_mtime
         self.notes_directory = self.config['notes_directory']
         self.grep_path = self.config['grep_path']
         self.find_path = self.config['find_path']
         self.patch_path = self.config['patch_path']
         self.track_edit_history = self.config['track_edit_history']
+        self.element_index = self.config['element_index']
+        self.search_backend = self.config['search_backend']
+        self.scan_workers = self.config['scan_workers']
+        # The watcher is started when watching is enabled in the config,
+        # but not when the config is first loaded
+        watching_enabled = self.watch_notes is False and \
+            self.config['watch_notes']
+        self.watch_notes = self.config['watch_notes']
+        self.stamp_on_change = self.config['stamp_on_change']
+        self.async_history = self.config['async_history']
+        self.typeahead_tokenizer = self.config['typeahead_tokenizer']
+        self.ngram_workers = self.config['ngram_workers']
+        self.render_cache_bytes = self.config['render_cache_bytes']
+        self.render_cache_spill = self.config['render_cache_spill']
         self.setup_logging()
 
+        # Cached renderings are kept unless the cache config changed
+        render_cache_config = (self.notes_directory, self.render_cache_bytes,
+                               self.render_cache_spill)
+        if render_cache_config != self.render_cache_config:
+            self.render_cache = None
+            if self.render_cache_bytes:
+                self.render_cache = RenderCache(
+                    max_size=self.render_cache_bytes,
+                    spill_dir=get_render_cache_dir(self.notes_directory)
+                    if self.render_cache_spill else None)
+            self.render_cache_config = render_cache_config
+
+        # Edits queued with the old config are recorded before switching
+        self.stop_history_worker()
+        if self.async_history and self.track_edit_history:
+            self.start_history_worker()
+
+        # Restart a running watcher if the notes directory changed
+        if self.watcher is not None and \
+                (not self.watch_notes or
+                 self.watcher.notes_directory != self.notes_directory):
+            self.stop_watcher()
+            if self.watch_notes:
+                self.start_watcher()
+        elif watching_enabled:
+            self.start_watcher()
+
+    def get_config_mtime(self) -> Optional[int]:
+        '''Get the modification time of the config file, if it exists
+        '''
+        try:
+            return os.stat(os.path.expanduser(self.config_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload_config_if_changed(self) -> bool:
+        '''Reload the config only if the config file was modified since
+           it was last loaded. Returns whether the config was reloaded
+        '''
+        if self.get_config_mtime() == self.config_mtime:
+            return False
+        self.log.info('Config file changed, reloading config')
+        self.reload_config()
+        return True
+
     def update_config(self, updates):
         '''Update one or more fields in the configuration
            Note: This will save the updated config to disk
@@ -144,29 +253,37 @@ class ShorthandServer(object):
         if not self.is_note_path(note_path):
             raise ValueError('Only note files can be updated')
 
-        if self.track_edit_history:
+        # The worker can be replaced by a config reload at any time
+        history_worker = self.history_worker
+        if self.track_edit_history and history_worker is not None:
+            history_worker.record_edit(
+                note_path=note_path, old_content=self.get_note(note_path),
+                new_content=content)
+        elif self.track_edit_history:
             _store_history_for_note_edit(notes_directory=self.notes_directory,
                                          note_path=note_path, new_content=content,
                                          find_path=self.find_path,
                                          patch_path=self.patch_path)
 
-        return _update_note(notes_directory=self.notes_directory,
-                            file_path=note_path, content=content)
+        _update_note(notes_directory=self.notes_directory,
+                     file_path=note_path, content=content)
+        self._sync_changed_paths([note_path])
 
     def append_to_note(self, note_path, content, blank_lines=1):
-        return _append_to_note(notes_directory=self.notes_directory,
-                               note_path=note_path, content=content,
-                               blank_lines=blank_lines)
+        _append_to_note(notes_directory=self.notes_directory,
+                        note_path=note_path, content=content,
+                        blank_lines=blank_lines)
+        self._sync_changed_paths([note_path])
 
     def validate_internal_links(self, source: Optional[NotePath] = None):
         return _validate_internal_links(
             notes_directory=self.notes_directory,
-            source=source, grep_path=self.grep_path)
+            source=source, scan_workers=self.scan_workers)
 
     def get_backlinks(self, note_path: NotePath):
         return _get_backlinks(notes_directory=self.notes_directory,
                               note_path=note_path,
-                              grep_path=self.grep_path)
+                              scan_workers=self.scan_workers)
 
     def get_links(self, source=None, target=None, note=None,
                   include_external=False, include_invalid=False):
@@ -174,16 +291,18 @@ class ShorthandServer(object):
                           source=source, target=target, note=note,
                           include_external=include_external,
                           include_invalid=include_invalid,
-                          grep_path=self.grep_path)
+                          scan_workers=self.scan_workers)
 
     # Stamping
     def stamp_notes(self, stamp_todos=True, stamp_today=True,
                     stamp_questions=True, stamp_answers=True):
-        return _stamp_notes(notes_directory=self.notes_directory,
-                            stamp_todos=stamp_todos, stamp_today=stamp_today,
-                            stamp_questions=stamp_questions,
-                            stamp_answers=stamp_answers,
-                            grep_path=self.grep_path)
+        changes = _stamp_notes(notes_directory=self.notes_directory,
+                               stamp_todos=stamp_todos,
+                               stamp_today=stamp_today,
+                               stamp_questions=stamp_questions,
+                               stamp_answers=stamp_answers)
+        self._sync_changed_paths(list(changes.keys()))
+        return changes
 
     def stamp_raw_note(self, raw_note, stamp_todos=True, stamp_today=True,
                        stamp_questions=True, stamp_answers=True):
@@ -194,21 +313,57 @@ class ShorthandServer(object):
 
     # Search
     def search_full_text(self, query_string, case_sensitive=False,
-                         aggregate_by_file=False):
+                         aggregate_by_file=False, include_highlights=False):
+        '''Search the content of all notes. Highlight offsets are only
+           included in results from the sqlite backend
+        '''
+        if self.search_backend == 'sqlite':
+            return _search_full_text_sqlite(
+                notes_directory=self.notes_directory,
+                query_string=query_string, case_sensitive=case_sensitive,
+                aggregate_by_file=aggregate_by_file,
+                include_highlights=include_highlights)
+        elif self.search_backend == 'index':
+            return _search_full_text_indexed(
+                notes_directory=self.notes_directory,
+                query_string=query_string, case_sensitive=case_sensitive,
+                aggregate_by_file=aggregate_by_file)
         return _search_full_text(
             notes_directory=self.notes_directory,
             query_string=query_string, case_sensitive=case_sensitive,
             aggregate_by_file=aggregate_by_file,
             grep_path=self.grep_path)
 
+    def refresh_search_index(self):
+        if self.search_backend == 'sqlite':
+            _refresh_sqlite_search_index(notes_directory=self.notes_directory)
+        elif self.search_backend == 'index':
+            _refresh_search_index(notes_directory=self.notes_directory)
+
+    def _sync_changed_paths(self, paths: List[InternalAbsolutePath]):
+        '''Update the search backend, element index, and typeahead sources
+           after the notes or directories at the specified paths were
+           changed through the server or picked up by the watcher
+        '''
+        _sync_typeahead_sources(notes_directory=self.notes_directory,
+                                paths=paths)
+        for path in paths:
+            if self.search_backend == 'sqlite':
+                _sync_sqlite_search_path(
+                    notes_directory=self.notes_directory, path=path)
+            elif self.search_backend == 'index':
+                _sync_search_index_path(
+                    notes_directory=self.notes_directory, path=path)
+        if self.element_index:
+            _sync_element_index_paths(notes_directory=self.notes_directory,
+                                      paths=paths)
+
     def search_filenames(self, prefer_recent=True, query_string=None,
                          case_sensitive=False):
         return _search_filenames(
                 notes_directory=self.notes_directory,
                 prefer_recent_files=prefer_recent,
-                query_string=query_string, case_sensitive=case_sensitive,
-                grep_path=self.grep_path,
-                find_path=self.find_path)
+                query_string=query_string, case_sensitive=case_sensitive)
 
     def record_file_view(self, note_path: NotePath):
         return _record_file_view(
@@ -219,32 +374,153 @@ class ShorthandServer(object):
     # Calendar
     def get_calendar(self, mode: CalendarMode = 'recent',
                      directory_filter=None):
+        if self.element_index:
+            return _get_indexed_calendar(notes_directory=self.notes_directory,
+                                         mode=mode,
+                                         directory_filter=directory_filter)
         return _get_calendar(notes_directory=self.notes_directory,
                              mode=mode,
                              directory_filter=directory_filter,
-                             grep_path=self.grep_path)
+                             scan_workers=self.scan_workers)
 
     # Tags
     def get_tags(self, directory_filter=None):
+        if self.element_index:
+            return _get_indexed_tags(notes_directory=self.notes_directory,
+                                     directory_filter=directory_filter)
         return _get_tags(notes_directory=self.notes_directory,
                          directory_filter=directory_filter,
-                         grep_path=self.grep_path)
+                         scan_workers=self.scan_workers)
 
     # TOC
     def get_toc(self, include_resources=False):
         return _get_toc(notes_directory=self.notes_directory,
                         include_resources=include_resources)
 
+    # Rendering
+    def get_rendered_markdown(self, note_path: NotePath) -> RenderedMarkdown:
+        return _get_rendered_note(notes_directory=self.notes_directory,
+                                  note_path=note_path,
+                                  cache=self.render_cache)
+
+    def get_render_cache_stats(self) -> Optional[RenderCacheStats]:
+        if self.render_cache is None:
+            return None
+        return self.render_cache.get_stats()
+
     # Typeahead
-    def update_ngram_database(self):
+    def update_ngram_database(self, paths=None):
         return _update_ngram_database(
-            notes_directory=self.notes_directory)
+            notes_directory=self.notes_directory,
+            tokenizer=self.typeahead_tokenizer,
+            workers=self.ngram_workers, paths=paths)
 
     def get_typeahead_suggestions(self, query_string, limit=10):
         return _get_typeahead_suggestions(
             notes_directory=self.notes_directory,
             query_string=query_string, limit=limit)
 
+    def get_typeahead_completions(self, query_string: str,
+                                  sources: Dict[TypeaheadSource, int]
+                                  ) -> Dict[TypeaheadSource, List[str]]:
+        return _get_typeahead_completions(
+            notes_directory=self.notes_directory,
+            query_string=query_string, sources=sources)
+
+    # Watcher
+    def start_watcher(self):
+        '''Start watching the notes directory in the background, so that
+           changes made outside of the server are picked up by stamping
+           and by any indexes which are in use
+        '''
+        if self.watcher is not None:
+            return
+        self.watcher = NotesWatcher(self.notes_directory)
+        self.watcher.subscribe(self.handle_note_changes)
+        self.watcher.start()
+
+    def stop_watcher(self):
+        if self.watcher is None:
+            return
+        self.watcher.stop()
+        self.watcher = None
+
+    def start_history_worker(self):
+        '''Record the history for note edits in the background, instead of
+           before each edit is saved
+        '''
+        if self.history_worker is not None:
+            return
+        self.history_worker = HistoryWorker(
+            self.notes_directory, find_path=self.find_path,
+            patch_path=self.patch_path)
+        self.history_worker.start()
+
+    def stop_history_worker(self):
+        '''Stop recording history in the background, once every queued
+           edit has been recorded
+        '''
+        history_worker = self.history_worker
+        if history_worker is None:
+            return
+        history_worker.stop()
+        self.history_worker = None
+
+    def flush_history(self):
+        '''Wait for any edits queued in the background to be recorded, so
+           that the stored history is up to date
+        '''
+        history_worker = self.history_worker
+        if history_worker is not None:
+            history_worker.flush()
+
+    def get_history_queue_depth(self) -> int:
+        '''Get the number of notes with edits waiting to be recorded
+        '''
+        history_worker = self.history_worker
+        if history_worker is None:
+            return 0
+        return history_worker.queue_depth()
+
+    def handle_note_changes(self, events: List[ChangeEvent]):
+        '''Bring stamps and indexes up to date after changes
+           were detected in the notes directory
+        '''
+        changed_paths = []
+        changed_note_paths: Optional[List[NotePath]] = []
+        for event in events:
+            changed_paths.append(event['path'])
+            if event['dest_path']:
+                changed_paths.append(event['dest_path'])
+
+            if event['target'] == 'directory' and \
+                    event['type'] != 'deleted':
+                # Any of the notes within the directory could have changed
+                changed_note_paths = None
+            elif event['target'] == 'note' and \
+                    changed_note_paths is not None:
+                changed_note_paths.append(event['dest_path'] or
+                                          event['path'])
+
+        if self.stamp_on_change and changed_note_paths != []:
+            changes = _stamp_notes(notes_directory=self.notes_directory,
+                                   note_paths=changed_note_paths)
+            changed_paths.extend(
+                get_relative_path(self.notes_directory, full_path)
+                for full_path in changes.keys())
+
+        self._sync_changed_paths(changed_paths)
+        has_typeahead = os.path.exists(
+            f'{self.notes_directory}/.shorthand/typeahead')
+        if has_typeahead and any(event['target'] != 'resource'
+                                 for event in events):
+            self.update_ngram_database(paths=changed_paths)
+
+    # Element Index
+    def refresh_element_index(self, paths=None):
+        _refresh_element_index(notes_directory=self.notes_directory,
+                               paths=paths)
+
     # Subdirs
     def get_subdirs(self, max_depth=2, exclude_hidden=True):
         return _get_subdirs(notes_directory=self.notes_directory,
@@ -263,25 +539,41 @@ class ShorthandServer(object):
     def get_todos(self, todo_status: TodoStatus = 'incomplete', directory_filter=None,
                   query_string=None, case_sensitive=False, sort_by=None,
                   suppress_future=True, tag=None):
+        if self.element_index:
+            return _get_indexed_todos(notes_directory=self.notes_directory,
+                                      todo_status=todo_status,
+                                      directory_filter=directory_filter,
+                                      query_string=query_string,
+                                      case_sensitive=case_sensitive,
+                                      sort_by=sort_by,
+                                      suppress_future=suppress_future,
+                                      tag=tag)
         return _get_todos(notes_directory=self.notes_directory,
                           todo_status=todo_status,
                           directory_filter=directory_filter,
                           query_string=query_string,
                           case_sensitive=case_sensitive, sort_by=sort_by,
                           suppress_future=suppress_future, tag=tag,
-                          grep_path=self.grep_path)
+                          scan_workers=self.scan_workers)
 
     def mark_todo(self, note_path, line_number, status):
-        return _mark_todo(notes_directory=self.notes_directory,
-                          note_path=note_path, line_number=line_number,
-                          status=status)
+        marked_line = _mark_todo(notes_directory=self.notes_directory,
+                                 note_path=note_path, line_number=line_number,
+                                 status=status)
+        self._sync_changed_paths([note_path])
+        return marked_line
 
     # Questions
     def get_questions(self, question_status: QuestionStatus = 'all', directory_filter=None):
+        if self.element_index:
+            return _get_indexed_questions(
+                notes_directory=self.notes_directory,
+                question_status=question_status,
+                directory_filter=directory_filter)
         return _get_questions(notes_directory=self.notes_directory,
                               question_status=question_status,
                               directory_filter=directory_filter,
-                              grep_path=self.grep_path)
+                              scan_workers=self.scan_workers)
 
     # Definitions
     def get_definitions(self, directory_filter=None,
@@ -289,25 +581,41 @@ class ShorthandServer(object):
                         case_sensitive: bool = False,
                         search_term_only: bool = True,
                         include_sub_elements: bool = False):
+        if self.element_index:
+            return _get_indexed_definitions(
+                notes_directory=self.notes_directory,
+                directory_filter=directory_filter,
+                query_string=query_string,
+                case_sensitive=case_sensitive,
+                search_term_only=search_term_only,
+                include_sub_elements=include_sub_elements)
         return _get_definitions(notes_directory=self.notes_directory,
                                 directory_filter=directory_filter,
                                 query_string=query_string,
                                 case_sensitive=case_sensitive,
                                 search_term_only=search_term_only,
-                                grep_path=self.grep_path,
+                                scan_workers=self.scan_workers,
                                 include_sub_elements=include_sub_elements)
 
     # Locations
     def get_locations(self, directory_filter=None):
+        if self.element_index:
+            return _get_indexed_locations(
+                notes_directory=self.notes_directory,
+                directory_filter=directory_filter)
         return _get_locations(notes_directory=self.notes_directory,
                               directory_filter=directory_filter,
-                              grep_path=self.grep_path)
+                              scan_workers=self.scan_workers)
 
     # Record Sets
     def get_record_sets(self, directory_filter=None):
+        if self.element_index:
+            return _get_indexed_record_sets(
+                notes_directory=self.notes_directory,
+                directory_filter=directory_filter)
         return _get_record_sets(notes_directory=self.notes_directory,
                                 directory_filter=directory_filter,
-                                grep_path=self.grep_path)
+                                scan_workers=self.scan_workers)
 
     def get_record_set(self, file_path, line_number, parse=True,
                        parse_format='json', include_config=False):
@@ -316,6 +624,24 @@ class ShorthandServer(object):
                                parse=parse, parse_format=parse_format,
                                include_config=include_config)
 
+    # Multiple Element Types
+    def get_elements(self, element_types=None, directory_filter=None,
+                     calendar_mode: CalendarMode = 'recent'):
+        '''Get several types of elements at once, reading each note only
+           once. All element types are included if none are specified
+        '''
+        if self.element_index:
+            return _get_indexed_elements(
+                notes_directory=self.notes_directory,
+                element_types=element_types,
+                directory_filter=directory_filter,
+                calendar_mode=calendar_mode)
+        return _get_elements(notes_directory=self.notes_directory,
+                             element_types=element_types,
+                             directory_filter=directory_filter,
+                             calendar_mode=calendar_mode,
+                             scan_workers=self.scan_workers)
+
     # ---------------
     # --- Buffers ---
     # ---------------
@@ -340,21 +666,24 @@ class ShorthandServer(object):
                               buffer_id=buffer_id)
 
     def write_buffer(self, buffer_id: BufferID, note_path: NotePath):
-        return _write_buffer(notes_directory=self.notes_directory,
-                             buffer_id=buffer_id, note_path=note_path)
+        _write_buffer(notes_directory=self.notes_directory,
+                      buffer_id=buffer_id, note_path=note_path)
+        self._sync_changed_paths([note_path])
 
     # ------------------------
     # --- Filesystem Utils ---
     # ------------------------
     def create_file(self, file_path: InternalAbsoluteFilePath):
+        self.flush_history()
         if self.track_edit_history and \
                 self.is_note_path(file_path, must_exist=False):
             _store_history_for_note_create(
                 notes_directory=self.notes_directory,
                 note_path=file_path)
 
-        return _create_file(notes_directory=self.notes_directory,
-                            file_path=file_path)
+        _create_file(notes_directory=self.notes_directory,
+                     file_path=file_path)
+        self._sync_changed_paths([file_path])
 
     def create_directory(self, directory_path: Subdir):
         return _create_directory(notes_directory=self.notes_directory,
@@ -366,7 +695,9 @@ class ShorthandServer(object):
                                 content=content)
 
     def move_file_or_directory(self, source: InternalAbsolutePath,
-                               destination: InternalAbsolutePath):
+                               destination: InternalAbsolutePath,
+                               progress_callback: Optional[HistoryProgressCallback] = None):
+        self.flush_history()
         if self.track_edit_history and \
                 (self.is_note_path(source) \
                 or self.is_note_path(destination, must_exist=False)):
@@ -381,32 +712,40 @@ class ShorthandServer(object):
                 notes_directory=self.notes_directory,
                 old_directory_path=source,
                 new_directory_path=destination,
-                find_path=self.find_path)
+                find_path=self.find_path,
+                progress_callback=progress_callback)
 
-        return _move_file_or_directory(
+        _move_file_or_directory(
             notes_directory=self.notes_directory,
             source=source, destination=destination)
+        self._sync_changed_paths([source, destination])
 
     def delete_file(self, file_path: InternalAbsoluteFilePath):
+        self.flush_history()
         if self.track_edit_history and self.is_note_path(file_path):
             _store_history_for_note_delete(
                 notes_directory=self.notes_directory,
                 note_path=file_path)
 
-        return _delete_file(notes_directory=self.notes_directory,
-                            file_path=file_path)
+        _delete_file(notes_directory=self.notes_directory,
+                     file_path=file_path)
+        self._sync_changed_paths([file_path])
 
     def delete_directory(self, directory_path: Subdir,
-                         recursive: bool = False):
+                         recursive: bool = False,
+                         progress_callback: Optional[HistoryProgressCallback] = None):
+        self.flush_history()
         if self.track_edit_history and recursive:
             _store_history_for_directory_delete(
                 notes_directory=self.notes_directory,
                 directory_path=directory_path,
-                find_path=self.find_path)
+                find_path=self.find_path,
+                progress_callback=progress_callback)
 
-        return _delete_directory(
+        _delete_directory(
             notes_directory=self.notes_directory,
             directory_path=directory_path, recursive=recursive)
+        self._sync_changed_paths([directory_path])
 
     def get_note_archive(self):
         return _get_note_archive(notes_directory=self.notes_directory)
@@ -434,29 +773,74 @@ class ShorthandServer(object):
     # --- Edit History ---
     # --------------------
     def list_note_versions(self, note_path: NotePath):
+        self.flush_history()
         return _list_note_versions(notes_directory=self.notes_directory,
                                    note_path=note_path,
                                    find_path=self.find_path)
 
     def get_note_version(self, note_path: NotePath,
                          version_timestamp: NoteVersionTimestamp):
+        self.flush_history()
         return _get_note_version(notes_directory=self.notes_directory,
                                  note_path=note_path,
                                  version_timestamp=version_timestamp)
 
     def list_diffs_for_note(self, note_path: NotePath):
+        self.flush_history()
         return _list_diffs_for_note(notes_directory=self.notes_directory,
                                     note_path=note_path,
                                     find_path=self.find_path)
 
     def get_note_diff(self, note_path: NotePath, timestamp: NoteDiffTimestamp,
                       diff_type: NoteDiffType):
+        self.flush_history()
         return _get_note_diff(notes_directory=self.notes_directory,
                               note_path=note_path, timestamp=timestamp,
                               diff_type=diff_type)
 
-    def get_edit_timeline(self, note_path: NotePath):
+    def get_note_at(self, note_path: NotePath, timestamp: NoteDiffTimestamp):
+        self.flush_history()
+        return _get_note_at(notes_directory=self.notes_directory,
+                            note_path=note_path, timestamp=timestamp,
+                            find_path=self.find_path,
+                            patch_path=self.patch_path)
+
+    def diff_note_versions(self, note_path: NotePath,
+                           from_timestamp: NoteDiffTimestamp,
+                           to_timestamp: NoteDiffTimestamp):
+        self.flush_history()
+        return _diff_note_versions(notes_directory=self.notes_directory,
+                                   note_path=note_path,
+                                   from_timestamp=from_timestamp,
+                                   to_timestamp=to_timestamp,
+                                   find_path=self.find_path,
+                                   patch_path=self.patch_path)
+
+    def get_note_blame(self, note_path: NotePath):
+        self.flush_history()
+        return _get_note_blame(notes_directory=self.notes_directory,
+                               note_path=note_path,
+                               find_path=self.find_path,
+                               patch_path=self.patch_path)
+
+    def migrate_edit_history(self):
+        self.flush_history()
+        return _migrate_edit_history(notes_directory=self.notes_directory)
+
+    def compact_edit_history(
+            self, retention_days: int = DEFAULT_HISTORY_RETENTION_DAYS):
+        self.flush_history()
+        return _compact_edit_history(notes_directory=self.notes_directory,
+                                     retention_days=retention_days,
+                                     find_path=self.find_path,
+                                     patch_path=self.patch_path)
+
+    def get_edit_timeline(self, note_path: NotePath,
+                          before: Optional[NoteDiffTimestamp] = None,
+                          limit: Optional[int] = None):
+        self.flush_history()
         return get_edit_timeline(
             notes_directory=self.notes_directory,
             note_path=note_path,
-            find_path=self.find_path)
+            find_path=self.find_path,
+            before=before, limit=limit)
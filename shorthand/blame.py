@@ -0,0 +1,273 @@
+'''
+Line-level blame for notes, which annotates each line of a note with the
+time and author of the edit which last changed it, based on the note's
+edit history.
+
+Blame is calculated by replaying the history of a note from its creation,
+carrying the annotation for each line through every edit. The result is
+cached in the note's history directory, so later requests only need to
+replay the history which was stored since then.
+
+The cache always stops before the latest diff in the history log, since
+that diff may still be replaced when further edits are merged into it.
+'''
+import os
+import json
+import logging
+from typing import List, Optional, Tuple, TypedDict
+
+from shorthand.edit_history import NoteDiffTimestamp, _get_note_version, \
+                                   _list_note_versions, apply_diffs, \
+                                   extract_paths_from_move_diff, \
+                                   get_note_history_dir
+from shorthand.history_log import HistoryLogEntry, read_history_index, \
+                                  read_history_record
+from shorthand.notes import _get_note, _is_note_path
+from shorthand.types import DirectoryPath, ExecutablePath, NotePath, \
+                            RawNoteContent
+from shorthand.utils.diff import get_opcodes
+from shorthand.utils.filesystem import atomic_write
+
+
+BLAME_CACHE_FILENAME = 'blame.json'
+BLAME_CACHE_VERSION = 1
+
+
+log = logging.getLogger(__name__)
+
+
+class BlameLine(TypedDict):
+    line_number: int
+    content: str
+    # The time and author of the change which last modified the line.
+    # These are `None` for changes which weren't recorded in the history
+    timestamp: Optional[NoteDiffTimestamp]
+    author: Optional[str]
+
+
+type LineAnnotation = Tuple[Optional[NoteDiffTimestamp], Optional[str]]
+
+
+class BlameState(TypedDict):
+    # The lines of the note, or `None` if it didn't exist
+    lines: Optional[List[str]]
+    annotations: List[LineAnnotation]
+
+
+class BlameCache(TypedDict):
+    version: int
+    # The number of entries in the history log which have been replayed,
+    # and the offset, length and timestamp of the last of them, used to
+    # check that the log hasn't been rewritten since
+    entry_count: int
+    last_entry: Optional[Tuple[int, int, NoteDiffTimestamp]]
+    state: BlameState
+
+
+def get_blame_cache_path(notes_directory: DirectoryPath,
+                         note_path: NotePath) -> str:
+    return f'{get_note_history_dir(notes_directory, note_path)}/' + \
+           f'{BLAME_CACHE_FILENAME}'
+
+
+def _load_blame_cache(notes_directory: DirectoryPath, note_path: NotePath,
+                      entries: List[HistoryLogEntry]) -> Optional[BlameCache]:
+    '''Load the cached blame for a note, if it is still valid for the
+       note's history log
+    '''
+    cache_path = get_blame_cache_path(notes_directory, note_path)
+    try:
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        log.error(f'Blame cache at {cache_path} is corrupted, rebuilding')
+        return None
+
+    if not isinstance(cache, dict) or \
+            cache.get('version') != BLAME_CACHE_VERSION:
+        return None
+
+    entry_count = cache['entry_count']
+    if entry_count > len(entries):
+        return None
+    if entry_count:
+        last_entry = entries[entry_count - 1]
+        if [last_entry.offset, last_entry.length, last_entry.timestamp] != \
+                cache['last_entry']:
+            return None
+
+    cache['state']['annotations'] = [
+        tuple(annotation) for annotation in cache['state']['annotations']]
+    return cache
+
+
+def _write_blame_cache(notes_directory: DirectoryPath, note_path: NotePath,
+                       cache: BlameCache) -> None:
+    '''Atomically replace the cached blame for a note
+    '''
+    with atomic_write(get_blame_cache_path(notes_directory, note_path)) as f:
+        json.dump(cache, f)
+
+
+def _update_blame_state(state: BlameState, content: RawNoteContent,
+                        annotation: LineAnnotation) -> None:
+    '''Update the lines of a note to new content, keeping the annotations
+       for lines which are unchanged and annotating the rest as changed
+    '''
+    new_lines = content.splitlines(keepends=True)
+    if state['lines'] is None:
+        state['lines'] = new_lines
+        state['annotations'] = [annotation] * len(new_lines)
+        return
+
+    new_annotations: List[LineAnnotation] = []
+    for tag, i1, i2, j1, j2 in get_opcodes(state['lines'], new_lines):
+        if tag == 'equal':
+            new_annotations.extend(state['annotations'][i1:i2])
+        else:
+            new_annotations.extend([annotation] * (j2 - j1))
+    state['lines'] = new_lines
+    state['annotations'] = new_annotations
+
+
+def _replay_blame(notes_directory: DirectoryPath,
+                  note_path: NotePath,
+                  state: BlameState,
+                  versions: List[NoteDiffTimestamp],
+                  entries: List[HistoryLogEntry],
+                  find_path: ExecutablePath = 'find',
+                  patch_path: Optional[ExecutablePath] = None) -> None:
+    '''Update the blame for a note with the versions and history log
+       entries which were stored after its current state
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    # Versions hold the state before any diffs at their timestamp,
+    # so they are ordered before diffs with the same timestamp
+    events = sorted([(version, 0, None) for version in versions] +
+                    [(entry.timestamp, 1, entry) for entry in entries],
+                    key=lambda event: event[:2])
+
+    for timestamp, _, entry in events:
+        if entry is None:
+            # Versions are a copy of the note, so any differences are
+            # changes which weren't recorded as diffs
+            version = _get_note_version(notes_directory, note_path, timestamp)
+            _update_blame_state(state, version, (timestamp, None))
+            continue
+
+        record = read_history_record(history_dir, entry)
+        if record.diff_type == 'create':
+            state['lines'] = []
+            state['annotations'] = []
+        elif record.diff_type == 'delete':
+            state['lines'] = None
+            state['annotations'] = []
+        elif record.diff_type == 'move':
+            move_paths = extract_paths_from_move_diff(record.diff)
+            if move_paths['from'] == note_path:
+                state['lines'] = None
+                state['annotations'] = []
+            else:
+                # The note was moved here, so lines keep their blame
+                # from the note it was moved from
+                source_state = _get_blame_state_at(
+                    notes_directory, move_paths['from'], timestamp,
+                    find_path, patch_path)
+                state['lines'] = source_state['lines']
+                state['annotations'] = source_state['annotations']
+        elif state['lines'] is None:
+            raise ValueError(f'Found edits for note {note_path} '
+                             f'while it did not exist')
+        else:
+            content = apply_diffs(''.join(state['lines']), [record.diff],
+                                  patch_path)
+            _update_blame_state(state, content,
+                                (record.timestamp, record.author))
+
+
+def _get_blame_state_at(notes_directory: DirectoryPath,
+                        note_path: NotePath,
+                        timestamp: NoteDiffTimestamp,
+                        find_path: ExecutablePath = 'find',
+                        patch_path: Optional[ExecutablePath] = None
+                        ) -> BlameState:
+    '''Get the blame for a note immediately before a point in time, by
+       replaying all of its history before then
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    state: BlameState = {'lines': None, 'annotations': []}
+    _replay_blame(
+        notes_directory, note_path, state,
+        [version for version in _list_note_versions(notes_directory,
+                                                    note_path, find_path)
+         if version < timestamp],
+        [entry for entry in read_history_index(history_dir)
+         if entry.timestamp < timestamp],
+        find_path, patch_path)
+    return state
+
+
+def _get_note_blame(notes_directory: DirectoryPath,
+                    note_path: NotePath,
+                    find_path: ExecutablePath = 'find',
+                    patch_path: Optional[ExecutablePath] = None
+                    ) -> List[BlameLine]:
+    '''Annotate each line of a note with the time and author of the edit
+       which last changed it
+    '''
+    if not _is_note_path(notes_directory, note_path):
+        raise ValueError(f'No note found at path {note_path}')
+
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    entries = read_history_index(history_dir)
+    versions = _list_note_versions(notes_directory, note_path, find_path)
+
+    cache = _load_blame_cache(notes_directory, note_path, entries)
+    if cache is None:
+        cache = {
+            'version': BLAME_CACHE_VERSION,
+            'entry_count': 0,
+            'last_entry': None,
+            'state': {'lines': None, 'annotations': []}
+        }
+    state = cache['state']
+    entry_count = cache['entry_count']
+    cached_timestamp = cache['last_entry'][2] if cache['last_entry'] else ''
+
+    # Everything up to the latest entry is replayed and cached first
+    cacheable_count = max(len(entries) - 1, entry_count)
+    cacheable_timestamp = entries[cacheable_count - 1].timestamp \
+        if cacheable_count else ''
+    _replay_blame(notes_directory, note_path, state,
+                  [version for version in versions
+                   if cached_timestamp < version <= cacheable_timestamp],
+                  entries[entry_count:cacheable_count],
+                  find_path, patch_path)
+    if cacheable_count != entry_count or not os.path.exists(
+            get_blame_cache_path(notes_directory, note_path)):
+        last_entry = entries[cacheable_count - 1] if cacheable_count \
+            else None
+        cache['entry_count'] = cacheable_count
+        cache['last_entry'] = (last_entry.offset, last_entry.length,
+                               last_entry.timestamp) if last_entry else None
+        if entries:
+            _write_blame_cache(notes_directory, note_path, cache)
+
+    _replay_blame(notes_directory, note_path, state,
+                  [version for version in versions
+                   if version > max(cached_timestamp, cacheable_timestamp)],
+                  entries[cacheable_count:], find_path, patch_path)
+
+    # Any changes since the history was last stored aren't attributed
+    _update_blame_state(state, _get_note(notes_directory, note_path),
+                        (None, None))
+
+    return [{
+        'line_number': idx + 1,
+        'content': line.removesuffix('\n'),
+        'timestamp': timestamp,
+        'author': author
+    } for idx, (line, (timestamp, author)) in enumerate(
+        zip(state['lines'] or [], state['annotations']))]
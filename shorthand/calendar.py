@@ -1,17 +1,15 @@
-from enum import StrEnum
-import re
 import logging
-from subprocess import Popen, PIPE
 from typing import Dict, List, Literal, Optional, Required, TypedDict
 from datetime import datetime
 
-from shorthand.elements.todos import _get_todos
-from shorthand.elements.questions import _get_questions
-from shorthand.types import DirectoryPath, ExecutablePath, RelativeDirectoryPath
-from shorthand.utils.patterns import DATED_HEADING_PATTERN
-
-
-dated_heading_regex = re.compile(DATED_HEADING_PATTERN)
+from shorthand.elements.extract import ExtractedNotes, _extract_notes, \
+                                       collect_questions, collect_todos, \
+                                       dated_heading_regex
+from shorthand.elements.todos import Todo
+from shorthand.elements.questions import Question
+from shorthand.types import DirectoryPath, NotePath, \
+                            RawNoteLine, RelativeDirectoryPath
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS
 
 
 log = logging.getLogger(__name__)
@@ -38,71 +36,77 @@ Calendar = Dict[YearIndex, Dict[MonthIndex, Dict[DayIndex, List[CalendarEvent]]]
 def _get_calendar(notes_directory: DirectoryPath,
                   mode: CalendarMode = 'recent',
                   directory_filter: Optional[RelativeDirectoryPath] = None,
-                  grep_path: ExecutablePath = 'grep') -> Calendar:
-
-    todays_date = datetime.now().isoformat()[:10]
-    events: List[CalendarEvent] = []
-    calendar = {}
-
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
-
-    grep_command = ('{grep_path} -Prn "{pattern}" ' \
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}').format(
-                        grep_path=grep_path,
-                        pattern=DATED_HEADING_PATTERN,
-                        dir=search_directory)
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    # Create events from parsed headings
-    for line in output_lines:
+                  scan_workers: int = DEFAULT_SCAN_WORKERS) -> Calendar:
 
-        if not line.strip():
-            continue
-
-        split_line = line.split(':', 2)
-        file_path = split_line[0]
-        line_number = split_line[1]
-        heading_raw = split_line[2]
+    # Every note is read once and all of the elements needed
+    # for the calendar are pulled from the same pass
+    notes = _extract_notes(notes_directory, directory_filter, scan_workers)
+    return collect_calendar(notes, mode=mode,
+                            directory_filter=directory_filter)
 
-        heading_match = dated_heading_regex.match(heading_raw)
-        heading_text, date = None, None
-        if heading_match:
-            heading_text = heading_match.group(3).strip()
-            date = heading_match.group(4).strip()
-        else:
-            raise ValueError(f'Line {heading_raw} returned by grep did not match dated heading pattern')
 
-        if notes_directory in file_path:
-            file_path = file_path[len(notes_directory):]
+def collect_calendar(notes: ExtractedNotes, mode: CalendarMode = 'recent',
+                     directory_filter: Optional[RelativeDirectoryPath] = None
+                     ) -> Calendar:
+    '''Build the calendar from extracted note elements
+    '''
+    notes = list(notes)
 
-        split_heading = heading_raw.split(' ', 1)
-        element_id = split_heading[1].replace(' ', '-')
-
-        parsed_heading: CalendarEvent = {
-            "file_path": file_path,
-            "line_number": line_number,
-            "event": heading_text,
-            "date": date,
-            "element_id": element_id,
-            "type": "section"
-        }
+    # Create events from parsed headings
+    events: List[CalendarEvent] = []
+    for note_path, elements in notes:
+        for heading in elements['dated_headings']:
+            events.append(parse_dated_heading(
+                heading['line'], note_path, str(heading['line_number'])))
+
+    return build_calendar(
+        mode=mode, section_events=events,
+        incomplete_todos=collect_todos(notes, 'incomplete',
+                                       directory_filter),
+        completed_todos=collect_todos(notes, 'complete', directory_filter),
+        skipped_todos=collect_todos(notes, 'skipped', directory_filter),
+        questions=collect_questions(notes, 'all', directory_filter))
+
+
+def parse_dated_heading(heading_raw: RawNoteLine, file_path: NotePath,
+                        line_number: str) -> CalendarEvent:
+    '''Create a calendar event from the raw content of a heading which
+       ends with a date stamp
+    '''
+    heading_match = dated_heading_regex.match(heading_raw)
+    heading_text, date = None, None
+    if heading_match:
+        heading_text = heading_match.group(3).strip()
+        date = heading_match.group(4).strip()
+    else:
+        raise ValueError(f'Line {heading_raw} returned by grep did not match dated heading pattern')
+
+    split_heading = heading_raw.split(' ', 1)
+    element_id = split_heading[1].replace(' ', '-')
+
+    return {
+        "file_path": file_path,
+        "line_number": line_number,
+        "event": heading_text,
+        "date": date,
+        "element_id": element_id,
+        "type": "section"
+    }
+
+
+def build_calendar(mode: CalendarMode, section_events: List[CalendarEvent],
+                   incomplete_todos: List[Todo], completed_todos: List[Todo],
+                   skipped_todos: List[Todo], questions: List[Question]
+                   ) -> Calendar:
+    '''Assemble a calendar from the dated headings, todos, and questions
+       which were found within the notes directory
+    '''
 
-        events.append(parsed_heading)
+    todays_date = datetime.now().isoformat()[:10]
+    events: List[CalendarEvent] = list(section_events)
+    calendar = {}
 
     # Add Incomplete Todos to the calendar view
-    incomplete_todos = _get_todos(notes_directory=notes_directory,
-                                 todo_status='incomplete',
-                                 directory_filter=directory_filter,
-                                 query_string=None, grep_path=grep_path)
     for todo in incomplete_todos:
         if todo['start_date']:
             parsed_todo: CalendarEvent = {
@@ -122,10 +126,6 @@ def _get_calendar(notes_directory: DirectoryPath,
             events.append(parsed_todo)
 
     # Add Completed Todos to the calendar view
-    completed_todos = _get_todos(notes_directory=notes_directory,
-                                 todo_status='complete',
-                                 directory_filter=directory_filter,
-                                 query_string=None, grep_path=grep_path)
     for todo in completed_todos:
         parsed_todo: CalendarEvent = {
             "file_path": todo['file_path'],
@@ -150,10 +150,6 @@ def _get_calendar(notes_directory: DirectoryPath,
         events.append(parsed_todo)
 
     # Add Skipped Todos to the calendar view
-    skipped_todos = _get_todos(notes_directory=notes_directory,
-                               todo_status='skipped',
-                               directory_filter=directory_filter,
-                               query_string=None, grep_path=grep_path)
     for todo in skipped_todos:
         parsed_todo: CalendarEvent = {
             "file_path": todo['file_path'],
@@ -178,10 +174,6 @@ def _get_calendar(notes_directory: DirectoryPath,
         events.append(parsed_todo)
 
     # Add opened questions and answers to calendar view
-    questions = _get_questions(
-        notes_directory=notes_directory,
-        question_status='all', directory_filter=directory_filter,
-        grep_path=grep_path)
     for question in questions:
         parsed_question: CalendarEvent = {
             "file_path": question['file_path'],
@@ -4,8 +4,12 @@ import argparse
 import logging
 
 from shorthand.utils.config import _get_notes_config, CONFIG_FILE_LOCATION
+from shorthand.edit_history import _migrate_edit_history
+from shorthand.history_compaction import DEFAULT_HISTORY_RETENTION_DAYS, \
+                                         _compact_edit_history
 from shorthand.elements.todos import _get_todos
-from shorthand.stamping import _stamp_notes
+from shorthand.stamping import StampingChanges, _stamp_notes
+from shorthand.watcher import ChangeEvent, NotesWatcher
 
 
 log = logging.getLogger(__name__)
@@ -26,6 +30,15 @@ def main(args):
     if args.action == 'stamp':
         cli_stamp_notes(notes_config)
 
+    elif args.action == 'watch':
+        cli_watch_notes(notes_config)
+
+    elif args.action == 'migrate-history':
+        cli_migrate_history(notes_config)
+
+    elif args.action == 'compact-history':
+        cli_compact_history(notes_config, args.retention_days)
+
     elif args.action == 'list':
         log.info('Listing Todos')
         print(_get_todos(notes_directory, args.status))
@@ -33,8 +46,56 @@ def main(args):
 
 def cli_stamp_notes(notes_config):
     log.info('Stamping Notes')
-    changes = _stamp_notes(notes_config['notes_directory'],
-                           grep_path=notes_config['grep_path'])
+    changes = _stamp_notes(notes_config['notes_directory'])
+    print_stamping_changes(changes)
+
+
+def cli_watch_notes(notes_config):
+    '''Stamp notes whenever they are changed, until interrupted
+    '''
+    notes_directory = notes_config['notes_directory']
+    cli_stamp_notes(notes_config)
+
+    def stamp_changed_notes(events: list[ChangeEvent]) -> None:
+        note_paths = None
+        if not any(event['target'] == 'directory' for event in events):
+            note_paths = [event['dest_path'] or event['path']
+                          for event in events if event['target'] == 'note']
+            if not note_paths:
+                return
+        log.info('Stamping changed notes')
+        print_stamping_changes(_stamp_notes(notes_directory,
+                                            note_paths=note_paths))
+
+    log.info(f'Watching {notes_directory} for changes')
+    watcher = NotesWatcher(notes_directory)
+    watcher.subscribe(stamp_changed_notes)
+    watcher.start()
+    try:
+        watcher.thread.join()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+
+def cli_migrate_history(notes_config):
+    log.info('Migrating edit history')
+    migrated_notes = _migrate_edit_history(notes_config['notes_directory'])
+    for note_path in migrated_notes:
+        print(note_path)
+    print(f'Migrated edit history for {len(migrated_notes)} notes')
+
+
+def cli_compact_history(notes_config, retention_days):
+    log.info('Compacting edit history')
+    stats = _compact_edit_history(notes_config['notes_directory'],
+                                  retention_days=retention_days,
+                                  find_path=notes_config['find_path'],
+                                  patch_path=notes_config['patch_path'])
+    for key, value in stats.items():
+        print(f'{key}: {value}')
+
+
+def print_stamping_changes(changes: StampingChanges):
     for file in changes.keys():
         print(f'\n<<--{file}-->>')
         for change in changes[file]:
@@ -48,12 +109,16 @@ def parse_args():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser()
     parser.add_argument('--action', required=True,
-                        choices=['stamp', 'list'],
+                        choices=['stamp', 'list', 'watch', 'migrate-history',
+                                 'compact-history'],
                         help='Action to take')
     parser.add_argument('--status', required=False,
                         choices=['completed', 'incomplete', 'skipped'],
                         default='incomplete',
                         help='To-Do Status to show')
+    parser.add_argument('--retention-days', required=False, type=int,
+                        default=DEFAULT_HISTORY_RETENTION_DAYS,
+                        help='Days of edit history to keep uncompacted')
     parser.add_argument('--config', required=False,
                         default=CONFIG_FILE_LOCATION,
                         help='Config file to use')
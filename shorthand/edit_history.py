@@ -11,18 +11,33 @@ construct the modification history of a note. These are:
      - File Renames
      - File Creation
      - File Deletion
+   The diffs for each note are stored in a packed history log,
+   see `shorthand.history_log`
 '''
 import os
+import json
+import lzma
 import shutil
-import difflib
 import logging
 import tempfile
 from datetime import date, datetime, UTC, timedelta
 from subprocess import PIPE, Popen
-from typing import List, Literal, Optional, Required, TypedDict
-
+from collections import OrderedDict
+from typing import Callable, List, Literal, NamedTuple, Optional, Required, \
+                   Tuple, TypedDict
+
+from shorthand.history_log import LEGACY_DIFFS_DIRNAME, HistoryLogRecord, \
+                                  get_history_log_path, \
+                                  append_history_record, \
+                                  delete_history_record, get_diff_author, \
+                                  get_latest_history_entry, \
+                                  migrate_legacy_diffs, read_history_index, \
+                                  read_history_record
 from shorthand.notes import _get_note, _is_note_path
 from shorthand.types import DirectoryPath, ExecutablePath, NotePath, RawNoteContent, Subdir
+from shorthand.utils.diff import unified_diff
+from shorthand.utils.filesystem import atomic_write
+from shorthand.utils.patch import apply_patch
 from shorthand.utils.paths import get_full_path, get_relative_path
 
 
@@ -30,6 +45,26 @@ HISTORY_PATH = '.shorthand/history'
 
 MERGE_CUTOFF_LIMIT_MIN = 15
 
+# Suffix for version files which are stored compressed with lzma
+COMPRESSED_VERSION_SUFFIX = '.xz'
+
+TIMELINE_MANIFEST_FILENAME = 'timeline.json'
+TIMELINE_MANIFEST_VERSION = 1
+
+CHECKPOINTS_DIRNAME = 'checkpoints'
+# A checkpoint of the full note content is stored once replaying the edits
+# since the last version or checkpoint would read more than the note itself,
+# with a floor so that small notes aren't checkpointed on every edit
+MIN_CHECKPOINT_DIFF_SIZE = 4096
+# Always store a checkpoint after this many edits, so that rebuilding any
+# state of a note never needs to replay more diffs than this
+MAX_CHECKPOINT_DIFFS = 32
+
+
+# The number of diffs between two points in a note's history which are
+# kept in memory
+VERSION_DIFF_CACHE_SIZE = 128
+
 
 log = logging.getLogger(__name__)
 
@@ -61,15 +96,50 @@ type NoteVersionTimestamp = str
 
    By default, this is the timestamp of the start of day UTC time'''
 
+type HistoryProgressCallback = Callable[[int, int], None]
+'''Called with the number of notes processed so far and the total number
+   of notes, while storing the history for a whole directory'''
+
+class TimelineManifest(TypedDict):
+    '''All of the versions and diffs stored for a note, kept up to date as
+       history is stored so that the timeline can be read from one file
+    '''
+    version: int
+    # The size of the note's history log when the manifest was written,
+    # used to detect diffs which were stored without updating it
+    log_size: int
+    versions: List[NoteVersionTimestamp]
+    diffs: List[NoteDiffInfo]
+
+
+class PendingNoteHistory(NamedTuple):
+    '''The history to store for one note when moving or deleting a whole
+       directory, which is planned for every note before any of it is stored
+    '''
+    note_path: NotePath
+    diff_type: NoteDiffType
+    diff: NoteDiff
+    # The timestamp of a version to add for the note, if one is needed
+    version: Optional[NoteVersionTimestamp] = None
+    version_content: Optional[RawNoteContent] = None
+
+
+# Diffs between two points in a note's history, keyed by the note and the
+# two timestamps, along with the history stamp they were calculated from
+_version_diff_cache: OrderedDict[tuple, Tuple[tuple, NoteDiff]] = \
+    OrderedDict()
+
 
 def ensure_note_version(notes_directory: DirectoryPath,
                         note_path: NotePath,
                         timestamp: datetime,
-                        find_path: ExecutablePath = 'find') -> None:
+                        find_path: ExecutablePath = 'find',
+                        content: Optional[RawNoteContent] = None) -> None:
     '''Ensure that a daily starting version exists for the specified note and
        the current UTC day
 
-       A note must currently exist at the specified note path
+       A note must currently exist at the specified note path. The version
+       is a copy of the note, unless its `content` is provided
 
        `use_exact_time` is used in the case of moves, if there is already
        a version present for the note for the beginning of the day
@@ -93,32 +163,31 @@ def ensure_note_version(notes_directory: DirectoryPath,
     if not os.path.exists(note_history_dir):
         os.makedirs(note_history_dir)
 
-    full_note_path = get_full_path(notes_directory, note_path)
-    shutil.copy2(full_note_path, note_version_path)
+    if content is None:
+        full_note_path = get_full_path(notes_directory, note_path)
+        shutil.copy2(full_note_path, note_version_path)
+    else:
+        with open(note_version_path, 'w') as f:
+            f.write(content)
+    _update_timeline_manifest(notes_directory, note_path,
+                              added_version=timestamp_string)
 
 
 def note_version_exists_for_date(notes_directory: DirectoryPath,
                                  note_path: NotePath,
                                  utc_date: date,
                                  find_path: ExecutablePath = 'find') -> bool:
+    '''Check whether a version is stored for a note for the given UTC day,
+       from a single listing of the note's history directory
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    if not os.path.isdir(history_dir):
+        return False
 
     date_string = utc_date.isoformat()
-    find_command = f'{find_path} {notes_directory}/{HISTORY_PATH}{note_path} ' + \
-                   f'-type f -name "{date_string}*.version"'
-
-    log.debug(f'Running command {find_command} to list note versions')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    version_files = [get_relative_path(notes_directory, line.strip())
-                     for line in output_lines
-                     if line.strip()]
-
-    if len(version_files):
-        return True
-
-    return False
+    return any(filename.startswith(date_string) and
+               '.version' in filename
+               for filename in os.listdir(history_dir))
 
 
 def add_note_version_for_move(notes_directory: DirectoryPath,
@@ -147,6 +216,8 @@ def add_note_version_for_move(notes_directory: DirectoryPath,
 
     full_note_path = get_full_path(notes_directory, source)
     shutil.copy2(full_note_path, note_version_path)
+    _update_timeline_manifest(notes_directory, destination,
+                              added_version=timestamp_string)
 
 
 def _list_note_versions(notes_directory: DirectoryPath,
@@ -162,19 +233,23 @@ def _list_note_versions(notes_directory: DirectoryPath,
     if not _is_note_path(notes_directory, note_path, must_exist=False):
         raise ValueError(f'The path {note_path} is not a valid note')
 
-    find_command = f'{find_path} {notes_directory}/{HISTORY_PATH}{note_path} ' + \
-                   '-type f -name "*.version"'
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    try:
+        filenames = os.listdir(history_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
 
-    log.debug(f'Running command {find_command} to list note versions')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
+    return [get_version_timestamp(filename) for filename in filenames
+            if filename.endswith('.version') or
+            filename.endswith(f'.version{COMPRESSED_VERSION_SUFFIX}')]
 
-    version_files = [get_relative_path(notes_directory, line.strip())
-                     for line in output_lines
-                     if line.strip()]
 
-    return [f.split('/')[-1][:-8] for f in version_files]
+def get_version_timestamp(filename: str) -> NoteVersionTimestamp:
+    '''Get the timestamp of a version from the name of its file, which may
+       be compressed
+    '''
+    return filename.removesuffix(COMPRESSED_VERSION_SUFFIX) \
+                   .removesuffix('.version')
 
 
 def _get_note_version(notes_directory: DirectoryPath,
@@ -193,18 +268,26 @@ def _get_note_version(notes_directory: DirectoryPath,
                         f'{HISTORY_PATH}' + \
                         f'{note_path}/{version_timestamp}.version'
 
-    if not os.path.exists(note_version_path):
-        raise ValueError(f'A Version for note {note_path} on date ' + \
-                         f'{version_timestamp} does not exist')
+    if os.path.exists(note_version_path):
+        with open(note_version_path, 'r') as f:
+            return f.read()
 
-    with open(note_version_path, 'r') as f:
-        return f.read()
+    # Older versions may have been compressed by compaction
+    compressed_version_path = note_version_path + COMPRESSED_VERSION_SUFFIX
+    if os.path.exists(compressed_version_path):
+        with lzma.open(compressed_version_path, 'rt') as f:
+            return f.read()
+
+    raise ValueError(f'A Version for note {note_path} on date ' + \
+                     f'{version_timestamp} does not exist')
 
 
 def get_unified_diff(old: RawNoteContent, new: RawNoteContent,
-                     path: NotePath, author: str = 'Unknown'
-                     ) -> NoteDiff:
-    timestamp = datetime.now(UTC).isoformat(timespec='milliseconds')
+                     path: NotePath, author: str = 'Unknown',
+                     diff_time: Optional[datetime] = None) -> NoteDiff:
+    if diff_time is None:
+        diff_time = datetime.now(UTC)
+    timestamp = diff_time.isoformat(timespec='milliseconds')
     header_lines = [
         f'Author: {author}\n',
         f'Time: {timestamp}\n',
@@ -213,9 +296,9 @@ def get_unified_diff(old: RawNoteContent, new: RawNoteContent,
     ]
 
     if old == new:
-        return get_empty_edit_diff(path, author)
+        return get_empty_edit_diff(path, author, diff_time)
 
-    diff_lines = list(difflib.unified_diff(
+    diff_lines = list(unified_diff(
         old.splitlines(keepends=True),
         new.splitlines(keepends=True),
         fromfile=f'{path} (old)',
@@ -229,10 +312,10 @@ def get_unified_diff(old: RawNoteContent, new: RawNoteContent,
             cleaned_diff_lines.append(line + '\n')
 
     log.debug(f'Got calculated diff {cleaned_diff_lines}')
-    unified_diff = ''.join(header_lines + cleaned_diff_lines)
-    log.debug(f'Got unified diff {unified_diff}')
+    note_diff = ''.join(header_lines + cleaned_diff_lines)
+    log.debug(f'Got unified diff {note_diff}')
 
-    return unified_diff
+    return note_diff
 
 
 def calculate_diff_for_edit(notes_directory: DirectoryPath,
@@ -273,11 +356,14 @@ new file mode 100644'''
 
 def calculate_diff_for_delete(notes_directory: DirectoryPath,
                               note_path: NotePath,
-                              author: str = 'Unknown') -> NoteDiff:
+                              author: str = 'Unknown',
+                              old_content: Optional[RawNoteContent] = None
+                              ) -> NoteDiff:
     # Only works with GNU Patch
     timestamp = datetime.now(UTC).isoformat(timespec='milliseconds')
-    old_content = _get_note(notes_directory, note_path)
-    diff_lines = difflib.unified_diff(
+    if old_content is None:
+        old_content = _get_note(notes_directory, note_path)
+    diff_lines = unified_diff(
         old_content.splitlines(keepends=True),
         [],
         fromfile=note_path, tofile=note_path)
@@ -293,12 +379,15 @@ deleted file mode 100644
 
 
 def get_empty_edit_diff(note_path: NotePath,
-                        author: str = 'Unknown') -> NoteDiff:
+                        author: str = 'Unknown',
+                        diff_time: Optional[datetime] = None) -> NoteDiff:
     '''A diff which represents no changes being made to a note.
        Used in the case where multiple edits are merged together which
        cancel out and results in no net-changes being made to the note
     '''
-    timestamp = datetime.now(UTC).isoformat(timespec='milliseconds')
+    if diff_time is None:
+        diff_time = datetime.now(UTC)
+    timestamp = diff_time.isoformat(timespec='milliseconds')
     return \
 f'''Author: {author}
 Time: {timestamp}
@@ -307,45 +396,51 @@ diff --git a{note_path} b{note_path}
 no changes made'''
 
 
-def save_diff(notes_directory: DirectoryPath, note_path: NotePath,
-              diff: NoteDiff, timestamp: datetime, diff_type: NoteDiffType) -> None:
+def get_note_history_dir(notes_directory: DirectoryPath,
+                         note_path: NotePath) -> str:
+    return f'{notes_directory}/{HISTORY_PATH}{note_path}'
 
-    utc_time_string = timestamp.isoformat(timespec='milliseconds')
-    diff_path = f'{notes_directory}/' + \
-                f'{HISTORY_PATH}' + \
-                f'{note_path}/diffs/' + \
-                f'{timestamp.year}/' + \
-                f'{timestamp.month}/' + \
-                f'{timestamp.day}/' + \
-                f'{utc_time_string}.{diff_type}.diff'
 
-    if os.path.exists(diff_path):
-        raise ValueError(f'A diff already exists at path {diff_path}')
+def save_diff(notes_directory: DirectoryPath, note_path: NotePath,
+              diff: NoteDiff, timestamp: datetime, diff_type: NoteDiffType,
+              replace_latest: bool = False) -> None:
+    '''Append a diff to the history log for a note
 
-    daily_diffs_dir = os.path.dirname(diff_path)
-    if not os.path.exists(daily_diffs_dir):
-        os.makedirs(daily_diffs_dir)
+       If `replace_latest` is set, then the latest diff stored for the note
+       is replaced with the new one
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    replaced_diff = None
+    if replace_latest:
+        latest_entry = get_latest_history_entry(history_dir)
+        if latest_entry:
+            replaced_diff = get_diff_info(note_path, latest_entry.diff_type,
+                                          latest_entry.timestamp)
 
-    with open(diff_path, 'w') as f:
-        f.write(diff)
+    utc_time_string = timestamp.isoformat(timespec='milliseconds')
+    record = HistoryLogRecord(diff_type, utc_time_string,
+                              get_diff_author(diff), diff)
+    previous_log_size = _get_history_log_size(notes_directory, note_path)
+    append_history_record(history_dir, record, replace_latest=replace_latest)
+    _update_timeline_manifest(
+        notes_directory, note_path,
+        added_diff=get_diff_info(note_path, diff_type, utc_time_string, diff),
+        removed_diff=replaced_diff, previous_log_size=previous_log_size)
 
 
 def delete_diff(notes_directory: DirectoryPath, note_path: NotePath,
                 timestamp: NoteDiffTimestamp, diff_type: NoteDiffType) -> None:
-    parsed_diff_time = datetime.fromisoformat(timestamp)
-
-    diff_path = f'{notes_directory}/' + \
-                f'{HISTORY_PATH}' + \
-                f'{note_path}/diffs/' + \
-                f'{parsed_diff_time.year}/' + \
-                f'{parsed_diff_time.month}/' + \
-                f'{parsed_diff_time.day}/' + \
-                f'{timestamp}.{diff_type}.diff'
-
-    if not os.path.exists(diff_path):
+    previous_log_size = _get_history_log_size(notes_directory, note_path)
+    try:
+        delete_history_record(
+            get_note_history_dir(notes_directory, note_path),
+            diff_type, timestamp)
+    except ValueError:
         raise ValueError(f'Diff not found for note {note_path} action {diff_type} and time {timestamp}')
-
-    os.remove(diff_path)
+    _update_timeline_manifest(
+        notes_directory, note_path,
+        removed_diff=get_diff_info(note_path, diff_type, timestamp),
+        previous_log_size=previous_log_size)
 
 
 def extract_paths_from_move_diff(diff: NoteDiff):
@@ -364,6 +459,32 @@ def extract_paths_from_move_diff(diff: NoteDiff):
     }
 
 
+def get_diff_info(note_path: NotePath, diff_type: NoteDiffType,
+                  timestamp: NoteDiffTimestamp,
+                  diff: Optional[NoteDiff] = None) -> NoteDiffInfo:
+    '''Get the info listed for a diff. The full diff is only needed to
+       get the paths for move diffs
+    '''
+    if diff_type != 'move' or diff is None:
+        return {
+            'diff_type': diff_type,
+            'timestamp': timestamp
+        }
+
+    move_diff_paths = extract_paths_from_move_diff(diff)
+    if move_diff_paths['from'] == note_path:
+        move_direction = 'out'
+    else:
+        move_direction = 'in'
+    return {
+        'diff_type': diff_type,
+        'timestamp': timestamp,
+        'from_path': move_diff_paths['from'],
+        'to_path': move_diff_paths['to'],
+        'move_direction': move_direction
+    }
+
+
 def _list_diffs_for_note(notes_directory: DirectoryPath,
                          note_path: NotePath,
                          find_path: ExecutablePath = 'find'
@@ -371,49 +492,155 @@ def _list_diffs_for_note(notes_directory: DirectoryPath,
     if not _is_note_path(notes_directory, note_path, must_exist=False):
         raise ValueError(f'The path {note_path} is not a valid note path')
 
-    find_command = f'{find_path} {notes_directory}/' + \
-                   f'{HISTORY_PATH}{note_path} ' + \
-                   f'-type f -name "*.diff"'
-
-    log.debug(f'Running command {find_command} to list note diffs')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    diff_files = [get_relative_path(notes_directory, line.strip())
-                  for line in output_lines
-                  if line.strip()]
-
+    history_dir = get_note_history_dir(notes_directory, note_path)
     response = []
-    for diff_file in diff_files:
-        filename = diff_file.split('/')[-1]
-        diff_type = filename.split('.')[-2]
-        timestamp = filename.rsplit('.', 2)[0]
-        if diff_type == 'move':
-            full_diff = _get_note_diff(notes_directory, note_path, timestamp, diff_type)
-            move_diff_paths = extract_paths_from_move_diff(full_diff)
-            if move_diff_paths['from'] == note_path:
-                move_direction = 'out'
-            else:
-                move_direction = 'in'
-            response.append({
-                'diff_type': diff_type,
-                'timestamp': timestamp,
-                'from_path': move_diff_paths['from'],
-                'to_path': move_diff_paths['to'],
-                'move_direction': move_direction
-            })
-        else:
-            response.append({
-                'diff_type': diff_type,
-                'timestamp': timestamp
-            })
+    # Of the diffs with the same timestamp, the last one stored is the newest
+    for entry in reversed(read_history_index(history_dir)):
+        diff = None
+        if entry.diff_type == 'move':
+            diff = read_history_record(history_dir, entry).diff
+        response.append(get_diff_info(note_path, entry.diff_type,
+                                      entry.timestamp, diff))
 
     response.sort(key=lambda x: x['timestamp'], reverse=True)
 
     return response
 
 
+def get_timeline_manifest_path(notes_directory: DirectoryPath,
+                               note_path: NotePath) -> str:
+    return f'{get_note_history_dir(notes_directory, note_path)}/' + \
+           f'{TIMELINE_MANIFEST_FILENAME}'
+
+
+def _get_history_log_size(notes_directory: DirectoryPath,
+                          note_path: NotePath) -> int:
+    log_path = get_history_log_path(
+        get_note_history_dir(notes_directory, note_path))
+    if not os.path.exists(log_path):
+        return 0
+    return os.path.getsize(log_path)
+
+
+def _write_timeline_manifest(notes_directory: DirectoryPath,
+                             note_path: NotePath,
+                             manifest: TimelineManifest) -> None:
+    '''Atomically replace the timeline manifest for a note
+    '''
+    manifest_path = get_timeline_manifest_path(notes_directory, note_path)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with atomic_write(manifest_path) as f:
+        json.dump(manifest, f)
+
+
+def _rebuild_timeline_manifest(notes_directory: DirectoryPath,
+                               note_path: NotePath,
+                               find_path: ExecutablePath = 'find'
+                               ) -> TimelineManifest:
+    '''Build the timeline manifest for a note from all of its stored history
+    '''
+    diffs = _list_diffs_for_note(notes_directory, note_path, find_path)
+    versions = _list_note_versions(notes_directory, note_path, find_path)
+    manifest: TimelineManifest = {
+        'version': TIMELINE_MANIFEST_VERSION,
+        'log_size': _get_history_log_size(notes_directory, note_path),
+        'versions': sorted(versions, reverse=True),
+        'diffs': diffs
+    }
+    if diffs or versions:
+        _write_timeline_manifest(notes_directory, note_path, manifest)
+    return manifest
+
+
+def _load_timeline_manifest(notes_directory: DirectoryPath,
+                            note_path: NotePath,
+                            find_path: ExecutablePath = 'find'
+                            ) -> TimelineManifest:
+    '''Load the timeline manifest for a note, rebuilding it if it is
+       missing or out of date with the note's history log
+    '''
+    if not _is_note_path(notes_directory, note_path, must_exist=False):
+        raise ValueError(f'The path {note_path} is not a valid note path')
+
+    # Notes with history in the legacy layout are migrated on first access
+    migrate_legacy_diffs(get_note_history_dir(notes_directory, note_path))
+
+    manifest_path = get_timeline_manifest_path(notes_directory, note_path)
+    if not os.path.exists(manifest_path):
+        return _rebuild_timeline_manifest(notes_directory, note_path,
+                                          find_path)
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except json.JSONDecodeError:
+        log.error(f'Timeline manifest at {manifest_path} is corrupted, '
+                  f'rebuilding it')
+        return _rebuild_timeline_manifest(notes_directory, note_path,
+                                          find_path)
+
+    if not isinstance(manifest, dict) or \
+            manifest.get('version') != TIMELINE_MANIFEST_VERSION or \
+            manifest.get('log_size') != _get_history_log_size(
+                notes_directory, note_path):
+        return _rebuild_timeline_manifest(notes_directory, note_path,
+                                          find_path)
+
+    return manifest
+
+
+def _update_timeline_manifest(notes_directory: DirectoryPath,
+                              note_path: NotePath,
+                              added_version: Optional[NoteVersionTimestamp] = None,
+                              added_diff: Optional[NoteDiffInfo] = None,
+                              removed_diff: Optional[NoteDiffInfo] = None,
+                              previous_log_size: Optional[int] = None
+                              ) -> None:
+    '''Record a change to the history of a note in its timeline manifest.
+       This must be called after the change has been stored
+
+       `previous_log_size` is the size of the note's history log before
+       the change was stored, if the change was stored in the log
+    '''
+    manifest_path = get_timeline_manifest_path(notes_directory, note_path)
+    if not os.path.exists(manifest_path):
+        # Building the manifest from scratch includes the change already
+        _rebuild_timeline_manifest(notes_directory, note_path)
+        return
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest: TimelineManifest = json.load(f)
+    except json.JSONDecodeError:
+        _rebuild_timeline_manifest(notes_directory, note_path)
+        return
+
+    log_size = _get_history_log_size(notes_directory, note_path)
+    if previous_log_size is None:
+        previous_log_size = log_size
+    if manifest.get('version') != TIMELINE_MANIFEST_VERSION or \
+            manifest.get('log_size') != previous_log_size:
+        # The manifest was already out of date before this change
+        _rebuild_timeline_manifest(notes_directory, note_path)
+        return
+
+    if added_version and added_version not in manifest['versions']:
+        manifest['versions'].append(added_version)
+        manifest['versions'].sort(reverse=True)
+    if removed_diff:
+        manifest['diffs'] = [
+            diff for diff in manifest['diffs']
+            if (diff['diff_type'], diff['timestamp']) !=
+               (removed_diff['diff_type'], removed_diff['timestamp'])]
+    if added_diff:
+        # Of the diffs with the same timestamp, the last one stored is the
+        # newest, the same as when listing them from the history log
+        manifest['diffs'].insert(0, added_diff)
+        manifest['diffs'].sort(key=lambda x: x['timestamp'], reverse=True)
+    manifest['log_size'] = log_size
+    _write_timeline_manifest(notes_directory, note_path, manifest)
+
+
 def _get_note_diff(notes_directory: DirectoryPath,
                    note_path: NotePath,
                    timestamp: NoteDiffTimestamp,
@@ -421,32 +648,295 @@ def _get_note_diff(notes_directory: DirectoryPath,
     if not _is_note_path(notes_directory, note_path, must_exist=False):
         raise ValueError(f'The path {note_path} is not a valid note path')
 
-    parsed_diff_time = datetime.fromisoformat(timestamp)
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    for entry in read_history_index(history_dir):
+        if entry.timestamp == timestamp and entry.diff_type == diff_type:
+            return read_history_record(history_dir, entry).diff
+
+    raise ValueError(f'Diff not found for note {note_path} and timestamp {timestamp}')
+
 
-    diff_path = f'{notes_directory}/' + \
-            f'{HISTORY_PATH}' + \
-            f'{note_path}/diffs/' + \
-            f'{parsed_diff_time.year}/' + \
-            f'{parsed_diff_time.month}/' + \
-            f'{parsed_diff_time.day}/' + \
-            f'{timestamp}.{diff_type}.diff'
+def _list_note_checkpoints(notes_directory: DirectoryPath,
+                           note_path: NotePath) -> List[NoteDiffTimestamp]:
+    checkpoints_dir = f'{get_note_history_dir(notes_directory, note_path)}' + \
+                      f'/{CHECKPOINTS_DIRNAME}'
+    if not os.path.isdir(checkpoints_dir):
+        return []
+    return sorted(filename[:-len('.checkpoint')]
+                  for filename in os.listdir(checkpoints_dir)
+                  if filename.endswith('.checkpoint'))
 
-    if not os.path.exists(diff_path):
-        raise ValueError(f'Diff not found for note {note_path} and timestamp {timestamp}')
 
-    with open(diff_path, 'r') as f:
+def _get_note_checkpoint(notes_directory: DirectoryPath,
+                         note_path: NotePath,
+                         timestamp: NoteDiffTimestamp) -> RawNoteContent:
+    checkpoint_path = f'{get_note_history_dir(notes_directory, note_path)}' + \
+                      f'/{CHECKPOINTS_DIRNAME}/{timestamp}.checkpoint'
+    with open(checkpoint_path, 'r') as f:
         return f.read()
 
 
+def ensure_note_checkpoint(notes_directory: DirectoryPath,
+                           note_path: NotePath,
+                           timestamp: datetime,
+                           content: Optional[RawNoteContent] = None) -> bool:
+    '''Store a checkpoint of the current content of a note if enough has
+       been edited since the last version or checkpoint of it.
+
+       Like a version, a checkpoint is the content of the note before any
+       diffs made at or after its timestamp. It must be stored before the
+       diff for the edit being made at `timestamp`
+
+       The checkpoint is the current content of the note, unless its
+       `content` is provided
+
+       Returns whether or not a checkpoint was stored
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    latest_snapshot = max(
+        [get_version_timestamp(filename)
+         for filename in os.listdir(history_dir)
+         if filename.endswith(('.version',
+                               f'.version{COMPRESSED_VERSION_SUFFIX}'))] +
+        _list_note_checkpoints(notes_directory, note_path),
+        default='')
+
+    # Add up the edits which would need to be replayed on top of the
+    # latest version or checkpoint
+    diff_size = 0
+    diff_count = 0
+    for entry in reversed(read_history_index(history_dir)):
+        if entry.timestamp < latest_snapshot or entry.diff_type != 'edit':
+            break
+        diff_size += entry.length
+        diff_count += 1
+
+    note_content = content
+    if note_content is None:
+        note_content = _get_note(notes_directory, note_path)
+    if diff_count < MAX_CHECKPOINT_DIFFS and \
+            diff_size < max(len(note_content), MIN_CHECKPOINT_DIFF_SIZE):
+        return False
+
+    timestamp_string = timestamp.isoformat(timespec='milliseconds')
+    checkpoints_dir = f'{history_dir}/{CHECKPOINTS_DIRNAME}'
+    os.makedirs(checkpoints_dir, exist_ok=True)
+    log.debug(f'Storing checkpoint of {note_path} after {diff_count} edits')
+    with open(f'{checkpoints_dir}/{timestamp_string}.checkpoint', 'w') as f:
+        f.write(note_content)
+    return True
+
+
+def _get_note_at(notes_directory: DirectoryPath,
+                 note_path: NotePath,
+                 timestamp: NoteDiffTimestamp,
+                 find_path: ExecutablePath = 'find',
+                 patch_path: Optional[ExecutablePath] = None
+                 ) -> RawNoteContent:
+    '''Get the content of a note as of a given point in time
+
+       The state is rebuilt from the latest version or checkpoint of the note
+       before that time, by replaying the edits made since then
+    '''
+    if not _is_note_path(notes_directory, note_path, must_exist=False):
+        raise ValueError(f'The path {note_path} is not a valid note path')
+
+    content = _rebuild_note_state(notes_directory, note_path,
+                                  get_utc_timestamp(timestamp),
+                                  inclusive=True, find_path=find_path,
+                                  patch_path=patch_path)
+    if content is None:
+        raise ValueError(f'Note {note_path} did not exist at {timestamp}')
+    return content
+
+
+def get_utc_timestamp(timestamp: str) -> NoteDiffTimestamp:
+    '''Normalize an ISO-8601 timestamp to a UTC timestamp with millisecond
+       precision, the same as the timestamps that history is stored with.
+       Timestamps without a timezone are treated as UTC
+    '''
+    parsed_timestamp = datetime.fromisoformat(timestamp)
+    if not parsed_timestamp.tzinfo:
+        parsed_timestamp = parsed_timestamp.replace(tzinfo=UTC)
+    return parsed_timestamp.astimezone(UTC).isoformat(timespec='milliseconds')
+
+
+def _get_history_stamp(notes_directory: DirectoryPath,
+                       note_path: NotePath) -> Tuple[Optional[int], ...]:
+    '''Get a value which changes whenever history is stored for a note or
+       the note itself is changed, used to invalidate cached results
+    '''
+    stamp: List[Optional[int]] = []
+    for path in [get_timeline_manifest_path(notes_directory, note_path),
+                 get_history_log_path(
+                     get_note_history_dir(notes_directory, note_path)),
+                 get_full_path(notes_directory, note_path)]:
+        try:
+            stat = os.stat(path)
+            stamp.extend([stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            stamp.extend([None, None])
+    return tuple(stamp)
+
+
+def _diff_note_versions(notes_directory: DirectoryPath,
+                        note_path: NotePath,
+                        from_timestamp: str,
+                        to_timestamp: str,
+                        find_path: ExecutablePath = 'find',
+                        patch_path: Optional[ExecutablePath] = None
+                        ) -> NoteDiff:
+    '''Get a single diff between the content of a note at two points in
+       time, composed from all of the history stored in between.
+
+       A note which didn't exist at one of the times is treated as empty.
+       Results are cached until more history is stored for the note
+    '''
+    if not _is_note_path(notes_directory, note_path, must_exist=False):
+        raise ValueError(f'The path {note_path} is not a valid note path')
+
+    from_timestamp = get_utc_timestamp(from_timestamp)
+    to_timestamp = get_utc_timestamp(to_timestamp)
+    cache_key = (notes_directory, note_path, from_timestamp, to_timestamp)
+    stamp = _get_history_stamp(notes_directory, note_path)
+    cached = _version_diff_cache.get(cache_key)
+    if cached and cached[0] == stamp:
+        _version_diff_cache.move_to_end(cache_key)
+        return cached[1]
+
+    from_content = _rebuild_note_state(notes_directory, note_path,
+                                       from_timestamp, inclusive=True,
+                                       find_path=find_path,
+                                       patch_path=patch_path)
+    to_content = _rebuild_note_state(notes_directory, note_path,
+                                     to_timestamp, inclusive=True,
+                                     find_path=find_path,
+                                     patch_path=patch_path)
+    if from_content is None and to_content is None:
+        raise ValueError(f'Note {note_path} did not exist at {from_timestamp} '
+                         f'or {to_timestamp}')
+
+    diff = get_unified_diff(from_content or '', to_content or '', note_path,
+                            diff_time=datetime.fromisoformat(to_timestamp))
+    _version_diff_cache[cache_key] = (stamp, diff)
+    while len(_version_diff_cache) > VERSION_DIFF_CACHE_SIZE:
+        _version_diff_cache.popitem(last=False)
+    return diff
+
+
+def _rebuild_note_state(notes_directory: DirectoryPath,
+                        note_path: NotePath,
+                        timestamp: NoteDiffTimestamp,
+                        inclusive: bool,
+                        find_path: ExecutablePath = 'find',
+                        patch_path: Optional[ExecutablePath] = None
+                        ) -> Optional[RawNoteContent]:
+    '''Rebuild the content of a note as of a UTC timestamp, or `None` if
+       the note didn't exist at that path at the time.
+
+       Diffs made exactly at the timestamp are only included if `inclusive`
+       is set
+    '''
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    all_entries = read_history_index(history_dir)
+    entries = [entry for entry in all_entries
+               if entry.timestamp < timestamp or
+               (inclusive and entry.timestamp == timestamp)]
+
+    if len(entries) == len(all_entries) and \
+            _is_note_path(notes_directory, note_path):
+        # Nothing has changed since the timestamp
+        return _get_note(notes_directory, note_path)
+
+    # Versions and checkpoints hold the state before any diffs at their
+    # timestamp, so they are ordered before diffs with the same timestamp
+    snapshots = [(version, 0, 'version') for version in _list_note_versions(
+                     notes_directory, note_path, find_path)
+                 if version <= timestamp] + \
+                [(checkpoint, 0, 'checkpoint') for checkpoint in
+                 _list_note_checkpoints(notes_directory, note_path)
+                 if checkpoint <= timestamp]
+    events = sorted(snapshots + [(entry.timestamp, 1, entry)
+                                 for entry in entries],
+                    key=lambda event: event[:2])
+
+    # Find the latest event which sets the full state of the note,
+    # and only replay the edits which come after it
+    for start_idx in range(len(events) - 1, -1, -1):
+        event = events[start_idx][2]
+        if isinstance(event, str) or event.diff_type != 'edit':
+            break
+    else:
+        raise ValueError(f'No history found for note {note_path} '
+                         f'before {timestamp}')
+
+    start_timestamp, _, start_event = events[start_idx]
+    if start_event == 'version':
+        content = _get_note_version(notes_directory, note_path,
+                                    start_timestamp)
+    elif start_event == 'checkpoint':
+        content = _get_note_checkpoint(notes_directory, note_path,
+                                       start_timestamp)
+    elif start_event.diff_type == 'create':
+        content = ''
+    elif start_event.diff_type == 'move':
+        move_paths = extract_paths_from_move_diff(
+            read_history_record(history_dir, start_event).diff)
+        if move_paths['from'] == note_path:
+            content = None
+        else:
+            # The note was moved here, so it has the state of the
+            # note it was moved from immediately before the move
+            content = _rebuild_note_state(notes_directory,
+                                          move_paths['from'],
+                                          start_timestamp, inclusive=False,
+                                          find_path=find_path,
+                                          patch_path=patch_path)
+    else:
+        content = None
+
+    edits = [read_history_record(history_dir, event[2]).diff
+             for event in events[start_idx + 1:]]
+    if edits:
+        if content is None:
+            raise ValueError(f'Found edits for note {note_path} '
+                             f'while it did not exist')
+        content = apply_diffs(content, edits, patch_path)
+    return content
+
+
+def _migrate_edit_history(notes_directory: DirectoryPath) -> List[NotePath]:
+    '''Convert the history for every note which still stores each of its
+       diffs as a separate file into a packed history log
+
+       Returns the paths of the notes whose history was migrated
+    '''
+    history_root = f'{notes_directory}/{HISTORY_PATH}'
+    migrated_notes = []
+    for root, dirs, _ in os.walk(history_root):
+        # Only the history directories for notes store diffs, a `diffs`
+        # directory anywhere else is for a subdirectory of the notes
+        if not root.endswith('.note') or LEGACY_DIFFS_DIRNAME not in dirs:
+            continue
+        # Don't descend into the legacy diffs, they are removed below
+        dirs.remove(LEGACY_DIFFS_DIRNAME)
+        if migrate_legacy_diffs(root):
+            migrated_notes.append(root[len(history_root):])
+    return sorted(migrated_notes)
+
+
 def apply_diffs(starting_content: RawNoteContent,
                 diffs: List[NoteDiff],
-                patch_path: ExecutablePath = 'patch',
+                patch_path: Optional[ExecutablePath] = None,
                 reverse: bool = False) -> RawNoteContent:
-    '''Apply one or more patches to a file with GNU patch
+    '''Apply one or more patches to a file
 
        Patches are applied in the order they are provided
 
        If `reverse` is set, then patches are undone from the starting content
+
+       Patches are applied in-process unless `patch_path` is set, in which
+       case GNU patch at that path is used instead
     '''
 
     # Remove empty patches from being applied,
@@ -455,6 +945,22 @@ def apply_diffs(starting_content: RawNoteContent,
     if not filtered_diffs:
         return starting_content
 
+    if patch_path:
+        return apply_diffs_with_gnu_patch(starting_content, filtered_diffs,
+                                          patch_path, reverse)
+
+    patched_content = starting_content
+    for diff in filtered_diffs:
+        patched_content = apply_patch(patched_content, diff, reverse=reverse)
+    return patched_content
+
+
+def apply_diffs_with_gnu_patch(starting_content: RawNoteContent,
+                               diffs: List[NoteDiff],
+                               patch_path: ExecutablePath = 'patch',
+                               reverse: bool = False) -> RawNoteContent:
+    '''Apply one or more non-empty patches to a file with GNU patch
+    '''
     with tempfile.TemporaryDirectory() as tmpdir:
         original_filename = f'{tmpdir}/original.txt'
         patched_filename = f'{tmpdir}/patched.txt'
@@ -465,7 +971,7 @@ def apply_diffs(starting_content: RawNoteContent,
             if not starting_content.endswith('\n'):
                 f.write('\n')
 
-        for idx, diff_content in enumerate(filtered_diffs):
+        for idx, diff_content in enumerate(diffs):
             diff_filename = f'{tmpdir}/diff_{idx}.txt'
             with open(diff_filename, 'w') as f:
                 f.write(diff_content)
@@ -496,40 +1002,61 @@ def _store_history_for_note_edit(notes_directory: DirectoryPath,
                                  note_path: NotePath,
                                  new_content: RawNoteContent,
                                  find_path: ExecutablePath = 'find',
-                                 patch_path: ExecutablePath = 'patch') -> None:
-    timestamp = datetime.now(UTC)
+                                 patch_path: Optional[ExecutablePath] = None,
+                                 old_content: Optional[RawNoteContent] = None,
+                                 timestamp: Optional[datetime] = None
+                                 ) -> None:
+    '''Store the history for an edit to a note, which must be stored
+       before the note is updated with its `new_content`
 
-    ensure_note_version(notes_directory, note_path, timestamp)
+       History can also be stored after the note was updated by providing
+       the `old_content` of the note before the edit, along with the
+       `timestamp` of the edit
+    '''
+    if timestamp is None:
+        timestamp = datetime.now(UTC)
+    if old_content is None:
+        old_content = _get_note(notes_directory, note_path)
+
+    ensure_note_version(notes_directory, note_path, timestamp,
+                        content=old_content)
 
     # If the latest diff is an edit diff
     #   which was made within the last 5 minutes
     #   then merge this change into the latest diff
-    all_diffs = _list_diffs_for_note(notes_directory, note_path, find_path)
-    if all_diffs:
-        latest_diff = all_diffs[0]
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    latest_diff = get_latest_history_entry(history_dir)
+    if latest_diff:
         merge_cutoff_time = timestamp - timedelta(minutes=MERGE_CUTOFF_LIMIT_MIN)
         merge_cutoff_time = merge_cutoff_time.isoformat(timespec='milliseconds')
-        if latest_diff and latest_diff['diff_type'] == 'edit' \
-                       and latest_diff['timestamp'] > merge_cutoff_time:
+        # Edits aren't merged across UTC days, since the latest diff would
+        # then start before the daily version it is listed under
+        if latest_diff.diff_type == 'edit' \
+                and latest_diff.timestamp > merge_cutoff_time \
+                and latest_diff.timestamp[:10] == timestamp.date().isoformat():
             # We are merging these changes into the latest diff
-            current_version = _get_note(notes_directory, note_path)
-            latest_diff_content = _get_note_diff(notes_directory, note_path, latest_diff['timestamp'], latest_diff['diff_type'])
-            pre_edit_state = apply_diffs(current_version, [latest_diff_content], patch_path, reverse=True)
+            latest_diff_content = read_history_record(history_dir, latest_diff).diff
+            pre_edit_state = apply_diffs(old_content, [latest_diff_content], patch_path, reverse=True)
             combined_diff = get_unified_diff(pre_edit_state, new_content, note_path)
-            save_diff(notes_directory, note_path, combined_diff, timestamp, 'edit')
-            delete_diff(notes_directory, note_path, latest_diff['timestamp'], latest_diff['diff_type'])
+            save_diff(notes_directory, note_path, combined_diff, timestamp, 'edit',
+                      replace_latest=True)
             return None
 
     # If we are not doing a merge
-    diff = calculate_diff_for_edit(notes_directory, note_path, new_content)
+    if old_content == new_content:
+        return None
+    diff = get_unified_diff(old_content, new_content, note_path)
     if diff:
+        ensure_note_checkpoint(notes_directory, note_path, timestamp,
+                               content=old_content)
         save_diff(notes_directory, note_path, diff, timestamp, 'edit')
 
 
 def _store_history_for_note_move(notes_directory: DirectoryPath,
                                  old_note_path: NotePath,
                                  new_note_path: NotePath,
-                                 find_path: ExecutablePath = 'find'
+                                 find_path: ExecutablePath = 'find',
+                                 timestamp: Optional[datetime] = None
                                  ) -> None:
     '''Ensure that all needed edit history is created for a note being moved
 
@@ -544,7 +1071,8 @@ def _store_history_for_note_move(notes_directory: DirectoryPath,
         raise ValueError(f'Cannot track move history. Neither {old_note_path} ' + \
                          f'or {new_note_path} are valid note paths')
 
-    timestamp = datetime.now(UTC)
+    if timestamp is None:
+        timestamp = datetime.now(UTC)
     if _is_note_path(notes_directory, new_note_path, must_exist=False) and \
             note_version_exists_for_date(
                 notes_directory=notes_directory, note_path=new_note_path,
@@ -568,41 +1096,113 @@ def _store_history_for_note_move(notes_directory: DirectoryPath,
         save_diff(notes_directory, new_note_path, diff, timestamp, 'move')
 
 
+def _list_notes_in_directory(notes_directory: DirectoryPath,
+                             directory_path: Subdir) -> List[NotePath]:
+    '''List every note within a directory and its subdirectories, with a
+       single walk of the directory tree. Hidden directories are skipped
+    '''
+    full_dir_path = get_full_path(notes_directory, directory_path)
+    note_paths = []
+    for root, dirs, filenames in os.walk(full_dir_path):
+        dirs[:] = [dirname for dirname in dirs if not dirname.startswith('.')]
+        for filename in filenames:
+            if filename.endswith('.note'):
+                note_paths.append(get_relative_path(
+                    notes_directory, os.path.join(root, filename)))
+    return sorted(note_paths)
+
+
+def _store_pending_history(notes_directory: DirectoryPath,
+                           pending_history: List[List[PendingNoteHistory]],
+                           timestamp: datetime,
+                           progress_callback: Optional[HistoryProgressCallback] = None
+                           ) -> None:
+    '''Store the history planned for every note in a directory, grouped by
+       the note in the directory it belongs to. Each note's version is
+       written and its diff is appended to its history log, and then its
+       timeline manifest is updated once for both
+    '''
+    timestamp_string = timestamp.isoformat(timespec='milliseconds')
+    for idx, note_group in enumerate(pending_history):
+        for note_history in note_group:
+            history_dir = get_note_history_dir(notes_directory,
+                                               note_history.note_path)
+            os.makedirs(history_dir, exist_ok=True)
+            if note_history.version is not None:
+                with open(f'{history_dir}/{note_history.version}.version',
+                          'w') as f:
+                    f.write(note_history.version_content)
+
+            previous_log_size = _get_history_log_size(notes_directory,
+                                                      note_history.note_path)
+            append_history_record(history_dir, HistoryLogRecord(
+                note_history.diff_type, timestamp_string,
+                get_diff_author(note_history.diff), note_history.diff))
+            _update_timeline_manifest(
+                notes_directory, note_history.note_path,
+                added_version=note_history.version,
+                added_diff=get_diff_info(note_history.note_path,
+                                         note_history.diff_type,
+                                         timestamp_string, note_history.diff),
+                previous_log_size=previous_log_size)
+        if progress_callback:
+            progress_callback(idx + 1, len(pending_history))
+
+
 def _store_history_for_directory_move(notes_directory: DirectoryPath,
                                       old_directory_path: Subdir,
                                       new_directory_path: Subdir,
-                                      find_path: ExecutablePath = 'find'
+                                      find_path: ExecutablePath = 'find',
+                                      progress_callback: Optional[HistoryProgressCallback] = None
                                       ) -> None:
+    '''Store the history for moving every note in a directory
+
+       All of the moves are recorded with the same timestamp, and
+       `progress_callback` is called with the number of notes processed
+       so far and the total number of notes after each one
     '''
-    '''
-    old_full_dir_path = get_full_path(notes_directory, old_directory_path)
     new_full_dir_path = get_full_path(notes_directory, new_directory_path)
 
     if os.path.exists(new_full_dir_path):
         raise ValueError(f'Target directory {new_directory_path} already exists')
 
-    # Ensure that version history exists for every note being moved
-    find_command = f'{find_path} {old_full_dir_path} ' + \
-                   '-type f -name "*.note"'
-
-    log.debug(f'Running command {find_command} to list notes')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().splitlines()
-
-    note_paths = [get_relative_path(notes_directory, line.strip())
-                  for line in output_lines
-                  if line.strip()]
+    note_paths = _list_notes_in_directory(notes_directory, old_directory_path)
+    timestamp = datetime.now(UTC)
+    old_directory_path = get_relative_path(
+        notes_directory, get_full_path(notes_directory, old_directory_path))
+    new_directory_path = get_relative_path(notes_directory, new_full_dir_path)
 
+    # The same history is stored as when moving each note on its own, see
+    # `_store_history_for_note_move`, but each note is only read once and
+    # is known to exist, so it doesn't need to be checked again
+    timestamp_string = timestamp.isoformat(timespec='milliseconds')
+    # Versions added to the destination of a move are placed just after
+    # the move, see `add_note_version_for_move`
+    after_move = (timestamp + timedelta(milliseconds=1)).isoformat(
+        timespec='milliseconds')
+    pending_history = []
     for note_path in note_paths:
-        new_note_path = note_path.replace(
-            f'{old_directory_path}',
-            f'{new_directory_path}')
-        _store_history_for_note_move(
-            notes_directory=notes_directory,
-            old_note_path=note_path,
-            new_note_path=new_note_path,
-            find_path=find_path)
+        new_note_path = new_directory_path + \
+                        note_path[len(old_directory_path):]
+        diff = calculate_diff_for_move(note_path, new_note_path)
+        content = _get_note(notes_directory, note_path)
+        has_version = note_version_exists_for_date(
+            notes_directory, note_path, timestamp.date())
+        pending_history.append([
+            PendingNoteHistory(
+                note_path, 'move', diff,
+                version=None if has_version else timestamp_string,
+                version_content=content),
+            PendingNoteHistory(
+                new_note_path, 'move', diff,
+                version=after_move if note_version_exists_for_date(
+                    notes_directory, new_note_path, timestamp.date())
+                else None,
+                version_content=content)
+        ])
+
+    _store_pending_history(notes_directory, pending_history, timestamp,
+                           progress_callback)
 
 
 def _store_history_for_note_create(notes_directory: DirectoryPath,
@@ -618,8 +1218,11 @@ def _store_history_for_note_create(notes_directory: DirectoryPath,
 
 
 def _store_history_for_note_delete(notes_directory: DirectoryPath,
-                                   note_path: NotePath) -> None:
-    timestamp = datetime.now(UTC)
+                                   note_path: NotePath,
+                                   timestamp: Optional[datetime] = None
+                                   ) -> None:
+    if timestamp is None:
+        timestamp = datetime.now(UTC)
     ensure_note_version(notes_directory, note_path, timestamp)
     diff = calculate_diff_for_delete(notes_directory, note_path)
     save_diff(notes_directory, note_path, diff, timestamp, 'delete')
@@ -627,26 +1230,35 @@ def _store_history_for_note_delete(notes_directory: DirectoryPath,
 
 def _store_history_for_directory_delete(notes_directory: DirectoryPath,
                                         directory_path: Subdir,
-                                        find_path: ExecutablePath = 'find'
+                                        find_path: ExecutablePath = 'find',
+                                        progress_callback: Optional[HistoryProgressCallback] = None
                                         ) -> None:
+    '''Store the history for deleting every note in a directory
+
+       All of the deletes are recorded with the same timestamp, and
+       `progress_callback` is called with the number of notes processed
+       so far and the total number of notes after each one
+    '''
     full_dir_path = get_full_path(notes_directory, directory_path)
     if not os.path.exists(full_dir_path):
         raise ValueError(f'Directory {directory_path} to delete does not exist')
 
-    # Ensure that version history exists for every note being moved
-    find_command = f'{find_path} {full_dir_path} ' + \
-                   '-type f -name "*.note"'
-
-    log.debug(f'Running command {find_command} to list notes')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().splitlines()
-
-    note_paths = [get_relative_path(notes_directory, line.strip())
-                  for line in output_lines
-                  if line.strip()]
+    note_paths = _list_notes_in_directory(notes_directory, directory_path)
+    timestamp = datetime.now(UTC)
 
+    # The same history is stored as when deleting each note on its own
+    timestamp_string = timestamp.isoformat(timespec='milliseconds')
+    pending_history = []
     for note_path in note_paths:
-        _store_history_for_note_delete(
-            notes_directory=notes_directory,
-            note_path=note_path)
+        content = _get_note(notes_directory, note_path)
+        has_version = note_version_exists_for_date(
+            notes_directory, note_path, timestamp.date())
+        pending_history.append([PendingNoteHistory(
+            note_path, 'delete',
+            calculate_diff_for_delete(notes_directory, note_path,
+                                      old_content=content),
+            version=None if has_version else timestamp_string,
+            version_content=content)])
+
+    _store_pending_history(notes_directory, pending_history, timestamp,
+                           progress_callback)
@@ -1,6 +1,8 @@
 from typing import List, Optional, TypedDict
 
-from shorthand.edit_history import NoteDiffInfo, NoteVersionTimestamp, _list_diffs_for_note, _list_note_versions
+from shorthand.edit_history import NoteDiffInfo, NoteDiffTimestamp, \
+                                   NoteVersionTimestamp, \
+                                   _load_timeline_manifest
 from shorthand.types import DirectoryPath, ExecutablePath, NotePath
 
 
@@ -13,18 +15,42 @@ type EditTimeline = List[EditTimelineEntry]
 
 def get_edit_timeline(notes_directory: DirectoryPath,
                       note_path: NotePath,
-                      find_path: ExecutablePath = 'find'
+                      find_path: ExecutablePath = 'find',
+                      before: Optional[NoteDiffTimestamp] = None,
+                      limit: Optional[int] = None
                       ) -> EditTimeline:
     '''Get a timeline of the edit history of a note.
 
        Every entry in the timeline is a note version, and the diffs which
        were applied on top of that note version
+
+       The timeline can be paged through by setting `limit` to the maximum
+       number of diffs to return, and `before` to the timestamp of the
+       oldest diff in the previous page. The diffs for a single version
+       may be split across pages, and entries without any diffs are
+       left out of paged timelines
     '''
-    diffs = _list_diffs_for_note(notes_directory, note_path, find_path)
-    versions = _list_note_versions(notes_directory, note_path, find_path)
+    if limit is not None and limit < 1:
+        raise ValueError(f'Invalid timeline limit {limit}')
+
+    manifest = _load_timeline_manifest(notes_directory, note_path, find_path)
+    diffs = sorted(manifest['diffs'], key=lambda x: x['timestamp'],
+                   reverse=True)
+    versions = sorted(manifest['versions'], reverse=True)
 
-    diffs.sort(key=lambda x: x['timestamp'], reverse=True)
-    versions.sort(reverse=True)
+    paged = before is not None or limit is not None
+    if before is not None:
+        diffs = [diff for diff in diffs if diff['timestamp'] < before]
+        versions = [version for version in versions if version < before]
+    if limit is not None and len(diffs) > limit:
+        diffs = diffs[:limit]
+        # Only include the versions which the diffs in this page belong to
+        oldest_diff = diffs[-1]['timestamp']
+        earlier_versions = [version for version in versions
+                            if version <= oldest_diff]
+        if earlier_versions:
+            versions = [version for version in versions
+                        if version >= earlier_versions[0]]
 
     timeline = []
 
@@ -38,6 +64,8 @@ def get_edit_timeline(notes_directory: DirectoryPath,
             else:
                 break
         diffs = diffs[oldest_diff_idx + 1:]
+        if paged and not diffs_for_version:
+            continue
         timeline.append({
             'version': version,
             'diffs': diffs_for_version
@@ -53,6 +81,3 @@ def get_edit_timeline(notes_directory: DirectoryPath,
         })
 
     return timeline
-
-
-
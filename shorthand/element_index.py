@@ -0,0 +1,330 @@
+'''
+A persistent index of all of the structured elements within the notes
+directory (todos, questions, definitions, locations, record sets, tags,
+and dated headings).
+
+The index is stored as a single JSON file within the `.shorthand` directory
+and holds the parsed elements of every note, keyed by the note path along
+with the modification time and size of the note when it was parsed. When
+the index is refreshed, only notes which were added, modified, or removed
+since the last refresh are parsed again.
+
+Notes are parsed with the single-pass extractor in
+`shorthand.elements.extract`, so element queries which are answered from
+the index return exactly the same structures as their counterparts which
+scan the notes directory, but never need to read the note files themselves.
+'''
+import os
+import json
+import logging
+from typing import Dict, Iterable, List, Optional, Set, TypedDict
+
+from shorthand.calendar import Calendar, CalendarMode, collect_calendar
+from shorthand.elements.combined import ElementType, Elements, \
+                                        collect_elements
+from shorthand.elements.definitions import Definition
+from shorthand.elements.extract import NoteElements, collect_definitions, \
+                                       collect_locations, collect_questions, \
+                                       collect_record_sets, collect_tags, \
+                                       collect_todos, extract_note_elements
+from shorthand.elements.locations import Location
+from shorthand.elements.questions import Question, QuestionStatus
+from shorthand.elements.record_sets import RecordSetIndex
+from shorthand.elements.todos import Todo, TodoStatus
+from shorthand.types import DirectoryPath, InternalAbsolutePath, NotePath, \
+                            RelativeDirectoryPath
+from shorthand.utils.filesystem import atomic_write
+from shorthand.utils.paths import _get_changed_note_paths, \
+                                  _list_note_paths, get_full_path
+
+
+ELEMENT_INDEX_PATH = '.shorthand/index/elements.json'
+ELEMENT_INDEX_VERSION = 1
+
+
+log = logging.getLogger(__name__)
+
+
+class IndexedNote(TypedDict):
+    mtime_ns: int
+    size: int
+    elements: NoteElements
+
+class ElementIndex(TypedDict):
+    version: int
+    notes: Dict[NotePath, IndexedNote]
+
+
+# Loaded indexes are kept in memory, keyed by the notes directory, along
+# with the modification time of the index file when it was loaded
+_loaded_indexes: Dict[DirectoryPath, tuple[int, ElementIndex]] = {}
+
+# Notes directories whose element index was fully refreshed by this process.
+# After that, the index is kept up to date by refreshing only the paths
+# which are changed through the server or reported by the watcher
+_fully_refreshed_indexes: Set[DirectoryPath] = set()
+
+
+def get_element_index_path(notes_directory: DirectoryPath) -> str:
+    return f'{notes_directory}/{ELEMENT_INDEX_PATH}'
+
+
+def _load_element_index(notes_directory: DirectoryPath) -> ElementIndex:
+    '''Load the element index from disk, or return an empty index if
+       none exists yet or the existing index is unusable
+    '''
+    index_path = get_element_index_path(notes_directory)
+    empty_index: ElementIndex = {
+        'version': ELEMENT_INDEX_VERSION,
+        'notes': {}
+    }
+
+    try:
+        index_mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return empty_index
+
+    cached = _loaded_indexes.get(notes_directory)
+    if cached and cached[0] == index_mtime:
+        return cached[1]
+
+    try:
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+    except json.JSONDecodeError:
+        log.error(f'Element index at {index_path} is corrupted, rebuilding')
+        return empty_index
+
+    if not isinstance(index, dict) or \
+            index.get('version') != ELEMENT_INDEX_VERSION:
+        log.info(f'Element index at {index_path} has an outdated format, '
+                 f'rebuilding')
+        return empty_index
+
+    _loaded_indexes[notes_directory] = (index_mtime, index)
+    return index
+
+
+def _write_element_index(notes_directory: DirectoryPath,
+                         index: ElementIndex) -> None:
+    '''Atomically replace the element index on disk
+    '''
+    index_path = get_element_index_path(notes_directory)
+    index_dir = os.path.dirname(index_path)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+
+    with atomic_write(index_path) as f:
+        json.dump(index, f)
+
+    _loaded_indexes[notes_directory] = (os.stat(index_path).st_mtime_ns,
+                                        index)
+
+
+def _refresh_element_index(notes_directory: DirectoryPath,
+                           paths: Optional[Iterable[InternalAbsolutePath]] = None
+                           ) -> ElementIndex:
+    '''Bring the element index up to date with the notes directory,
+       re-parsing only notes which changed since the last refresh. Every
+       note is checked unless a list of note or directory paths which
+       changed is specified
+    '''
+    index = _load_element_index(notes_directory)
+    indexed_notes = index['notes']
+    is_modified = False
+
+    if paths is None:
+        current_note_paths = _list_note_paths(notes_directory)
+        removed_note_paths = set(indexed_notes.keys()) - \
+            set(current_note_paths)
+    else:
+        current_note_paths = []
+        removed_note_paths = set()
+        for note_path in sorted(_get_changed_note_paths(
+                notes_directory, paths, indexed_notes.keys())):
+            if os.path.isfile(get_full_path(notes_directory, note_path)):
+                current_note_paths.append(note_path)
+            elif note_path in indexed_notes:
+                removed_note_paths.add(note_path)
+
+    for note_path in current_note_paths:
+        full_path = get_full_path(notes_directory, note_path)
+        try:
+            stat_result = os.stat(full_path)
+        except FileNotFoundError:
+            continue
+
+        indexed_note = indexed_notes.get(note_path)
+        if indexed_note and \
+                indexed_note['mtime_ns'] == stat_result.st_mtime_ns and \
+                indexed_note['size'] == stat_result.st_size:
+            continue
+
+        log.debug(f'Updating element index for note {note_path}')
+        with open(full_path, 'r') as f:
+            note_content = f.read()
+        indexed_notes[note_path] = {
+            'mtime_ns': stat_result.st_mtime_ns,
+            'size': stat_result.st_size,
+            'elements': extract_note_elements(note_content)
+        }
+        is_modified = True
+
+    for note_path in removed_note_paths:
+        log.debug(f'Removing note {note_path} from the element index')
+        del indexed_notes[note_path]
+        is_modified = True
+
+    if is_modified:
+        _write_element_index(notes_directory, index)
+    if paths is None:
+        _fully_refreshed_indexes.add(notes_directory)
+
+    return index
+
+
+def _is_element_index_current(notes_directory: DirectoryPath) -> bool:
+    '''Check whether the element index was fully refreshed by this process
+       and hasn't been replaced or removed on disk since then
+    '''
+    if notes_directory not in _fully_refreshed_indexes:
+        return False
+
+    try:
+        index_mtime = os.stat(
+            get_element_index_path(notes_directory)).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    cached = _loaded_indexes.get(notes_directory)
+    return cached is not None and cached[0] == index_mtime
+
+
+def _sync_element_index_paths(notes_directory: DirectoryPath,
+                              paths: Iterable[InternalAbsolutePath]) -> None:
+    '''Update the element index after the notes or directories at the
+       specified paths were changed. Nothing is done until the index has
+       been fully refreshed, since the next query does that anyway
+    '''
+    if not _is_element_index_current(notes_directory):
+        return
+    _refresh_element_index(notes_directory, paths=paths)
+
+
+def _get_indexed_notes(notes_directory: DirectoryPath,
+                       directory_filter: Optional[RelativeDirectoryPath] = None
+                       ) -> List[tuple[NotePath, NoteElements]]:
+    '''Get the indexed elements of all notes, in path order, which are
+       within the specified directory filter. The whole notes directory is
+       only checked for changes the first time the index is used
+    '''
+    if _is_element_index_current(notes_directory):
+        index = _load_element_index(notes_directory)
+    else:
+        index = _refresh_element_index(notes_directory)
+
+    path_prefix = None
+    if directory_filter:
+        path_prefix = '/' + directory_filter.strip('/') + '/'
+
+    return [(note_path, index['notes'][note_path]['elements'])
+            for note_path in sorted(index['notes'].keys())
+            if not path_prefix or note_path.startswith(path_prefix)]
+
+
+def _get_indexed_todos(notes_directory: DirectoryPath,
+                       todo_status: TodoStatus = 'incomplete',
+                       directory_filter: Optional[RelativeDirectoryPath] = None,
+                       query_string: Optional[str] = None,
+                       case_sensitive: bool = False,
+                       sort_by: Optional[str] = None,
+                       suppress_future: bool = True,
+                       tag: Optional[str] = None
+                       ) -> List[Todo]:
+    '''Get a specified set of todos from the element index
+    '''
+    todo_items = collect_todos(
+        _get_indexed_notes(notes_directory, directory_filter),
+        todo_status=todo_status, directory_filter=directory_filter,
+        query_string=query_string, case_sensitive=case_sensitive,
+        sort_by=sort_by, suppress_future=suppress_future, tag=tag)
+    log.info(f'returning {len(todo_items)} todos from the element index')
+    return todo_items
+
+
+def _get_indexed_questions(notes_directory: DirectoryPath,
+                           question_status: QuestionStatus = 'all',
+                           directory_filter: Optional[RelativeDirectoryPath] = None
+                           ) -> List[Question]:
+    '''Get questions from the element index
+    '''
+    return collect_questions(
+        _get_indexed_notes(notes_directory, directory_filter),
+        question_status=question_status, directory_filter=directory_filter)
+
+
+def _get_indexed_definitions(notes_directory: DirectoryPath,
+                             directory_filter: Optional[RelativeDirectoryPath] = None,
+                             query_string: Optional[str] = None,
+                             search_term_only: bool = True,
+                             case_sensitive: bool = False,
+                             include_sub_elements: bool = False
+                             ) -> List[Definition]:
+    '''Get definitions from the element index
+    '''
+    return collect_definitions(
+        _get_indexed_notes(notes_directory, directory_filter),
+        directory_filter=directory_filter, query_string=query_string,
+        search_term_only=search_term_only, case_sensitive=case_sensitive,
+        include_sub_elements=include_sub_elements)
+
+
+def _get_indexed_locations(notes_directory: DirectoryPath,
+                           directory_filter: Optional[RelativeDirectoryPath] = None
+                           ) -> List[Location]:
+    '''Get GPS locations from the element index
+    '''
+    return collect_locations(
+        _get_indexed_notes(notes_directory, directory_filter),
+        directory_filter=directory_filter)
+
+
+def _get_indexed_record_sets(notes_directory: DirectoryPath,
+                             directory_filter: Optional[RelativeDirectoryPath] = None
+                             ) -> List[RecordSetIndex]:
+    '''List all record sets from the element index
+    '''
+    return collect_record_sets(
+        _get_indexed_notes(notes_directory, directory_filter),
+        directory_filter=directory_filter)
+
+
+def _get_indexed_tags(notes_directory: DirectoryPath,
+                      directory_filter: Optional[RelativeDirectoryPath] = None
+                      ) -> List[str]:
+    '''Get the sorted set of all tags from the element index
+    '''
+    return collect_tags(_get_indexed_notes(notes_directory, directory_filter))
+
+
+def _get_indexed_calendar(notes_directory: DirectoryPath,
+                          mode: CalendarMode = 'recent',
+                          directory_filter: Optional[RelativeDirectoryPath] = None
+                          ) -> Calendar:
+    '''Build the calendar from the element index
+    '''
+    return collect_calendar(
+        _get_indexed_notes(notes_directory, directory_filter),
+        mode=mode, directory_filter=directory_filter)
+
+
+def _get_indexed_elements(notes_directory: DirectoryPath,
+                          element_types: Optional[List[ElementType]] = None,
+                          directory_filter: Optional[RelativeDirectoryPath] = None,
+                          calendar_mode: CalendarMode = 'recent'
+                          ) -> Elements:
+    '''Get several types of elements at once from the element index
+    '''
+    return collect_elements(
+        _get_indexed_notes(notes_directory, directory_filter),
+        element_types=element_types, directory_filter=directory_filter,
+        calendar_mode=calendar_mode)
@@ -0,0 +1,101 @@
+'''
+Fetch several types of elements for a directory in a single call, reading
+each note only once regardless of how many element types are requested.
+'''
+import logging
+from typing import List, Literal, Optional, TypedDict
+
+from shorthand.calendar import Calendar, CalendarMode, collect_calendar
+from shorthand.elements.definitions import Definition
+from shorthand.elements.extract import ExtractedNotes, _extract_notes, \
+                                       collect_definitions, \
+                                       collect_locations, collect_questions, \
+                                       collect_record_sets, collect_tags, \
+                                       collect_todos
+from shorthand.elements.locations import Location
+from shorthand.elements.questions import Question
+from shorthand.elements.record_sets import RecordSetIndex
+from shorthand.elements.todos import Todo
+from shorthand.types import DirectoryPath, RelativeDirectoryPath
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS
+
+
+log = logging.getLogger(__name__)
+
+
+type ElementType = Literal['todos', 'questions', 'definitions', 'locations',
+                           'record_sets', 'tags', 'calendar']
+ELEMENT_TYPES: List[ElementType] = ['todos', 'questions', 'definitions',
+                                    'locations', 'record_sets', 'tags',
+                                    'calendar']
+
+class Elements(TypedDict, total=False):
+    todos: List[Todo]
+    questions: List[Question]
+    definitions: List[Definition]
+    locations: List[Location]
+    record_sets: List[RecordSetIndex]
+    tags: List[str]
+    calendar: Calendar
+
+
+def collect_elements(notes: ExtractedNotes,
+                     element_types: Optional[List[ElementType]] = None,
+                     directory_filter: Optional[RelativeDirectoryPath] = None,
+                     calendar_mode: CalendarMode = 'recent'
+                     ) -> Elements:
+    '''Get each of the requested element types from extracted note
+       elements. All element types are included if none are specified.
+
+       Todos of every status are included, with future todos suppressed
+       in the same way as the default for `get_todos`
+    '''
+    if not element_types:
+        element_types = ELEMENT_TYPES
+    for element_type in element_types:
+        if element_type not in ELEMENT_TYPES:
+            raise ValueError(f'Invalid element type {element_type} '
+                             f'specified. Valid options are: '
+                             f'{", ".join(ELEMENT_TYPES)}')
+
+    notes = list(notes)
+    elements: Elements = {}
+    if 'todos' in element_types:
+        elements['todos'] = collect_todos(notes, todo_status=None,
+                                          directory_filter=directory_filter)
+    if 'questions' in element_types:
+        elements['questions'] = collect_questions(
+            notes, directory_filter=directory_filter)
+    if 'definitions' in element_types:
+        elements['definitions'] = collect_definitions(
+            notes, directory_filter=directory_filter)
+    if 'locations' in element_types:
+        elements['locations'] = collect_locations(
+            notes, directory_filter=directory_filter)
+    if 'record_sets' in element_types:
+        elements['record_sets'] = collect_record_sets(
+            notes, directory_filter=directory_filter)
+    if 'tags' in element_types:
+        elements['tags'] = collect_tags(notes)
+    if 'calendar' in element_types:
+        elements['calendar'] = collect_calendar(
+            notes, mode=calendar_mode, directory_filter=directory_filter)
+
+    return elements
+
+
+def _get_elements(notes_directory: DirectoryPath,
+                  element_types: Optional[List[ElementType]] = None,
+                  directory_filter: Optional[RelativeDirectoryPath] = None,
+                  calendar_mode: CalendarMode = 'recent',
+                  scan_workers: int = DEFAULT_SCAN_WORKERS
+                  ) -> Elements:
+    '''Get several types of elements at once by reading every note
+       within the directory filter exactly once
+    '''
+    log.info(f'Getting elements {element_types} in directory '
+             f'{directory_filter}')
+    return collect_elements(
+        _extract_notes(notes_directory, directory_filter, scan_workers),
+        element_types=element_types, directory_filter=directory_filter,
+        calendar_mode=calendar_mode)
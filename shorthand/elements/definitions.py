@@ -1,12 +1,13 @@
 import re
 import shlex
-from subprocess import Popen, PIPE
 import logging
-from typing import List, Optional, TypedDict, Required
-from shorthand.types import DirectoryPath, DisplayPath, ExecutablePath, RelativeDirectoryPath, RelativeNotePath
+from typing import List, Optional, Tuple, TypedDict, Required
+from shorthand.types import DirectoryPath, DisplayPath, RawNoteLine, RelativeDirectoryPath, RelativeNotePath
 
 from shorthand.utils.patterns import DEFINITION_PATTERN
-from shorthand.utils.paths import get_full_path, get_relative_path, get_display_path
+from shorthand.utils.paths import get_full_path, get_display_path
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, compile_pattern, \
+                                 literal_filters, scan_notes
 
 
 definition_regex = re.compile(DEFINITION_PATTERN)
@@ -24,117 +25,81 @@ class Definition(TypedDict, total=False):
     sub_elements: str
 
 
+def parse_definition(definition_raw: RawNoteLine) -> Tuple[str, str]:
+    '''Get the term and the definition text from a raw definition line
+    '''
+    definition_match = definition_regex.match(definition_raw)
+    if not definition_match:
+        log.debug(f'No definition match found for line {definition_raw}')
+        return '', ''
+
+    term = definition_match.group(3)
+    term = term.strip().strip(r'{}')
+    return term, definition_match.group(4)
+
+
+def get_sub_elements(note_lines: List[RawNoteLine], line_number: int) -> str:
+    '''Get all lines nested (more indented) underneath the element
+       on the specified line number (1-indexed) of a note
+    '''
+    element_line = note_lines[line_number - 1]
+    indent_level = len(element_line) - len(element_line.lstrip(' '))
+    sub_element_lines = []
+    for line_content in note_lines[line_number:]:
+        current_indent = len(line_content) - len(line_content.lstrip(' '))
+        if current_indent > indent_level:
+            sub_element_lines.append(line_content)
+        else:
+            break
+
+    return '\n'.join(sub_element_lines)
+
+
 def _get_definitions(notes_directory: DirectoryPath,
                      directory_filter: Optional[RelativeDirectoryPath] = None,
                      query_string: Optional[str] = None,
                      search_term_only: bool = True,
                      case_sensitive: bool = False,
-                     grep_path: ExecutablePath = 'grep',
-                     include_sub_elements: bool = False) -> List[Definition]:
+                     include_sub_elements: bool = False,
+                     scan_workers: int = DEFAULT_SCAN_WORKERS
+                     ) -> List[Definition]:
 
     definitions: List[Definition] = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
-
-    grep_command = '{grep_path} -Prn "{pattern}" '\
-                   '--include="*.note" {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=DEFINITION_PATTERN,
-                        dir=search_directory)
-
+    line_filters = []
     if query_string:
         query_components = shlex.split(query_string)
-        # Add safe handling of quoted phrases
-        safe_components = []
-        for component in query_components:
-            if component[0] == '"' and component[-1] == '"':
-                safe_components.append(component[1:-1])
-            else:
-                safe_components.append(component)
-
-        if not case_sensitive:
-            grep_filter_mode = ' -i'
-        else:
-            grep_filter_mode = ''
-
-        for additional_filter in query_components:
-            if search_term_only:
-                new_filter = ' | {grep_path}{mode} "{{.*{pattern}.*}}"'.format(
-                                grep_path=grep_path,
-                                mode=grep_filter_mode,
-                                pattern=additional_filter)
-                grep_command = grep_command + new_filter
-            else:
-                new_filter = ' | {grep_path}{mode} "{pattern}"'.format(
-                                grep_path=grep_path,
-                                mode=grep_filter_mode,
-                                pattern=additional_filter)
-                grep_command = grep_command + new_filter
-
-    log.debug(f'Running grep command {grep_command} to get definitions')
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    for line in output_lines:
-
-        if not line.strip():
-            continue
-
-        split_line = line.split(':', 2)
-        file_path = split_line[0]
-        line_number = split_line[1]
-        definition_raw = split_line[2]
-
-        # Return all paths as relative paths within the notes dir
-        file_path = get_relative_path(notes_directory, file_path)
-        display_path = get_display_path(file_path, directory_filter)
-        # Placeholders
-        term = ''
-        definition_text = ''
-
-        definition_match = definition_regex.match(definition_raw)
-        if not definition_match:
-            log.debug(f'No definition match found for line {line}')
+        if search_term_only:
+            # Only match query components within the `{term}`
+            line_filters = [
+                compile_pattern(r'\{.*' + re.escape(component) + r'.*\}',
+                                case_sensitive=case_sensitive)
+                for component in query_components]
         else:
-            term = definition_match.group(3)
-            term = term.strip().strip(r'{}')
-            definition_text = definition_match.group(4)
+            line_filters = literal_filters(query_components,
+                                           case_sensitive=case_sensitive)
+
+    for match in scan_notes(notes_directory, DEFINITION_PATTERN,
+                            directory_filter=directory_filter,
+                            filters=line_filters, workers=scan_workers):
+
+        display_path = get_display_path(match.file_path, directory_filter)
+        term, definition_text = parse_definition(match.line)
 
         parsed_definition: Definition = {
-            "file_path": file_path,
+            "file_path": match.file_path,
             "display_path": display_path,
-            "line_number": line_number,
+            "line_number": str(match.line_number),
             "term": term,
             "definition": definition_text
         }
 
         if include_sub_elements:
-            full_file_path = get_full_path(notes_directory, file_path)
-            indent_level = 0
-            sub_element_lines = []
+            full_file_path = get_full_path(notes_directory, match.file_path)
             with open(full_file_path, 'r') as f:
                 file_contents = f.read()
-            for line_num, line_content in enumerate(file_contents.split('\n')):
-                if line_num + 1 < int(line_number):
-                    continue
-                elif line_num + 1 == int(line_number):
-                    indent_level = len(line_content) - len(line_content.lstrip(' '))
-                elif line_num + 1 > int(line_number):
-                    current_indent = len(line_content) - len(line_content.lstrip(' '))
-                    if current_indent > indent_level:
-                        sub_element_lines.append(line_content)
-                    else:
-                        break
-
-            parsed_definition['sub_elements'] = '\n'.join(sub_element_lines)
+            parsed_definition['sub_elements'] = get_sub_elements(
+                file_contents.split('\n'), match.line_number)
 
         definitions.append(parsed_definition)
 
@@ -0,0 +1,426 @@
+'''
+A single-pass extractor for all of the structured elements within a note
+(todos of every status, questions along with their answers, definitions
+with their sub-elements, GPS locations, record sets, tags, and dated
+headings).
+
+Each note is read once and every line is checked against each element
+type, rather than running a separate search over the notes directory for
+every element type. The extracted elements of a set of notes can then be
+turned into the same results as the per-element `_get_*` functions by the
+`collect_*` functions, no matter whether the elements were just extracted
+or loaded from the element index.
+'''
+import re
+import shlex
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Tuple, TypedDict
+
+from shorthand.elements.definitions import Definition, parse_definition
+from shorthand.elements.locations import Location, gps_regex
+from shorthand.elements.questions import ANSWER_REGEX, Question, \
+                                         QuestionStatus, parse_question_text, \
+                                         parse_answer_text
+from shorthand.elements.record_sets import RecordSetIndex
+from shorthand.elements.todos import PATTERN_MAPPING, SUPPORTED_SORT_FIELDS, \
+                                     Todo, TodoStatus, parse_todo
+from shorthand.tags import tag_regex
+from shorthand.types import DirectoryPath, NotePath, RawNoteContent, \
+                            RawNoteLine, RelativeDirectoryPath
+from shorthand.utils.paths import _list_note_paths, get_display_path, \
+                                  get_full_path
+from shorthand.utils.patterns import ALL_QUESTIONS, DATED_HEADING_PATTERN, \
+                                     DEFINITION_PATTERN, RECORD_SET_PATTERN, \
+                                     TAG_FILTER
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS
+
+
+todo_regexes = {status: re.compile(pattern)
+                for status, pattern in PATTERN_MAPPING.items()}
+question_regex = re.compile(ALL_QUESTIONS)
+definition_regex = re.compile(DEFINITION_PATTERN)
+dated_heading_regex = re.compile(DATED_HEADING_PATTERN)
+record_set_regex = re.compile(RECORD_SET_PATTERN)
+tag_filter_regex = re.compile(TAG_FILTER)
+
+
+log = logging.getLogger(__name__)
+
+
+class ExtractedTodo(TypedDict):
+    line_number: int
+    line: RawNoteLine
+    status: TodoStatus
+    todo_text: str
+    start_date: Optional[str]
+    end_date: Optional[str]
+    tags: List[str]
+
+class ExtractedQuestion(TypedDict):
+    line_number: int
+    question: str
+    question_date: Optional[str]
+    answer: Optional[str]
+    answer_date: Optional[str]
+    tags: List[str]
+
+class ExtractedDefinition(TypedDict):
+    line_number: int
+    line: RawNoteLine
+    term: str
+    definition: str
+    sub_elements: str
+
+class ExtractedLocation(TypedDict):
+    line_number: int
+    latitude: str
+    longitude: str
+    name: str
+
+class ExtractedHeading(TypedDict):
+    line_number: int
+    line: RawNoteLine
+
+class NoteElements(TypedDict):
+    todos: List[ExtractedTodo]
+    questions: List[ExtractedQuestion]
+    definitions: List[ExtractedDefinition]
+    locations: List[ExtractedLocation]
+    record_sets: List[int]
+    tags: List[str]
+    dated_headings: List[ExtractedHeading]
+
+type ExtractedNotes = Iterable[Tuple[NotePath, NoteElements]]
+
+
+def extract_note_elements(note_content: RawNoteContent) -> NoteElements:
+    '''Parse all of the elements out of the raw content of a single note
+    '''
+    elements: NoteElements = {
+        'todos': [],
+        'questions': [],
+        'definitions': [],
+        'locations': [],
+        'record_sets': [],
+        'tags': [],
+        'dated_headings': []
+    }
+    note_tags = set()
+    # Definitions whose sub-elements are still being collected, along with
+    # their indentation and their nested lines so far, from the least to
+    # the most indented
+    open_definitions: List[Tuple[int, List[RawNoteLine],
+                                 ExtractedDefinition]] = []
+
+    note_lines = note_content.split('\n')
+    for idx, line in enumerate(note_lines):
+        line_number = idx + 1
+
+        # Lines which are more indented than a definition are nested
+        # underneath it, until the first line which isn't
+        indent_level = len(line) - len(line.lstrip(' '))
+        while open_definitions and indent_level <= open_definitions[-1][0]:
+            _, sub_element_lines, definition = open_definitions.pop()
+            definition['sub_elements'] = '\n'.join(sub_element_lines)
+        for _, sub_element_lines, _ in open_definitions:
+            sub_element_lines.append(line)
+
+        for status, todo_regex in todo_regexes.items():
+            if todo_regex.search(line):
+                todo = parse_todo(line.strip())
+                elements['todos'].append({
+                    'line_number': line_number,
+                    'line': line.strip(),
+                    'status': status,
+                    'todo_text': todo['todo_text'],
+                    'start_date': todo['start_date'],
+                    'end_date': todo['end_date'],
+                    'tags': todo['tags']
+                })
+                break
+
+        if question_regex.search(line):
+            question_text, question_date, tags = \
+                parse_question_text(line.strip()[4:])
+            answer, answer_date = None, None
+            if idx < len(note_lines) - 1:
+                answer_match = ANSWER_REGEX.match(note_lines[idx + 1])
+                if answer_match and answer_match.groups()[3]:
+                    answer, answer_date = parse_answer_text(
+                        answer_match.groups()[3])
+            elements['questions'].append({
+                'line_number': line_number,
+                'question': question_text,
+                'question_date': question_date,
+                'answer': answer,
+                'answer_date': answer_date,
+                'tags': tags
+            })
+
+        if definition_regex.search(line):
+            term, definition_text = parse_definition(line)
+            definition: ExtractedDefinition = {
+                'line_number': line_number,
+                'line': line,
+                'term': term,
+                'definition': definition_text,
+                'sub_elements': ''
+            }
+            elements['definitions'].append(definition)
+            open_definitions.append((indent_level, [], definition))
+
+        for match in gps_regex.findall(line.strip()):
+            elements['locations'].append({
+                'line_number': line_number,
+                'latitude': match[1],
+                'longitude': match[3],
+                'name': match[5]
+            })
+
+        if record_set_regex.search(line):
+            elements['record_sets'].append(line_number)
+
+        if tag_filter_regex.search(line):
+            for tag in tag_regex.findall(line):
+                note_tags.add(tag[0].strip().strip(':'))
+
+        if dated_heading_regex.match(line):
+            elements['dated_headings'].append({
+                'line_number': line_number,
+                'line': line
+            })
+
+    for _, sub_element_lines, definition in open_definitions:
+        definition['sub_elements'] = '\n'.join(sub_element_lines)
+
+    # Only keep tags with at least one letter
+    elements['tags'] = sorted([tag for tag in note_tags
+                               if any(char.isalpha() for char in tag)])
+
+    return elements
+
+
+def _extract_note(notes_directory: DirectoryPath, note_path: NotePath
+                  ) -> Optional[NoteElements]:
+    try:
+        with open(get_full_path(notes_directory, note_path), 'r') as f:
+            note_content = f.read()
+    except (FileNotFoundError, UnicodeDecodeError) as e:
+        log.warning(f'Skipping note {note_path} during extraction: {e}')
+        return None
+    return extract_note_elements(note_content)
+
+
+def _extract_notes(notes_directory: DirectoryPath,
+                   directory_filter: Optional[RelativeDirectoryPath] = None,
+                   scan_workers: int = DEFAULT_SCAN_WORKERS
+                   ) -> Iterator[Tuple[NotePath, NoteElements]]:
+    '''Extract the elements of all notes within the directory filter,
+       reading each note exactly once. Notes are yielded in path order
+    '''
+    note_paths = _list_note_paths(notes_directory, directory_filter)
+    log.debug(f'Extracting elements from {len(note_paths)} notes '
+              f'with {scan_workers} workers')
+
+    if scan_workers <= 1:
+        for note_path in note_paths:
+            elements = _extract_note(notes_directory, note_path)
+            if elements is not None:
+                yield note_path, elements
+        return
+
+    with ThreadPoolExecutor(max_workers=scan_workers) as executor:
+        all_elements = executor.map(
+            lambda note_path: _extract_note(notes_directory, note_path),
+            note_paths)
+        for note_path, elements in zip(note_paths, all_elements):
+            if elements is not None:
+                yield note_path, elements
+
+
+def matches_query(content: str, query_string: Optional[str],
+                  case_sensitive: bool = False) -> bool:
+    '''Check whether every component of a query string is present
+       in the specified content. Quoted phrases are treated as a
+       single component
+    '''
+    if not query_string:
+        return True
+
+    query_components = shlex.split(query_string)
+    if not case_sensitive:
+        content = content.lower()
+        query_components = [component.lower()
+                            for component in query_components]
+
+    return all(component in content for component in query_components)
+
+
+def collect_todos(notes: ExtractedNotes,
+                  todo_status: Optional[TodoStatus] = 'incomplete',
+                  directory_filter: Optional[RelativeDirectoryPath] = None,
+                  query_string: Optional[str] = None,
+                  case_sensitive: bool = False,
+                  sort_by: Optional[str] = None,
+                  suppress_future: bool = True,
+                  tag: Optional[str] = None
+                  ) -> List[Todo]:
+    '''Get a specified set of todos from extracted note elements.
+       Todos of every status are included if no status is specified
+    '''
+    if todo_status is not None and todo_status not in PATTERN_MAPPING.keys():
+        log.error(f'Got invalid todo type {todo_status}')
+        raise ValueError(f'Invalid todo type {todo_status} specified. ' +
+                         f'Valid options are: ' +
+                         f'{", ".join(PATTERN_MAPPING.keys())}')
+
+    current_date_stamp = datetime.now().isoformat()[:10]
+    todo_items = []
+
+    for note_path, elements in notes:
+        display_path = get_display_path(note_path, directory_filter)
+        for todo in elements['todos']:
+            if todo_status is not None and todo['status'] != todo_status:
+                continue
+            if not matches_query(todo['line'], query_string, case_sensitive):
+                continue
+            if tag and f':{tag}:' not in todo['line']:
+                continue
+            if suppress_future and todo['start_date'] and \
+                    todo['start_date'] > current_date_stamp:
+                continue
+
+            todo_items.append({
+                'file_path': note_path,
+                'display_path': display_path,
+                'line_number': str(todo['line_number']),
+                'todo_text': todo['todo_text'],
+                'start_date': todo['start_date'],
+                'end_date': todo['end_date'],
+                'status': todo['status'],
+                'tags': list(todo['tags'])
+            })
+
+    if sort_by:
+        if sort_by not in SUPPORTED_SORT_FIELDS:
+            raise ValueError('Invalid sort field {}'.format(sort_by))
+        todo_items = sorted(todo_items,
+                            key=lambda k: k[sort_by] if k[sort_by] else '',
+                            reverse=True)
+
+    return todo_items
+
+
+def collect_questions(notes: ExtractedNotes,
+                      question_status: QuestionStatus = 'all',
+                      directory_filter: Optional[RelativeDirectoryPath] = None
+                      ) -> List[Question]:
+    '''Get questions from extracted note elements
+    '''
+    if question_status not in ['all', 'answered', 'unanswered']:
+        raise ValueError('Invalid question status ' + question_status)
+
+    questions = []
+    for note_path, elements in notes:
+        display_path = get_display_path(note_path, directory_filter)
+        for question in elements['questions']:
+            is_answered = question['answer'] is not None
+            if question_status == 'answered' and not is_answered:
+                continue
+            if question_status == 'unanswered' and is_answered:
+                continue
+
+            questions.append({
+                'file_path': note_path,
+                'display_path': display_path,
+                'line_number': str(question['line_number']),
+                'question': question['question'],
+                'question_date': question['question_date'],
+                'answer': question['answer'],
+                'answer_date': question['answer_date'],
+                'tags': list(question['tags'])
+            })
+
+    return questions
+
+
+def collect_definitions(notes: ExtractedNotes,
+                        directory_filter: Optional[RelativeDirectoryPath] = None,
+                        query_string: Optional[str] = None,
+                        search_term_only: bool = True,
+                        case_sensitive: bool = False,
+                        include_sub_elements: bool = False
+                        ) -> List[Definition]:
+    '''Get definitions from extracted note elements
+    '''
+    definitions = []
+    for note_path, elements in notes:
+        display_path = get_display_path(note_path, directory_filter)
+        for definition in elements['definitions']:
+            query_content = definition['term'] if search_term_only \
+                            else definition['line']
+            if not matches_query(query_content, query_string, case_sensitive):
+                continue
+
+            parsed_definition: Definition = {
+                'file_path': note_path,
+                'display_path': display_path,
+                'line_number': str(definition['line_number']),
+                'term': definition['term'],
+                'definition': definition['definition']
+            }
+            if include_sub_elements:
+                parsed_definition['sub_elements'] = definition['sub_elements']
+            definitions.append(parsed_definition)
+
+    return definitions
+
+
+def collect_locations(notes: ExtractedNotes,
+                      directory_filter: Optional[RelativeDirectoryPath] = None
+                      ) -> List[Location]:
+    '''Get GPS locations from extracted note elements
+    '''
+    locations = []
+    for note_path, elements in notes:
+        display_path = get_display_path(note_path, directory_filter)
+        for location in elements['locations']:
+            locations.append({
+                'latitude': location['latitude'],
+                'longitude': location['longitude'],
+                'name': location['name'],
+                'file_path': note_path,
+                'display_path': display_path,
+                'line_number': str(location['line_number'])
+            })
+
+    return locations
+
+
+def collect_record_sets(notes: ExtractedNotes,
+                        directory_filter: Optional[RelativeDirectoryPath] = None
+                        ) -> List[RecordSetIndex]:
+    '''List all record sets from extracted note elements
+    '''
+    record_sets = []
+    for note_path, elements in notes:
+        display_path = get_display_path(note_path, directory_filter)
+        for line_number in elements['record_sets']:
+            record_sets.append({
+                'file_path': note_path,
+                'line_number': line_number,
+                'display_path': display_path
+            })
+
+    return record_sets
+
+
+def collect_tags(notes: ExtractedNotes) -> List[str]:
+    '''Get the sorted set of all tags from extracted note elements
+    '''
+    tags = set()
+    for _, elements in notes:
+        tags.update(elements['tags'])
+    return sorted(tags)
@@ -1,10 +1,10 @@
 import re
-from subprocess import Popen, PIPE
 import logging
 from typing import List, Optional, TypedDict
 
-from shorthand.types import DirectoryPath, DisplayPath, ExecutablePath, NotePath, Subdir
-from shorthand.utils.paths import get_relative_path, get_display_path
+from shorthand.types import DirectoryPath, DisplayPath, NotePath, Subdir
+from shorthand.utils.paths import get_display_path
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, scan_notes
 from shorthand.utils.patterns import GPS_PATTERN
 
 
@@ -25,57 +25,30 @@ class Location(TypedDict):
 
 def _get_locations(notes_directory: DirectoryPath,
                    directory_filter: Optional[Subdir] = None,
-                   grep_path: ExecutablePath = 'grep'
+                   scan_workers: int = DEFAULT_SCAN_WORKERS
                    ) -> List[Location]:
 
     location_items = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
+    for match in scan_notes(notes_directory, gps_regex,
+                            directory_filter=directory_filter,
+                            workers=scan_workers):
 
-    grep_command = '{grep_path} -Prn "{pattern}" '\
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=GPS_PATTERN,
-                        dir=search_directory)
-    log.debug(f'Running grep command {grep_command} to get locations')
+        locations = gps_regex.findall(match.line.strip())
 
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
+        # Create display path
+        display_path = get_display_path(match.file_path, directory_filter)
 
-    for line in output_lines:
-
-        if not line.strip():
-            continue
-
-        split_line = line.split(':', 2)
-        file_path = split_line[0].strip()
-        line_number = split_line[1].strip()
-        match_content = split_line[2].strip()
-
-        locations = gps_regex.findall(match_content)
-
-        # Clean up file path and create display path
-        file_path = get_relative_path(notes_directory, file_path)
-        display_path = get_display_path(file_path, directory_filter)
-
-        for match in locations:
+        for location in locations:
             log.debug('Got Match')
-            log.debug(match)
+            log.debug(location)
             extracted_location = {
-                "latitude": match[1],
-                "longitude": match[3],
-                "name": match[5],
-                'file_path': file_path,
+                "latitude": location[1],
+                "longitude": location[3],
+                "name": location[5],
+                'file_path': match.file_path,
                 'display_path': display_path,
-                'line_number': line_number,
+                'line_number': str(match.line_number),
             }
             location_items.append(extracted_location)
 
@@ -1,13 +1,13 @@
 import re
 import logging
-from subprocess import Popen, PIPE
 from typing import Literal, Optional, Tuple, TypedDict
 
 from shorthand.tags import extract_tags
-from shorthand.types import DirectoryPath, DisplayPath, ExecutablePath, NotePath, RelativeDirectoryPath
+from shorthand.types import DirectoryPath, DisplayPath, NotePath, RelativeDirectoryPath
 from shorthand.utils.patterns import ALL_QUESTIONS, ANSWER_PATTERN, \
                                      START_STAMP_ONLY_PATTERN
-from shorthand.utils.paths import get_relative_path, get_display_path
+from shorthand.utils.paths import get_display_path
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, scan_notes
 
 
 ANSWER_REGEX = re.compile(ANSWER_PATTERN)
@@ -30,37 +30,40 @@ class Question(TypedDict):
     tags: list[str]
 
 
-def is_question_line(line_content: str) -> bool:
-    '''If a `:` character occurs before the first space,
-    it's an output line (from grep) for a match
+def parse_question_text(question_text: str
+                        ) -> Tuple[str, Optional[str], list[str]]:
+    '''Split the text of a question (without its list prefix) into
+       the question text, the creation date, and the tags
     '''
-    if ':' in line_content and ' ' not in line_content.split(':')[0]:
-        return True
-    return False
+    # Extract the date stamp from the question if present
+    question_date_match = TIMESTAMP_REGEX.match(question_text)
+    if question_date_match:
+        question_date = question_date_match.groups()[1]
+        question_text = question_date_match.groups()[4]
+    else:
+        question_date = None
 
+    # Extract tags from the question
+    tags, clean_text = extract_tags(question_text)
+    if tags:
+        question_text = clean_text
 
-def is_answer_line(line_content: str) -> Tuple[bool, Optional[str]]:
+    return question_text, question_date, tags
 
-    if line_content.strip() == '--':
-        # Grep adds these lines to separate match results
-        return False, None
 
-    split_content = line_content.split('-', 2)
-    if len(split_content) < 3:
-        return False, None
-
-    line_content = split_content[-1]
-    answer_match = ANSWER_REGEX.match(line_content)
-    if answer_match:
-        answer_text = answer_match.groups()[3]
-        return True, answer_text
-
-    return False, None
+def parse_answer_text(answer_content: str) -> Tuple[str, Optional[str]]:
+    '''Split the text of an answer into the answer text and its date
+    '''
+    # Extract the date stamp from the answer if present
+    answer_date_match = TIMESTAMP_REGEX.match(answer_content)
+    if answer_date_match:
+        return answer_date_match.groups()[4], answer_date_match.groups()[1]
+    return answer_content, None
 
 
 def _get_questions(notes_directory: DirectoryPath, question_status: QuestionStatus = 'all',
                    directory_filter: Optional[RelativeDirectoryPath] = None,
-                   grep_path: ExecutablePath = 'grep'):
+                   scan_workers: int = DEFAULT_SCAN_WORKERS):
 
     # question_status = question_status.lower()
 
@@ -69,87 +72,45 @@ def _get_questions(notes_directory: DirectoryPath, question_status: QuestionStat
 
     parsed_questions = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
-
-    proc = Popen(
-        ('{grep_path} -Prn -A 1 "{pattern}" --include="*.note" '
-         '--exclude-dir=\'.*\' {dir}').format(
-            grep_path=grep_path,
-            pattern=ALL_QUESTIONS,
-            dir=search_directory),
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    for idx, output_line in enumerate(output_lines):
-
-        # Early exits
-        if not output_line.strip():
-            continue
-        if output_line.strip() == '--':
-            continue
-
-        if is_question_line(output_line):
-            split_line = output_line.split(':', 2)
-            file_path = split_line[0].strip()
-            line_number = split_line[1].strip()
-            question_text = split_line[2].strip()[4:]
-
-            # Return all paths as relative paths within the notes dir
-            file_path = get_relative_path(notes_directory, file_path)
-            display_path = get_display_path(file_path, directory_filter)
-
-            # Extract the date stamp from the question if present
-            question_date_match = TIMESTAMP_REGEX.match(question_text)
-            if question_date_match:
-                question_date = question_date_match.groups()[1]
-                question_text = question_date_match.groups()[4]
-            else:
-                question_date = None
-
-            # Extract tags from the question
-            tags, clean_text = extract_tags(question_text)
-            if tags:
-                question_text = clean_text
-
-            parsed_question = {
-                'file_path': file_path,
-                'display_path': display_path,
-                'line_number': line_number,
-                'question': question_text,
-                'question_date': question_date,
-                'answer': None,
-                'answer_date': None,
-                'tags': tags
-            }
-
-            # If the next line is an answer line, add the answer
-            # text as metadata to the question
-            if idx < len(output_lines) - 1:
-                is_answer, answer_content = is_answer_line(output_lines[idx+1])
-                if is_answer and answer_content:
-
-                    # Extract the date stamp from the answer if present
-                    answer_date_match = TIMESTAMP_REGEX.match(answer_content)
-                    if answer_date_match:
-                        answer_date = answer_date_match.groups()[1]
-                        answer_content = answer_date_match.groups()[4]
-                        parsed_question['answer_date'] = answer_date
-
+    for match in scan_notes(notes_directory, ALL_QUESTIONS,
+                            directory_filter=directory_filter,
+                            with_next_line=True, workers=scan_workers):
+
+        display_path = get_display_path(match.file_path, directory_filter)
+
+        question_text, question_date, tags = \
+            parse_question_text(match.line.strip()[4:])
+
+        parsed_question = {
+            'file_path': match.file_path,
+            'display_path': display_path,
+            'line_number': str(match.line_number),
+            'question': question_text,
+            'question_date': question_date,
+            'answer': None,
+            'answer_date': None,
+            'tags': tags
+        }
+
+        # If the next line is an answer line, add the answer
+        # text as metadata to the question
+        is_answer = False
+        if match.next_line is not None:
+            answer_match = ANSWER_REGEX.match(match.next_line)
+            if answer_match:
+                is_answer = True
+                answer_content = answer_match.groups()[3]
+                if answer_content:
+                    answer_content, answer_date = \
+                        parse_answer_text(answer_content)
                     parsed_question['answer'] = answer_content
-            else:
-                is_answer = False
-
-            if question_status == 'all':
-                parsed_questions.append(parsed_question)
-            elif question_status == 'answered' and is_answer:
-                parsed_questions.append(parsed_question)
-            elif question_status == 'unanswered' and not is_answer:
-                parsed_questions.append(parsed_question)
+                    parsed_question['answer_date'] = answer_date
+
+        if question_status == 'all':
+            parsed_questions.append(parsed_question)
+        elif question_status == 'answered' and is_answer:
+            parsed_questions.append(parsed_question)
+        elif question_status == 'unanswered' and not is_answer:
+            parsed_questions.append(parsed_question)
 
     return parsed_questions
@@ -1,12 +1,11 @@
-from subprocess import Popen, PIPE
 import logging
 from typing import Literal, Optional, TypedDict
 
-from shorthand.types import DirectoryPath, ExecutablePath, NotePath, Subdir
-from shorthand.utils.patterns import RECORD_SET_PATTERN, escape_for_cli
+from shorthand.types import DirectoryPath, NotePath, Subdir
+from shorthand.utils.patterns import RECORD_SET_PATTERN
 from shorthand.utils.rec import load_from_string
-from shorthand.utils.paths import get_relative_path, get_display_path, \
-                                  get_full_path
+from shorthand.utils.paths import get_display_path, get_full_path
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, scan_notes
 
 
 log = logging.getLogger(__name__)
@@ -82,49 +81,22 @@ def _get_record_set(notes_directory: DirectoryPath, file_path: NotePath,
 
 def _get_record_sets(notes_directory: DirectoryPath,
                      directory_filter: Optional[Subdir] = None,
-                     grep_path: ExecutablePath = 'grep'
+                     scan_workers: int = DEFAULT_SCAN_WORKERS
                      ) -> list[RecordSetIndex]:
     '''List all record sets within a specified directory
     '''
 
     record_sets = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
+    for match in scan_notes(notes_directory, RECORD_SET_PATTERN,
+                            directory_filter=directory_filter,
+                            workers=scan_workers):
 
-    grep_command = '{grep_path} -Prn "{pattern}" '\
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=escape_for_cli(RECORD_SET_PATTERN),
-                        dir=search_directory)
-
-    log.debug(f'Running grep command {grep_command} to get record sets')
-
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    for line in output_lines:
-
-        if not line.strip():
-            continue
-
-        split_line = line.split(':', 2)
-        file_path = split_line[0]
-        line_number = int(split_line[1])
-
-        file_path = get_relative_path(notes_directory, file_path)
-        display_path = get_display_path(file_path, directory_filter)
+        display_path = get_display_path(match.file_path, directory_filter)
 
         parsed_record_set = {
-            "file_path": file_path,
-            "line_number": line_number,
+            "file_path": match.file_path,
+            "line_number": match.line_number,
             "display_path": display_path
         }
 
@@ -1,20 +1,20 @@
 import re
 import logging
 from datetime import datetime
-from subprocess import Popen, PIPE
 import shlex
 from typing import Dict, Literal, TypedDict, List, Optional
 
 from shorthand.tags import extract_tags
-from shorthand.types import DirectoryPath, DisplayPath, ExecutablePath, InternalAbsoluteFilePath, InternalAbsolutePath, NotePath, RawNoteLine, \
+from shorthand.types import DirectoryPath, DisplayPath, InternalAbsoluteFilePath, InternalAbsolutePath, NotePath, RawNoteLine, \
                             RelativeDirectoryPath
-from shorthand.utils.paths import get_relative_path, get_display_path, \
-                                  get_full_path
+from shorthand.utils.paths import get_display_path, get_full_path
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, literal_filters, \
+                                 scan_notes
 from shorthand.utils.patterns import INCOMPLETE_PREFIX_GREP, \
     COMPLETE_PREFIX_GREP, SKIPPED_PREFIX_GREP, \
     START_STAMP_ONLY_PATTERN, START_END_STAMP_ONLY_PATTERN
 
-# Set up Regexes to use for finding files to process with `grep`
+# Set up Regexes to use for finding todos of each status
 PATTERN_MAPPING = {
     'incomplete': INCOMPLETE_PREFIX_GREP,
     'complete': COMPLETE_PREFIX_GREP,
@@ -93,9 +93,10 @@ def _get_todos(notes_directory: DirectoryPath,
                directory_filter: Optional[RelativeDirectoryPath] = None,
                query_string: Optional[str] = None, case_sensitive: bool = False,
                sort_by: Optional[str] = None, suppress_future: bool = True,
-               tag: Optional[str] = None, grep_path: ExecutablePath = 'grep'
+               tag: Optional[str] = None,
+               scan_workers: int = DEFAULT_SCAN_WORKERS
                ) -> List[Todo]:
-    '''Get a specified set of todos using grep on the filesystem
+    '''Get a specified set of todos by scanning the notes directory
     '''
 
     log.info(f'Getting {todo_status} todos in directory {directory_filter}' +
@@ -111,108 +112,30 @@ def _get_todos(notes_directory: DirectoryPath,
 
     todo_items = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
-
-    grep_command = '{grep_path} -Prn "{pattern}" ' \
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=PATTERN_MAPPING[todo_status],
-                        dir=search_directory)
-
+    line_filters = []
     if query_string:
-        query_components = shlex.split(query_string)
-        # Add safe handling of quoted phrases
-        safe_components = []
-        for component in query_components:
-            if component[0] == '"' and component[-1] == '"':
-                safe_components.append(component[1:-1])
-            else:
-                safe_components.append(component)
-
-        if not case_sensitive:
-            grep_filter_mode = ' -i'
-        else:
-            grep_filter_mode = ''
-
-        for additional_filter in query_components:
-            new_filter = ' | {grep_path}{mode} "{pattern}"'.format(
-                            grep_path=grep_path,
-                            mode=grep_filter_mode,
-                            pattern=additional_filter)
-            grep_command = grep_command + new_filter
-
+        line_filters = literal_filters(shlex.split(query_string),
+                                       case_sensitive=case_sensitive)
     if tag:
-        new_filter = f' | {grep_path} ":{tag}:"'
-        grep_command = grep_command + new_filter
+        line_filters.append(re.compile(re.escape(f':{tag}:')))
 
-    log.debug(f'Running grep command {grep_command} to get todos')
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
+    current_date_stamp = datetime.now().isoformat()[:10]
 
-    start_stamp_regex = re.compile(START_STAMP_ONLY_PATTERN)
-    start_end_stamp_regex = re.compile(START_END_STAMP_ONLY_PATTERN)
-
-    for line in output_lines:
-
-        if not line.strip():
-            continue
-
-        split_line = line.split(':', 2)
-        file_path = split_line[0].strip()
-        line_number = split_line[1].strip()
-        match_content = split_line[2].strip()
-
-        # remove the leading `[]`, `[ ]`, `[X]`, or `[S]`
-        match_content = match_content.split(']', 1)[1].strip()
-
-        # Return all paths as relative paths within the notes dir
-        file_path = get_relative_path(notes_directory, file_path)
-
-        # Pull out and structure out date info if included
-        start_stamp_match = start_stamp_regex.match(match_content)
-        start_end_stamp_match = start_end_stamp_regex.match(match_content)
-        if start_stamp_match:
-            start_date = start_stamp_match.groups()[1]
-            end_date = None
-            todo_text = start_stamp_match.groups()[4]
-        elif start_end_stamp_match:
-            start_date = start_end_stamp_match.groups()[1]
-            end_date = start_end_stamp_match.groups()[3]
-            todo_text = start_end_stamp_match.groups()[6]
-        else:
-            start_date = None
-            end_date = None
-            todo_text = match_content
-
-        tags, clean_text = extract_tags(todo_text)
-        if tags:
-            todo_text = clean_text
-
-        display_path = get_display_path(file_path, directory_filter)
+    for match in scan_notes(notes_directory, PATTERN_MAPPING[todo_status],
+                            directory_filter=directory_filter,
+                            filters=line_filters, workers=scan_workers):
 
         processed_todo: Todo = {
-            'file_path': file_path,
-            'display_path': display_path,
-            'line_number': line_number,
-            'todo_text': todo_text,
-            'start_date': start_date,
-            'end_date': end_date,
-            'status': todo_status,
-            'tags': tags
+            'file_path': match.file_path,
+            'display_path': get_display_path(match.file_path,
+                                             directory_filter),
+            'line_number': str(match.line_number),
+            **parse_todo(match.line.strip())
         }
 
         is_future_todo = False
-        current_date_stamp = datetime.now().isoformat()[:10]
-        if start_date:
-            if start_date > current_date_stamp:
+        if processed_todo['start_date']:
+            if processed_todo['start_date'] > current_date_stamp:
                 is_future_todo = True
 
         if not suppress_future or not is_future_todo:
@@ -1,7 +1,10 @@
 import re
 import json
+import zlib
 import logging
-from typing import TypedDict
+import threading
+from collections import OrderedDict
+from typing import List, NamedTuple, Tuple, TypedDict
 
 from shorthand.elements.todos import parse_todo
 from shorthand.tags import extract_tags
@@ -20,6 +23,20 @@ image_regex = re.compile(IMAGE_PATTERN)
 gps_regex = re.compile(GPS_PATTERN)
 timestamp_regex = re.compile(START_STAMP_PATTERN)
 leading_whitespace_regex = re.compile(r'^[ \t]*')
+list_item_regex = re.compile(r'^[ \t]*([-*+]|\d+[.)]|\[.?\])[ \t]')
+
+# Bumped whenever changes to rendering change its output, so that notes
+# rendered by earlier versions aren't served from the render cache
+RENDERER_VERSION = 1
+
+# Notes are rendered in blocks which are split at points chosen from
+# their content, so that inserting or removing lines only changes the
+# blocks around the edit. Blocks are split on average at one in this many
+# blank lines or list items, and are kept within these sizes
+BLOCK_SPLIT_INTERVAL = 16
+MIN_BLOCK_LINES = 8
+MAX_BLOCK_LINES = 200
+RENDERED_BLOCK_CACHE_SIZE = 4096
 
 
 log = logging.getLogger(__name__)
@@ -75,6 +92,76 @@ class RenderedMarkdown(TypedDict):
     toc_content: str
 
 
+class RenderState(NamedTuple):
+    '''The state of the renderer between two lines of a note
+    '''
+    is_fenced_code_block: bool = False
+    is_diagram_block: bool = False
+    is_rec_data_block: bool = False
+    is_equation_block: bool = False
+    rec_data_lines: Tuple[str, ...] = ()
+
+
+class RenderedBlock(NamedTuple):
+    '''A rendered block of consecutive lines. The line number spans are
+       left blank in `html_lines`, and are recorded with their index in
+       `html_lines`, their indentation, and the index of their line within
+       the block so that they can be numbered wherever the block is
+    '''
+    html_lines: List[str]
+    line_spans: List[Tuple[int, str, int]]
+    toc_lines: List[str]
+    end_state: RenderState
+
+
+# Rendered blocks, keyed by the note path, the state of the renderer at
+# the start of the block, and the content of the block
+_rendered_block_cache: OrderedDict[Tuple[str, RenderState, str],
+                                   RenderedBlock] = OrderedDict()
+_rendered_block_cache_lock = threading.Lock()
+
+
+def get_line_span(span_whitespace: str, line_number: int) -> str:
+    return f'{span_whitespace}<span id="line-number-{line_number}"></span>'
+
+
+def is_block_start(markdown_line: str) -> bool:
+    '''Whether a line always starts a new block, which are split at
+       headings and the edges of fenced code and equation blocks
+    '''
+    stripped_line = markdown_line.strip()
+    return markdown_line.startswith('#') or \
+        stripped_line.startswith('```') or stripped_line.startswith('$$')
+
+
+def is_block_split(previous_line: str, markdown_line: str) -> bool:
+    '''Whether a block can be split before a blank line or list item,
+       which is decided from the content of the line before it so that
+       the same lines are split the same way wherever they are in a note
+    '''
+    if markdown_line.strip() and not list_item_regex.match(markdown_line):
+        return False
+    line_hash = zlib.crc32(previous_line.encode('utf-8', 'surrogatepass'))
+    return line_hash % BLOCK_SPLIT_INTERVAL == 0
+
+
+def split_blocks(markdown_content_lines: List[str],
+                 min_block_lines: int = MIN_BLOCK_LINES,
+                 max_block_lines: int = MAX_BLOCK_LINES) -> List[List[str]]:
+    '''Split the lines of a note into blocks of consecutive lines, which
+       can each be rendered separately
+    '''
+    blocks: List[List[str]] = []
+    for markdown_line in markdown_content_lines:
+        if not blocks or len(blocks[-1]) >= max_block_lines or \
+                is_block_start(markdown_line) or \
+                (len(blocks[-1]) >= min_block_lines and
+                 is_block_split(blocks[-1][-1], markdown_line)):
+            blocks.append([])
+        blocks[-1].append(markdown_line)
+    return blocks
+
+
 def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
     '''Pre-render all non-standard notes file
        elements into HTML
@@ -82,20 +169,78 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
        markdown_content: Raw unprocessed note content
        note_path: Relative path within the notes directory
                   of the markdown file being rendered
+
+       The note is rendered in blocks, and the rendering of each block is
+       cached. Blocks which haven't changed since they were last rendered
+       are re-used, even if they moved to different lines
     '''
 
     html_content_lines = []
     toc_content_lines = []
-    markdown_content_lines = markdown_content.split('\n')
-    is_fenced_code_block = False
-    is_diagram_block = False
-    is_rec_data_block = False
-    is_equation_block = False
-    rec_data_lines = []
+    state = RenderState()
+    line_number = 1
+
+    for block_lines in split_blocks(markdown_content.split('\n')):
+        block = _get_rendered_block(block_lines, note_path, state)
+        html_lines = list(block.html_lines)
+        for html_idx, span_whitespace, line_idx in block.line_spans:
+            html_lines[html_idx] = get_line_span(span_whitespace,
+                                                 line_number + line_idx)
+        html_content_lines.extend(html_lines)
+        toc_content_lines.extend(block.toc_lines)
+        state = block.end_state
+        line_number += len(block_lines)
+
+    html_content = '\n'.join(html_content_lines)
+    toc_content = '\n'.join(toc_content_lines)
+
+    return {
+        'file_content': html_content,
+        'toc_content': toc_content
+    }
+
+
+def _get_rendered_block(block_lines: List[str], note_path: str,
+                        state: RenderState) -> RenderedBlock:
+    '''Render a block of lines, re-using its cached rendering if the same
+       block was rendered from the same state before
+    '''
+    cache_key = (note_path, state, '\n'.join(block_lines))
+    with _rendered_block_cache_lock:
+        block = _rendered_block_cache.get(cache_key)
+        if block is not None:
+            _rendered_block_cache.move_to_end(cache_key)
+            return block
+
+    block = render_block(block_lines, note_path, state)
+    with _rendered_block_cache_lock:
+        _rendered_block_cache[cache_key] = block
+        while len(_rendered_block_cache) > RENDERED_BLOCK_CACHE_SIZE:
+            _rendered_block_cache.popitem(last=False)
+    return block
+
+
+def render_block(block_lines: List[str], note_path: str,
+                 state: RenderState = RenderState()) -> RenderedBlock:
+    '''Render a block of consecutive lines of a note, starting from the
+       state the renderer was in after the lines before the block
+    '''
 
-    for idx, markdown_line in enumerate(markdown_content_lines):
+    html_lines: List[str] = []
+    line_spans: List[Tuple[int, str, int]] = []
+    toc_lines: List[str] = []
+    is_fenced_code_block = state.is_fenced_code_block
+    is_diagram_block = state.is_diagram_block
+    is_rec_data_block = state.is_rec_data_block
+    is_equation_block = state.is_equation_block
+    rec_data_lines = list(state.rec_data_lines)
+
+    def add_line_span(line_idx: int, span_whitespace: str) -> None:
+        line_spans.append((len(html_lines), span_whitespace, line_idx))
+        html_lines.append('')
+
+    for idx, markdown_line in enumerate(block_lines):
 
-        line_number = idx + 1
         # Add whitespace at the beginning of the span line to
         # match the content line indent level
         span_whitespace = ''
@@ -103,12 +248,10 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
         if leading_whitespace_match:
             span_whitespace = leading_whitespace_match.group(0)
 
-        line_span = f'{span_whitespace}<span id="line-number-{line_number}"></span>'
-
         # Grab everything for record sets
         if markdown_line.strip()[:3] != '```' and is_rec_data_block:
             rec_data_lines.append(markdown_line)
-            html_content_lines.append(line_span)
+            add_line_span(idx, span_whitespace)
             continue
 
         # Special handling for diagram blocks
@@ -120,12 +263,12 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
                 # Get rid of any indentation so it doesn't trip up the
                 # Markdown parser into creating new paragraphs which
                 # mess up mermaid
-                html_content_lines.append(markdown_line.strip())
+                html_lines.append(markdown_line.strip())
                 continue
 
         # Handle empty or pseudo-empty lines
         if not markdown_line.strip():
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
 
         # Handle edges of fenced code blocks
@@ -143,7 +286,7 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
                 record_set_name = record_set.get_config().get(
                     'rec', {}).get('name')
                 if record_set_name:
-                    html_content_lines.append(f'##### Record Set: ' +
+                    html_lines.append(f'##### Record Set: ' +
                                               f'{record_set_name}')
                 record_set_html = (
                     f'<div class="record-set">' +
@@ -151,18 +294,18 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
                     f'<div class="record-set-columns">{column_config}</div>' +
                     f'<div class="record-set-display"></div>' +
                     f'</div>')
-                html_content_lines.append(record_set_html)
-                html_content_lines.append(line_span)
+                html_lines.append(record_set_html)
+                add_line_span(idx, span_whitespace)
                 rec_data_lines = []
                 continue
 
             is_fenced_code_block = not is_fenced_code_block
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
 
         # Handle contents of fenced code blocks
         if is_fenced_code_block:
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
 
         # Process internal links
@@ -186,26 +329,26 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
         # Process All to-dos
         if len(markdown_line) >= 6:
             if todo_regex.match(markdown_line):
-                html_content_lines.append(line_span)
+                add_line_span(idx, span_whitespace)
                 todo_element = get_todo_element(markdown_line)
-                html_content_lines.append(todo_element)
+                html_lines.append(todo_element)
                 continue
 
         # Process Questions & Answers
         if len(markdown_line) >= 2:
             if question_regex.match(markdown_line):
-                html_content_lines.append(line_span)
+                add_line_span(idx, span_whitespace)
                 question_element = get_question_element(markdown_line)
-                html_content_lines.append(question_element)
+                html_lines.append(question_element)
                 continue
 
         # Process Definitions
         definition_match = definition_regex.match(markdown_line)
         if definition_match:
-            html_content_lines.append(line_span)
+            add_line_span(idx, span_whitespace)
             definition_element = get_definition_element(definition_match,
                                                         markdown_line)
-            html_content_lines.append(definition_element)
+            html_lines.append(definition_element)
             continue
 
         # Process Headings for Navigation
@@ -216,44 +359,41 @@ def get_rendered_markdown(markdown_content, note_path) -> RenderedMarkdown:
             heading_div = f'<span id="{element_id}"></span>'
             toc_markdown_line = (f'{"  " * (heading_level - 1)}- ' +
                                  f'[{split_heading[1]}](#{element_id})')
-            html_content_lines.append(line_span)
-            html_content_lines.append(heading_div)
-            html_content_lines.append(markdown_line)
-            toc_content_lines.append(toc_markdown_line)
+            add_line_span(idx, span_whitespace)
+            html_lines.append(heading_div)
+            html_lines.append(markdown_line)
+            toc_lines.append(toc_markdown_line)
             continue
 
         # Special handling for markdown tables
         if markdown_line.lstrip()[0] == '|':
             # Adding span tags into a table will break it, so we exclude them
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
 
         # Handle edges of equation blocks
         if not is_equation_block and markdown_line.strip().startswith('$$') \
                 and not markdown_line.strip().endswith('$$'):
             is_equation_block = True
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
         elif is_equation_block and not markdown_line.strip().startswith('$$') \
                 and markdown_line.strip().endswith('$$'):
             is_equation_block = False
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
         elif is_equation_block and not markdown_line.strip().endswith('$$'):
-            html_content_lines.append(markdown_line)
+            html_lines.append(markdown_line)
             continue
 
         # Catch-all for everything else
-        html_content_lines.append(line_span)
-        html_content_lines.append(markdown_line)
-
-    html_content = '\n'.join(html_content_lines)
-    toc_content = '\n'.join(toc_content_lines)
+        add_line_span(idx, span_whitespace)
+        html_lines.append(markdown_line)
 
-    return {
-        'file_content': html_content,
-        'toc_content': toc_content
-    }
+    end_state = RenderState(is_fenced_code_block, is_diagram_block,
+                            is_rec_data_block, is_equation_block,
+                            tuple(rec_data_lines))
+    return RenderedBlock(html_lines, line_spans, toc_lines, end_state)
 
 
 def get_todo_element(raw_todo):
@@ -0,0 +1,199 @@
+'''
+An LRU cache of rendered notes, so that opening a note which hasn't
+changed since it was last rendered only costs reading and hashing it.
+
+Entries are keyed by a hash of the renderer version, the note path, and
+the note content, so edits to a note or changes to the renderer never
+return stale output. The cache is bounded by the total size of the
+rendered content it holds. Entries which are evicted from memory can
+optionally be spilled to disk in the `.shorthand` directory, where they
+are also bounded in total size, and are loaded back into memory the next
+time they are requested.
+'''
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, TypedDict
+
+from shorthand.frontend.render import RENDERER_VERSION, RenderedMarkdown, \
+                                      get_rendered_markdown
+from shorthand.notes import _get_note
+from shorthand.types import DirectoryPath, NotePath, RawNoteContent
+from shorthand.utils.filesystem import atomic_write
+
+
+RENDER_CACHE_DIR = '.shorthand/cache/render'
+DEFAULT_RENDER_CACHE_BYTES = 32 * 1024 * 1024
+# Spilled entries can take up this many times the size of the cache
+RENDER_SPILL_FACTOR = 4
+
+
+log = logging.getLogger(__name__)
+
+
+class RenderCacheStats(TypedDict):
+    hits: int
+    # Hits which were loaded back into memory from disk
+    spill_hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size: int
+    max_size: int
+
+
+def get_render_cache_dir(notes_directory: DirectoryPath) -> str:
+    return f'{notes_directory}/{RENDER_CACHE_DIR}'
+
+
+def get_render_cache_key(note_path: NotePath, content: RawNoteContent
+                         ) -> str:
+    key = hashlib.sha256(f'{RENDERER_VERSION}\0{note_path}\0'.encode())
+    key.update(content.encode('utf-8', errors='surrogatepass'))
+    return key.hexdigest()
+
+
+def get_rendered_size(rendered: RenderedMarkdown) -> int:
+    return len(rendered['file_content']) + len(rendered['toc_content'])
+
+
+class RenderCache:
+    '''A least recently used cache of rendered notes, bounded by the total
+       length of their rendered content
+    '''
+
+    def __init__(self, max_size: int = DEFAULT_RENDER_CACHE_BYTES,
+                 spill_dir: Optional[str] = None):
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.max_spill_size = max_size * RENDER_SPILL_FACTOR
+        self.entries: OrderedDict[str, RenderedMarkdown] = OrderedDict()
+        self.size = 0
+        # The size of each spilled entry, from the least recently spilled,
+        # which is loaded from the spill directory when first needed
+        self.spilled: Optional[OrderedDict[str, int]] = None
+        self.spill_size = 0
+        self.hits = 0
+        self.spill_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[RenderedMarkdown]:
+        with self.lock:
+            rendered = self.entries.get(key)
+            if rendered is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return rendered
+
+            rendered = self.load_spilled(key)
+            if rendered is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.spill_hits += 1
+            self.add(key, rendered)
+            return rendered
+
+    def put(self, key: str, rendered: RenderedMarkdown) -> None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return
+            self.add(key, rendered)
+
+    def add(self, key: str, rendered: RenderedMarkdown) -> None:
+        rendered_size = get_rendered_size(rendered)
+        if rendered_size > self.max_size:
+            return
+        self.entries[key] = rendered
+        self.size += rendered_size
+        while self.size > self.max_size:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= get_rendered_size(evicted)
+            self.evictions += 1
+            self.spill(evicted_key, evicted)
+
+    def get_spill_path(self, key: str) -> str:
+        return f'{self.spill_dir}/{key}.json'
+
+    def load_spilled(self, key: str) -> Optional[RenderedMarkdown]:
+        if self.spill_dir is None:
+            return None
+        try:
+            with open(self.get_spill_path(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.warning(f'Spilled render cache entry {key} is corrupted')
+            return None
+
+    def spill(self, key: str, rendered: RenderedMarkdown) -> None:
+        '''Write an entry evicted from memory to disk, removing the least
+           recently spilled entries if there are too many
+        '''
+        if self.spill_dir is None:
+            return
+        if not os.path.exists(self.spill_dir):
+            os.makedirs(self.spill_dir)
+        if self.spilled is None:
+            entries = sorted(
+                (entry for entry in os.scandir(self.spill_dir)
+                 if entry.name.endswith('.json')),
+                key=lambda entry: entry.stat().st_mtime_ns)
+            self.spilled = OrderedDict(
+                (entry.name.removesuffix('.json'), entry.stat().st_size)
+                for entry in entries)
+            self.spill_size = sum(self.spilled.values())
+
+        spill_path = self.get_spill_path(key)
+        if key in self.spilled:
+            self.spilled.move_to_end(key)
+            return
+        with atomic_write(spill_path) as f:
+            json.dump(rendered, f)
+        self.spilled[key] = os.path.getsize(spill_path)
+        self.spill_size += self.spilled[key]
+
+        while self.spill_size > self.max_spill_size:
+            removed_key, removed_size = self.spilled.popitem(last=False)
+            self.spill_size -= removed_size
+            try:
+                os.remove(self.get_spill_path(removed_key))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self) -> RenderCacheStats:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'spill_hits': self.spill_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size
+            }
+
+
+def _get_rendered_note(notes_directory: DirectoryPath, note_path: NotePath,
+                       cache: Optional[RenderCache] = None
+                       ) -> RenderedMarkdown:
+    '''Render a note, re-using the cached rendering if the note hasn't
+       changed since it was last rendered
+    '''
+    content = _get_note(notes_directory, note_path)
+    if cache is None:
+        return get_rendered_markdown(content, note_path)
+
+    key = get_render_cache_key(note_path, content)
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = get_rendered_markdown(content, note_path)
+        cache.put(key, rendered)
+    return rendered
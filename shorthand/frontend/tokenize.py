@@ -0,0 +1,62 @@
+'''
+Tokenizers which split note content into sentences of words, for building
+the n-gram database used for typeahead suggestions.
+
+The built-in `regex` tokenizer doesn't need any other libraries or data.
+The `nltk` tokenizer uses NLTK's punkt sentence tokenizer instead, which
+handles abbreviations and other edge cases better but is much slower and
+requires the punkt data to be downloaded. NLTK is only imported when the
+`nltk` tokenizer is used.
+'''
+import re
+import logging
+from typing import Iterator, List, Literal
+
+
+type NgramTokenizer = Literal['regex', 'nltk']
+
+NGRAM_TOKENIZERS = ['regex', 'nltk']
+DEFAULT_NGRAM_TOKENIZER = 'regex'
+
+# A sentence ends with punctuation followed by whitespace
+sentence_end_regex = re.compile(r'(?<=[.!?])\s+')
+
+
+log = logging.getLogger(__name__)
+
+
+def split_lines(content: str) -> Iterator[str]:
+    '''Split content into its lines, skipping blank lines
+    '''
+    for line in content.splitlines():
+        if line.strip():
+            yield line
+
+
+def split_sentences_regex(line: str) -> List[str]:
+    return [sentence for sentence in sentence_end_regex.split(line)
+            if sentence]
+
+
+def split_sentences_nltk(line: str) -> List[str]:
+    from nltk.tokenize import sent_tokenize
+    return sent_tokenize(line)
+
+
+def tokenize_sentences(content: str,
+                       tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER
+                       ) -> Iterator[List[str]]:
+    '''Split content into sentences, each of which is a list of the
+       whitespace-separated words in it. Sentences never span lines
+    '''
+    if tokenizer == 'regex':
+        split_sentences = split_sentences_regex
+    elif tokenizer == 'nltk':
+        split_sentences = split_sentences_nltk
+    else:
+        raise ValueError(f'Invalid tokenizer "{tokenizer}" specified, valid '
+                         f'options are: {", ".join(NGRAM_TOKENIZERS)}')
+
+    for line in split_lines(content):
+        for sentence in split_sentences(line):
+            yield sentence.split()
@@ -1,15 +1,23 @@
 import os
-from subprocess import Popen, PIPE
-from collections import OrderedDict
+import sys
+import heapq
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, \
+                               ProcessPoolExecutor, wait
+from multiprocessing import get_context
 import json
 import codecs
+import sqlite3
 import logging
-from typing import List
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TypedDict
 
-from nltk import bigrams, trigrams
-from nltk.tokenize import sent_tokenize, WhitespaceTokenizer, \
-        LineTokenizer
-from shorthand.types import DirectoryPath
+from shorthand.frontend.tokenize import DEFAULT_NGRAM_TOKENIZER, \
+                                        NgramTokenizer, tokenize_sentences
+from shorthand.types import DirectoryPath, InternalAbsolutePath, NotePath
+from shorthand.utils.filesystem import atomic_write, file_lock
+from shorthand.utils.paths import _get_changed_note_paths, \
+                                  _list_note_paths, get_full_path
 
 
 FORBIDDEN_CHARS = [
@@ -18,17 +26,165 @@ FORBIDDEN_CHARS = [
     '-', '_', '=', '+', '*', '%', ':', '{',
     '}']
 
+NGRAM_TYPES = ['unigrams', 'bigrams', 'trigrams']
+# Changed every time the n-gram database is rebuilt, so that the
+# in-memory copy of it is only reloaded when it has changed
+GENERATION_FILENAME = 'generation'
+# The n-grams counted for each note and their totals, so that only changed
+# notes need to be counted again when the database is updated
+NGRAM_STATE_FILENAME = 'note_ngrams.db'
+NGRAM_STATE_VERSION = 2
+NGRAM_STATE_TIMEOUT = 30
+# Where the counts were kept before they were stored in SQLite
+LEGACY_NGRAM_STATE_FILENAME = 'note_ngrams.json'
+# Held while updating the n-gram database, so that concurrent updates
+# don't count the same changes twice
+NGRAM_LOCK_FILENAME = 'lock'
+
+DEFAULT_NGRAM_WORKERS = 4
+# Notes are counted in shards of up to this much note content, with only
+# a few shards in progress per worker process at once
+NGRAM_SHARD_BYTES = 4 * 1024 * 1024
+NGRAM_SHARDS_PER_WORKER = 2
+
+# The number of completions stored for each short prefix
+PREFIX_INDEX_TOP_K = 10
+# Completions are stored for prefixes up to this long. Longer prefixes
+# match few enough terms that they can be ranked when they are searched
+MAX_PRECOMPUTED_PREFIX = 3
+
 
 log = logging.getLogger(__name__)
 
 
+class PrefixIndex:
+    '''An in-memory index of terms which finds the highest ranked terms
+       starting with a given prefix.
+
+       Terms are kept in sorted order, so that the terms matching a prefix
+       are always a contiguous range, along with the most highly ranked
+       completions for every short prefix
+    '''
+
+    def __init__(self, ranked_terms: List[str],
+                 top_k: int = PREFIX_INDEX_TOP_K):
+        '''Build an index from a list of terms, ordered from the highest
+           ranked to the lowest
+        '''
+        self.ranked_terms = ranked_terms
+        self.top_k = top_k
+        # The rank of each term, in sorted order of the terms
+        self.sorted_ranks = sorted(range(len(ranked_terms)),
+                                   key=ranked_terms.__getitem__)
+        self.sorted_terms = [ranked_terms[rank]
+                             for rank in self.sorted_ranks]
+
+        # Terms are visited from the highest ranked, so the first terms
+        # found for each prefix are its top completions
+        self.top_completions: Dict[str, List[int]] = {}
+        for rank, term in enumerate(ranked_terms):
+            for length in range(min(len(term), MAX_PRECOMPUTED_PREFIX) + 1):
+                completions = self.top_completions.setdefault(
+                    term[:length], [])
+                if len(completions) < top_k:
+                    completions.append(rank)
+
+    def __len__(self) -> int:
+        return len(self.ranked_terms)
+
+    def search(self, prefix: str, limit: int = PREFIX_INDEX_TOP_K
+               ) -> List[str]:
+        '''Get up to `limit` of the highest ranked terms which start with
+           the prefix, from highest to lowest ranked
+        '''
+        if limit <= 0:
+            return []
+        if limit <= self.top_k and len(prefix) <= MAX_PRECOMPUTED_PREFIX:
+            ranks = self.top_completions.get(prefix, [])[:limit]
+        else:
+            start, end = self.get_prefix_range(prefix)
+            ranks = heapq.nsmallest(limit, self.sorted_ranks[start:end])
+        return [self.ranked_terms[rank] for rank in ranks]
+
+    def get_prefix_range(self, prefix: str) -> Tuple[int, int]:
+        '''Get the range of indexes of sorted terms starting with a prefix
+        '''
+        start = bisect_left(self.sorted_terms, prefix)
+        if prefix and ord(prefix[-1]) < sys.maxunicode:
+            # Every term starting with the prefix sorts before this
+            upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            return start, bisect_left(self.sorted_terms, upper_bound, lo=start)
+
+        end = start
+        while end < len(self.sorted_terms) and \
+                self.sorted_terms[end].startswith(prefix):
+            end += 1
+        return start, end
+
+
+# The prefix indexes for the n-gram database in each notes directory,
+# along with the generation of the database they were loaded from
+_loaded_ngram_indexes: Dict[str, Tuple[str, Dict[str, PrefixIndex]]] = {}
+
+
+def get_ngram_db_dir(notes_directory: DirectoryPath) -> str:
+    return f'{notes_directory}/.shorthand/typeahead'
+
+
+def get_ngram_generation(ngram_db_dir: str) -> Optional[str]:
+    '''Get the generation of the n-gram database, or `None` if it
+       hasn't been built
+    '''
+    try:
+        with open(f'{ngram_db_dir}/{GENERATION_FILENAME}', 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    # Databases built before generations were recorded
+    try:
+        return str(os.stat(f'{ngram_db_dir}/unigrams.txt').st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+def _load_ngram_indexes(notes_directory: DirectoryPath
+                        ) -> Dict[str, PrefixIndex]:
+    '''Load the n-gram database into prefix indexes, re-using the indexes
+       which are already loaded unless the database has been rebuilt
+    '''
+    ngram_db_dir = get_ngram_db_dir(notes_directory)
+    generation = get_ngram_generation(ngram_db_dir)
+    if generation is None:
+        return {}
+
+    cached = _loaded_ngram_indexes.get(notes_directory)
+    if cached and cached[0] == generation:
+        return cached[1]
+
+    indexes = {}
+    for ngram_type in NGRAM_TYPES:
+        try:
+            with codecs.open(f'{ngram_db_dir}/{ngram_type}.txt', mode='r',
+                             encoding='utf-8') as f:
+                ranked_terms = [line.rstrip('\n') for line in f if line]
+        except FileNotFoundError:
+            ranked_terms = []
+        indexes[ngram_type] = PrefixIndex(
+            [term for term in ranked_terms if term])
+
+    log.debug(f'Loaded generation {generation} of the n-gram database')
+    _loaded_ngram_indexes[notes_directory] = (generation, indexes)
+    return indexes
+
+
 def _get_typeahead_suggestions(notes_directory: DirectoryPath, query_string, limit=10) -> List[str]:
     '''Get typeahead suggestions for the current active query.
     This can be a large query that we only want to provide
     suggestions for extending the last word or term of
     '''
 
-    ngram_db_dir = f'{notes_directory}/.shorthand/typeahead'
+    indexes = _load_ngram_indexes(notes_directory)
 
     num_quotes = query_string.count('"')
     if num_quotes % 2 != 0:
@@ -44,15 +200,15 @@ def _get_typeahead_suggestions(notes_directory: DirectoryPath, query_string, lim
         if num_words_in_term > 3:
             return []
         elif num_words_in_term == 3:
-            matches = search_ngram_db(ngram_db_dir + '/trigrams.txt',
+            matches = search_ngram_db(indexes, 'trigrams',
                                       current_term, limit)
             return [previous_query + '"' + match + '"' for match in matches]
         elif num_words_in_term == 2:
-            matches = search_ngram_db(ngram_db_dir + '/bigrams.txt',
+            matches = search_ngram_db(indexes, 'bigrams',
                                       current_term, limit)
             return [previous_query + '"' + match + '"' for match in matches]
         elif num_words_in_term == 1:
-            matches = search_ngram_db(ngram_db_dir + '/unigrams.txt',
+            matches = search_ngram_db(indexes, 'unigrams',
                                       current_term, limit)
             return [previous_query + '"' + match + '"' for match in matches]
 
@@ -63,7 +219,7 @@ def _get_typeahead_suggestions(notes_directory: DirectoryPath, query_string, lim
         current_term = split_terms[-1]
         previous_query = ' '.join(split_terms[:-1])
 
-        matches = search_ngram_db(ngram_db_dir + '/unigrams.txt',
+        matches = search_ngram_db(indexes, 'unigrams',
                                   current_term, limit)
         clean = []
         for match in matches:
@@ -74,158 +230,389 @@ def _get_typeahead_suggestions(notes_directory: DirectoryPath, query_string, lim
         return clean
 
 
-def search_ngram_db(database_file, search_string, limit):
-    '''Search an ngram DB file for terms starting with a given string
-    As always, do the search with grep
+def search_ngram_db(indexes: Dict[str, PrefixIndex], ngram_type: str,
+                    search_string: str, limit: int) -> List[str]:
+    '''Search the loaded n-gram database for the most frequent terms
+       starting with a given string
     '''
+    index = indexes.get(ngram_type)
+    if index is None:
+        return []
+    return index.search(search_string, limit)
 
-    grep_pattern = '"^{raw_pattern}"'.format(raw_pattern=search_string)
-
-    grep_command = 'grep {pattern} {file} | head -n {limit}'.format(
-                        pattern=grep_pattern,
-                        file=database_file,
-                        limit=limit)
-
-    proc = Popen(grep_command,
-                 stdout=PIPE, stderr=PIPE,
-                 shell=True)
-
-    output, err = proc.communicate()
-    matching_terms = output.decode().split('\n')
-    matching_terms = [term for term in matching_terms if len(term)]
-    return matching_terms
-
-
-def _update_ngram_database(notes_directory: DirectoryPath) -> None:
 
-    ngram_db_dir = f'{notes_directory}/.shorthand/typeahead'
-
-    if not os.path.exists(ngram_db_dir):
-        os.makedirs(ngram_db_dir)
+class NoteNgrams(TypedDict):
+    '''The n-grams counted for a single note, along with the modification
+       time and size of the note when they were counted
+    '''
+    mtime_ns: int
+    size: int
+    counts: Dict[str, Dict[str, int]]
 
-    line_tokenizer = LineTokenizer(blanklines='discard')
-    word_tokenizer = WhitespaceTokenizer()
 
-    grep_command = 'find {} | grep ".note$"'.format(notes_directory)
+def get_ngram_state_path(ngram_db_dir: str) -> str:
+    return f'{ngram_db_dir}/{NGRAM_STATE_FILENAME}'
 
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    all_notes_files = output.decode().split('\n')
 
+def _connect_ngram_state(ngram_db_dir: str,
+                         tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER
+                         ) -> sqlite3.Connection:
+    '''Open the stored n-gram counts, creating them if needed. Counts
+       which were stored in an older format or counted with a different
+       tokenizer are cleared
     '''
-    Create master list of all raw tokens. Will look like:
-        tokens = {
-            'unigrams': ['all', 'unigrams'],
-            'bigrams': [('all', 'bigrams')],
-            'trigrams': [('all', 'the', 'trigrams')]
-        }
+    connection = sqlite3.connect(get_ngram_state_path(ngram_db_dir),
+                                 timeout=NGRAM_STATE_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    with connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS state ('
+                           'key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS notes ('
+                           'path TEXT PRIMARY KEY, mtime_ns INTEGER, '
+                           'size INTEGER, counts TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS totals ('
+                           'ngram_type TEXT, term TEXT, count INTEGER, '
+                           'PRIMARY KEY (ngram_type, term)) WITHOUT ROWID')
+
+        expected_state = {'version': str(NGRAM_STATE_VERSION),
+                          'tokenizer': tokenizer}
+        if dict(connection.execute('SELECT key, value FROM state')) != \
+                expected_state:
+            connection.execute('DELETE FROM notes')
+            connection.execute('DELETE FROM totals')
+            connection.execute('DELETE FROM state')
+            connection.executemany(
+                'INSERT INTO state (key, value) VALUES (?, ?)',
+                expected_state.items())
+    return connection
+
+
+def count_note_ngrams(note_content: str,
+                      tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER
+                      ) -> Dict[str, Counter]:
+    '''Count the unigrams, bigrams and trigrams in the content of a note
     '''
+    counts = {ngram_type: Counter() for ngram_type in NGRAM_TYPES}
+    for sentence in tokenize_sentences(note_content.lower(), tokenizer):
+
+        sentence_safe_split = []
+        for word in sentence:
+            # Skip any word with a forbidden character
+            if any([char in word for char in FORBIDDEN_CHARS]):
+                continue
+
+            has_letters = False
+            for char in word:
+                if char.isalpha():
+                    has_letters = True
+                    break
+
+            if word and has_letters:
+                sentence_safe_split.append(word)
+
+        counts['unigrams'].update(sentence_safe_split)
+        counts['bigrams'].update(
+            ' '.join(bigram) for bigram in zip(sentence_safe_split,
+                                               sentence_safe_split[1:]))
+        counts['trigrams'].update(
+            ' '.join(trigram) for trigram in zip(sentence_safe_split,
+                                                 sentence_safe_split[1:],
+                                                 sentence_safe_split[2:]))
+    return counts
+
+
+def rank_ngrams(totals: Dict[str, int]) -> List[str]:
+    '''Order n-grams from the most to the least frequent
+    '''
+    return sorted(totals.keys(), key=lambda term: (-totals[term], term))
 
-    tokens = {
-        'unigrams': [],
-        'bigrams': [],
-        'trigrams': []
-    }
-
-    for note_file in all_notes_files:
 
-        if not note_file:
+def _count_ngram_shard(notes_directory: DirectoryPath,
+                       note_paths: List[NotePath],
+                       tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER
+                       ) -> Tuple[Dict[NotePath, NoteNgrams],
+                                  Dict[str, Counter]]:
+    '''Count the n-grams in a group of notes, returning the counts for
+       each note along with their totals
+    '''
+    shard_notes: Dict[NotePath, NoteNgrams] = {}
+    shard_totals = {ngram_type: Counter() for ngram_type in NGRAM_TYPES}
+    for note_path in note_paths:
+        full_path = get_full_path(notes_directory, note_path)
+        try:
+            stat = os.stat(full_path)
+            with codecs.open(full_path, mode='r', encoding='utf-8') \
+                    as note_file_object:
+                note_counts = count_note_ngrams(note_file_object.read(),
+                                                tokenizer)
+        except FileNotFoundError:
             continue
 
-        with codecs.open(note_file, mode="r", encoding="utf-8") \
-                as note_file_object:
-            note_file_content = note_file_object.read()
-
-        note_file_content = note_file_content.lower()
-
-        lines = line_tokenizer.tokenize(note_file_content)
-        for line in lines:
-
-            sentences = sent_tokenize(line)
-            for sentence in sentences:
-
-                sentence_safe_split = []
-
-                all_words = word_tokenizer.tokenize(sentence)
-                for word in all_words:
+        for ngram_type, counts in note_counts.items():
+            shard_totals[ngram_type].update(counts)
+        shard_notes[note_path] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'counts': {ngram_type: dict(counts)
+                       for ngram_type, counts in note_counts.items()}
+        }
+    return shard_notes, shard_totals
 
-                    # Skip any word with a forbidden character
-                    if any([char in word for char in FORBIDDEN_CHARS]):
-                        continue
 
-                    has_letters = False
-                    for char in word:
-                        if char.isalpha():
-                            has_letters = True
-                            break
+def _merge_ngram_counts(first: Dict[str, Counter], second: Dict[str, Counter]
+                        ) -> Dict[str, Counter]:
+    for ngram_type in NGRAM_TYPES:
+        if len(first[ngram_type]) < len(second[ngram_type]):
+            first[ngram_type], second[ngram_type] = \
+                second[ngram_type], first[ngram_type]
+        first[ngram_type].update(second[ngram_type])
+    return first
 
-                    if word and has_letters:
-                        sentence_safe_split.append(word)
 
-                tokens['unigrams'].extend(sentence_safe_split)
-                tokens['bigrams'].extend(bigrams(sentence_safe_split))
-                tokens['trigrams'].extend(trigrams(sentence_safe_split))
+class NgramCountReducer:
+    '''Merge the totals counted for each shard of notes as a tree, so that
+       counts are merged with others of a similar size and only a
+       logarithmic number of partial totals are held at once
+    '''
 
+    def __init__(self):
+        # The partial totals at each level of the tree, where level `n`
+        # holds the merged totals of `2 ** n` shards
+        self.levels: List[Optional[Dict[str, Counter]]] = []
+
+    def add(self, counts: Dict[str, Counter]) -> None:
+        for level, level_counts in enumerate(self.levels):
+            if level_counts is None:
+                self.levels[level] = counts
+                return
+            counts = _merge_ngram_counts(level_counts, counts)
+            self.levels[level] = None
+        self.levels.append(counts)
+
+    def result(self) -> Dict[str, Counter]:
+        totals = {ngram_type: Counter() for ngram_type in NGRAM_TYPES}
+        for level_counts in self.levels:
+            if level_counts is not None:
+                totals = _merge_ngram_counts(level_counts, totals)
+        return totals
+
+
+def _shard_notes(note_sizes: Dict[NotePath, int], max_shard_bytes: int
+                 ) -> List[List[NotePath]]:
+    '''Split notes into shards, each of which holds up to around
+       `max_shard_bytes` of note content
     '''
-    Squash the list of tokens into a dict that tracks
-    the number of occurences of each token. Will look like:
-    tokens = {
-        'unigrams': {
-            'foo': 17,
-            'bar': 42,
-            ...
-        },
-        ...
-    }
+    shards: List[List[NotePath]] = [[]]
+    shard_bytes = 0
+    for note_path, size in note_sizes.items():
+        if shards[-1] and shard_bytes + size > max_shard_bytes:
+            shards.append([])
+            shard_bytes = 0
+        shards[-1].append(note_path)
+        shard_bytes += size
+    return [shard for shard in shards if shard]
+
+
+def _count_ngrams(notes_directory: DirectoryPath,
+                  note_sizes: Dict[NotePath, int],
+                  tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER,
+                  workers: int = DEFAULT_NGRAM_WORKERS,
+                  max_shard_bytes: int = NGRAM_SHARD_BYTES
+                  ) -> Tuple[Dict[NotePath, NoteNgrams], Dict[str, Counter]]:
+    '''Count the n-grams in the specified notes, given the size of each,
+       spread across `workers` processes when there are enough notes to
+       fill more than one shard.
+
+       Only a few shards per worker are in progress at once, so that the
+       memory used is limited no matter how many notes there are
     '''
+    shards = _shard_notes(note_sizes, max_shard_bytes)
+    note_ngrams: Dict[NotePath, NoteNgrams] = {}
+    reducer = NgramCountReducer()
+
+    if workers <= 1 or len(shards) <= 1:
+        for shard in shards:
+            shard_notes, shard_totals = _count_ngram_shard(
+                notes_directory, shard, tokenizer)
+            note_ngrams.update(shard_notes)
+            reducer.add(shard_totals)
+        return note_ngrams, reducer.result()
+
+    log.debug(f'Counting n-grams for {len(note_sizes)} notes in '
+              f'{len(shards)} shards with {workers} workers')
+    # Worker processes are spawned rather than forked, since the server
+    # may be running other threads
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=get_context('spawn')) as executor:
+        pending_shards = iter(shards)
+        in_progress: Set[Future] = set()
+        while True:
+            for shard in pending_shards:
+                in_progress.add(executor.submit(
+                    _count_ngram_shard, notes_directory, shard, tokenizer))
+                if len(in_progress) >= workers * NGRAM_SHARDS_PER_WORKER:
+                    break
+            if not in_progress:
+                break
+            done, in_progress = wait(in_progress,
+                                     return_when=FIRST_COMPLETED)
+            for future in done:
+                shard_notes, shard_totals = future.result()
+                note_ngrams.update(shard_notes)
+                reducer.add(shard_totals)
+    return note_ngrams, reducer.result()
+
+
+def _update_ngram_database(notes_directory: DirectoryPath,
+                           tokenizer: NgramTokenizer = DEFAULT_NGRAM_TOKENIZER,
+                           workers: int = DEFAULT_NGRAM_WORKERS,
+                           max_shard_bytes: int = NGRAM_SHARD_BYTES,
+                           paths: Optional[Iterable[InternalAbsolutePath]] = None
+                           ) -> None:
+    '''Update the n-gram database used for typeahead suggestions
+
+       The n-grams counted for each note are stored along with their
+       totals, so only the notes which changed since the last update need
+       to be counted again, and only their counts are rewritten. Every
+       note is checked unless a list of note or directory paths which
+       changed is specified. The ranked n-gram files are only rewritten if
+       their order has changed
+    '''
+    ngram_db_dir = get_ngram_db_dir(notes_directory)
 
-    for token_type in tokens.keys():
-
-        all_tokens_of_type = tokens[token_type]
-        weighted_tokens = {}
+    if not os.path.exists(ngram_db_dir):
+        os.makedirs(ngram_db_dir)
 
-        for single_token in all_tokens_of_type:
-            if not isinstance(single_token, str):
-                single_token = ' '.join(single_token)
-            if not weighted_tokens.get(single_token):
-                weighted_tokens[single_token] = 1
-            else:
-                weighted_tokens[single_token] = weighted_tokens[single_token]+1
-
-        tokens[token_type] = OrderedDict(sorted(
-            weighted_tokens.items(),
-            key=lambda t: t[1],
-            reverse=True))
-
-    # Write Unigrams to Disk
-    unigrams_json_file_path = ngram_db_dir + '/unigrams.json'
-    unigrams_text_file_path = ngram_db_dir + '/unigrams.txt'
-    with open(unigrams_json_file_path, 'w') as unigrams_json_file_object:
-        json.dump(tokens['unigrams'], unigrams_json_file_object)
-    with codecs.open(unigrams_text_file_path, mode="w", encoding="utf-8") \
-            as unigrams_text_file_object:
-        for unigram, frequency in tokens['unigrams'].items():
-            unigrams_text_file_object.write(unigram + '\n')
-
-    # Write Bigrams to Disk
-    bigrams_json_file_path = ngram_db_dir + '/bigrams.json'
-    bigrams_text_file_path = ngram_db_dir + '/bigrams.txt'
-    with open(bigrams_json_file_path, 'w') as bigrams_json_file_object:
-        json.dump(tokens['bigrams'], bigrams_json_file_object)
-    with codecs.open(bigrams_text_file_path, mode="w", encoding="utf-8") \
-            as bigrams_text_file_object:
-        for bigram, frequency in tokens['bigrams'].items():
-            bigrams_text_file_object.write(bigram + '\n')
-
-    # Write Trigrams to Disk
-    trigrams_json_file_path = ngram_db_dir + '/trigrams.json'
-    trigrams_text_file_path = ngram_db_dir + '/trigrams.txt'
-    with open(trigrams_json_file_path, 'w') as trigrams_json_file_object:
-        json.dump(tokens['trigrams'], trigrams_json_file_object)
-    with codecs.open(trigrams_text_file_path, mode="w", encoding="utf-8") \
-            as trigrams_text_file_object:
-        for trigram, frequency in tokens['trigrams'].items():
-            trigrams_text_file_object.write(trigram + '\n')
+    with file_lock(f'{ngram_db_dir}/{NGRAM_LOCK_FILENAME}'):
+        try:
+            os.remove(f'{ngram_db_dir}/{LEGACY_NGRAM_STATE_FILENAME}')
+        except FileNotFoundError:
+            pass
+        if _update_ngram_state(notes_directory, ngram_db_dir, tokenizer,
+                               workers, max_shard_bytes, paths):
+            _write_ngram_generation(ngram_db_dir)
+
+
+def _update_ngram_state(notes_directory: DirectoryPath, ngram_db_dir: str,
+                        tokenizer: NgramTokenizer, workers: int,
+                        max_shard_bytes: int,
+                        paths: Optional[Iterable[InternalAbsolutePath]]
+                        ) -> bool:
+    '''Update the stored n-gram counts and the ranked n-gram files, which
+       must be called while holding the lock on the n-gram database.
+       Returns whether the ranking of any of the n-grams changed
+    '''
+    connection = _connect_ngram_state(ngram_db_dir, tokenizer)
+    try:
+        counted_notes = {
+            note_path: (mtime_ns, size)
+            for note_path, mtime_ns, size
+            in connection.execute('SELECT path, mtime_ns, size FROM notes')}
+
+        if paths is None:
+            current_note_paths = set(_list_note_paths(notes_directory))
+            removed_note_paths = set(counted_notes.keys()) - \
+                current_note_paths
+        else:
+            current_note_paths = set()
+            removed_note_paths = set()
+            for note_path in _get_changed_note_paths(
+                    notes_directory, paths, counted_notes.keys()):
+                if os.path.isfile(get_full_path(notes_directory, note_path)):
+                    current_note_paths.add(note_path)
+                elif note_path in counted_notes:
+                    removed_note_paths.add(note_path)
+
+        changed_note_sizes: Dict[NotePath, int] = {}
+        for note_path in sorted(current_note_paths):
+            try:
+                stat = os.stat(get_full_path(notes_directory, note_path))
+            except FileNotFoundError:
+                continue
+            if counted_notes.get(note_path) == (stat.st_mtime_ns,
+                                                stat.st_size):
+                continue
+            if note_path in counted_notes:
+                removed_note_paths.add(note_path)
+            changed_note_sizes[note_path] = stat.st_size
+
+        changed_notes, changed_totals = _count_ngrams(
+            notes_directory, changed_note_sizes, tokenizer, workers,
+            max_shard_bytes)
+
+        # The counts of notes which changed or were removed are taken out
+        # of the totals, and the counts of changed notes are added back
+        for note_path in removed_note_paths:
+            row = connection.execute('SELECT counts FROM notes WHERE path = ?',
+                                     (note_path,)).fetchone()
+            for ngram_type, counts in json.loads(row[0]).items():
+                changed_totals[ngram_type].subtract(counts)
+
+        with connection:
+            connection.executemany('DELETE FROM notes WHERE path = ?',
+                                   [(note_path,)
+                                    for note_path in removed_note_paths])
+            connection.executemany(
+                'INSERT INTO notes (path, mtime_ns, size, counts) '
+                'VALUES (?, ?, ?, ?)',
+                [(note_path, note['mtime_ns'], note['size'],
+                  json.dumps(note['counts']))
+                 for note_path, note in changed_notes.items()])
+            connection.executemany(
+                'INSERT INTO totals (ngram_type, term, count) '
+                'VALUES (?, ?, ?) ON CONFLICT (ngram_type, term) '
+                'DO UPDATE SET count = count + excluded.count',
+                [(ngram_type, term, count)
+                 for ngram_type in NGRAM_TYPES
+                 for term, count in changed_totals[ngram_type].items()
+                 if count])
+            # Drop n-grams which are no longer used by any note
+            connection.execute('DELETE FROM totals WHERE count <= 0')
+        log.debug(f'Counted n-grams for {len(changed_notes)} changed notes')
+
+        ranking_changed = False
+        for ngram_type in NGRAM_TYPES:
+            text_file_path = f'{ngram_db_dir}/{ngram_type}.txt'
+            if not changed_notes and not removed_note_paths and \
+                    os.path.exists(text_file_path):
+                continue
+
+            # Ranked the same way as `rank_ngrams`
+            type_totals = OrderedDict(connection.execute(
+                'SELECT term, count FROM totals WHERE ngram_type = ? '
+                'ORDER BY count DESC, term', (ngram_type,)))
+            ranked_terms = list(type_totals.keys())
+            try:
+                with codecs.open(text_file_path, mode='r',
+                                 encoding='utf-8') as text_file_object:
+                    existing_terms = text_file_object.read().splitlines()
+            except FileNotFoundError:
+                existing_terms = None
+            if ranked_terms == existing_terms:
+                continue
+
+            ranking_changed = True
+            with atomic_write(f'{ngram_db_dir}/{ngram_type}.json') as f:
+                f.write(json.dumps(type_totals))
+            with atomic_write(text_file_path, encoding='utf-8') \
+                    as text_file_object:
+                for term in ranked_terms:
+                    text_file_object.write(term + '\n')
+    finally:
+        connection.close()
+    return ranking_changed
+
+
+def _write_ngram_generation(ngram_db_dir: str) -> None:
+    '''Record that a new generation of the n-gram database was written,
+       once all of its files are complete
+    '''
+    previous_generation = get_ngram_generation(ngram_db_dir)
+    try:
+        generation = int(previous_generation or 0) + 1
+    except ValueError:
+        generation = 1
+
+    with atomic_write(f'{ngram_db_dir}/{GENERATION_FILENAME}') as f:
+        f.write(str(generation))
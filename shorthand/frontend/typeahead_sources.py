@@ -0,0 +1,273 @@
+'''
+Typeahead completions from several sources, so that every picker in the
+frontend can be driven from a single endpoint:
+
+- `words` completes the last word or quoted term of a search query from
+  the n-gram database built from the content of notes
+- `paths` completes note paths, with recently viewed notes ranked first
+- `tags` completes tag names, ranked by the number of notes using them
+- `definitions` completes defined terms, ranked by how often they are
+  defined
+
+Paths, tags and definition terms are served from prefix indexes which are
+kept in memory for each notes directory. They are built the first time
+they are needed, and afterwards only notes which the server or its
+watcher reported as changed are parsed again. Every note is still checked
+once in a while, to pick up changes made while nothing was watching. An
+index is only rebuilt when the set of terms or their ranking changes.
+'''
+import os
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Literal, Optional, Set, TypedDict
+
+from shorthand.elements.extract import _extract_note
+from shorthand.frontend.typeahead import PrefixIndex, \
+                                         _get_typeahead_suggestions, \
+                                         rank_ngrams
+from shorthand.types import DirectoryPath, InternalAbsolutePath, NotePath
+from shorthand.utils.paths import _get_changed_note_paths, \
+                                  _list_note_paths, get_full_path
+
+
+type TypeaheadSource = Literal['words', 'paths', 'tags', 'definitions']
+
+TYPEAHEAD_SOURCES = ['words', 'paths', 'tags', 'definitions']
+# Sources whose terms are parsed from the content of notes
+ELEMENT_SOURCES = ['tags', 'definitions']
+DEFAULT_TYPEAHEAD_LIMIT = 10
+# Every note is checked for changes at most this often, otherwise only the
+# notes which were reported as changed are
+TYPEAHEAD_RESCAN_SECONDS = 60
+
+RECENT_FILES_PATH = '.shorthand/state/recent_files.txt'
+
+
+log = logging.getLogger(__name__)
+
+
+class SourceNote(TypedDict):
+    '''The terms parsed from a single note, along with the modification
+       time and size of the note when they were parsed
+    '''
+    mtime_ns: int
+    size: int
+    terms: Dict[str, List[str]]
+
+
+class TypeaheadSourceState(TypedDict):
+    notes: Dict[NotePath, SourceNote]
+    # The number of occurrences of each term across all notes
+    counts: Dict[str, Counter]
+    # The note paths which the path index was built from, and the
+    # modification time of the recently viewed notes file at the time
+    note_paths: Set[NotePath]
+    recent_files_mtime: Optional[int]
+    indexes: Dict[str, PrefixIndex]
+    # The note or directory paths reported as changed since the last
+    # refresh, and when every note was last checked
+    changed_paths: Set[InternalAbsolutePath]
+    last_scan: Optional[float]
+
+
+# The state of the typeahead sources for each notes directory
+_loaded_source_states: Dict[DirectoryPath, TypeaheadSourceState] = {}
+_source_states_lock = threading.Lock()
+
+
+def get_note_terms(notes_directory: DirectoryPath, note_path: NotePath
+                   ) -> Optional[Dict[str, List[str]]]:
+    '''Get the tags and definition terms within a note
+    '''
+    elements = _extract_note(notes_directory, note_path)
+    if elements is None:
+        return None
+    return {
+        'tags': elements['tags'],
+        'definitions': [definition['term']
+                        for definition in elements['definitions']
+                        if definition['term']]
+    }
+
+
+def get_recent_files(notes_directory: DirectoryPath) -> List[NotePath]:
+    '''Get the recently viewed notes, from the most recently viewed
+    '''
+    try:
+        with open(f'{notes_directory}/{RECENT_FILES_PATH}', 'r') as f:
+            recent_files = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    recent_files.reverse()
+    return recent_files
+
+
+def rank_note_paths(note_paths: List[NotePath],
+                    recent_files: List[NotePath]) -> List[NotePath]:
+    '''Rank recently viewed notes first, followed by all other notes in
+       path order
+    '''
+    existing_paths = set(note_paths)
+    ranked_paths = list(dict.fromkeys(
+        path for path in recent_files if path in existing_paths))
+    viewed_paths = set(ranked_paths)
+    ranked_paths.extend(sorted(path for path in note_paths
+                               if path not in viewed_paths))
+    return ranked_paths
+
+
+def _sync_typeahead_sources(notes_directory: DirectoryPath,
+                            paths: Iterable[InternalAbsolutePath]) -> None:
+    '''Record that the notes or directories at the specified paths were
+       changed, so that they are checked at the next refresh
+    '''
+    with _source_states_lock:
+        state = _loaded_source_states.get(notes_directory)
+        if state is not None:
+            state['changed_paths'].update(paths)
+
+
+def _refresh_typeahead_sources(notes_directory: DirectoryPath
+                               ) -> Dict[str, PrefixIndex]:
+    '''Bring the in-memory indexes of paths, tags and definition terms up
+       to date with the notes directory, parsing only notes which changed
+       since the last refresh
+    '''
+    with _source_states_lock:
+        state = _loaded_source_states.get(notes_directory)
+        if state is None:
+            state = {
+                'notes': {},
+                'counts': {source: Counter() for source in ELEMENT_SOURCES},
+                'note_paths': set(),
+                'recent_files_mtime': None,
+                'indexes': {},
+                'changed_paths': set(),
+                'last_scan': None
+            }
+            _loaded_source_states[notes_directory] = state
+        _update_source_state(notes_directory, state)
+        return state['indexes']
+
+
+def _update_source_state(notes_directory: DirectoryPath,
+                         state: TypeaheadSourceState) -> None:
+    '''Update the state of the typeahead sources for a notes directory,
+       which must be called while holding the lock on the loaded states
+    '''
+    changed_sources = set()
+    no_terms: Dict[str, List[str]] = {source: []
+                                      for source in ELEMENT_SOURCES}
+
+    def update_counts(old_terms: Dict[str, List[str]],
+                      new_terms: Dict[str, List[str]]) -> None:
+        for source in ELEMENT_SOURCES:
+            if old_terms[source] == new_terms[source]:
+                continue
+            changed_sources.add(source)
+            state['counts'][source].subtract(old_terms[source])
+            state['counts'][source].update(new_terms[source])
+
+    now = time.monotonic()
+    if state['last_scan'] is None or \
+            now - state['last_scan'] >= TYPEAHEAD_RESCAN_SECONDS:
+        note_paths = set(_list_note_paths(notes_directory))
+        checked_paths = note_paths | set(state['notes'].keys())
+        state['last_scan'] = now
+    else:
+        checked_paths = _get_changed_note_paths(
+            notes_directory, state['changed_paths'], state['notes'].keys())
+        note_paths = set(state['note_paths'])
+    state['changed_paths'].clear()
+
+    for note_path in checked_paths:
+        try:
+            stat = os.stat(get_full_path(notes_directory, note_path))
+        except FileNotFoundError:
+            note_paths.discard(note_path)
+            if note_path in state['notes']:
+                update_counts(state['notes'].pop(note_path)['terms'],
+                              no_terms)
+            continue
+        note_paths.add(note_path)
+        previous = state['notes'].get(note_path)
+        if previous and previous['mtime_ns'] == stat.st_mtime_ns and \
+                previous['size'] == stat.st_size:
+            continue
+
+        terms = get_note_terms(notes_directory, note_path)
+        if terms is None:
+            continue
+        update_counts(previous['terms'] if previous else no_terms, terms)
+        state['notes'][note_path] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'terms': terms
+        }
+
+    for source in ELEMENT_SOURCES:
+        if source not in changed_sources and source in state['indexes']:
+            continue
+        # Drop terms which are no longer in any note
+        counts = +state['counts'][source]
+        state['counts'][source] = counts
+        log.debug(f'Building typeahead index for {len(counts)} {source}')
+        state['indexes'][source] = PrefixIndex(rank_ngrams(counts))
+
+    try:
+        recent_files_mtime = os.stat(
+            f'{notes_directory}/{RECENT_FILES_PATH}').st_mtime_ns
+    except FileNotFoundError:
+        recent_files_mtime = None
+    if 'paths' not in state['indexes'] or \
+            note_paths != state['note_paths'] or \
+            recent_files_mtime != state['recent_files_mtime']:
+        log.debug(f'Building typeahead index for {len(note_paths)} paths')
+        state['indexes']['paths'] = PrefixIndex(rank_note_paths(
+            note_paths, get_recent_files(notes_directory)))
+        state['note_paths'] = note_paths
+        state['recent_files_mtime'] = recent_files_mtime
+
+
+def _get_typeahead_completions(notes_directory: DirectoryPath,
+                               query_string: str,
+                               sources: Dict[TypeaheadSource, int]
+                               ) -> Dict[TypeaheadSource, List[str]]:
+    '''Get completions for a query from each of the specified sources,
+       mapped to the maximum number of completions to return from each.
+
+       Completions for the `words` source extend the full query, while
+       the other sources complete the query as a whole. A leading `/` is
+       optional for paths, and a leading `:` is optional for tags
+    '''
+    for source, limit in sources.items():
+        if source not in TYPEAHEAD_SOURCES:
+            raise ValueError(f'Invalid typeahead source "{source}" '
+                             f'specified, valid options are: '
+                             f'{", ".join(TYPEAHEAD_SOURCES)}')
+        if not isinstance(limit, int) or limit < 0:
+            raise ValueError(f'Invalid limit {limit} specified for '
+                             f'typeahead source "{source}"')
+
+    completions: Dict[TypeaheadSource, List[str]] = {}
+    if 'words' in sources:
+        completions['words'] = _get_typeahead_suggestions(
+            notes_directory, query_string, sources['words'])
+    if not set(sources.keys()) - {'words'}:
+        return completions
+
+    indexes = _refresh_typeahead_sources(notes_directory)
+    if 'paths' in sources:
+        prefix = query_string if query_string.startswith('/') \
+            else f'/{query_string}'
+        completions['paths'] = indexes['paths'].search(prefix,
+                                                       sources['paths'])
+    if 'tags' in sources:
+        completions['tags'] = indexes['tags'].search(
+            query_string.removeprefix(':'), sources['tags'])
+    if 'definitions' in sources:
+        completions['definitions'] = indexes['definitions'].search(
+            query_string, sources['definitions'])
+    return completions
@@ -0,0 +1,334 @@
+'''
+Compaction for the edit history stored in `.shorthand/history`, which
+otherwise grows forever.
+
+History older than a retention window is made coarser and compressed:
+  - The edits made to a note on each day are squashed into a single diff
+  - Daily versions are thinned out to one per week, as long as the versions
+    which are removed can be rebuilt exactly from the versions before them
+  - Checkpoints are removed, since far fewer diffs need to be replayed
+  - Diffs and versions are compressed with lzma, and are decompressed
+    transparently when they are read
+
+Identical version files, across all notes, are then deduplicated by
+hard-linking them together.
+'''
+import os
+import lzma
+import uuid
+import hashlib
+import logging
+from datetime import datetime, UTC, timedelta
+from typing import Dict, List, Optional, Set, Tuple, TypedDict
+
+from shorthand.edit_history import CHECKPOINTS_DIRNAME, \
+                                   COMPRESSED_VERSION_SUFFIX, HISTORY_PATH, \
+                                   _get_note_version, \
+                                   _list_note_checkpoints, \
+                                   _list_note_versions, \
+                                   _rebuild_note_state, \
+                                   _rebuild_timeline_manifest, \
+                                   get_note_history_dir, get_unified_diff
+from shorthand.history_log import HistoryLogRecord, read_history_log, \
+                                  write_history_records
+from shorthand.types import DirectoryPath, ExecutablePath, NotePath
+from shorthand.utils.filesystem import atomic_write
+
+
+DEFAULT_HISTORY_RETENTION_DAYS = 30
+# The number of times to try compacting a note whose history keeps
+# changing while it is being compacted
+COMPACTION_ATTEMPTS = 3
+
+
+log = logging.getLogger(__name__)
+
+
+class HistoryCompactionStats(TypedDict):
+    notes: int
+    diffs_squashed: int
+    versions_removed: int
+    checkpoints_removed: int
+    files_compressed: int
+    files_deduplicated: int
+    bytes_before: int
+    bytes_after: int
+    bytes_reclaimed: int
+
+
+def get_history_size(notes_directory: DirectoryPath) -> int:
+    '''Get the total size of all stored history, counting files which are
+       hard-linked together only once
+    '''
+    seen_inodes: Set[Tuple[int, int]] = set()
+    total_size = 0
+    for root, _, filenames in os.walk(f'{notes_directory}/{HISTORY_PATH}'):
+        for filename in filenames:
+            stat = os.lstat(os.path.join(root, filename))
+            if (stat.st_dev, stat.st_ino) in seen_inodes:
+                continue
+            seen_inodes.add((stat.st_dev, stat.st_ino))
+            total_size += stat.st_size
+    return total_size
+
+
+def _list_notes_with_history(notes_directory: DirectoryPath
+                             ) -> List[NotePath]:
+    history_root = f'{notes_directory}/{HISTORY_PATH}'
+    note_paths = []
+    for root, dirs, _ in os.walk(history_root):
+        for dirname in dirs:
+            if dirname.endswith('.note'):
+                note_paths.append(
+                    os.path.join(root, dirname)[len(history_root):])
+    return sorted(note_paths)
+
+
+def _get_squash_runs(records: List[HistoryLogRecord],
+                     versions: List[str],
+                     cutoff: str) -> List[List[HistoryLogRecord]]:
+    '''Group the records for a note into runs which can be squashed into a
+       single diff. A run is a sequence of edits made on the same day before
+       the cutoff, without any other changes or versions in between
+    '''
+    runs: List[List[HistoryLogRecord]] = []
+    version_idx = 0
+    for record in records:
+        # Versions hold the state before any diffs made at their time
+        starts_version = False
+        while version_idx < len(versions) and \
+                versions[version_idx] <= record.timestamp:
+            version_idx += 1
+            starts_version = True
+
+        previous = runs[-1][-1] if runs else None
+        if previous and not starts_version and \
+                record.diff_type == 'edit' and \
+                previous.diff_type == 'edit' and \
+                record.timestamp < cutoff and \
+                record.timestamp[:10] == previous.timestamp[:10]:
+            runs[-1].append(record)
+        else:
+            runs.append([record])
+    return runs
+
+
+def _squash_note_diffs(notes_directory: DirectoryPath,
+                       note_path: NotePath,
+                       records: List[HistoryLogRecord],
+                       versions: List[str],
+                       cutoff: str,
+                       find_path: ExecutablePath = 'find',
+                       patch_path: Optional[ExecutablePath] = None
+                       ) -> List[HistoryLogRecord]:
+    squashed_records = []
+    for run in _get_squash_runs(records, versions, cutoff):
+        if len(run) == 1:
+            squashed_records.append(run[0])
+            continue
+
+        start = _rebuild_note_state(notes_directory, note_path,
+                                    run[0].timestamp, inclusive=False,
+                                    find_path=find_path,
+                                    patch_path=patch_path)
+        end = _rebuild_note_state(notes_directory, note_path,
+                                  run[-1].timestamp, inclusive=True,
+                                  find_path=find_path, patch_path=patch_path)
+        if start is None or end is None:
+            squashed_records.extend(run)
+            continue
+
+        diff = get_unified_diff(start, end, note_path, author=run[-1].author,
+                                diff_time=datetime.fromisoformat(
+                                    run[-1].timestamp))
+        squashed_records.append(HistoryLogRecord(
+            'edit', run[-1].timestamp, run[-1].author, diff))
+    return squashed_records
+
+
+def _get_removable_versions(notes_directory: DirectoryPath,
+                            note_path: NotePath,
+                            records: List[HistoryLogRecord],
+                            versions: List[str],
+                            cutoff: str,
+                            find_path: ExecutablePath = 'find',
+                            patch_path: Optional[ExecutablePath] = None
+                            ) -> List[str]:
+    '''Get the versions from before the cutoff which can be removed, so that
+       only one version is kept for each week.
+
+       A version can only be removed if only edits were made since the
+       previous version which is kept, and replaying them gives exactly
+       the same content as the version
+    '''
+    removable_versions = []
+    kept_version = None
+    for version in versions:
+        if version >= cutoff:
+            break
+
+        if kept_version is not None and \
+                datetime.fromisoformat(version).isocalendar()[:2] == \
+                datetime.fromisoformat(kept_version).isocalendar()[:2] and \
+                all(record.diff_type == 'edit' for record in records
+                    if kept_version <= record.timestamp < version):
+            try:
+                rebuilt_content = _rebuild_note_state(
+                    notes_directory, note_path, version, inclusive=False,
+                    find_path=find_path, patch_path=patch_path)
+            except ValueError:
+                rebuilt_content = None
+            if rebuilt_content == _get_note_version(notes_directory,
+                                                    note_path, version):
+                removable_versions.append(version)
+                continue
+
+        kept_version = version
+    return removable_versions
+
+
+def _get_version_path(notes_directory: DirectoryPath, note_path: NotePath,
+                      version: str) -> str:
+    '''Get the path to the file for a version, whether or not it is
+       compressed
+    '''
+    version_path = f'{get_note_history_dir(notes_directory, note_path)}/' + \
+                   f'{version}.version'
+    if os.path.exists(version_path):
+        return version_path
+    return version_path + COMPRESSED_VERSION_SUFFIX
+
+
+def _compress_file(path: str) -> None:
+    '''Replace a file with a compressed copy of it
+    '''
+    with open(path, 'rb') as f:
+        content = f.read()
+    with atomic_write(path + COMPRESSED_VERSION_SUFFIX, 'wb') as f:
+        f.write(lzma.compress(content))
+    os.remove(path)
+
+
+def _compact_note_history(notes_directory: DirectoryPath,
+                          note_path: NotePath,
+                          cutoff: str,
+                          stats: HistoryCompactionStats,
+                          find_path: ExecutablePath = 'find',
+                          patch_path: Optional[ExecutablePath] = None
+                          ) -> None:
+    history_dir = get_note_history_dir(notes_directory, note_path)
+    for _ in range(COMPACTION_ATTEMPTS):
+        entries, records = read_history_log(history_dir)
+        records.sort(key=lambda record: record.timestamp)
+        versions = sorted(_list_note_versions(notes_directory, note_path,
+                                              find_path))
+        if not any(record.timestamp < cutoff for record in records) and \
+                not any(version < cutoff for version in versions):
+            return
+
+        # All of the new diffs are calculated before anything is changed
+        squashed_records = _squash_note_diffs(notes_directory, note_path,
+                                              records, versions, cutoff,
+                                              find_path, patch_path)
+        # The log is only replaced if nothing was recorded since it was
+        # read, otherwise the note is compacted again
+        if not records or write_history_records(
+                history_dir, squashed_records, compress_before=cutoff,
+                expected_entries=entries):
+            break
+        log.info(f'History for {note_path} changed while compacting it, '
+                 f'retrying')
+    else:
+        raise ValueError('History kept changing while compacting it')
+    stats['diffs_squashed'] += len(records) - len(squashed_records)
+
+    for version in _get_removable_versions(notes_directory, note_path,
+                                           squashed_records, versions,
+                                           cutoff, find_path, patch_path):
+        os.remove(_get_version_path(notes_directory, note_path, version))
+        versions.remove(version)
+        stats['versions_removed'] += 1
+
+    for checkpoint in _list_note_checkpoints(notes_directory, note_path):
+        if checkpoint < cutoff:
+            os.remove(f'{history_dir}/{CHECKPOINTS_DIRNAME}/'
+                      f'{checkpoint}.checkpoint')
+            stats['checkpoints_removed'] += 1
+
+    for version in versions:
+        version_path = _get_version_path(notes_directory, note_path, version)
+        if version < cutoff and \
+                not version_path.endswith(COMPRESSED_VERSION_SUFFIX):
+            _compress_file(version_path)
+            stats['files_compressed'] += 1
+
+    _rebuild_timeline_manifest(notes_directory, note_path, find_path)
+    stats['notes'] += 1
+
+
+def _deduplicate_versions(notes_directory: DirectoryPath) -> int:
+    '''Hard-link identical version files together, so that their content is
+       only stored once. Returns the number of files which were linked
+    '''
+    files_by_hash: Dict[Tuple[int, str], str] = {}
+    deduplicated = 0
+    for root, _, filenames in os.walk(f'{notes_directory}/{HISTORY_PATH}'):
+        for filename in sorted(filenames):
+            if not filename.endswith(('.version',
+                                      f'.version{COMPRESSED_VERSION_SUFFIX}')):
+                continue
+            path = os.path.join(root, filename)
+            with open(path, 'rb') as f:
+                content = f.read()
+            key = (len(content), hashlib.sha1(content).hexdigest())
+            original_path = files_by_hash.setdefault(key, path)
+            if original_path == path or \
+                    os.path.samefile(original_path, path):
+                continue
+            # Linking fails rather than replacing an existing file,
+            # so a unique name keeps concurrent runs apart
+            temp_path = f'{root}/.{filename}.{uuid.uuid4().hex}.tmp'
+            os.link(original_path, temp_path)
+            os.replace(temp_path, path)
+            deduplicated += 1
+    return deduplicated
+
+
+def _compact_edit_history(notes_directory: DirectoryPath,
+                          retention_days: int = DEFAULT_HISTORY_RETENTION_DAYS,
+                          find_path: ExecutablePath = 'find',
+                          patch_path: Optional[ExecutablePath] = None
+                          ) -> HistoryCompactionStats:
+    '''Compact all history from before the retention window, and
+       deduplicate identical versions
+    '''
+    if retention_days < 0:
+        raise ValueError(f'Invalid retention period of {retention_days} days')
+
+    cutoff = (datetime.now(UTC) - timedelta(days=retention_days)).isoformat(
+        timespec='milliseconds')
+    stats: HistoryCompactionStats = {
+        'notes': 0,
+        'diffs_squashed': 0,
+        'versions_removed': 0,
+        'checkpoints_removed': 0,
+        'files_compressed': 0,
+        'files_deduplicated': 0,
+        'bytes_before': get_history_size(notes_directory),
+        'bytes_after': 0,
+        'bytes_reclaimed': 0
+    }
+
+    for note_path in _list_notes_with_history(notes_directory):
+        try:
+            _compact_note_history(notes_directory, note_path, cutoff, stats,
+                                  find_path, patch_path)
+        except ValueError as e:
+            log.error(f'Unable to compact history for {note_path}: {e}')
+
+    stats['files_deduplicated'] = _deduplicate_versions(notes_directory)
+    stats['bytes_after'] = get_history_size(notes_directory)
+    stats['bytes_reclaimed'] = stats['bytes_before'] - stats['bytes_after']
+    log.info(f'Compacted history for {stats["notes"]} notes, reclaiming '
+             f'{stats["bytes_reclaimed"]} bytes')
+    return stats
@@ -0,0 +1,520 @@
+'''
+Storage for the diffs which make up the edit history of a single note.
+
+All of the diffs for a note are packed into an append-only log file
+(`history.log`) in the note's history directory, alongside a small sidecar
+index (`history.idx`) with a fixed-size entry per record. Diffs can then be
+listed from the index alone, and the latest diff can be found with a single
+seek to the end of the index, no matter how much history a note has.
+
+Each record in the log is length-prefixed, and contains the type of the
+diff, its timestamp, its author, and the diff itself. The diff can be
+stored compressed, which is flagged in the type of the record and undone
+transparently when it is read. The index can always be rebuilt from the
+log, so it is only ever written after the log.
+
+Writers hold an exclusive lock on the log (`history.lock`) while they
+change it, so that several threads or server processes can record history
+for the same note. Readers share the lock, and skip over a partially
+written record left at the end of the log by an interrupted write, which
+is only removed by the next writer.
+
+Older versions of shorthand stored every diff as its own file under
+`diffs/YYYY/M/D/` in the note's history directory. These are converted
+into the packed log the first time the note's history is accessed.
+'''
+import os
+import lzma
+import shutil
+import struct
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from shorthand.utils.filesystem import atomic_write, file_lock
+
+
+HISTORY_LOG_FILENAME = 'history.log'
+HISTORY_INDEX_FILENAME = 'history.idx'
+HISTORY_LOCK_FILENAME = 'history.lock'
+LEGACY_DIFFS_DIRNAME = 'diffs'
+
+HISTORY_LOG_MAGIC = b'SHLOG1\n'
+
+# Every record starts with the length of the rest of the record
+RECORD_LENGTH = struct.Struct('>I')
+# Followed by the diff type, timestamp, and the length of the author
+RECORD_HEADER = struct.Struct('>B29sH')
+# Each index entry is the offset and length of a record in the log,
+# along with its diff type and timestamp
+INDEX_ENTRY = struct.Struct('>QIB29s')
+
+TIMESTAMP_LENGTH = 29
+
+DIFF_TYPE_CODES: Dict[str, int] = {
+    'create': 1,
+    'edit': 2,
+    'move': 3,
+    'delete': 4
+}
+DIFF_TYPES_BY_CODE = {code: diff_type
+                      for diff_type, code in DIFF_TYPE_CODES.items()}
+# Set in the type code of records whose diff is compressed with lzma
+COMPRESSED_FLAG = 0x80
+
+
+log = logging.getLogger(__name__)
+
+
+class HistoryLogEntry(NamedTuple):
+    offset: int
+    length: int
+    diff_type: str
+    timestamp: str
+
+
+class HistoryLogRecord(NamedTuple):
+    diff_type: str
+    timestamp: str
+    author: str
+    diff: str
+
+
+def get_history_log_path(history_dir: str) -> str:
+    return f'{history_dir}/{HISTORY_LOG_FILENAME}'
+
+
+def get_history_index_path(history_dir: str) -> str:
+    return f'{history_dir}/{HISTORY_INDEX_FILENAME}'
+
+
+def get_history_lock_path(history_dir: str) -> str:
+    return f'{history_dir}/{HISTORY_LOCK_FILENAME}'
+
+
+def get_diff_author(diff: str) -> str:
+    '''Get the author from the header of a diff
+    '''
+    first_line = diff.split('\n', 1)[0]
+    if first_line.startswith('Author: '):
+        return first_line[len('Author: '):]
+    return 'Unknown'
+
+
+def encode_record(record: HistoryLogRecord, compress: bool = False
+                  ) -> bytes:
+    '''Encode a record for the log. If `compress` is set, then the diff is
+       compressed unless that wouldn't make it any smaller
+    '''
+    if record.diff_type not in DIFF_TYPE_CODES:
+        raise ValueError(f'Invalid diff type {record.diff_type}')
+    timestamp = record.timestamp.encode()
+    if len(timestamp) != TIMESTAMP_LENGTH:
+        raise ValueError(f'Invalid diff timestamp {record.timestamp}')
+    author = record.author.encode()
+    type_code = DIFF_TYPE_CODES[record.diff_type]
+    diff = record.diff.encode()
+    if compress:
+        compressed_diff = lzma.compress(diff)
+        if len(compressed_diff) < len(diff):
+            type_code |= COMPRESSED_FLAG
+            diff = compressed_diff
+    body = RECORD_HEADER.pack(type_code, timestamp, len(author)) + \
+        author + diff
+    return RECORD_LENGTH.pack(len(body)) + body
+
+
+def decode_record(data: bytes) -> HistoryLogRecord:
+    '''Decode a full record from the log, including its length prefix
+    '''
+    type_code, timestamp, author_length = RECORD_HEADER.unpack_from(
+        data, RECORD_LENGTH.size)
+    author_start = RECORD_LENGTH.size + RECORD_HEADER.size
+    diff_start = author_start + author_length
+    diff = data[diff_start:]
+    if type_code & COMPRESSED_FLAG:
+        diff = lzma.decompress(diff)
+    return HistoryLogRecord(
+        diff_type=DIFF_TYPES_BY_CODE[type_code & ~COMPRESSED_FLAG],
+        timestamp=timestamp.decode(),
+        author=data[author_start:diff_start].decode(),
+        diff=diff.decode())
+
+
+def encode_index_entry(entry: HistoryLogEntry) -> bytes:
+    return INDEX_ENTRY.pack(entry.offset, entry.length,
+                            DIFF_TYPE_CODES[entry.diff_type],
+                            entry.timestamp.encode())
+
+
+def decode_index_entry(data: bytes, offset: int = 0) -> HistoryLogEntry:
+    record_offset, length, type_code, timestamp = INDEX_ENTRY.unpack_from(
+        data, offset)
+    return HistoryLogEntry(record_offset, length,
+                           DIFF_TYPES_BY_CODE[type_code], timestamp.decode())
+
+
+def _scan_history_log(data: bytes) -> List[HistoryLogEntry]:
+    '''Get the index entries for every complete record in the data of a
+       history log. A partially written record at the end is ignored
+    '''
+    entries = []
+    offset = len(HISTORY_LOG_MAGIC)
+    while offset + RECORD_LENGTH.size <= len(data):
+        body_length, = RECORD_LENGTH.unpack_from(data, offset)
+        length = RECORD_LENGTH.size + body_length
+        if offset + length > len(data) or \
+                body_length < RECORD_HEADER.size:
+            break
+        type_code, timestamp, _ = RECORD_HEADER.unpack_from(
+            data, offset + RECORD_LENGTH.size)
+        entries.append(HistoryLogEntry(
+            offset, length,
+            DIFF_TYPES_BY_CODE[type_code & ~COMPRESSED_FLAG],
+            timestamp.decode()))
+        offset += length
+    return entries
+
+
+def _read_history_index_file(history_dir: str
+                             ) -> Optional[List[HistoryLogEntry]]:
+    '''Read the entries in the index for a history log, or None if the
+       index is missing or malformed
+    '''
+    try:
+        with open(get_history_index_path(history_dir), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) % INDEX_ENTRY.size:
+        return None
+    return [decode_index_entry(data, offset)
+            for offset in range(0, len(data), INDEX_ENTRY.size)]
+
+
+def get_log_end(entries: List[HistoryLogEntry]) -> int:
+    '''Get the offset in the log just after the last of its entries
+    '''
+    if not entries:
+        return len(HISTORY_LOG_MAGIC)
+    return entries[-1].offset + entries[-1].length
+
+
+def _load_history_entries(history_dir: str
+                          ) -> Tuple[List[HistoryLogEntry], bool]:
+    '''Get the index entries for every complete record in a note's
+       history log, and whether or not the index is up to date with
+       the log. If it isn't, which is only the case if a write to the log
+       was interrupted, then the entries are found by reading the log.
+
+       Must be called with the history log lock held
+    '''
+    log_path = get_history_log_path(history_dir)
+    entries = _read_history_index_file(history_dir)
+    if entries is not None and \
+            get_log_end(entries) == os.path.getsize(log_path):
+        return entries, True
+
+    with open(log_path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(HISTORY_LOG_MAGIC):
+        raise ValueError(f'Invalid history log at {log_path}')
+    return _scan_history_log(data), False
+
+
+def _repair_history_log(history_dir: str) -> List[HistoryLogEntry]:
+    '''Get the index entries for every record in a note's history log,
+       after removing any partially written record from the end of the log
+       and bringing the index up to date with it.
+
+       Must be called with the history log lock held exclusively, so that
+       no other writer can be in the middle of writing a record
+    '''
+    entries, is_indexed = _load_history_entries(history_dir)
+    if is_indexed:
+        return entries
+
+    log_path = get_history_log_path(history_dir)
+    log_end = get_log_end(entries)
+    if os.path.getsize(log_path) != log_end:
+        log.warning(f'Truncating incomplete record at the end of '
+                    f'{log_path}')
+        with open(log_path, 'r+b') as f:
+            f.truncate(log_end)
+    _write_history_index(history_dir, entries)
+    return entries
+
+
+def _write_history_index(history_dir: str,
+                         entries: List[HistoryLogEntry]) -> None:
+    with atomic_write(get_history_index_path(history_dir), 'wb') as f:
+        f.write(b''.join(encode_index_entry(entry) for entry in entries))
+
+
+@contextmanager
+def history_log_lock(history_dir: str, shared: bool = False
+                     ) -> Iterator[None]:
+    '''Lock a note's history log. Anything which changes the log or its
+       index must hold the lock exclusively, while readers share it so that
+       they never see a write which is still in progress
+    '''
+    os.makedirs(history_dir, exist_ok=True)
+    with file_lock(get_history_lock_path(history_dir), shared=shared):
+        yield
+
+
+def read_history_index(history_dir: str) -> List[HistoryLogEntry]:
+    '''Get the index entries for every record in a note's history log,
+       in the order that they were written
+    '''
+    migrate_legacy_diffs(history_dir)
+    if not os.path.exists(get_history_log_path(history_dir)):
+        return []
+
+    with history_log_lock(history_dir, shared=True):
+        entries, _ = _load_history_entries(history_dir)
+    return entries
+
+
+def get_latest_history_entry(history_dir: str) -> Optional[HistoryLogEntry]:
+    '''Get the index entry for the most recently written record in a
+       note's history log, without reading the rest of the index
+    '''
+    migrate_legacy_diffs(history_dir)
+    log_path = get_history_log_path(history_dir)
+    if not os.path.exists(log_path):
+        return None
+
+    with history_log_lock(history_dir, shared=True):
+        try:
+            with open(get_history_index_path(history_dir), 'rb') as f:
+                index_size = f.seek(0, os.SEEK_END)
+                latest_entry = None
+                if index_size and not index_size % INDEX_ENTRY.size:
+                    f.seek(index_size - INDEX_ENTRY.size)
+                    latest_entry = decode_index_entry(
+                        f.read(INDEX_ENTRY.size))
+            if not index_size % INDEX_ENTRY.size and \
+                    get_log_end([latest_entry] if latest_entry else []) == \
+                    os.path.getsize(log_path):
+                return latest_entry
+        except FileNotFoundError:
+            pass
+
+        entries, _ = _load_history_entries(history_dir)
+    return entries[-1] if entries else None
+
+
+def read_history_record(history_dir: str,
+                        entry: HistoryLogEntry) -> HistoryLogRecord:
+    with history_log_lock(history_dir, shared=True):
+        with open(get_history_log_path(history_dir), 'rb') as f:
+            f.seek(entry.offset)
+            return decode_record(f.read(entry.length))
+
+
+def read_history_records(history_dir: str) -> List[HistoryLogRecord]:
+    '''Read every record in a note's history log, in the order they
+       were written
+    '''
+    _, records = read_history_log(history_dir)
+    return records
+
+
+def read_history_log(history_dir: str
+                     ) -> Tuple[List[HistoryLogEntry], List[HistoryLogRecord]]:
+    '''Read the index entries and the records for every record in a
+       note's history log, in the order they were written
+    '''
+    migrate_legacy_diffs(history_dir)
+    if not os.path.exists(get_history_log_path(history_dir)):
+        return [], []
+
+    with history_log_lock(history_dir, shared=True):
+        entries, _ = _load_history_entries(history_dir)
+        return entries, _read_packed_records(history_dir, entries)
+
+
+def append_history_record(history_dir: str, record: HistoryLogRecord,
+                          replace_latest: bool = False) -> HistoryLogEntry:
+    '''Append a record to the end of a note's history log
+
+       If `replace_latest` is set, then the most recently written record
+       is replaced by the new one
+    '''
+    migrate_legacy_diffs(history_dir)
+    data = encode_record(record)
+    log_path = get_history_log_path(history_dir)
+
+    with history_log_lock(history_dir):
+        if not os.path.exists(log_path):
+            with open(log_path, 'wb') as f:
+                f.write(HISTORY_LOG_MAGIC)
+        entries = _repair_history_log(history_dir)
+
+        if entries and entries[-1].diff_type == record.diff_type and \
+                entries[-1].timestamp == record.timestamp and \
+                not replace_latest:
+            raise ValueError(f'A {record.diff_type} diff already exists for '
+                             f'time {record.timestamp}')
+        if replace_latest and not entries:
+            raise ValueError('There is no diff to replace')
+
+        with open(log_path, 'r+b') as f:
+            if replace_latest:
+                offset = entries.pop().offset
+                f.truncate(offset)
+            else:
+                offset = f.seek(0, os.SEEK_END)
+            f.seek(offset)
+            f.write(data)
+
+        entry = HistoryLogEntry(offset, len(data), record.diff_type,
+                                record.timestamp)
+        if replace_latest:
+            entries.append(entry)
+            _write_history_index(history_dir, entries)
+        else:
+            with open(get_history_index_path(history_dir), 'ab') as f:
+                f.write(encode_index_entry(entry))
+    return entry
+
+
+def write_history_records(history_dir: str,
+                          records: List[HistoryLogRecord],
+                          compress_before: Optional[str] = None,
+                          expected_entries: Optional[List[HistoryLogEntry]]
+                          = None) -> bool:
+    '''Replace the full contents of a note's history log
+
+       The diffs for any records from before the `compress_before`
+       timestamp are stored compressed. If `expected_entries` is given,
+       then the log is only replaced if its index entries are still the
+       same, so that records written since it was read aren't lost.
+       Returns whether or not the log was replaced
+    '''
+    with history_log_lock(history_dir):
+        if expected_entries is not None and \
+                os.path.exists(get_history_log_path(history_dir)) and \
+                _repair_history_log(history_dir) != expected_entries:
+            return False
+        _write_history_records(history_dir, records, compress_before)
+    return True
+
+
+def _write_history_records(history_dir: str,
+                           records: List[HistoryLogRecord],
+                           compress_before: Optional[str] = None) -> None:
+    '''Replace the full contents of a note's history log. Must be called
+       with the history log lock held exclusively
+    '''
+    entries = []
+    offset = len(HISTORY_LOG_MAGIC)
+    with atomic_write(get_history_log_path(history_dir), 'wb') as f:
+        f.write(HISTORY_LOG_MAGIC)
+        for record in records:
+            compress = compress_before is not None and \
+                record.timestamp < compress_before
+            data = encode_record(record, compress=compress)
+            f.write(data)
+            entries.append(HistoryLogEntry(offset, len(data),
+                                           record.diff_type,
+                                           record.timestamp))
+            offset += len(data)
+    _write_history_index(history_dir, entries)
+
+
+def delete_history_record(history_dir: str, diff_type: str,
+                          timestamp: str) -> None:
+    migrate_legacy_diffs(history_dir)
+    if not os.path.exists(get_history_log_path(history_dir)):
+        raise ValueError(f'Diff not found for action {diff_type} and '
+                         f'time {timestamp}')
+
+    with history_log_lock(history_dir):
+        entries = _repair_history_log(history_dir)
+        for idx, entry in enumerate(entries):
+            if entry.diff_type == diff_type and entry.timestamp == timestamp:
+                break
+        else:
+            raise ValueError(f'Diff not found for action {diff_type} and '
+                             f'time {timestamp}')
+
+        if idx == len(entries) - 1:
+            # Removing the latest record only requires truncating the log
+            with open(get_history_log_path(history_dir), 'r+b') as f:
+                f.truncate(entry.offset)
+            _write_history_index(history_dir, entries[:-1])
+            return
+
+        records = _read_packed_records(history_dir)
+        _write_history_records(history_dir,
+                               records[:idx] + records[idx + 1:])
+
+
+def _parse_legacy_diff_filename(filename: str) -> Optional[Tuple[str, str]]:
+    '''Get the timestamp and diff type from the name of a diff file in the
+       legacy layout, like `2024-08-06T01:54:23.789+00:00.create.diff`
+    '''
+    parts = filename.rsplit('.', 2)
+    if len(parts) != 3 or parts[2] != 'diff' or \
+            parts[1] not in DIFF_TYPE_CODES:
+        return None
+    return parts[0], parts[1]
+
+
+def migrate_legacy_diffs(history_dir: str) -> bool:
+    '''Convert the individual diff files stored for a note in the legacy
+       layout into records in the note's history log
+
+       Returns whether or not there were any legacy diffs to migrate
+    '''
+    legacy_dir = f'{history_dir}/{LEGACY_DIFFS_DIRNAME}'
+    if not os.path.isdir(legacy_dir):
+        return False
+
+    with history_log_lock(history_dir):
+        # Another writer may have migrated the diffs while this one
+        # was waiting for the lock
+        if not os.path.isdir(legacy_dir):
+            return False
+
+        records = []
+        for root, _, filenames in os.walk(legacy_dir):
+            for filename in filenames:
+                parsed_filename = _parse_legacy_diff_filename(filename)
+                if not parsed_filename:
+                    log.warning(f'Skipping unrecognized history file '
+                                f'{root}/{filename}')
+                    continue
+                timestamp, diff_type = parsed_filename
+                with open(f'{root}/{filename}', 'r') as f:
+                    diff = f.read()
+                records.append(HistoryLogRecord(diff_type, timestamp,
+                                                get_diff_author(diff), diff))
+
+        if os.path.exists(get_history_log_path(history_dir)):
+            # Keep anything which was already written to the packed log
+            records += _read_packed_records(history_dir)
+        records.sort(key=lambda record: record.timestamp)
+
+        log.info(f'Migrating {len(records)} diffs in {history_dir} to a '
+                 f'packed history log')
+        _write_history_records(history_dir, records)
+        shutil.rmtree(legacy_dir)
+    return True
+
+
+def _read_packed_records(history_dir: str,
+                         entries: Optional[List[HistoryLogEntry]] = None
+                         ) -> List[HistoryLogRecord]:
+    '''Read every complete record in a note's history log, or only the
+       records for the given index entries. Must be called with the history
+       log lock held
+    '''
+    if entries is None:
+        entries, _ = _load_history_entries(history_dir)
+    with open(get_history_log_path(history_dir), 'rb') as f:
+        data = f.read()
+    return [decode_record(data[entry.offset:entry.offset + entry.length])
+            for entry in entries]
@@ -0,0 +1,196 @@
+'''
+Records the edit history for note edits in a background thread, so that
+saving a note doesn't have to wait for its history to be stored.
+
+Edits are queued along with the content of the note before the edit. When
+a note is saved several times in quick succession, its queued edits are
+coalesced in memory so that a single diff is calculated from the content
+before the first edit to the content after the last one.
+'''
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, UTC
+from typing import Dict, Optional, Tuple, TypedDict
+
+from shorthand.edit_history import _store_history_for_note_edit
+from shorthand.types import DirectoryPath, ExecutablePath, NotePath, \
+                            RawNoteContent
+
+
+# How long to wait for more edits to a note before storing its history
+DEFAULT_COALESCE_SECONDS = 2.0
+# The most notes which can have edits waiting to be recorded at once.
+# Saving another note blocks until there is space in the queue
+DEFAULT_HISTORY_QUEUE_SIZE = 100
+
+
+log = logging.getLogger(__name__)
+
+
+class PendingEdit(TypedDict):
+    old_content: RawNoteContent
+    new_content: RawNoteContent
+    # The time of the latest coalesced edit, which the diff is stored with
+    timestamp: datetime
+    # When the first coalesced edit was queued, from `time.monotonic`
+    queued_at: float
+
+
+class HistoryWorker:
+    '''Store the history for note edits in a background thread
+    '''
+
+    def __init__(self, notes_directory: DirectoryPath,
+                 find_path: ExecutablePath = 'find',
+                 patch_path: Optional[ExecutablePath] = None,
+                 max_queue_size: int = DEFAULT_HISTORY_QUEUE_SIZE,
+                 coalesce_seconds: float = DEFAULT_COALESCE_SECONDS):
+        self.notes_directory = notes_directory
+        self.find_path = find_path
+        self.patch_path = patch_path
+        self.max_queue_size = max_queue_size
+        self.coalesce_seconds = coalesce_seconds
+
+        # Dicts keep insertion order, so the note which has been waiting
+        # the longest is always first
+        self.pending: Dict[NotePath, PendingEdit] = {}
+        self.in_progress = 0
+        self.flush_requests = 0
+        self.stopping = False
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+
+    def record_edit(self, note_path: NotePath, old_content: RawNoteContent,
+                    new_content: RawNoteContent) -> None:
+        '''Queue an edit to a note, given its content before and after the
+           edit. If there is already an edit queued for the note, then the
+           two are combined
+        '''
+        timestamp = datetime.now(UTC)
+        with self.condition:
+            pending_edit = self.pending.get(note_path)
+            if pending_edit:
+                pending_edit['new_content'] = new_content
+                pending_edit['timestamp'] = timestamp
+                return
+
+            while len(self.pending) >= self.max_queue_size and \
+                    self.thread is not None:
+                self.condition.wait()
+            self.pending[note_path] = {
+                'old_content': old_content,
+                'new_content': new_content,
+                'timestamp': timestamp,
+                'queued_at': time.monotonic()
+            }
+            self.condition.notify_all()
+            is_stopped = self.stopping and self.thread is None
+
+        # Edits which arrive after the worker was stopped are recorded
+        # right away, since nothing else will record them
+        if is_stopped:
+            self.process_pending(wait=False)
+
+    def queue_depth(self) -> int:
+        '''Get the number of notes with edits which haven't been recorded
+        '''
+        with self.condition:
+            return len(self.pending) + self.in_progress
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        '''Record all queued edits immediately and wait for them to be
+           stored. Returns whether the queue was emptied before the timeout
+        '''
+        if self.thread is None:
+            self.process_pending(wait=False)
+            return True
+
+        with self.condition:
+            self.flush_requests += 1
+            self.condition.notify_all()
+            try:
+                return self.condition.wait_for(
+                    lambda: not self.pending and not self.in_progress,
+                    timeout=timeout)
+            finally:
+                self.flush_requests -= 1
+
+    def store_edit(self, note_path: NotePath, edit: PendingEdit) -> None:
+        try:
+            _store_history_for_note_edit(
+                notes_directory=self.notes_directory,
+                note_path=note_path,
+                new_content=edit['new_content'],
+                find_path=self.find_path,
+                patch_path=self.patch_path,
+                old_content=edit['old_content'],
+                timestamp=edit['timestamp'])
+        except Exception:
+            log.exception(f'Error while recording history for {note_path}')
+
+    def next_ready_edit(self, wait: bool = True
+                        ) -> Optional[Tuple[NotePath, PendingEdit]]:
+        '''Get the next queued edit which is ready to be recorded, waiting
+           for one if `wait` is set. Must be called with the condition held
+        '''
+        while True:
+            if self.pending:
+                note_path, edit = next(iter(self.pending.items()))
+                ready_at = edit['queued_at'] + self.coalesce_seconds
+                if not wait or self.flush_requests or self.stopping or \
+                        time.monotonic() >= ready_at:
+                    del self.pending[note_path]
+                    return note_path, edit
+                self.condition.wait(timeout=ready_at - time.monotonic())
+            elif not wait or self.stopping:
+                return None
+            else:
+                self.condition.wait()
+
+    def process_pending(self, wait: bool = True) -> None:
+        '''Record queued edits until the queue is empty, or until the
+           worker is stopped if `wait` is set
+        '''
+        while True:
+            with self.condition:
+                next_edit = self.next_ready_edit(wait=wait)
+                if next_edit is None:
+                    return
+                self.in_progress += 1
+                # Wake up any callers waiting for space in the queue
+                self.condition.notify_all()
+
+            note_path, edit = next_edit
+            try:
+                self.store_edit(note_path, edit)
+            finally:
+                with self.condition:
+                    self.in_progress -= 1
+                    self.condition.notify_all()
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.stopping = False
+        self.thread = threading.Thread(target=self.process_pending,
+                                       daemon=True,
+                                       name='shorthand-history')
+        self.thread.start()
+        # Make sure no queued edits are lost when the process exits
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        '''Stop the worker once every queued edit has been recorded
+        '''
+        if self.thread is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.thread = None
+        atexit.unregister(self.stop)
+        # Record any edits which were queued as the thread was finishing
+        self.process_pending(wait=False)
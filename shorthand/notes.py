@@ -1,6 +1,5 @@
 import re
 import os
-from subprocess import Popen, PIPE
 import logging
 from typing import Optional, TypedDict, cast, Union
 
@@ -9,7 +8,8 @@ from shorthand.utils.paths import get_full_path, get_relative_path, \
                                   _is_note_path
 from shorthand.utils.patterns import INTERNAL_LINK_PATTERN, ALL_LINK_PATTERN
 from shorthand.utils.filesystem import _delete_file
-from shorthand.types import DirectoryPath, ExecutablePath, ExternalURL, NotePath, RawNoteContent, RelativeNotePath
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, scan_notes
+from shorthand.types import DirectoryPath, ExternalURL, NotePath, RawNoteContent, RelativeNotePath
 
 
 link_regex = re.compile(ALL_LINK_PATTERN)
@@ -82,7 +82,7 @@ def _append_to_note(notes_directory: DirectoryPath, note_path: NotePath,
 
 def _validate_internal_links(notes_directory: DirectoryPath,
                              source: Optional[NotePath]=None,
-                             grep_path: ExecutablePath='grep'
+                             scan_workers: int=DEFAULT_SCAN_WORKERS
                              ) -> list[Link]:
     '''Validate that all of the internal links within notes point
        to files that actually exist within the notes directory (not
@@ -95,7 +95,7 @@ def _validate_internal_links(notes_directory: DirectoryPath,
                                     source=source, target=None, note=None,
                                     include_external=False,
                                     include_invalid=True,
-                                    grep_path=grep_path)
+                                    scan_workers=scan_workers)
     invalid_links = [link for link in all_internal_links if not link['valid']]
 
     return invalid_links
@@ -109,18 +109,18 @@ def deduplicate_links(links: list[Link]) -> list[Link]:
 
 
 def _get_backlinks(notes_directory: DirectoryPath, note_path: NotePath,
-                   grep_path: ExecutablePath='grep') -> list[Link]:
+                   scan_workers: int=DEFAULT_SCAN_WORKERS) -> list[Link]:
     '''Get backlinks from various notes to the specified note
     '''
     return _get_links(notes_directory=notes_directory, target=note_path,
                       include_external=False, include_invalid=False,
-                      grep_path=grep_path)
+                      scan_workers=scan_workers)
 
 
 def _get_links(notes_directory: DirectoryPath, source: Optional[NotePath]=None,
                target: Optional[NotePath]=None, note: Optional[NotePath]=None,
                include_external: bool=False, include_invalid: bool=False,
-               grep_path: ExecutablePath='grep') -> list[Link]:
+               scan_workers: int=DEFAULT_SCAN_WORKERS) -> list[Link]:
     '''Get all links between notes within the notes directory
 
        notes_directory: The directory to do the search within
@@ -133,7 +133,7 @@ def _get_links(notes_directory: DirectoryPath, source: Optional[NotePath]=None,
        include_external: Boolean for whether or not external links are included
        include_invalid: Boolean for whether or not links with invlaid targets
                         are included
-       grep_path: Path to the grep CLI utility to use for the search
+       scan_workers: The number of threads to scan notes with
 
        Returns:
             [
@@ -166,12 +166,12 @@ def _get_links(notes_directory: DirectoryPath, source: Optional[NotePath]=None,
                                   target=None, note=None,
                                   include_external=include_external,
                                   include_invalid=include_invalid,
-                                  grep_path=grep_path)
+                                  scan_workers=scan_workers)
         target_links = _get_links(notes_directory=notes_directory, source=None,
                                   target=note, note=None,
                                   include_external=include_external,
                                   include_invalid=include_invalid,
-                                  grep_path=grep_path)
+                                  scan_workers=scan_workers)
 
         all_links = source_links + target_links
         all_links = deduplicate_links(all_links)
@@ -184,7 +184,7 @@ def _get_links(notes_directory: DirectoryPath, source: Optional[NotePath]=None,
     if target:
         # Only include the target filename to catch both
         # relative and absolute references
-        target_filename = os.path.basename(target)
+        target_filename = re.escape(os.path.basename(target))
         LINK_PATTERN += rf'(.*?{target_filename})(#.+?)?'
     elif not include_external:
         # Only catch internal links which don't have http[s]://
@@ -194,52 +194,17 @@ def _get_links(notes_directory: DirectoryPath, source: Optional[NotePath]=None,
         LINK_PATTERN += r'(.*?)'
     LINK_PATTERN += r'(\))'
 
+    # Only scan the source note if one is specified
+    source_paths = None
     if source:
-        search_path = get_full_path(notes_directory, source)
-    else:
-        search_path = notes_directory
-
-    # Use Grep to find all links
-    grep_command = '{grep_path} -Prn "{pattern}" ' \
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=LINK_PATTERN,
-                        dir=search_path)
-    log.debug(f'Running grep command {grep_command} to get links')
-
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    for line in output_lines:
-
-        log.debug(f'Got line "{line}"')
-
-        if not line.strip():
-            continue
-
-        # Grep returns results in different forms depending on if you specify
-        # a path to a file or directory
-        #     dir:  <file-path>:<line-number>:<line>
-        #     file: <line-number>:<line>
-        if source:
-            split_line = line.split(':', 1)
-
-            file_path = source
-            line_number = split_line[0].strip()
-            match_content = split_line[1].strip()
-
-        else:
-            split_line = line.split(':', 2)
+        source_paths = [get_relative_path(notes_directory, source)]
 
-            file_path = split_line[0].strip()
-            line_number = split_line[1].strip()
-            match_content = split_line[2].strip()
+    for match in scan_notes(notes_directory, LINK_PATTERN,
+                            note_paths=source_paths, workers=scan_workers):
 
-        note_path = get_relative_path(notes_directory, file_path)
+        note_path = match.file_path
+        line_number = str(match.line_number)
+        match_content = match.line.strip()
 
         matches = link_regex.findall(match_content)
         for match in matches:
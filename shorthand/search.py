@@ -3,9 +3,9 @@ import pathlib
 import shlex
 import logging
 from subprocess import Popen, PIPE
-from typing import Union, TypedDict
+from typing import NotRequired, Union, TypedDict
 
-from shorthand.utils.paths import get_relative_path, _is_note_path
+from shorthand.utils.paths import _is_note_path, _list_note_paths
 from shorthand.types import DirectoryPath, NotePath, ExecutablePath
 
 log = logging.getLogger(__name__)
@@ -14,6 +14,7 @@ log = logging.getLogger(__name__)
 class AggregatedFullTextSearchMatch(TypedDict):
     line_number: str
     match_content: str
+    highlights: NotRequired[list[tuple[int, int]]]
 
 class AggregatedFullTextSearchResult(TypedDict):
   file_path: NotePath
@@ -23,6 +24,7 @@ class FullTextSearchResult(TypedDict):
   file_path: NotePath
   line_number: str
   match_content: str
+  highlights: NotRequired[list[tuple[int, int]]]
 
 
 def _record_file_view(notes_directory: DirectoryPath, note_path: NotePath,
@@ -80,9 +82,7 @@ def _record_file_view(notes_directory: DirectoryPath, note_path: NotePath,
 
 def _search_filenames(notes_directory: DirectoryPath, prefer_recent_files=True,
                       query_string: Union[str, None] = None,
-                      case_sensitive=False,
-                      grep_path: ExecutablePath = 'grep',
-                      find_path: ExecutablePath = 'find'
+                      case_sensitive=False
                       ) -> list[NotePath]:
     '''Search for a note file in the notes directory
 
@@ -100,19 +100,7 @@ def _search_filenames(notes_directory: DirectoryPath, prefer_recent_files=True,
         log.debug('No Query String Provided for finding files')
         return []
 
-    find_command = '{find_path} {notes_dir} -not -path \'*/\\.*\' ' \
-                   '-type f -name "*.note"'.format(
-                        find_path=find_path,
-                        notes_dir=notes_directory)
-
-    log.debug(f'Running command {find_command} to find all notes files')
-    proc = Popen(find_command, stdout=PIPE, stderr=PIPE, shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    find_results = [get_relative_path(notes_directory, line.strip())
-                    for line in output_lines
-                    if line.strip()]
+    find_results = _list_note_paths(notes_directory)
 
     ordered_notes = find_results
 
@@ -164,6 +152,29 @@ def _search_filenames(notes_directory: DirectoryPath, prefer_recent_files=True,
     return search_results
 
 
+def aggregate_search_results(search_results: list[FullTextSearchResult]
+                             ) -> list[AggregatedFullTextSearchResult]:
+    '''Aggregate full-text search results by file, keeping the order
+       in which each file first appears in the results
+    '''
+    log.debug('Aggregating search results by file')
+    aggregated_results: dict[NotePath, AggregatedFullTextSearchResult] = {}
+    for result in search_results:
+        if result['file_path'] not in aggregated_results:
+            aggregated_results[result['file_path']] = {
+                'file_path': result['file_path'],
+                'matches': []
+            }
+        match: AggregatedFullTextSearchMatch = {
+            'line_number': result['line_number'],
+            'match_content': result['match_content']
+        }
+        if 'highlights' in result:
+            match['highlights'] = result['highlights']
+        aggregated_results[result['file_path']]['matches'].append(match)
+    return list(aggregated_results.values())
+
+
 def _search_full_text(notes_directory: DirectoryPath, query_string: str,
                       case_sensitive=False, aggregate_by_file=False,
                       grep_path: ExecutablePath = 'grep'
@@ -252,29 +263,7 @@ def _search_full_text(notes_directory: DirectoryPath, query_string: str,
         search_results.append(processed_line)
 
     if aggregate_by_file:
-
-        log.debug('Aggregating search results by file')
-        aggregated_results = []
-
-        # Aggregate all matches by file
-        for result in search_results:
-            if result['file_path'] not in [f['file_path']
-                                           for f in aggregated_results]:
-                aggregated_results.append({
-                    'file_path': result['file_path'],
-                    'matches': [{
-                        'line_number': result['line_number'],
-                        'match_content': result['match_content']
-                    }]
-                })
-            else:
-                for entry in aggregated_results:
-                    if entry['file_path'] == result['file_path']:
-                        entry['matches'].append({
-                            'line_number': result['line_number'],
-                            'match_content': result['match_content']
-                        })
-                        break
+        aggregated_results = aggregate_search_results(search_results)
 
         # Sort files by number of matches
         aggregated_results.sort(key=lambda result: len(result['matches']),
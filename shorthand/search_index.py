@@ -0,0 +1,656 @@
+'''
+A persistent inverted index used to answer full-text searches without
+scanning every note.
+
+The index lives in `.shorthand/search/` within the notes directory:
+
+  - `files.json` maps every indexed note to a numeric file ID, along with
+    the modification time and size of the note when it was indexed, and
+    the number of tokens it contains. It also holds an ID for the build of
+    the index, and a generation number which is incremented every time
+    the index is updated.
+  - `notes/<file ID>.json` maps each term within a note to the line
+    number and position within the line of every occurrence of it, so
+    that updating the index for a note only rewrites that note's file.
+
+The index is built in full the first time it is searched. After that, it
+is kept up to date by syncing the paths which the server or the notes
+watcher report as changed, so searches never have to check every note.
+Updates are serialized by a lock file, so that several processes serving
+the same notes directory don't overwrite each other's changes.
+
+The postings of every term and the vocabulary of terms are kept in memory
+between searches. When the generation of the index changes, only the notes
+whose entries in the file list changed are loaded again.
+
+Searches keep the semantics of the grep-based search: every query
+component (a single word or a quoted phrase) must appear within a line
+for that line to match, and components may match part of a word.
+Query components are always matched as literal text, rather than as
+regular expressions.
+'''
+import os
+import re
+import json
+import math
+import shlex
+import bisect
+import shutil
+import logging
+import threading
+import uuid
+from typing import Dict, Iterable, List, Optional, Set, Tuple, \
+                   TypedDict, Union
+
+from shorthand.search import AggregatedFullTextSearchResult, \
+                             FullTextSearchResult, aggregate_search_results
+from shorthand.types import DirectoryPath, FilePath, InternalAbsolutePath, \
+                           NotePath, RawNoteContent
+from shorthand.utils.filesystem import atomic_write, file_lock
+from shorthand.utils.paths import _get_changed_note_paths, \
+                                  _list_note_paths, get_full_path, \
+                                  get_relative_path
+
+
+SEARCH_INDEX_DIR = '.shorthand/search'
+SEARCH_INDEX_VERSION = 2
+# The number of expanded query terms remembered between searches
+MAX_CACHED_EXPANSIONS = 4096
+
+# BM25 tuning parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+token_regex = re.compile(r'\w+')
+
+
+log = logging.getLogger(__name__)
+
+
+type FileID = str
+type Term = str
+# The occurrences of a term within a note are stored as a flat list of
+# [line_number, position, line_number, position, ...], which is much
+# quicker to load than a separate list for every occurrence
+type Occurrences = List[int]
+type NotePostings = Dict[Term, Occurrences]
+type Postings = Dict[Term, Dict[FileID, Occurrences]]
+
+class IndexedFile(TypedDict):
+    id: FileID
+    mtime_ns: int
+    size: int
+    length: int
+
+class SearchIndexFiles(TypedDict):
+    version: int
+    # A unique ID for every time the index is built from scratch
+    build_id: str
+    generation: int
+    next_id: int
+    files: Dict[NotePath, IndexedFile]
+
+
+# The file list of the index for each notes directory, along with its
+# modification time when it was loaded
+_loaded_files: Dict[DirectoryPath, Tuple[int, SearchIndexFiles]] = {}
+
+
+def tokenize_line(line: str) -> List[Term]:
+    '''Split a single line into the lower-cased terms which are indexed
+    '''
+    return token_regex.findall(line.lower())
+
+
+def _get_index_file_path(notes_directory: DirectoryPath,
+                         name: str) -> FilePath:
+    return f'{notes_directory}/{SEARCH_INDEX_DIR}/{name}'
+
+
+def _get_note_postings_path(notes_directory: DirectoryPath,
+                            file_id: FileID) -> FilePath:
+    return _get_index_file_path(notes_directory, f'notes/{file_id}.json')
+
+
+def _write_index_file(path: FilePath, data: dict) -> None:
+    '''Atomically replace a JSON file within the index
+    '''
+    parent_dir = os.path.dirname(path)
+    if not os.path.exists(parent_dir):
+        os.makedirs(parent_dir)
+
+    # Encoding the whole file at once is much faster than `json.dump`,
+    # which can't use the C encoder
+    with atomic_write(path) as f:
+        f.write(json.dumps(data))
+
+
+def _load_index_files(notes_directory: DirectoryPath) -> SearchIndexFiles:
+    '''Load the file list of the index, re-using the in-memory copy
+       if the file has not changed since it was last loaded
+    '''
+    path = _get_index_file_path(notes_directory, 'files.json')
+    empty_index: SearchIndexFiles = {'version': SEARCH_INDEX_VERSION,
+                                     'build_id': uuid.uuid4().hex,
+                                     'generation': 0, 'next_id': 0,
+                                     'files': {}}
+    try:
+        file_mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return empty_index
+
+    cached = _loaded_files.get(notes_directory)
+    if cached and cached[0] == file_mtime:
+        return cached[1]
+
+    try:
+        with open(path, 'r') as f:
+            index_files = json.load(f)
+    except json.JSONDecodeError:
+        log.error(f'Search index file {path} is corrupted, rebuilding it')
+        return empty_index
+    if index_files.get('version') != SEARCH_INDEX_VERSION:
+        log.info('Search index has an outdated format, rebuilding')
+        return empty_index
+
+    _loaded_files[notes_directory] = (file_mtime, index_files)
+    return index_files
+
+
+def _load_note_postings(notes_directory: DirectoryPath,
+                        file_id: FileID) -> NotePostings:
+    path = _get_note_postings_path(notes_directory, file_id)
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # The note was removed from the index after the file list was read
+        return {}
+    except json.JSONDecodeError:
+        log.error(f'Search index file {path} is corrupted, ignoring it')
+        return {}
+
+
+def index_note_content(note_content: RawNoteContent
+                       ) -> Tuple[NotePostings, int]:
+    '''Get the occurrences of every term within a note, and the
+       total number of tokens the note contains
+    '''
+    occurrences: NotePostings = {}
+    length = 0
+    for idx, line in enumerate(note_content.split('\n')):
+        for position, term in enumerate(tokenize_line(line)):
+            occurrences.setdefault(term, []).extend((idx + 1, position))
+            length += 1
+    return occurrences, length
+
+
+def _update_search_index(notes_directory: DirectoryPath,
+                         paths: Optional[List[NotePath]] = None
+                         ) -> SearchIndexFiles:
+    '''Re-index notes which changed since they were last indexed, and
+       remove notes which no longer exist. Every note is checked unless
+       a list of note or directory paths to check is specified
+    '''
+    index_dir = f'{notes_directory}/{SEARCH_INDEX_DIR}'
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+
+    with file_lock(_get_index_file_path(notes_directory, 'lock')):
+        previous_files = _load_index_files(notes_directory)
+        is_rebuild = not previous_files['generation']
+        if is_rebuild:
+            if paths is not None:
+                # The index is built in full the first time it is searched
+                return previous_files
+            # File IDs from an earlier index can't be trusted, and
+            # earlier versions of the index kept postings in shards
+            for name in ['notes', 'postings']:
+                shutil.rmtree(_get_index_file_path(notes_directory, name),
+                              ignore_errors=True)
+
+        # Copy the file list so the cached copy of the file on disk
+        # is never changed in place
+        index_files = dict(previous_files)
+        indexed_files = dict(index_files['files'])
+        index_files['files'] = indexed_files
+        removed_file_ids = []
+
+        if paths is None:
+            checked_paths = set(_list_note_paths(notes_directory)) | \
+                set(indexed_files.keys())
+        else:
+            checked_paths = _get_changed_note_paths(
+                notes_directory, paths, indexed_files.keys())
+
+        for note_path in sorted(checked_paths):
+            indexed_file = indexed_files.get(note_path)
+            full_path = get_full_path(notes_directory, note_path)
+            try:
+                stat_result = os.stat(full_path)
+                if indexed_file and \
+                        indexed_file['mtime_ns'] == stat_result.st_mtime_ns \
+                        and indexed_file['size'] == stat_result.st_size:
+                    continue
+                with open(full_path, 'r') as f:
+                    note_content = f.read()
+            except FileNotFoundError:
+                if indexed_file:
+                    log.debug(f'Removing note {note_path} from the search '
+                              f'index')
+                    removed_file_ids.append(
+                        indexed_files.pop(note_path)['id'])
+                continue
+
+            log.debug(f'Updating search index for note {note_path}')
+            if indexed_file:
+                file_id = indexed_file['id']
+            else:
+                file_id = str(index_files['next_id'])
+                index_files['next_id'] += 1
+
+            occurrences, length = index_note_content(note_content)
+            _write_index_file(
+                _get_note_postings_path(notes_directory, file_id),
+                occurrences)
+            indexed_files[note_path] = {
+                'id': file_id,
+                'mtime_ns': stat_result.st_mtime_ns,
+                'size': stat_result.st_size,
+                'length': length
+            }
+
+        if indexed_files == previous_files['files'] and not is_rebuild:
+            return previous_files
+
+        # The file list is written after the postings of the notes in it,
+        # so that an interrupted update is picked up again by the next one
+        index_files['generation'] = previous_files['generation'] + 1
+        _write_index_file(_get_index_file_path(notes_directory, 'files.json'),
+                          index_files)
+        _loaded_files[notes_directory] = (
+            os.stat(_get_index_file_path(notes_directory,
+                                         'files.json')).st_mtime_ns,
+            index_files)
+        for file_id in removed_file_ids:
+            try:
+                os.remove(_get_note_postings_path(notes_directory, file_id))
+            except FileNotFoundError:
+                pass
+
+    return index_files
+
+
+def _refresh_search_index(notes_directory: DirectoryPath) -> SearchIndexFiles:
+    '''Bring the search index up to date with the notes directory,
+       re-indexing only notes which changed since the last refresh
+    '''
+    return _update_search_index(notes_directory)
+
+
+def _sync_search_index_path(notes_directory: DirectoryPath,
+                            path: InternalAbsolutePath) -> None:
+    '''Update the search index after a note or directory was created,
+       modified, moved, or deleted. The path can point to a note, to a
+       directory of notes, or to a path which no longer exists
+    '''
+    _update_search_index(notes_directory,
+                         [get_relative_path(notes_directory, path)])
+
+
+def get_trigrams(term: Term) -> Set[str]:
+    return {term[idx:idx + 3] for idx in range(len(term) - 2)}
+
+
+def get_prefixed_terms(sorted_terms: List[Term], prefix: str) -> List[Term]:
+    '''Get the terms in a sorted list which start with a prefix
+    '''
+    start = bisect.bisect_left(sorted_terms, prefix)
+    # Terms only contain word characters, which all sort before this one
+    end = bisect.bisect_left(sorted_terms, prefix + '\U0010ffff', lo=start)
+    return sorted_terms[start:end]
+
+
+class TermVocabulary:
+    '''The set of indexed terms, along with sorted lists of the terms and
+       a map of the trigrams within them, so that query terms can be
+       expanded to the indexed terms they match without checking them all
+    '''
+
+    def __init__(self, terms: Iterable[Term]):
+        self.terms: Set[Term] = set(terms)
+        self.sorted_terms = sorted(self.terms)
+        # Every term spelled backwards, to find terms ending with a suffix
+        self.reversed_terms = sorted(term[::-1] for term in self.terms)
+        self.trigrams: Dict[str, List[Term]] = {}
+        for term in self.terms:
+            for trigram in get_trigrams(term):
+                self.trigrams.setdefault(trigram, []).append(term)
+        # Query terms which were already expanded, keyed by the
+        # query term and the expansion mode
+        self.expansions: Dict[Tuple[Term, str], List[Term]] = {}
+
+    def add(self, term: Term) -> None:
+        if term in self.terms:
+            return
+        self.terms.add(term)
+        bisect.insort(self.sorted_terms, term)
+        bisect.insort(self.reversed_terms, term[::-1])
+        for trigram in get_trigrams(term):
+            self.trigrams.setdefault(trigram, []).append(term)
+        self.expansions.clear()
+
+    def remove(self, term: Term) -> None:
+        if term not in self.terms:
+            return
+        self.terms.remove(term)
+        del self.sorted_terms[bisect.bisect_left(self.sorted_terms, term)]
+        del self.reversed_terms[bisect.bisect_left(self.reversed_terms,
+                                                   term[::-1])]
+        for trigram in get_trigrams(term):
+            trigram_terms = self.trigrams[trigram]
+            trigram_terms.remove(term)
+            if not trigram_terms:
+                del self.trigrams[trigram]
+        self.expansions.clear()
+
+    def expand(self, query_term: Term, mode: str = 'contains') -> List[Term]:
+        '''Get all indexed terms which can match part of a query term.
+           Query terms match any part of an indexed term, unless they
+           are at the edge of a phrase, where they must match the end
+           (`suffix`) or start (`prefix`) of the indexed term instead
+        '''
+        expansion = self.expansions.get((query_term, mode))
+        if expansion is not None:
+            return expansion
+
+        if mode == 'exact':
+            expansion = [query_term] if query_term in self.terms else []
+        elif mode == 'suffix':
+            expansion = [term[::-1] for term in get_prefixed_terms(
+                self.reversed_terms, query_term[::-1])]
+        elif mode == 'prefix':
+            expansion = get_prefixed_terms(self.sorted_terms, query_term)
+        else:
+            query_trigrams = get_trigrams(query_term)
+            if query_trigrams:
+                # Only the terms sharing the rarest trigram need checking
+                candidate_terms = min(
+                    (self.trigrams.get(trigram, [])
+                     for trigram in query_trigrams), key=len)
+            else:
+                candidate_terms = self.sorted_terms
+            expansion = [term for term in candidate_terms
+                         if query_term in term]
+
+        if len(self.expansions) >= MAX_CACHED_EXPANSIONS:
+            self.expansions.clear()
+        self.expansions[(query_term, mode)] = expansion
+        return expansion
+
+
+class SearchIndexSnapshot:
+    '''The postings and vocabulary of the search index for a notes
+       directory, as of one generation of the index
+    '''
+
+    def __init__(self, build_id: str):
+        self.build_id = build_id
+        self.generation = 0
+        self.files: Dict[NotePath, IndexedFile] = {}
+        self.postings: Postings = {}
+        self.vocabulary = TermVocabulary([])
+        # The terms within each file, to remove them when the file changes
+        self.file_terms: Dict[FileID, List[Term]] = {}
+        self.file_paths: Dict[FileID, NotePath] = {}
+        self.file_lengths: Dict[FileID, int] = {}
+
+    def update(self, notes_directory: DirectoryPath,
+               index_files: SearchIndexFiles) -> None:
+        '''Bring the snapshot up to date with a newer generation of the
+           index, loading the postings of only the notes which changed
+        '''
+        old_files = self.files
+        new_files = index_files['files']
+        for note_path, indexed_file in old_files.items():
+            if new_files.get(note_path) != indexed_file:
+                self.remove_file(indexed_file['id'])
+
+        for note_path, indexed_file in new_files.items():
+            if old_files.get(note_path) == indexed_file:
+                continue
+            file_id = indexed_file['id']
+            note_postings = _load_note_postings(notes_directory, file_id)
+            for term, occurrences in note_postings.items():
+                term_postings = self.postings.get(term)
+                if term_postings is None:
+                    term_postings = self.postings[term] = {}
+                    self.vocabulary.add(term)
+                term_postings[file_id] = occurrences
+            self.file_terms[file_id] = list(note_postings.keys())
+
+        # These are replaced rather than changed in place, so searches
+        # can keep using them after releasing the snapshot lock
+        self.files = new_files
+        self.generation = index_files['generation']
+        self.file_paths = {indexed_file['id']: note_path
+                           for note_path, indexed_file in new_files.items()}
+        self.file_lengths = {indexed_file['id']: indexed_file['length']
+                             for indexed_file in new_files.values()}
+
+    def remove_file(self, file_id: FileID) -> None:
+        for term in self.file_terms.pop(file_id, []):
+            term_postings = self.postings[term]
+            term_postings.pop(file_id, None)
+            if not term_postings:
+                del self.postings[term]
+                self.vocabulary.remove(term)
+
+
+# The in-memory copy of the index for each notes directory. Searches
+# must hold the lock while using or updating any of them
+_loaded_snapshots: Dict[DirectoryPath, SearchIndexSnapshot] = {}
+_snapshot_lock = threading.Lock()
+
+
+def _get_snapshot(notes_directory: DirectoryPath) -> SearchIndexSnapshot:
+    '''Get the in-memory copy of the search index, updating it if the
+       index changed since it was last used. Must be called with the
+       snapshot lock held
+    '''
+    index_files = _load_index_files(notes_directory)
+    snapshot = _loaded_snapshots.get(notes_directory)
+    if snapshot is None or snapshot.build_id != index_files['build_id']:
+        # File IDs are only meaningful within a single build of the index
+        snapshot = SearchIndexSnapshot(index_files['build_id'])
+        _loaded_snapshots[notes_directory] = snapshot
+    if snapshot.generation != index_files['generation']:
+        log.debug(f'Loading generation {index_files["generation"]} '
+                  f'of the search index')
+        snapshot.update(notes_directory, index_files)
+    return snapshot
+
+
+def _get_candidate_lines(query_component: str, postings: Postings,
+                         vocabulary: TermVocabulary
+                         ) -> Optional[Dict[FileID, Set[int]]]:
+    '''Get the lines of each file which may contain a query component,
+       based on the postings alone. Returns None if the component has
+       no indexable terms, meaning that any line could match
+    '''
+    query_terms = tokenize_line(query_component)
+    if not query_terms:
+        return None
+
+    if len(query_terms) == 1:
+        candidates: Dict[FileID, Set[int]] = {}
+        for term in vocabulary.expand(query_terms[0]):
+            for file_id, occurrences in postings[term].items():
+                candidates.setdefault(file_id, set()).update(
+                    occurrences[0::2])
+        return candidates
+
+    # For phrases, every term must appear at consecutive
+    # positions within the same line
+    starts: Optional[Dict[FileID, Set[Tuple[int, int]]]] = None
+    for offset, query_term in enumerate(query_terms):
+        if offset == 0:
+            mode = 'suffix'
+        elif offset == len(query_terms) - 1:
+            mode = 'prefix'
+        else:
+            mode = 'exact'
+
+        term_starts: Dict[FileID, Set[Tuple[int, int]]] = {}
+        for term in vocabulary.expand(query_term, mode):
+            for file_id, occurrences in postings[term].items():
+                if starts is not None and file_id not in starts:
+                    continue
+                term_starts.setdefault(file_id, set()).update(
+                    (line_number, position - offset)
+                    for line_number, position
+                    in zip(occurrences[0::2], occurrences[1::2]))
+
+        if starts is None:
+            starts = term_starts
+        else:
+            starts = {file_id: starts[file_id] & file_starts
+                      for file_id, file_starts in term_starts.items()
+                      if starts[file_id] & file_starts}
+        if not starts:
+            return {}
+
+    return {file_id: {line_number for line_number, _ in file_starts}
+            for file_id, file_starts in starts.items()}
+
+
+def _score_files(query_components: List[str], file_ids: Set[FileID],
+                 file_lengths: Dict[FileID, int], postings: Postings,
+                 vocabulary: TermVocabulary) -> Dict[FileID, float]:
+    '''Score files against the query using BM25, treating every
+       indexed term which a query term matches as an occurrence of it
+    '''
+    file_count = len(file_lengths)
+    average_length = sum(file_lengths.values()) / max(file_count, 1)
+
+    scores = {file_id: 0.0 for file_id in file_ids}
+    for query_component in query_components:
+        for query_term in tokenize_line(query_component):
+            term_frequencies: Dict[FileID, int] = {}
+            for term in vocabulary.expand(query_term):
+                for file_id, occurrences in postings[term].items():
+                    term_frequencies[file_id] = \
+                        term_frequencies.get(file_id, 0) + \
+                        len(occurrences) // 2
+
+            document_frequency = len(term_frequencies)
+            idf = math.log(1 + (file_count - document_frequency + 0.5) /
+                           (document_frequency + 0.5))
+            for file_id in file_ids:
+                frequency = term_frequencies.get(file_id, 0)
+                if not frequency:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * \
+                    file_lengths[file_id] / max(average_length, 1)
+                scores[file_id] += idf * frequency * (BM25_K1 + 1) / \
+                    (frequency + BM25_K1 * length_norm)
+
+    return scores
+
+
+def _search_full_text_indexed(notes_directory: DirectoryPath,
+                              query_string: str, case_sensitive=False,
+                              aggregate_by_file=False
+                              ) -> Union[list[FullTextSearchResult],
+                                         list[AggregatedFullTextSearchResult]]:
+    '''Perform a full-text search using the search index. Takes the same
+       arguments and returns the same results as `_search_full_text`,
+       except that when results are aggregated by file, the files are
+       ranked by how relevant they are to the query
+    '''
+    query_components = shlex.split(query_string)
+
+    # Early exit for empty query
+    if not query_components:
+        log.debug('No query string provided for full text search')
+        return []
+
+    if not _load_index_files(notes_directory)['generation']:
+        _refresh_search_index(notes_directory)
+
+    # Narrow down the lines to check using the postings for each component
+    candidates: Optional[Dict[FileID, Set[int]]] = None
+    with _snapshot_lock:
+        snapshot = _get_snapshot(notes_directory)
+        for query_component in query_components:
+            component_candidates = _get_candidate_lines(
+                query_component, snapshot.postings, snapshot.vocabulary)
+            if component_candidates is None:
+                continue
+            if candidates is None:
+                candidates = component_candidates
+            else:
+                candidates = {file_id: candidates[file_id] & line_numbers
+                              for file_id, line_numbers
+                              in component_candidates.items()
+                              if file_id in candidates}
+        file_paths = snapshot.file_paths
+        file_lengths = snapshot.file_lengths
+
+    if candidates is None:
+        # No component could be narrowed down, so check every line
+        candidates = {file_id: set() for file_id in file_paths.keys()}
+        check_all_lines = True
+    else:
+        check_all_lines = False
+
+    if not case_sensitive:
+        query_components = [query_component.lower()
+                            for query_component in query_components]
+
+    # Check candidate lines against the current note content, skipping
+    # anything which changed since the index was last updated
+    search_results: list[FullTextSearchResult] = []
+    for file_id, line_numbers in candidates.items():
+        if not line_numbers and not check_all_lines:
+            continue
+        note_path = file_paths[file_id]
+        try:
+            with open(get_full_path(notes_directory, note_path), 'r') as f:
+                note_lines = f.read().split('\n')
+        except FileNotFoundError:
+            continue
+
+        if check_all_lines:
+            line_numbers = range(1, len(note_lines) + 1)
+        for line_number in sorted(line_numbers):
+            if line_number > len(note_lines):
+                break
+            line_content = note_lines[line_number - 1]
+            compare_content = line_content if case_sensitive \
+                              else line_content.lower()
+            if all(query_component in compare_content
+                   for query_component in query_components):
+                search_results.append({
+                    'file_path': note_path,
+                    'line_number': str(line_number),
+                    'match_content': line_content.strip()
+                })
+
+    if aggregate_by_file:
+        aggregated_results = aggregate_search_results(search_results)
+        path_ids = {note_path: file_id
+                    for file_id, note_path in file_paths.items()}
+        with _snapshot_lock:
+            scores = _score_files(
+                query_components, set(path_ids[result['file_path']]
+                                      for result in aggregated_results),
+                file_lengths, snapshot.postings, snapshot.vocabulary)
+        aggregated_results.sort(
+            key=lambda result: (-scores[path_ids[result['file_path']]],
+                                result['file_path']))
+        return aggregated_results
+
+    search_results.sort(key=lambda result:
+                        f"{result['file_path']}:{result['line_number']}")
+    return search_results
@@ -0,0 +1,299 @@
+'''
+A full-text search backend which stores every line of every note in a
+SQLite FTS5 table, using the trigram tokenizer so that query components
+can match any part of a word, like the grep-based search.
+
+The database lives in a single file within `.shorthand/search/` and uses
+WAL mode, so that multiple server processes can read from it concurrently
+while it is being updated. It is kept in sync incrementally as notes are
+changed through the server, and can be fully reconciled with the notes
+directory on demand.
+'''
+import os
+import re
+import shlex
+import sqlite3
+import logging
+from typing import List, Tuple, Union
+
+from shorthand.search import AggregatedFullTextSearchResult, \
+                             FullTextSearchResult, aggregate_search_results
+from shorthand.types import DirectoryPath, FilePath, InternalAbsolutePath, \
+                            NotePath
+from shorthand.utils.paths import _list_note_paths, get_full_path, \
+                                  get_relative_path
+
+
+SEARCH_DB_PATH = '.shorthand/search/notes.db'
+SEARCH_DB_TIMEOUT = 30
+SEARCH_DB_BUILT_KEY = 'built'
+
+# Characters which must be escaped in LIKE and GLOB patterns
+like_escape_regex = re.compile(r'([\\%_])')
+glob_escape_regex = re.compile(r'([\[\]*?])')
+
+
+log = logging.getLogger(__name__)
+
+
+def is_sqlite_search_supported() -> bool:
+    '''Check whether the available SQLite library has support for
+       FTS5 tables with the trigram tokenizer
+    '''
+    try:
+        connection = sqlite3.connect(':memory:')
+        connection.execute("CREATE VIRTUAL TABLE test "
+                           "USING fts5(content, tokenize='trigram')")
+        connection.close()
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def get_search_db_path(notes_directory: DirectoryPath) -> FilePath:
+    return f'{notes_directory}/{SEARCH_DB_PATH}'
+
+
+def _connect(notes_directory: DirectoryPath) -> sqlite3.Connection:
+    '''Open a connection to the search database, creating it if needed
+    '''
+    db_path = get_search_db_path(notes_directory)
+    db_dir = os.path.dirname(db_path)
+    if not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+
+    connection = sqlite3.connect(db_path, timeout=SEARCH_DB_TIMEOUT)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS notes ('
+                       'path TEXT PRIMARY KEY, mtime_ns INTEGER, '
+                       'size INTEGER)')
+    connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS note_lines "
+                       "USING fts5(path UNINDEXED, line_number UNINDEXED, "
+                       "content, tokenize='trigram')")
+    connection.execute('CREATE TABLE IF NOT EXISTS meta ('
+                       'key TEXT PRIMARY KEY, value TEXT)')
+    return connection
+
+
+def _is_built(connection: sqlite3.Connection) -> bool:
+    '''Check whether a full build of the search database has completed.
+       Until it has, the database only holds the notes which were synced
+       individually and can't be used to answer searches
+    '''
+    return connection.execute(
+        'SELECT 1 FROM meta WHERE key = ?',
+        (SEARCH_DB_BUILT_KEY,)).fetchone() is not None
+
+
+def _index_note(connection: sqlite3.Connection,
+                notes_directory: DirectoryPath, note_path: NotePath) -> None:
+    '''Replace the stored lines of a single note with its current content
+    '''
+    full_path = get_full_path(notes_directory, note_path)
+    stat_result = os.stat(full_path)
+    with open(full_path, 'r') as f:
+        note_lines = f.read().split('\n')
+
+    connection.execute('DELETE FROM note_lines WHERE path = ?', (note_path,))
+    connection.executemany(
+        'INSERT INTO note_lines (path, line_number, content) '
+        'VALUES (?, ?, ?)',
+        [(note_path, idx + 1, line)
+         for idx, line in enumerate(note_lines)
+         if line.strip()])
+    connection.execute(
+        'INSERT OR REPLACE INTO notes (path, mtime_ns, size) '
+        'VALUES (?, ?, ?)',
+        (note_path, stat_result.st_mtime_ns, stat_result.st_size))
+
+
+def _remove_notes(connection: sqlite3.Connection,
+                  path: InternalAbsolutePath) -> None:
+    '''Remove a note, or all notes within a directory, from the database
+    '''
+    prefix_pattern = like_escape_regex.sub(r'\\\1', path.rstrip('/')) + '/%'
+    for table in ['notes', 'note_lines']:
+        connection.execute(
+            f"DELETE FROM {table} WHERE path = ? "
+            f"OR path LIKE ? ESCAPE '\\'",
+            (path, prefix_pattern))
+
+
+def _sync_sqlite_search_path(notes_directory: DirectoryPath,
+                             path: InternalAbsolutePath) -> None:
+    '''Update the search database after a note or directory was created,
+       modified, moved, or deleted. The path can point to a note, to a
+       directory of notes, or to a path which no longer exists.
+       Nothing is done until the database has been fully built, since
+       the first search builds it from the notes directory anyway
+    '''
+    if not os.path.exists(get_search_db_path(notes_directory)):
+        return
+
+    path = get_relative_path(notes_directory, path)
+    full_path = get_full_path(notes_directory, path)
+
+    connection = _connect(notes_directory)
+    try:
+        if not _is_built(connection):
+            return
+        with connection:
+            _remove_notes(connection, path)
+            if os.path.isdir(full_path):
+                for note_path in _list_note_paths(notes_directory, path):
+                    _index_note(connection, notes_directory, note_path)
+            elif os.path.isfile(full_path) and path.endswith('.note'):
+                _index_note(connection, notes_directory, path)
+    finally:
+        connection.close()
+
+
+def _refresh_sqlite_search_index(notes_directory: DirectoryPath) -> None:
+    '''Reconcile the search database with the notes directory, picking up
+       any notes which were changed without going through the server
+    '''
+    connection = _connect(notes_directory)
+    try:
+        indexed_notes = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size
+            in connection.execute('SELECT path, mtime_ns, size FROM notes')}
+
+        current_note_paths = _list_note_paths(notes_directory)
+        with connection:
+            for note_path in current_note_paths:
+                stat_result = os.stat(get_full_path(notes_directory,
+                                                    note_path))
+                if indexed_notes.get(note_path) == \
+                        (stat_result.st_mtime_ns, stat_result.st_size):
+                    continue
+                log.debug(f'Updating search database for note {note_path}')
+                _index_note(connection, notes_directory, note_path)
+
+            for note_path in set(indexed_notes) - set(current_note_paths):
+                log.debug(f'Removing note {note_path} from search database')
+                _remove_notes(connection, note_path)
+
+            connection.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (SEARCH_DB_BUILT_KEY, '1'))
+    finally:
+        connection.close()
+
+
+def get_match_highlights(match_content: str, query_components: List[str],
+                         case_sensitive: bool = False
+                         ) -> List[Tuple[int, int]]:
+    '''Get the start and end offsets of every occurrence of each query
+       component within the matched content, sorted and merged so that
+       no two highlighted ranges overlap
+    '''
+    if not case_sensitive:
+        match_content = match_content.lower()
+        query_components = [query_component.lower()
+                            for query_component in query_components]
+
+    ranges = []
+    for query_component in query_components:
+        start = match_content.find(query_component)
+        while start != -1:
+            ranges.append((start, start + len(query_component)))
+            start = match_content.find(query_component, start + 1)
+
+    merged_ranges: List[Tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged_ranges and start <= merged_ranges[-1][1]:
+            merged_ranges[-1] = (merged_ranges[-1][0],
+                                 max(end, merged_ranges[-1][1]))
+        else:
+            merged_ranges.append((start, end))
+    return merged_ranges
+
+
+def _search_full_text_sqlite(notes_directory: DirectoryPath,
+                             query_string: str, case_sensitive=False,
+                             aggregate_by_file=False,
+                             include_highlights=False
+                             ) -> Union[list[FullTextSearchResult],
+                                        list[AggregatedFullTextSearchResult]]:
+    '''Perform a full-text search using the SQLite search database.
+       Takes the same arguments and returns the same results as
+       `_search_full_text`.
+
+       "include_highlights" adds the offsets of each match within
+           the `match_content` of every result as `highlights`
+    '''
+    query_components = shlex.split(query_string)
+
+    # Early exit for empty query
+    if not query_components:
+        log.debug('No query string provided for full text search')
+        return []
+
+    # LIKE is case-insensitive and GLOB is case-sensitive, and both can be
+    # answered from the trigram index. Components shorter than a trigram
+    # can't use the index, and are only checked once the rows are loaded
+    # (SQLite 3.40 can also crash when these are combined with other
+    # GLOB conditions on a trigram table)
+    conditions = ['1']
+    parameters = []
+    for query_component in query_components:
+        if len(query_component) < 3:
+            continue
+        elif case_sensitive:
+            conditions.append('content GLOB ?')
+            parameters.append(
+                '*' + glob_escape_regex.sub(r'[\1]', query_component) + '*')
+        else:
+            conditions.append("content LIKE ? ESCAPE '\\'")
+            parameters.append(
+                '%' + like_escape_regex.sub(r'\\\1', query_component) + '%')
+
+    connection = _connect(notes_directory)
+    try:
+        if not _is_built(connection):
+            connection.close()
+            log.info('Search database has not been built, building it')
+            _refresh_sqlite_search_index(notes_directory)
+            connection = _connect(notes_directory)
+
+        rows = connection.execute(
+            f'SELECT path, line_number, content FROM note_lines '
+            f'WHERE {" AND ".join(conditions)} '
+            f'ORDER BY path, CAST(line_number AS INTEGER)',
+            parameters).fetchall()
+    finally:
+        connection.close()
+
+    if not case_sensitive:
+        query_components = [query_component.lower()
+                            for query_component in query_components]
+
+    search_results = []
+    for file_path, line_number, content in rows:
+        compare_content = content if case_sensitive else content.lower()
+        if not all(query_component in compare_content
+                   for query_component in query_components):
+            continue
+
+        match_content = content.strip()
+        search_result: FullTextSearchResult = {
+            'file_path': file_path,
+            'line_number': str(line_number),
+            'match_content': match_content
+        }
+        if include_highlights:
+            search_result['highlights'] = get_match_highlights(
+                match_content, query_components, case_sensitive)
+        search_results.append(search_result)
+
+    if aggregate_by_file:
+        aggregated_results = aggregate_search_results(search_results)
+        aggregated_results.sort(key=lambda result: len(result['matches']),
+                                reverse=True)
+        return aggregated_results
+
+    search_results.sort(key=lambda result:
+                        f"{result['file_path']}:{result['line_number']}")
+    return search_results
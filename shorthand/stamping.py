@@ -1,17 +1,23 @@
+import os
 import re
+import json
+import hashlib
 import logging
 from datetime import datetime
-from subprocess import Popen, PIPE
-from typing import TypedDict
-from shorthand.types import DirectoryPath, ExecutablePath, NotePath, \
+from typing import Dict, List, Optional, Tuple, TypedDict
+from shorthand.types import DirectoryPath, NotePath, \
                             RawNoteContent, RawNoteLine
 
-from shorthand.utils.patterns import CATCH_ALL_PATTERN, \
-    VALID_INCOMPLETE_PATTERN, VALID_COMPLETE_PATTERN, \
-    UNFINISHED_UNSTAMPED_PATTERN, FINISHED_START_STAMPED_PATTERN, \
-    FINISHED_UNSTAMPED_PATTERN, TODAY_GREP, TODAY_LINE_PATTERN, \
-    ALL_QUESTIONS, UNSTAMPED_QUESTION, STAMPED_QUESTION, \
-    ANSWER_PATTERN, UNSTAMPED_ANSWER, STAMPED_ANSWER
+from shorthand.utils.patterns import UNFINISHED_UNSTAMPED_PATTERN, \
+    FINISHED_START_STAMPED_PATTERN, FINISHED_UNSTAMPED_PATTERN, \
+    TODAY_LINE_PATTERN, UNSTAMPED_QUESTION, UNSTAMPED_ANSWER
+from shorthand.utils.filesystem import atomic_write
+from shorthand.utils.paths import _list_note_paths, get_full_path, \
+                                  get_relative_path
+
+
+STAMPING_MANIFEST_PATH = '.shorthand/state/stamping_manifest.json'
+STAMPING_MANIFEST_VERSION = 1
 
 
 log = logging.getLogger(__name__)
@@ -40,6 +46,16 @@ class StampingChange(TypedDict):
 
 StampingChanges = dict[NotePath, list[StampingChange]]
 
+class StampedNote(TypedDict):
+    mtime_ns: int
+    size: int
+    hash: str
+
+class StampingManifest(TypedDict):
+    version: int
+    options: List[str]
+    notes: Dict[NotePath, StampedNote]
+
 
 def _stamp_unfinished_todo(line: RawNoteLine) -> RawNoteLine:
     return unfinished_unstamped_regex.sub(
@@ -116,9 +132,143 @@ def _stamp_raw_note(raw_note: RawNoteContent, stamp_todos=True,
     return '\n'.join(processed_lines)
 
 
+def _stamp_note_content(note_content: RawNoteContent, stamp_todos=True,
+                        stamp_today=True, stamp_questions=True,
+                        stamp_answers=True
+                        ) -> Tuple[RawNoteContent, List[StampingChange]]:
+    '''Apply every enabled type of stamp to the content of a note
+       in a single pass
+
+       Returns the stamped content, along with the details of each
+       change that was made
+    '''
+    todo_changes: List[StampingChange] = []
+    today_changes: List[StampingChange] = []
+    question_changes: List[StampingChange] = []
+    answer_changes: List[StampingChange] = []
+
+    def record_change(change_list: List[StampingChange], change_type: str,
+                      line_number: int, before: RawNoteLine,
+                      after: RawNoteLine) -> None:
+        log.info(f'Stamped {change_type} "{before}" -> "{after}"')
+        change_list.append({
+            "type": change_type,
+            "line_number": line_number,
+            "before": before.rstrip(),
+            "after": after.rstrip(),
+        })
+
+    stamped_lines = []
+    for idx, line in enumerate(note_content.split('\n')):
+        line_number = idx + 1
+
+        if stamp_todos:
+            if unfinished_unstamped_regex.match(line):
+                new_line = _stamp_unfinished_todo(line)
+                record_change(todo_changes, 'incomplete_todo', line_number,
+                              line, new_line)
+                line = new_line
+            elif finished_start_stamped_regex.match(line):
+                new_line = _stamp_finished_start_stamped_todo(line)
+                record_change(todo_changes, 'finished_todo', line_number,
+                              line, new_line)
+                line = new_line
+            elif finished_unstamped_regex.match(line):
+                new_line = _stamp_finished_unstamped_todo(line)
+                record_change(todo_changes, 'finished_todo', line_number,
+                              line, new_line)
+                line = new_line
+
+        if stamp_today and today_placeholder_regex.match(line):
+            new_line = _stamp_today_placeholder(line)
+            record_change(today_changes, 'date_placeholder', line_number,
+                          line, new_line)
+            line = new_line
+
+        if stamp_questions and unstamped_question_regex.match(line):
+            new_line = _stamp_question(line)
+            record_change(question_changes, 'question', line_number,
+                          line, new_line)
+            line = new_line
+
+        if stamp_answers and unstamped_answer_regex.match(line):
+            new_line = _stamp_answer(line)
+            record_change(answer_changes, 'answer', line_number,
+                          line, new_line)
+            line = new_line
+
+        stamped_lines.append(line)
+
+    # Changes are grouped by type in the order that each
+    # type of stamp has always been applied in
+    changes = todo_changes + today_changes + question_changes + \
+        answer_changes
+    return '\n'.join(stamped_lines), changes
+
+
+def get_content_hash(note_content: RawNoteContent) -> str:
+    return hashlib.sha1(note_content.encode()).hexdigest()
+
+
+def _get_stamp_options(stamp_todos=True, stamp_today=True,
+                       stamp_questions=True, stamp_answers=True
+                       ) -> List[str]:
+    options = {'todos': stamp_todos, 'today': stamp_today,
+               'questions': stamp_questions, 'answers': stamp_answers}
+    return [option for option, enabled in options.items() if enabled]
+
+
+def get_stamping_manifest_path(notes_directory: DirectoryPath) -> str:
+    return f'{notes_directory}/{STAMPING_MANIFEST_PATH}'
+
+
+def _load_stamping_manifest(notes_directory: DirectoryPath
+                            ) -> StampingManifest:
+    '''Load the manifest of notes which were already checked for
+       stamping, or an empty manifest if none exists or it is unusable
+    '''
+    manifest_path = get_stamping_manifest_path(notes_directory)
+    empty_manifest: StampingManifest = {
+        'version': STAMPING_MANIFEST_VERSION,
+        'options': [],
+        'notes': {}
+    }
+
+    if not os.path.exists(manifest_path):
+        return empty_manifest
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except json.JSONDecodeError:
+        log.error(f'Stamping manifest at {manifest_path} is corrupted, '
+                  f'checking all notes')
+        return empty_manifest
+
+    if not isinstance(manifest, dict) or \
+            manifest.get('version') != STAMPING_MANIFEST_VERSION:
+        return empty_manifest
+
+    return manifest
+
+
+def _write_stamping_manifest(notes_directory: DirectoryPath,
+                             manifest: StampingManifest) -> None:
+    '''Atomically replace the stamping manifest on disk
+    '''
+    manifest_path = get_stamping_manifest_path(notes_directory)
+    manifest_dir = os.path.dirname(manifest_path)
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+
+    with atomic_write(manifest_path) as f:
+        json.dump(manifest, f)
+
+
 def _stamp_notes(notes_directory: DirectoryPath, stamp_todos=True,
                  stamp_today=True, stamp_questions=True, stamp_answers=True,
-                 grep_path: ExecutablePath = 'grep') -> StampingChanges:
+                 note_paths: Optional[List[NotePath]] = None
+                 ) -> StampingChanges:
     r'''Stamp notes for the purpose of inserting date stamps
     as a convenience feature. This function makes the following
     replacements:
@@ -156,6 +306,12 @@ def _stamp_notes(notes_directory: DirectoryPath, stamp_todos=True,
         - @ This is a sample
         - @ (2020-01-01) This is a sample
 
+    Every enabled type of stamp is applied to a note in a single read
+    and rewrite. A manifest of the modification time, size, and content
+    hash of each note is kept in `.shorthand/state/`, and notes which
+    haven't changed since the last run are not read again. If
+    `note_paths` is specified, only those notes are checked at all.
+
     This function returns a changes object of the form:
     {
         "/file/path/1": [
@@ -178,272 +334,73 @@ def _stamp_notes(notes_directory: DirectoryPath, stamp_todos=True,
     '''
 
     log.info('Stamping notes')
-    changes = {}
-
-    # Stamp start and end dates for todo elements
-    if stamp_todos:
-        grep_command = ('{grep_path} -Pr "{pattern}" '
-                        '--include="*.note" --exclude-dir=\'.*\' {directory} |'
-                        '{grep_path} -Pv "{filter_1}" | '
-                        '{grep_path} -Pv "{filter_2}"').format(
-                            grep_path=grep_path,
-                            pattern=CATCH_ALL_PATTERN,
-                            directory=notes_directory,
-                            filter_1=VALID_INCOMPLETE_PATTERN,
-                            filter_2=VALID_COMPLETE_PATTERN)
-
-        log.debug(f'running grep command "{grep_command}" ' +
-                  f'to get todos to stamp')
-
-        proc = Popen(grep_command,
-                     stdout=PIPE, stderr=PIPE,
-                     shell=True)
-        output, err = proc.communicate()
-
-        output_lines = output.decode().split('\n')
-        matched_filenames = [line.split(':')[0] for line in output_lines
-                             if line.strip()]
-        matched_filenames = list(set(matched_filenames))
-        if matched_filenames:
-            log.info(f'Found unstamped todos in files ' +
-                     f'{", ".join(matched_filenames)}')
-
-        for filename in matched_filenames:
-            log.debug(f'Stamping todos in file {filename}')
-            with open(filename, 'r') as file_object:
-
-                stamped_content = []
-
-                for line_number, line in enumerate(file_object):
-
-                    if unfinished_unstamped_regex.match(line):
-                        # unfinished unstamped
-                        log.info(f'Found unstamped unfinished todo "{line}"')
-                        new_line = _stamp_unfinished_todo(line)
-                        log.info(f'Writing stamped unfinished ' +
-                                 f'todo "{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "incomplete_todo",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    elif finished_start_stamped_regex.match(line):
-                        # finished with start stamped
-                        log.info(f'Found unstamped finished todo "{line}"')
-                        new_line = _stamp_finished_start_stamped_todo(line)
-                        log.info(f'Writing stamped finished ' +
-                                 f'todo "{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "finished_todo",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    elif finished_unstamped_regex.match(line):
-                        # finished unstamped
-                        log.info(f'Found unstamped finished todo "{line}"')
-                        new_line = _stamp_finished_unstamped_todo(line)
-                        log.info(f'Writing stamped finished ' +
-                                 f'todo "{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "finished_todo",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    else:
-                        # no todos found -or- correctly formatted already
-                        stamped_content.append(line)
-
-            with open(filename, 'w') as write_file_object:
-                log.debug(f'Saving changes in file {filename}')
-                write_file_object.write(''.join(stamped_content))
-
-    # Replace placeholders for `\today` helper
-    if stamp_today:
-        today_grep_command = '{grep_path} -r {pattern} --include="*.note" ' \
-                             '--exclude-dir=\'.*\' {directory}'.format(
-                                grep_path=grep_path,
-                                pattern=TODAY_GREP,
-                                directory=notes_directory)
-
-        log.debug(f'running grep command "{today_grep_command}" ' +
-                  f'to get `\\today`s to replace')
-        today_proc = Popen(today_grep_command,
-                           stdout=PIPE, stderr=PIPE,
-                           shell=True)
-        today_output, err = today_proc.communicate()
-
-        today_output_lines = today_output.decode().split('\n')
-        today_matched_filenames = [line.split(':')[0]
-                                   for line in today_output_lines
-                                   if line.strip()]
-        today_matched_filenames = list(set(today_matched_filenames))
-
-        for filename in today_matched_filenames:
-            log.debug(f'Replacing today placeholder in {filename}')
-            with open(filename, 'r') as file_object:
-
-                stamped_content = []
-
-                for line_number, line in enumerate(file_object):
-
-                    if today_placeholder_regex.match(line):
-                        # Today placeholder
-                        log.info(f'Found today placeholder "{line}"')
-                        new_line = _stamp_today_placeholder(line)
-                        log.info(f'Replaced today placeholder '
-                                 f'"{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "date_placeholder",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    else:
-                        # no today placeholders
-                        stamped_content.append(line)
-
-            with open(filename, 'w') as write_file_object:
-                log.debug(f'Saving changes in file {filename}')
-                write_file_object.write(''.join(stamped_content))
-
-    # Stamp Questions
-    if stamp_questions:
-
-        unstamped_questions_grep_command = (
-            '{grep_path} -Pr '
-            '"{question_pattern}" --include="*.note" '
-            '--exclude-dir=\'.*\' {directory} | {grep_path} -Pv '
-            '"{stamped_question_pattern}"').format(
-                grep_path=grep_path, question_pattern=ALL_QUESTIONS,
-                stamped_question_pattern=STAMPED_QUESTION,
-                directory=notes_directory)
-
-        log.debug(f'running grep command "{unstamped_questions_grep_command}" '
-                  f'to get unstamped questions')
-        questions_proc = Popen(unstamped_questions_grep_command,
-                               stdout=PIPE, stderr=PIPE,
-                               shell=True)
-
-        questions_output, err = questions_proc.communicate()
-        questions_output_lines = questions_output.decode().split('\n')
-        questions_matched_filenames = [line.split(':')[0]
-                                       for line in questions_output_lines
-                                       if line.strip()]
-        questions_matched_filenames = list(set(questions_matched_filenames))
-
-        for filename in questions_matched_filenames:
-            log.info(f'Stamping questions in {filename}')
-            with open(filename, 'r') as file_object:
-
-                stamped_content = []
-
-                for line_number, line in enumerate(file_object):
-
-                    if unstamped_question_regex.match(line):
-                        # unstamped question
-                        log.info(f'Found unstamped question "{line}"')
-                        new_line = _stamp_question(line)
-                        log.info(f'Writing stamped question '
-                                 f'"{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "question",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    else:
-                        # no today placeholders
-                        stamped_content.append(line)
-
-            with open(filename, 'w') as write_file_object:
-                log.debug(f'Saving changes in file {filename}')
-                write_file_object.write(''.join(stamped_content))
-
-    # Stamp Answers
-    if stamp_answers:
-
-        unstamped_answers_grep_command = (
-            '{grep_path} -Pr "{answer_pattern}" '
-            '--include="*.note" --exclude-dir=\'.*\' '
-            '{directory} | '
-            '{grep_path} -Pv "{stamped_answer_pattern}"').format(
-                grep_path=grep_path,
-                answer_pattern=ANSWER_PATTERN,
-                stamped_answer_pattern=STAMPED_ANSWER,
-                directory=notes_directory)
-
-        log.debug(f'running grep command "{unstamped_answers_grep_command}" ' +
-                  f'to get unstamped answers')
-        answers_proc = Popen(unstamped_answers_grep_command,
-                             stdout=PIPE, stderr=PIPE,
-                             shell=True)
-
-        answers_output, err = answers_proc.communicate()
-        answers_output_lines = answers_output.decode().split('\n')
-        answers_matched_filenames = [line.split(':')[0]
-                                     for line in answers_output_lines
-                                     if line.strip()]
-        answers_matched_filenames = list(set(answers_matched_filenames))
-
-        for filename in answers_matched_filenames:
-            log.info(f'Stamping answers in {filename}')
-            with open(filename, 'r') as file_object:
-
-                stamped_content = []
-
-                for line_number, line in enumerate(file_object):
-
-                    if unstamped_answer_regex.match(line):
-                        # unstamped answer
-                        log.info(f'Found unstamped answer "{line}"')
-                        new_line = _stamp_answer(line)
-                        log.info(f'Writing stamped answer ' +
-                                 f'"{new_line.rstrip()}"')
-                        stamped_content.append(new_line)
-
-                        change_details = {
-                            "type": "answer",
-                            "line_number": line_number + 1,
-                            "before": line.rstrip(),
-                            "after": new_line.rstrip(),
-                        }
-                        changes.setdefault(filename, [])
-                        changes[filename].append(change_details)
-
-                    else:
-                        # no today placeholders
-                        stamped_content.append(line)
-
-            with open(filename, 'w') as write_file_object:
-                log.debug(f'Saving changes in file {filename}')
-                write_file_object.write(''.join(stamped_content))
+    changes: StampingChanges = {}
+
+    stamp_options = _get_stamp_options(stamp_todos, stamp_today,
+                                       stamp_questions, stamp_answers)
+    manifest = _load_stamping_manifest(notes_directory)
+    manifest_notes = manifest['notes']
+    if manifest['options'] != stamp_options:
+        # Notes which were previously checked for a different set of
+        # stamps may still need stamping, so they all have to be checked
+        log.debug('Stamping options changed, checking all notes')
+        manifest_notes = {}
+
+    if note_paths is None:
+        check_note_paths = _list_note_paths(notes_directory)
+        updated_notes: Dict[NotePath, StampedNote] = {}
+    else:
+        check_note_paths = [get_relative_path(notes_directory, note_path)
+                            for note_path in note_paths
+                            if note_path.endswith('.note')]
+        updated_notes = dict(manifest_notes)
+
+    for note_path in check_note_paths:
+        full_path = get_full_path(notes_directory, note_path)
+        try:
+            stat_result = os.stat(full_path)
+        except FileNotFoundError:
+            updated_notes.pop(note_path, None)
+            continue
+
+        manifest_entry = manifest_notes.get(note_path)
+        if manifest_entry and \
+                manifest_entry['mtime_ns'] == stat_result.st_mtime_ns and \
+                manifest_entry['size'] == stat_result.st_size:
+            updated_notes[note_path] = manifest_entry
+            continue
+
+        with open(full_path, 'r') as file_object:
+            note_content = file_object.read()
+        content_hash = get_content_hash(note_content)
+
+        if not manifest_entry or manifest_entry['hash'] != content_hash:
+            log.debug(f'Checking {note_path} for elements to stamp')
+            stamped_content, note_changes = _stamp_note_content(
+                note_content, stamp_todos=stamp_todos,
+                stamp_today=stamp_today, stamp_questions=stamp_questions,
+                stamp_answers=stamp_answers)
+
+            if note_changes:
+                log.info(f'Stamped {len(note_changes)} elements in '
+                         f'{full_path}')
+                with open(full_path, 'w') as write_file_object:
+                    log.debug(f'Saving changes in file {full_path}')
+                    write_file_object.write(stamped_content)
+                changes[full_path] = note_changes
+                stat_result = os.stat(full_path)
+                content_hash = get_content_hash(stamped_content)
+
+        updated_notes[note_path] = {
+            'mtime_ns': stat_result.st_mtime_ns,
+            'size': stat_result.st_size,
+            'hash': content_hash
+        }
+
+    _write_stamping_manifest(notes_directory, {
+        'version': STAMPING_MANIFEST_VERSION,
+        'options': stamp_options,
+        'notes': updated_notes
+    })
 
     return changes
@@ -1,8 +1,8 @@
 import re
-from subprocess import Popen, PIPE
 import logging
 
 from shorthand.utils.patterns import TAG_PATTERN, TAG_FILTER
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS, scan_notes
 
 
 tag_regex = re.compile(TAG_PATTERN)
@@ -11,36 +11,16 @@ tag_regex = re.compile(TAG_PATTERN)
 log = logging.getLogger(__name__)
 
 
-def _get_tags(notes_directory, directory_filter=None, grep_path='grep'):
+def _get_tags(notes_directory, directory_filter=None,
+              scan_workers=DEFAULT_SCAN_WORKERS):
 
     tag_items = []
 
-    search_directory = notes_directory
-    if directory_filter:
-        if search_directory[-1] != '/':
-            search_directory += '/'
-        search_directory += directory_filter
+    for match in scan_notes(notes_directory, TAG_FILTER,
+                            directory_filter=directory_filter,
+                            workers=scan_workers):
 
-    grep_command = '{grep_path} -Pr "{pattern}" '\
-                   '--include="*.note" --exclude-dir=\'.*\' {dir}'.format(
-                        grep_path=grep_path,
-                        pattern=TAG_FILTER,
-                        dir=search_directory)
-    log.debug(f'Running grep command {grep_command} to get tags')
-
-    proc = Popen(
-        grep_command,
-        stdout=PIPE, stderr=PIPE,
-        shell=True)
-    output, err = proc.communicate()
-    output_lines = output.decode().split('\n')
-
-    for line in output_lines:
-
-        if not line.strip():
-            continue
-
-        tags = tag_regex.findall(line)
+        tags = tag_regex.findall(match.line)
         # Matches are returned as tuples because the pattern
         # has two groups. We only want to keep the first one
         tags = [tag[0] for tag in tags]
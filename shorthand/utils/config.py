@@ -2,11 +2,19 @@ import os
 import copy
 import json
 import logging
-from typing import Optional, Required, TypedDict
-
+from typing import Literal, Optional, Required, TypedDict
+
+from shorthand.frontend.tokenize import DEFAULT_NGRAM_TOKENIZER, \
+                                        NGRAM_TOKENIZERS, NgramTokenizer
+from shorthand.frontend.render_cache import DEFAULT_RENDER_CACHE_BYTES
+from shorthand.frontend.typeahead import DEFAULT_NGRAM_WORKERS
+from shorthand.search_sqlite import is_sqlite_search_supported
+from shorthand.utils.scan import DEFAULT_SCAN_WORKERS
 from shorthand.types import ExecutablePath, FilePath, DirectoryPath, RelativeDirectoryPath
 
 
+type SearchBackend = Literal['grep', 'index', 'sqlite']
+
 class ShorthandFrontendConfig(TypedDict):
     view_history_limit: int
     map_tileserver_url: str
@@ -25,9 +33,19 @@ class ShorthandConfigInput(TypedDict, total=False):
     log_format: str
     grep_path: ExecutablePath
     find_path: ExecutablePath
-    patch_path: ExecutablePath
+    patch_path: Optional[ExecutablePath]
     frontend: ShorthandFrontendConfig
     track_edit_history: bool
+    element_index: bool
+    search_backend: SearchBackend
+    scan_workers: int
+    watch_notes: bool
+    stamp_on_change: bool
+    async_history: bool
+    typeahead_tokenizer: NgramTokenizer
+    ngram_workers: int
+    render_cache_bytes: int
+    render_cache_spill: bool
 
 class ShorthandConfig(TypedDict):
     '''The config used by the application.
@@ -42,9 +60,19 @@ class ShorthandConfig(TypedDict):
     log_format: str
     grep_path: ExecutablePath
     find_path: ExecutablePath
-    patch_path: ExecutablePath
+    patch_path: Optional[ExecutablePath]
     frontend: ShorthandFrontendConfig
     track_edit_history: bool
+    element_index: bool
+    search_backend: SearchBackend
+    scan_workers: int
+    watch_notes: bool
+    stamp_on_change: bool
+    async_history: bool
+    typeahead_tokenizer: NgramTokenizer
+    ngram_workers: int
+    render_cache_bytes: int
+    render_cache_spill: bool
 
 class ShorthandConfigUpdates(TypedDict, total=False):
     default_directory: Optional[RelativeDirectoryPath]
@@ -53,9 +81,19 @@ class ShorthandConfigUpdates(TypedDict, total=False):
     log_format: str
     grep_path: ExecutablePath
     find_path: ExecutablePath
-    patch_path: ExecutablePath
+    patch_path: Optional[ExecutablePath]
     frontend: ShorthandFrontendConfig
     track_edit_history: bool
+    element_index: bool
+    search_backend: SearchBackend
+    scan_workers: int
+    watch_notes: bool
+    stamp_on_change: bool
+    async_history: bool
+    typeahead_tokenizer: NgramTokenizer
+    ngram_workers: int
+    render_cache_bytes: int
+    render_cache_spill: bool
 
 
 CONFIG_FILE_LOCATION = '/etc/shorthand/shorthand_config.json'
@@ -65,7 +103,9 @@ DEFAULT_LOG_FORMAT = '%(asctime)s %(name)s %(levelname)-8s %(message)s'
 DEFAULT_LOG_LEVEL = 'INFO'
 DEFAULT_GREP_PATH = 'grep'
 DEFAULT_FIND_PATH = 'find'
-DEFAULT_PATCH_PATH = 'patch'
+DEFAULT_PATCH_PATH = None
+DEFAULT_SEARCH_BACKEND = 'grep'
+SEARCH_BACKENDS = ['grep', 'index', 'sqlite']
 DEFAULT_FRONTEND_CONFIG: ShorthandFrontendConfig = {
     'view_history_limit': 100,
     'map_tileserver_url': 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
@@ -81,7 +121,17 @@ DEFAULT_CONFIG: ShorthandConfig = {
     "find_path": DEFAULT_FIND_PATH,
     "patch_path": DEFAULT_PATCH_PATH,
     "frontend": DEFAULT_FRONTEND_CONFIG,
-    "track_edit_history": True
+    "track_edit_history": True,
+    "element_index": False,
+    "search_backend": DEFAULT_SEARCH_BACKEND,
+    "scan_workers": DEFAULT_SCAN_WORKERS,
+    "watch_notes": False,
+    "stamp_on_change": False,
+    "async_history": False,
+    "typeahead_tokenizer": DEFAULT_NGRAM_TOKENIZER,
+    "ngram_workers": DEFAULT_NGRAM_WORKERS,
+    "render_cache_bytes": DEFAULT_RENDER_CACHE_BYTES,
+    "render_cache_spill": False
 }
 
 REQUIRED_FIELDS = ['notes_directory']
@@ -195,6 +245,73 @@ def clean_and_validate_config(config: ShorthandConfigInput | ShorthandConfig) ->
     if not isinstance(config['track_edit_history'], bool):
         raise ValueError('track_edit_history must be a boolean value')
 
+    # Validation for the persistent element index
+    if 'element_index' not in config:
+        config['element_index'] = DEFAULT_CONFIG['element_index']
+    if not isinstance(config['element_index'], bool):
+        raise ValueError('element_index must be a boolean value')
+
+    # Validate the full-text search backend
+    if 'search_backend' not in config:
+        config['search_backend'] = DEFAULT_CONFIG['search_backend']
+    if config['search_backend'] not in SEARCH_BACKENDS:
+        raise ValueError(f'Invalid search backend '
+                         f'"{config["search_backend"]}" specified, valid '
+                         f'options are: {", ".join(SEARCH_BACKENDS)}')
+    if config['search_backend'] == 'sqlite' and \
+            not is_sqlite_search_supported():
+        raise ValueError('The sqlite search backend requires a version of '
+                         'SQLite with FTS5 and trigram tokenizer support')
+
+    # Validate the number of threads used to scan notes
+    if 'scan_workers' not in config:
+        config['scan_workers'] = DEFAULT_CONFIG['scan_workers']
+    if not isinstance(config['scan_workers'], int) or \
+            isinstance(config['scan_workers'], bool) or \
+            config['scan_workers'] < 0:
+        raise ValueError('scan_workers must be a non-negative integer')
+
+    # Validation for the notes directory watcher
+    for field in ['watch_notes', 'stamp_on_change']:
+        if field not in config:
+            config[field] = DEFAULT_CONFIG[field]
+        if not isinstance(config[field], bool):
+            raise ValueError(f'{field} must be a boolean value')
+
+    # Validation for recording edit history in the background
+    if 'async_history' not in config:
+        config['async_history'] = DEFAULT_CONFIG['async_history']
+    if not isinstance(config['async_history'], bool):
+        raise ValueError('async_history must be a boolean value')
+
+    # Validate the tokenizer used to build the typeahead n-gram database
+    if 'typeahead_tokenizer' not in config:
+        config['typeahead_tokenizer'] = DEFAULT_CONFIG['typeahead_tokenizer']
+    if config['typeahead_tokenizer'] not in NGRAM_TOKENIZERS:
+        raise ValueError(f'Invalid typeahead tokenizer '
+                         f'"{config["typeahead_tokenizer"]}" specified, '
+                         f'valid options are: {", ".join(NGRAM_TOKENIZERS)}')
+
+    # Validate the number of processes used to build the n-gram database
+    if 'ngram_workers' not in config:
+        config['ngram_workers'] = DEFAULT_CONFIG['ngram_workers']
+    if not isinstance(config['ngram_workers'], int) or \
+            isinstance(config['ngram_workers'], bool) or \
+            config['ngram_workers'] < 0:
+        raise ValueError('ngram_workers must be a non-negative integer')
+
+    # Validation for the rendered note cache
+    if 'render_cache_bytes' not in config:
+        config['render_cache_bytes'] = DEFAULT_CONFIG['render_cache_bytes']
+    if not isinstance(config['render_cache_bytes'], int) or \
+            isinstance(config['render_cache_bytes'], bool) or \
+            config['render_cache_bytes'] < 0:
+        raise ValueError('render_cache_bytes must be a non-negative integer')
+    if 'render_cache_spill' not in config:
+        config['render_cache_spill'] = DEFAULT_CONFIG['render_cache_spill']
+    if not isinstance(config['render_cache_spill'], bool):
+        raise ValueError('render_cache_spill must be a boolean value')
+
     # Ensure that the notes directory and cache directory
     # paths have no trailing `/`
     notes_dir = config['notes_directory']
@@ -310,13 +427,14 @@ def clean_and_validate_config(config: ShorthandConfigInput | ShorthandConfig) ->
             raise ValueError(f'Find executable specified as {find_path} '
                              f'could not be located')
 
+    # GNU patch is only used to apply edit history diffs when it is
+    # explicitly configured, otherwise diffs are applied in-process
     patch_path = config.get('patch_path')
     if not patch_path:
-        log.info(f'Patch path not specified, falling back to ' + \
-                 f'default of {DEFAULT_PATCH_PATH}')
-        patch_path = DEFAULT_PATCH_PATH
+        log.debug('Patch path not specified, applying diffs in-process')
+        config['patch_path'] = DEFAULT_PATCH_PATH
     # Check for the patch path as the full path to an executable
-    if os.path.isfile(patch_path):
+    elif os.path.isfile(patch_path):
         if not os.access(patch_path, os.X_OK):
             raise ValueError(f'Patch at {patch_path} is not executable')
         else:
@@ -0,0 +1,279 @@
+'''
+A line diff for recording edit history, which stays fast on large notes
+where `difflib` slows down badly, such as long logs with many similar
+lines.
+
+Lines are first interned to integers so that they are only hashed once.
+Matching lines are then found with a patience diff: lines which appear
+exactly once in both versions are used as anchors, and the regions between
+anchors are diffed recursively. Regions without any unique lines fall back
+to a Myers diff.
+
+`unified_diff` produces output in exactly the same format as
+`difflib.unified_diff`, so diffs from either can be stored and applied in
+the same way.
+'''
+import logging
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Literal, Tuple
+
+
+# Regions which need more edits than this to be diffed with Myers'
+# algorithm are treated as being completely replaced instead, since the
+# time taken grows with the square of the number of edits
+MAX_MYERS_EDITS = 1000
+
+
+log = logging.getLogger(__name__)
+
+
+type Opcode = Tuple[Literal['equal', 'replace', 'delete', 'insert'],
+                    int, int, int, int]
+'''A change between two lists of lines, in the same form as the opcodes
+   produced by `difflib.SequenceMatcher`'''
+
+
+def _intern_lines(a: List[str], b: List[str]
+                  ) -> Tuple[List[int], List[int]]:
+    '''Replace each distinct line with an integer id, so that comparing
+       lines doesn't need to compare their full content
+    '''
+    ids: Dict[str, int] = {}
+    a_ids = [ids.setdefault(line, len(ids)) for line in a]
+    b_ids = [ids.setdefault(line, len(ids)) for line in b]
+    return a_ids, b_ids
+
+
+def _unique_anchors(a: List[int], b: List[int], alo: int, ahi: int,
+                    blo: int, bhi: int) -> List[Tuple[int, int]]:
+    '''Find the longest sequence of lines which appear exactly once in each
+       region, and in the same order in both
+    '''
+    a_counts: Dict[int, int] = {}
+    a_positions: Dict[int, int] = {}
+    for i in range(alo, ahi):
+        a_counts[a[i]] = a_counts.get(a[i], 0) + 1
+        a_positions[a[i]] = i
+    b_counts: Dict[int, int] = {}
+    b_positions: Dict[int, int] = {}
+    for j in range(blo, bhi):
+        b_counts[b[j]] = b_counts.get(b[j], 0) + 1
+        b_positions[b[j]] = j
+
+    unique_pairs = [(a_positions[line], b_positions[line])
+                    for line, count in a_counts.items()
+                    if count == 1 and b_counts.get(line) == 1]
+    unique_pairs.sort()
+
+    # Longest increasing subsequence of the positions in `b`, using
+    # patience sorting
+    pile_tops: List[int] = []
+    pile_pairs: List[int] = []
+    previous: List[int] = []
+    for idx, (_, j) in enumerate(unique_pairs):
+        pile = bisect_left(pile_tops, j)
+        if pile == len(pile_tops):
+            pile_tops.append(j)
+            pile_pairs.append(idx)
+        else:
+            pile_tops[pile] = j
+            pile_pairs[pile] = idx
+        previous.append(pile_pairs[pile - 1] if pile else -1)
+
+    anchors = []
+    idx = pile_pairs[-1] if pile_pairs else -1
+    while idx != -1:
+        anchors.append(unique_pairs[idx])
+        idx = previous[idx]
+    anchors.reverse()
+    return anchors
+
+
+def _myers_matches(a: List[int], b: List[int], alo: int, ahi: int,
+                   blo: int, bhi: int) -> List[Tuple[int, int]]:
+    '''Find the matching lines in a shortest edit script between two
+       regions, using Myers' algorithm
+    '''
+    n = ahi - alo
+    m = bhi - blo
+    offset = n + m + 1
+    v = [0] * (2 * offset + 1)
+    # The furthest reaching paths before each step, only for the diagonals
+    # which can be reached by that step
+    trace: List[List[int]] = []
+    for d in range(n + m + 1):
+        if d > MAX_MYERS_EDITS:
+            log.debug(f'Too many edits to diff {n} lines against {m} lines')
+            return []
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+        break
+
+    matches = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        previous_v = trace[d]
+        k = x - y
+        if k == -d or (k != d and previous_v[k - 1 + d + 1] <
+                       previous_v[k + 1 + d + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_x = previous_v[previous_k + d + 1]
+        previous_y = previous_x - previous_k
+        while x > previous_x and y > previous_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = previous_x, previous_y
+    matches.reverse()
+    return matches
+
+
+def get_matching_lines(a: List[str], b: List[str]
+                       ) -> List[Tuple[int, int]]:
+    '''Get the pairs of indexes of lines which are unchanged between `a`
+       and `b`, in order
+    '''
+    a_ids, b_ids = _intern_lines(a, b)
+    matches = []
+    regions = [(0, len(a_ids), 0, len(b_ids))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+
+        # Lines at the start or end of a region which are unchanged
+        # are always matched
+        while alo < ahi and blo < bhi and a_ids[alo] == b_ids[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a_ids[ahi - 1] == b_ids[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a_ids, b_ids, alo, ahi, blo, bhi)
+        if not anchors:
+            matches.extend(_myers_matches(a_ids, b_ids, alo, ahi, blo, bhi))
+            continue
+
+        for i, j in anchors:
+            regions.append((alo, i, blo, j))
+            matches.append((i, j))
+            alo, blo = i + 1, j + 1
+        regions.append((alo, ahi, blo, bhi))
+
+    matches.sort()
+    return matches
+
+
+def get_opcodes(a: List[str], b: List[str]) -> List[Opcode]:
+    '''Get the changes needed to turn the lines in `a` into the lines in
+       `b`, in the same form as `difflib.SequenceMatcher.get_opcodes`
+    '''
+    opcodes: List[Opcode] = []
+    i = j = 0
+    for match_i, match_j in get_matching_lines(a, b) + [(len(a), len(b))]:
+        if i < match_i and j < match_j:
+            opcodes.append(('replace', i, match_i, j, match_j))
+        elif i < match_i:
+            opcodes.append(('delete', i, match_i, j, match_j))
+        elif j < match_j:
+            opcodes.append(('insert', i, match_i, j, match_j))
+
+        if match_i == len(a) and match_j == len(b):
+            break
+        if opcodes and opcodes[-1][0] == 'equal':
+            _, i1, _, j1, _ = opcodes[-1]
+            opcodes[-1] = ('equal', i1, match_i + 1, j1, match_j + 1)
+        else:
+            opcodes.append(('equal', match_i, match_i + 1,
+                            match_j, match_j + 1))
+        i, j = match_i + 1, match_j + 1
+
+    if not opcodes:
+        opcodes.append(('equal', 0, 0, 0, 0))
+    return opcodes
+
+
+def get_grouped_opcodes(opcodes: List[Opcode], n: int = 3
+                        ) -> Iterator[List[Opcode]]:
+    '''Group changes into hunks with up to `n` lines of context, the same
+       way as `difflib.SequenceMatcher.get_grouped_opcodes`
+    '''
+    opcodes = list(opcodes)
+    if opcodes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[0]
+        opcodes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if opcodes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = opcodes[-1]
+        opcodes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    group: List[Opcode] = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        # End the current group and start a new one whenever
+        # there is a large range with no changes
+        if tag == 'equal' and i2 - i1 > n * 2:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start: int, stop: int) -> str:
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f'{beginning}'
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def unified_diff(a: List[str], b: List[str], fromfile: str = '',
+                 tofile: str = '', n: int = 3, lineterm: str = '\n'
+                 ) -> Iterator[str]:
+    '''Produce a unified diff between two lists of lines, in exactly the
+       same format as `difflib.unified_diff`
+    '''
+    started = False
+    for group in get_grouped_opcodes(get_opcodes(a, b), n):
+        if not started:
+            started = True
+            yield f'--- {fromfile}{lineterm}'
+            yield f'+++ {tofile}{lineterm}'
+
+        first, last = group[0], group[-1]
+        file1_range = _format_range(first[1], last[2])
+        file2_range = _format_range(first[3], last[4])
+        yield f'@@ -{file1_range} +{file2_range} @@{lineterm}'
+
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                for line in a[i1:i2]:
+                    yield ' ' + line
+                continue
+            if tag in {'replace', 'delete'}:
+                for line in a[i1:i2]:
+                    yield '-' + line
+            if tag in {'replace', 'insert'}:
+                for line in b[j1:j2]:
+                    yield '+' + line
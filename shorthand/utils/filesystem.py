@@ -1,6 +1,11 @@
 import os
+import stat
+import fcntl
 import shutil
 import logging
+import tempfile
+from contextlib import contextmanager
+from typing import IO, Iterator, Optional
 
 from shorthand.types import DirectoryPath, Subdir, InternalAbsoluteFilePath, InternalAbsolutePath
 from shorthand.utils.paths import _is_note_path, get_full_path
@@ -9,6 +14,50 @@ from shorthand.utils.paths import _is_note_path, get_full_path
 log = logging.getLogger(__name__)
 
 
+@contextmanager
+def atomic_write(path: str, mode: str = 'w',
+                 encoding: Optional[str] = None) -> Iterator[IO]:
+    '''Write a file through a uniquely named temporary file in the same
+       directory, which replaces the file once it is fully written. Readers
+       never see a partially written file, and concurrent writers never
+       write to the same temporary file
+    '''
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.',
+        prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            yield f
+        # Temporary files are only readable by their owner,
+        # so keep the permissions of the file being replaced
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path: str, shared: bool = False) -> Iterator[None]:
+    '''Hold an advisory lock on a lock file, which is created if it
+       doesn't exist yet. The lock is exclusive unless `shared` is set,
+       applies across every thread and process which locks the same path,
+       and is released if the holder exits. Locks can't be nested
+    '''
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
 def _create_file(notes_directory: DirectoryPath,
                  file_path: InternalAbsoluteFilePath
                  ) -> None:
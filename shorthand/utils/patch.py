@@ -0,0 +1,199 @@
+'''
+An in-process applier for unified diffs, as produced by `get_unified_diff`
+in `shorthand.edit_history`, which can apply diffs either forwards or in
+reverse without writing anything to disk or running GNU patch.
+
+Each hunk is first matched strictly at the position recorded in its
+header (adjusted by any lines added or removed by earlier hunks). If the
+content has shifted, the closest position where the hunk matches exactly
+is used instead, and if it still can't be placed then up to
+`MAX_FUZZ` lines of context are ignored at each end of the hunk, the same
+way GNU patch does.
+'''
+import re
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+from shorthand.types import RawNoteContent
+
+
+MAX_FUZZ = 2
+
+hunk_header_regex = re.compile(
+    r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+diff_line_regex = re.compile(r'[^\n]*\n|[^\n]+$')
+
+
+log = logging.getLogger(__name__)
+
+
+class Hunk(NamedTuple):
+    old_start: int
+    old_length: int
+    new_start: int
+    new_length: int
+    # Each line of the hunk as (operation, text), where the operation is
+    # one of ` `, `-`, or `+` and the text includes its line ending
+    lines: List[Tuple[str, str]]
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    '''Parse all of the hunks out of a unified diff. Any lines before the
+       first hunk (like the author, time, and file headers) are ignored
+    '''
+    hunks = []
+    # Only split on newlines, since the content of a line can contain
+    # other characters which `splitlines` would treat as line breaks
+    diff_lines = diff_line_regex.findall(diff)
+    idx = 0
+    while idx < len(diff_lines):
+        header_match = hunk_header_regex.match(diff_lines[idx])
+        idx += 1
+        if not header_match:
+            continue
+
+        old_start = int(header_match.group(1))
+        old_length = int(header_match.group(2) or 1)
+        new_start = int(header_match.group(3))
+        new_length = int(header_match.group(4) or 1)
+
+        # The hunk body is read by counting lines rather than looking for
+        # the next header, since note content can look like diff syntax
+        lines = []
+        old_remaining, new_remaining = old_length, new_length
+        while old_remaining > 0 or new_remaining > 0:
+            if idx >= len(diff_lines):
+                raise ValueError(f'Hunk at line {old_start} of the diff '
+                                 f'ends unexpectedly')
+            line = diff_lines[idx]
+            idx += 1
+            if line.startswith('\\'):
+                # `\ No newline at end of file`
+                continue
+
+            operation, text = line[:1], line[1:]
+            if operation == ' ' or line in ['\n', '\r\n']:
+                operation = ' '
+                old_remaining -= 1
+                new_remaining -= 1
+            elif operation == '-':
+                old_remaining -= 1
+            elif operation == '+':
+                new_remaining -= 1
+            else:
+                raise ValueError(f'Invalid line in hunk at line {old_start} '
+                                 f'of the diff: {line!r}')
+            if old_remaining < 0 or new_remaining < 0:
+                raise ValueError(f'Hunk at line {old_start} of the diff '
+                                 f'does not match its header')
+            lines.append((operation, text))
+
+        hunks.append(Hunk(old_start, old_length, new_start, new_length,
+                          lines))
+
+    return hunks
+
+
+def reverse_hunk(hunk: Hunk) -> Hunk:
+    swapped_operations = {' ': ' ', '-': '+', '+': '-'}
+    return Hunk(hunk.new_start, hunk.new_length,
+                hunk.old_start, hunk.old_length,
+                [(swapped_operations[operation], text)
+                 for operation, text in hunk.lines])
+
+
+def lines_match(expected: List[str], actual: List[str]) -> bool:
+    if len(expected) != len(actual):
+        return False
+    return all(expected_line.rstrip('\r\n') == actual_line.rstrip('\r\n')
+               for expected_line, actual_line in zip(expected, actual))
+
+
+def find_hunk_position(content_lines: List[str], expected_lines: List[str],
+                       position: int) -> Optional[int]:
+    '''Find the position closest to the expected one where the lines of
+       a hunk match the content exactly
+    '''
+    max_offset = max(position, len(content_lines) - position)
+    for offset in range(max_offset + 1):
+        for candidate in [position - offset, position + offset]:
+            if candidate < 0 or \
+                    candidate + len(expected_lines) > len(content_lines):
+                continue
+            if lines_match(expected_lines, content_lines[
+                    candidate:candidate + len(expected_lines)]):
+                return candidate
+            if offset == 0:
+                break
+    return None
+
+
+def apply_hunk(content_lines: List[str], hunk: Hunk, offset: int
+               ) -> Tuple[List[str], int]:
+    '''Apply a single hunk to the lines of a note, returning the patched
+       lines along with the offset to apply to any following hunks
+    '''
+    # Zero-length ranges refer to the position after the start line
+    position = hunk.old_start - 1 if hunk.old_length else hunk.old_start
+    position += offset
+
+    for fuzz in range(MAX_FUZZ + 1):
+        lines = hunk.lines
+        leading = 0
+        trailing = 0
+        # Only context lines can be ignored at either end of the hunk
+        while leading < fuzz and leading < len(lines) and \
+                lines[leading][0] == ' ':
+            leading += 1
+        while trailing < fuzz and trailing < len(lines) - leading and \
+                lines[len(lines) - 1 - trailing][0] == ' ':
+            trailing += 1
+        if fuzz and not (leading or trailing):
+            break
+        lines = lines[leading:len(lines) - trailing]
+
+        old_lines = [text for operation, text in lines if operation != '+']
+        new_lines = [text for operation, text in lines if operation != '-']
+
+        match_position = find_hunk_position(content_lines, old_lines,
+                                            position + leading)
+        if match_position is None:
+            continue
+
+        if match_position != position + leading or fuzz:
+            log.debug(f'Applied hunk at line {hunk.old_start} with offset '
+                      f'{match_position - position - leading} and fuzz '
+                      f'{fuzz}')
+        patched_lines = content_lines[:match_position] + new_lines + \
+            content_lines[match_position + len(old_lines):]
+        new_offset = match_position - leading - \
+            (position - offset) + len(new_lines) - len(old_lines)
+        return patched_lines, new_offset
+
+    raise ValueError(f'Hunk at line {hunk.old_start} could not be applied')
+
+
+def apply_patch(content: RawNoteContent, diff: str, reverse: bool = False
+                ) -> RawNoteContent:
+    '''Apply a unified diff to the content of a note
+
+       If `reverse` is set, then the diff is undone from the content
+    '''
+    hunks = parse_unified_diff(diff)
+    if not hunks:
+        return content
+
+    if reverse:
+        hunks = [reverse_hunk(hunk) for hunk in hunks]
+
+    # Diffs are stored with every line terminated, so the content
+    # must be terminated as well for the last line to match
+    if content and not content.endswith('\n'):
+        content += '\n'
+    content_lines = content.splitlines(keepends=True)
+
+    offset = 0
+    for hunk in hunks:
+        content_lines, offset = apply_hunk(content_lines, hunk, offset)
+
+    return ''.join(content_lines)
@@ -1,7 +1,7 @@
 # Path Utilities
 import os
 import logging
-from typing import Optional, Union, List
+from typing import Iterable, Optional, Set, Union, List
 
 from shorthand.types import DirectoryPath, DisplayPath, ExternalURL, \
                             FilePath, NotePath, RelativeNotePath, ResourcePath, Subdir, \
@@ -116,6 +116,82 @@ def _get_subdirs(notes_directory: DirectoryPath, max_depth: int = 2,
     return all_directories
 
 
+def _list_note_paths(notes_directory: DirectoryPath,
+                     directory_filter: Optional[Subdir] = None
+                     ) -> List[NotePath]:
+    '''Returns a sorted list of the paths of all notes within the notes
+       directory, or within the specified sub-directory of it.
+       Hidden directories (starting with `.`) are skipped
+    '''
+    search_directory = notes_directory
+    if directory_filter:
+        search_directory = get_full_path(notes_directory, directory_filter)
+
+    note_paths = []
+    pending_dirs = [search_directory]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            entries = list(os.scandir(current_dir))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if not entry.name.startswith('.'):
+                    pending_dirs.append(entry.path)
+            elif entry.name.endswith('.note') and entry.is_file():
+                note_paths.append(get_relative_path(notes_directory,
+                                                    entry.path))
+
+    note_paths.sort()
+    return note_paths
+
+
+def _normalize_changed_path(notes_directory: DirectoryPath,
+                            path: Union[FilePath, InternalAbsolutePath]
+                            ) -> Optional[InternalAbsolutePath]:
+    '''Convert a changed path into a clean path within the notes
+       directory, or return None if it leads outside of the directory
+    '''
+    path = get_relative_path(notes_directory, path)
+    if '..' in path.split('/'):
+        log.warning(f'Ignoring changed path {path} outside of the '
+                    f'notes directory')
+        return None
+    return os.path.normpath(path)
+
+
+def _get_changed_note_paths(notes_directory: DirectoryPath,
+                            paths: Iterable[InternalAbsolutePath],
+                            known_note_paths: Iterable[NotePath]
+                            ) -> Set[NotePath]:
+    '''Get every note which may have changed after the notes or
+       directories at the specified paths were changed. This includes the
+       known notes at or within each path, which may no longer exist, along
+       with the notes which are there now. Full paths within the notes
+       directory are accepted, and paths leading outside of it are ignored
+    '''
+    paths = [path for path in (_normalize_changed_path(notes_directory,
+                                                       path)
+                               for path in paths)
+             if path is not None]
+    changed_note_paths = set()
+    for note_path in known_note_paths:
+        for path in paths:
+            if note_path == path or \
+                    note_path.startswith(f'{path.rstrip("/")}/'):
+                changed_note_paths.add(note_path)
+                break
+
+    for path in paths:
+        full_path = get_full_path(notes_directory, path)
+        if os.path.isdir(full_path):
+            changed_note_paths.update(_list_note_paths(notes_directory, path))
+        elif path.endswith('.note'):
+            changed_note_paths.add(path)
+    return changed_note_paths
+
+
 def parse_relative_link_path(source: NotePath,
                              target: Union[NotePath, RelativeNotePath,
                                            ExternalURL]
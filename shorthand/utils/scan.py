@@ -0,0 +1,163 @@
+'''
+An in-process scan engine for finding lines within notes which match
+a pattern, used in place of running `grep` in a shell.
+
+Notes are found by walking the notes directory (skipping hidden
+directories), and are read and matched on a pool of worker threads.
+Matches are yielded in order of note path and then line number, as
+each batch of notes finishes being scanned.
+'''
+import re
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+
+from shorthand.types import DirectoryPath, NotePath, RawNoteLine, \
+                            RelativeDirectoryPath
+from shorthand.utils.paths import _list_note_paths, get_full_path
+
+
+DEFAULT_SCAN_WORKERS = 4
+
+# The number of notes which are scanned ahead of the matches
+# which have been consumed, per worker
+SCAN_BATCH_FACTOR = 8
+
+
+log = logging.getLogger(__name__)
+
+
+type Pattern = Union[str, re.Pattern]
+
+class ScanMatch(NamedTuple):
+    file_path: NotePath
+    line_number: int
+    line: RawNoteLine
+    next_line: Optional[RawNoteLine] = None
+
+
+def compile_pattern(pattern: Pattern, case_sensitive: bool = True
+                    ) -> re.Pattern:
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    return re.compile(pattern, 0 if case_sensitive else re.IGNORECASE)
+
+
+def literal_filters(query_components: Iterable[str],
+                    case_sensitive: bool = False) -> List[re.Pattern]:
+    '''Build filters which match lines containing each of the query
+       components as literal text
+    '''
+    return [compile_pattern(re.escape(component), case_sensitive)
+            for component in query_components]
+
+
+def read_note_lines(notes_directory: DirectoryPath, note_path: NotePath
+                    ) -> Optional[List[RawNoteLine]]:
+    '''Read the lines of a note, or return None if the
+       note can't be read as text
+    '''
+    try:
+        with open(get_full_path(notes_directory, note_path), 'r') as f:
+            content = f.read()
+    except (FileNotFoundError, UnicodeDecodeError) as e:
+        log.warning(f'Skipping note {note_path} during scan: {e}')
+        return None
+
+    lines = content.split('\n')
+    if lines and lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def scan_note(notes_directory: DirectoryPath, note_path: NotePath,
+              pattern: re.Pattern, filters: List[re.Pattern],
+              excludes: List[re.Pattern], with_next_line: bool = False
+              ) -> List[ScanMatch]:
+    '''Find all lines of a single note which match the pattern and all
+       filters, and do not match any of the excludes
+    '''
+    lines = read_note_lines(notes_directory, note_path)
+    if not lines:
+        return []
+
+    matches = []
+    for idx, line in enumerate(lines):
+        if not pattern.search(line):
+            continue
+        if not all(line_filter.search(line) for line_filter in filters):
+            continue
+        if any(exclude.search(line) for exclude in excludes):
+            continue
+
+        next_line = None
+        if with_next_line and idx < len(lines) - 1:
+            next_line = lines[idx + 1]
+        matches.append(ScanMatch(note_path, idx + 1, line, next_line))
+
+    return matches
+
+
+def scan_notes(notes_directory: DirectoryPath, pattern: Pattern,
+               directory_filter: Optional[RelativeDirectoryPath] = None,
+               filters: Iterable[Pattern] = (),
+               excludes: Iterable[Pattern] = (),
+               case_sensitive: bool = True,
+               with_next_line: bool = False,
+               workers: int = DEFAULT_SCAN_WORKERS,
+               note_paths: Optional[Iterable[NotePath]] = None
+               ) -> Iterator[ScanMatch]:
+    '''Scan all notes for lines which match a pattern, yielding
+       a `ScanMatch` for each one
+
+       "pattern" is a regular expression which must be found in a line
+       "filters" are additional patterns which must all be found in a
+           line for it to match
+       "excludes" are patterns which must not be found in a line
+       "case_sensitive" determines how patterns specified as strings
+           are compiled
+       "with_next_line" includes the line following each match
+       "workers" is the number of threads to scan notes with. With
+           one worker or fewer, notes are scanned in the calling thread
+       "note_paths" limits the scan to specific notes, instead of all
+           notes within the directory filter
+    '''
+    pattern = compile_pattern(pattern, case_sensitive)
+    filters = [compile_pattern(line_filter, case_sensitive)
+               for line_filter in filters]
+    excludes = [compile_pattern(exclude, case_sensitive)
+                for exclude in excludes]
+
+    if note_paths is None:
+        note_paths = _list_note_paths(notes_directory, directory_filter)
+    else:
+        note_paths = list(note_paths)
+    log.debug(f'Scanning {len(note_paths)} notes for pattern '
+              f'"{pattern.pattern}" with {workers} workers')
+
+    if workers <= 1:
+        for note_path in note_paths:
+            yield from scan_note(notes_directory, note_path, pattern,
+                                 filters, excludes, with_next_line)
+        return
+
+    # Keep a bounded number of notes in flight so that the matches
+    # for the whole tree are never all held in memory at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: deque[Future] = deque()
+        note_path_iterator = iter(note_paths)
+        for note_path in note_path_iterator:
+            pending.append(executor.submit(
+                scan_note, notes_directory, note_path, pattern, filters,
+                excludes, with_next_line))
+            if len(pending) >= workers * SCAN_BATCH_FACTOR:
+                break
+
+        while pending:
+            yield from pending.popleft().result()
+            next_note_path = next(note_path_iterator, None)
+            if next_note_path is not None:
+                pending.append(executor.submit(
+                    scan_note, notes_directory, next_note_path, pattern,
+                    filters, excludes, with_next_line))
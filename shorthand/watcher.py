@@ -0,0 +1,489 @@
+'''
+A file watcher which runs inside the server process and publishes typed
+events whenever notes, resources, or directories within the notes
+directory are created, modified, moved, or deleted.
+
+On Linux, changes are picked up from inotify (called through ctypes, so
+no extra dependencies are needed). Everywhere else, or if inotify can't
+be used, the notes directory is polled and compared against a snapshot
+of the modification time and size of every file.
+
+Bursts of changes (like an editor writing a file in several steps) are
+debounced and coalesced, so that subscribers receive a single batch of
+events once the notes directory has been quiet for a moment. Hidden
+files and directories, including `.shorthand`, are never reported.
+'''
+import os
+import sys
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+import logging
+import threading
+from typing import Callable, Dict, List, Literal, Optional, Tuple, \
+                   TypedDict, Union
+
+from shorthand.types import DirectoryPath, InternalAbsolutePath
+
+
+DEFAULT_DEBOUNCE_SECONDS = 0.5
+# Changes are always published after this long, even if more keep arriving
+DEFAULT_MAX_DELAY_SECONDS = 5.0
+DEFAULT_POLL_INTERVAL_SECONDS = 1.0
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+READ_BUFFER_SIZE = 64 * 1024
+
+
+log = logging.getLogger(__name__)
+
+
+type ChangeType = Literal['created', 'modified', 'moved', 'deleted']
+type ChangeTarget = Literal['note', 'resource', 'directory']
+
+class ChangeEvent(TypedDict):
+    type: ChangeType
+    target: ChangeTarget
+    path: InternalAbsolutePath
+    # Only set for moves, the path the file or directory was moved to
+    dest_path: Optional[InternalAbsolutePath]
+
+# A change which hasn't been coalesced yet, of the form
+#     (type, path, dest_path, is_directory)
+type RawChange = Tuple[ChangeType, InternalAbsolutePath,
+                       Optional[InternalAbsolutePath], bool]
+
+type ChangeSubscriber = Callable[[List[ChangeEvent]], None]
+
+
+def is_hidden_path(path: InternalAbsolutePath) -> bool:
+    return any(part.startswith('.') for part in path.split('/') if part)
+
+
+def get_change_target(path: InternalAbsolutePath, is_directory: bool
+                      ) -> ChangeTarget:
+    if is_directory:
+        return 'directory'
+    elif path.endswith('.note'):
+        return 'note'
+    return 'resource'
+
+
+def coalesce_changes(changes: List[RawChange]) -> List[ChangeEvent]:
+    '''Combine a burst of raw changes into the smallest equivalent set of
+       events, in the order they happened. For example, a file which was
+       created and then modified several times is reported as created,
+       and a file which was created and then deleted is not reported
+    '''
+    events: List[Optional[ChangeEvent]] = []
+    # The position of the last event for each path, which can
+    # still be combined with later changes to the same path
+    last_event_idx: Dict[InternalAbsolutePath, int] = {}
+
+    for change_type, path, dest_path, is_directory in changes:
+        if change_type == 'moved':
+            last_event_idx.pop(path, None)
+            last_event_idx.pop(dest_path, None)
+            events.append({
+                'type': 'moved',
+                'target': get_change_target(dest_path, is_directory),
+                'path': path,
+                'dest_path': dest_path
+            })
+            continue
+
+        event: ChangeEvent = {
+            'type': change_type,
+            'target': get_change_target(path, is_directory),
+            'path': path,
+            'dest_path': None
+        }
+
+        idx = last_event_idx.get(path)
+        previous = events[idx] if idx is not None else None
+        if previous is None:
+            last_event_idx[path] = len(events)
+            events.append(event)
+        elif change_type == 'modified' and \
+                previous['type'] in ['created', 'modified']:
+            continue
+        elif change_type == 'deleted' and previous['type'] == 'created':
+            events[idx] = None
+            del last_event_idx[path]
+        elif change_type == 'deleted':
+            events[idx] = event
+        elif change_type == 'created' and previous['type'] == 'deleted':
+            event['type'] = 'modified'
+            events[idx] = event
+        else:
+            last_event_idx[path] = len(events)
+            events.append(event)
+
+    return [event for event in events if event is not None]
+
+
+class PollingBackend:
+    '''Detects changes by comparing snapshots of the modification time
+       and size of everything within the notes directory. Moves are
+       detected when a new path has the same inode as a removed one
+    '''
+
+    def __init__(self, notes_directory: DirectoryPath,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL_SECONDS):
+        self.notes_directory = notes_directory
+        self.poll_interval = poll_interval
+        self.snapshot = self.take_snapshot()
+        self.last_poll = time.monotonic()
+
+    def take_snapshot(self) -> Dict[InternalAbsolutePath,
+                                    Tuple[int, int, int, bool]]:
+        snapshot = {}
+        pending_dirs = [self.notes_directory]
+        while pending_dirs:
+            current_dir = pending_dirs.pop()
+            try:
+                entries = list(os.scandir(current_dir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat_result = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                is_directory = entry.is_dir(follow_symlinks=False)
+                path = entry.path[len(self.notes_directory):]
+                snapshot[path] = (stat_result.st_mtime_ns,
+                                  stat_result.st_size,
+                                  stat_result.st_ino, is_directory)
+                if is_directory:
+                    pending_dirs.append(entry.path)
+        return snapshot
+
+    def read_changes(self, timeout: float) -> List[RawChange]:
+        wait_time = self.last_poll + self.poll_interval - time.monotonic()
+        if wait_time > 0:
+            time.sleep(min(wait_time, timeout))
+            if time.monotonic() < self.last_poll + self.poll_interval:
+                return []
+
+        self.last_poll = time.monotonic()
+        snapshot = self.take_snapshot()
+        previous = self.snapshot
+        self.snapshot = snapshot
+
+        removed = {path: previous[path] for path in previous
+                   if path not in snapshot}
+        removed_by_inode = {details[2]: path
+                            for path, details in removed.items()}
+
+        changes: List[RawChange] = []
+        for path in sorted(snapshot.keys()):
+            mtime_ns, size, inode, is_directory = snapshot[path]
+            if path not in previous:
+                source_path = removed_by_inode.pop(inode, None)
+                if source_path is not None:
+                    del removed[source_path]
+                    changes.append(('moved', source_path, path,
+                                    is_directory))
+                else:
+                    changes.append(('created', path, None, is_directory))
+            elif not is_directory and previous[path][:2] != (mtime_ns, size):
+                changes.append(('modified', path, None, is_directory))
+
+        for path in sorted(removed.keys()):
+            changes.append(('deleted', path, None, removed[path][3]))
+
+        # Drop changes to paths within a directory which was itself
+        # moved or deleted, since the directory event covers them
+        moved_or_deleted_dirs = [change[1] + '/' for change in changes
+                                 if change[3] and
+                                 change[0] in ['moved', 'deleted']]
+        return [change for change in changes
+                if not any(change[1].startswith(prefix)
+                           for prefix in moved_or_deleted_dirs)]
+
+    def close(self) -> None:
+        pass
+
+
+class InotifyBackend:
+    '''Detects changes using inotify, with a watch on every
+       non-hidden directory within the notes directory
+    '''
+
+    def __init__(self, notes_directory: DirectoryPath):
+        self.notes_directory = notes_directory
+        self.libc = load_libc()
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+        self.watches: Dict[int, InternalAbsolutePath] = {}
+        # Moves out of a directory which haven't been matched with a move
+        # into another directory yet, keyed by the inotify move cookie
+        self.pending_moves: Dict[int, Tuple[InternalAbsolutePath, bool]] = {}
+        self.add_watches('')
+
+    def add_watch(self, path: InternalAbsolutePath) -> None:
+        full_path = self.notes_directory + path
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(full_path),
+                                         WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, 'The inotify watch limit was reached')
+            log.warning(f'Unable to watch {full_path}: '
+                        f'{os.strerror(error)}')
+            return
+        self.watches[wd] = path
+
+    def add_watches(self, path: InternalAbsolutePath) -> List[RawChange]:
+        '''Watch a directory and everything within it, and return changes
+           for any files which were created within it before the watches
+           were in place
+        '''
+        changes: List[RawChange] = []
+        pending_dirs = [path]
+        while pending_dirs:
+            current_dir = pending_dirs.pop()
+            self.add_watch(current_dir)
+            try:
+                entries = list(os.scandir(self.notes_directory + current_dir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                entry_path = f'{current_dir}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry_path)
+                elif current_dir != path:
+                    changes.append(('created', entry_path, None, False))
+        return changes
+
+    def rename_watches(self, source_path: InternalAbsolutePath,
+                       dest_path: InternalAbsolutePath) -> None:
+        for wd, path in self.watches.items():
+            if path == source_path or path.startswith(source_path + '/'):
+                self.watches[wd] = dest_path + path[len(source_path):]
+
+    def read_changes(self, timeout: float) -> List[RawChange]:
+        changes: List[RawChange] = []
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            try:
+                data = os.read(self.fd, READ_BUFFER_SIZE)
+            except BlockingIOError:
+                data = b''
+            changes.extend(self.parse_events(data))
+        elif self.pending_moves:
+            # Anything moved out of a watched directory that didn't turn up
+            # in another one was moved out of the notes directory entirely
+            for source_path, is_directory in self.pending_moves.values():
+                changes.append(('deleted', source_path, None, is_directory))
+            self.pending_moves = {}
+
+        return [change for change in changes
+                if not is_hidden_path(change[1])]
+
+    def parse_events(self, data: bytes) -> List[RawChange]:
+        changes: List[RawChange] = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_length = EVENT_HEADER.unpack_from(
+                data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(
+                data[offset:offset + name_length].rstrip(b'\0'))
+            offset += name_length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, so the whole directory may have changed
+                log.warning('inotify event queue overflowed')
+                changes.append(('modified', '/', None, True))
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = f'{directory}/{name}'
+            is_directory = bool(mask & IN_ISDIR)
+
+            if mask & IN_CREATE:
+                changes.append(('created', path, None, is_directory))
+                if is_directory and not name.startswith('.'):
+                    changes.extend(self.add_watches(path))
+            elif mask & (IN_MODIFY | IN_CLOSE_WRITE):
+                if not is_directory:
+                    changes.append(('modified', path, None, False))
+            elif mask & IN_DELETE:
+                changes.append(('deleted', path, None, is_directory))
+            elif mask & IN_MOVED_FROM:
+                self.pending_moves[cookie] = (path, is_directory)
+            elif mask & IN_MOVED_TO:
+                source = self.pending_moves.pop(cookie, None)
+                if source is None:
+                    changes.append(('created', path, None, is_directory))
+                    if is_directory:
+                        changes.extend(self.add_watches(path))
+                elif is_hidden_path(source[0]):
+                    changes.append(('created', path, None, is_directory))
+                elif is_hidden_path(path):
+                    changes.append(('deleted', source[0], None,
+                                    is_directory))
+                else:
+                    changes.append(('moved', source[0], path, is_directory))
+                    if is_directory:
+                        self.rename_watches(source[0], path)
+
+        return changes
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def load_libc() -> ctypes.CDLL:
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                       ctypes.c_uint32]
+    return libc
+
+
+def is_inotify_supported() -> bool:
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        return hasattr(load_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+
+class NotesWatcher:
+    '''Watch the notes directory for changes in a background thread, and
+       publish each debounced batch of changes to all subscribers
+    '''
+
+    def __init__(self, notes_directory: DirectoryPath,
+                 debounce_seconds: float = DEFAULT_DEBOUNCE_SECONDS,
+                 max_delay_seconds: float = DEFAULT_MAX_DELAY_SECONDS,
+                 use_inotify: Optional[bool] = None,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL_SECONDS):
+        self.notes_directory = notes_directory.rstrip('/')
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.subscribers: List[ChangeSubscriber] = []
+        self.pending_changes: List[RawChange] = []
+        self.first_change_time = 0.0
+        self.last_change_time = 0.0
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+
+        if use_inotify is None:
+            use_inotify = is_inotify_supported()
+
+        self.backend: Union[InotifyBackend, PollingBackend]
+        if use_inotify:
+            try:
+                self.backend = InotifyBackend(self.notes_directory)
+                log.info(f'Watching {self.notes_directory} with inotify')
+                return
+            except OSError as e:
+                log.warning(f'Unable to use inotify, falling back to '
+                            f'polling: {e}')
+        self.backend = PollingBackend(self.notes_directory, poll_interval)
+        log.info(f'Watching {self.notes_directory} by polling')
+
+    def subscribe(self, subscriber: ChangeSubscriber) -> None:
+        self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: ChangeSubscriber) -> None:
+        self.subscribers.remove(subscriber)
+
+    def publish(self, events: List[ChangeEvent]) -> None:
+        for subscriber in list(self.subscribers):
+            try:
+                subscriber(events)
+            except Exception:
+                log.exception(f'Watcher subscriber {subscriber} failed')
+
+    def process_changes(self, timeout: float = DEFAULT_DEBOUNCE_SECONDS
+                        ) -> List[ChangeEvent]:
+        '''Wait up to `timeout` seconds for new changes, and publish the
+           pending changes if the debounce period has passed. Returns the
+           events which were published, if any
+        '''
+        changes = self.backend.read_changes(timeout)
+        now = time.monotonic()
+        if changes:
+            if not self.pending_changes:
+                self.first_change_time = now
+            self.last_change_time = now
+            self.pending_changes.extend(changes)
+
+        if not self.pending_changes:
+            return []
+        if now - self.last_change_time < self.debounce_seconds and \
+                now - self.first_change_time < self.max_delay_seconds:
+            return []
+
+        events = coalesce_changes(self.pending_changes)
+        self.pending_changes = []
+        if events:
+            log.debug(f'Publishing {len(events)} change events')
+            self.publish(events)
+        return events
+
+    def run(self) -> None:
+        # Wake up often enough to notice when the watcher is stopped
+        timeout = max(min(self.debounce_seconds, 0.5), 0.1)
+        while not self.stop_event.is_set():
+            try:
+                self.process_changes(timeout=timeout)
+            except Exception:
+                log.exception('Error while watching the notes directory')
+                time.sleep(1)
+
+    def start(self) -> None:
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='shorthand-watcher')
+        self.thread.start()
+
+    def stop(self) -> None:
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.backend.close()
@@ -1,23 +1,32 @@
 import logging
 import os
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Annotated, Dict, List, Literal, Optional, Union
 
-from fastapi import FastAPI, Body, Response, UploadFile
+from fastapi import FastAPI, Body, Query, Response, UploadFile
 from fastapi.responses import PlainTextResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic_settings import BaseSettings
 
 from shorthand import ShorthandServer
+from shorthand.blame import BlameLine
 from shorthand.calendar import Calendar, CalendarMode
-from shorthand.edit_history import NoteDiff, NoteDiffType, NoteVersion, NoteVersionTimestamp
+from shorthand.edit_history import NoteDiff, NoteDiffTimestamp, NoteDiffType, NoteVersion, NoteVersionTimestamp
 from shorthand.edit_timeline import EditTimeline
+from shorthand.history_compaction import DEFAULT_HISTORY_RETENTION_DAYS, \
+                                         HistoryCompactionStats
+from shorthand.elements.combined import ElementType, Elements
 from shorthand.elements.definitions import Definition
 from shorthand.elements.locations import Location
 from shorthand.elements.questions import QuestionStatus
 from shorthand.elements.todos import Todo, TodoStatus, analyze_todos
-from shorthand.frontend.render import RenderedMarkdown, get_rendered_markdown
+from shorthand.frontend.render import RenderedMarkdown
+from shorthand.frontend.render_cache import RenderCacheStats
+from shorthand.frontend.typeahead_sources import DEFAULT_TYPEAHEAD_LIMIT, \
+                                                 TypeaheadSource
 from shorthand.notes import Link
 from shorthand.search import AggregatedFullTextSearchResult, \
                              FullTextSearchResult
@@ -47,11 +56,40 @@ class Settings(BaseSettings):
 settings = Settings()
 
 
+# A single server is shared by all requests handled by this worker. The lock
+# ensures that only one request at a time can reload its config
+server_lock = threading.Lock()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.server = ShorthandServer(settings.config_path)
+    if app.state.server.watch_notes:
+        app.state.server.start_watcher()
+    yield
+    app.state.server.stop_watcher()
+    app.state.server.stop_history_worker()
+
+
+def get_server() -> ShorthandServer:
+    '''Get the shared server for this worker, reloading its config first
+       if the config file was modified since it was last loaded
+    '''
+    with server_lock:
+        server = getattr(app.state, 'server', None)
+        if server is None:
+            server = app.state.server = ShorthandServer(settings.config_path)
+        else:
+            server.reload_config_if_changed()
+    return server
+
+
 app = FastAPI(
     title='Shorthand API',
     summary='summary',
     description='description',
-    version='0.1.0'
+    version='0.1.0',
+    lifespan=lifespan
 )
 
 
@@ -71,17 +109,18 @@ app.mount("/static/media", StaticFiles(directory=f"{STATIC_FOLDER}/static/media"
     # description=''
     )
 def get_server_config() -> ShorthandConfig:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     log.info('Returning config')
     return server.get_config()
 
 
 @app.post('/api/v1/config', tags=['Config'], response_class=PlainTextResponse)
 def update_server_config(updates: ShorthandConfigUpdates) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     log.info('Updating config')
-    server.update_config(updates)
-    server.save_config()
+    with server_lock:
+        # Saves the updated config and reloads it
+        server.update_config(updates)
     return 'ack'
 
 
@@ -93,19 +132,21 @@ def update_server_config(updates: ShorthandConfigUpdates) -> ACKResponse:
 def get_search_results(
         query_string: str,
         case_sensitive: bool = False,
-        aggregate_by_file: bool = False
+        aggregate_by_file: bool = False,
+        include_highlights: bool = False
         ) -> Union[list[FullTextSearchResult],
                    list[AggregatedFullTextSearchResult]]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.search_full_text(
         query_string=query_string,
         case_sensitive=case_sensitive,
-        aggregate_by_file=aggregate_by_file)
+        aggregate_by_file=aggregate_by_file,
+        include_highlights=include_highlights)
 
 
 @app.get('/api/v1/note', tags=['Notes'], response_class=PlainTextResponse)
 def get_full_note(path: NotePath) -> RawNoteContent:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_note(path)
 
 
@@ -113,14 +154,14 @@ def get_full_note(path: NotePath) -> RawNoteContent:
 def write_updated_note(path: NotePath,
                        content: Annotated[RawNoteContent, Body()]
                        ) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     server.update_note(path, content)
     return 'ack'
 
 
 @app.get('/api/v1/resource', tags=['Resources'], response_class=FileResponse)
 def get_resource(path: ResourcePath):
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     if _is_resource_path(server.notes_directory, path, must_exist=True):
         return FileResponse(
             path=get_full_path(server.notes_directory, path),
@@ -131,13 +172,13 @@ def get_resource(path: ResourcePath):
 
 @app.get('/api/v1/toc', tags=['Notes'])
 def get_toc_data(include_resources: bool = False) -> TOC:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_toc(include_resources=include_resources)
 
 
 @app.get('/api/v1/subdirs', tags=['Notes'])
 def get_subdirs_data() -> List[Subdir]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_subdirs()
 
 
@@ -148,7 +189,7 @@ def get_note_links(source: Optional[NotePath] = None,
                    include_external: bool = False,
                    include_invalid: bool = False
                    ) -> List[Link]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_links(source=source, target=target, note=note,
                             include_external=include_external,
                             include_invalid=include_invalid)
@@ -156,26 +197,47 @@ def get_note_links(source: Optional[NotePath] = None,
 
 @app.get('/api/v1/links/validate', tags=['Notes'])
 def validate_note_links(source: NotePath) -> list[Link]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.validate_internal_links(source=source)
 
 
 @app.get('/api/v1/typeahead', tags=['Notes'])
-def get_typeahead(query: str) -> List[str]:
-    server = ShorthandServer(settings.config_path)
-    return server.get_typeahead_suggestions(
-            query_string=query)
+def get_typeahead(query: str,
+                  source: Annotated[Optional[List[TypeaheadSource]],
+                                    Query()] = None,
+                  limit: Annotated[Optional[List[int]], Query()] = None
+                  ) -> Union[List[str], Dict[TypeaheadSource, List[str]]]:
+    '''Get completions for a query. Without any `source`, this completes
+       the last word of a search query. Otherwise, completions from each
+       `source` are returned, with either a single `limit` for all of
+       them or one `limit` for each source, in the same order
+    '''
+    server = get_server()
+    if not source:
+        return server.get_typeahead_suggestions(
+            query_string=query,
+            limit=limit[0] if limit else DEFAULT_TYPEAHEAD_LIMIT)
+
+    if not limit:
+        limit = [DEFAULT_TYPEAHEAD_LIMIT]
+    if len(limit) == 1:
+        limit = limit * len(source)
+    if len(limit) != len(source):
+        raise ValueError(f'Got {len(limit)} limits for {len(source)} '
+                         f'typeahead sources')
+    return server.get_typeahead_completions(
+        query_string=query, sources=dict(zip(source, limit)))
 
 
 @app.get('/api/v1/stamp', tags=['Notes'])
 def stamp() -> StampingChanges:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.stamp_notes()
 
 
 @app.post('/api/v1/stamp/raw', tags=['Notes'], response_class=PlainTextResponse)
 def stamp_raw(raw_note: Annotated[RawNoteContent, Body()]) -> RawNoteContent:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.stamp_raw_note(raw_note)
 
 
@@ -183,7 +245,7 @@ def stamp_raw(raw_note: Annotated[RawNoteContent, Body()]) -> RawNoteContent:
 def get_files(query_string: Optional[str] = None,
               prefer_recent: bool = True,
               case_sensitive: bool = True) -> List[NotePath]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.search_filenames(
         prefer_recent=prefer_recent,
         query_string=query_string, case_sensitive=case_sensitive)
@@ -191,7 +253,7 @@ def get_files(query_string: Optional[str] = None,
 
 @app.post('/api/v1/record_view', tags=['Notes'], response_class=PlainTextResponse)
 def record_file_view_api(note_path: NotePath) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     server.record_file_view(note_path=note_path)
     return 'ack'
 
@@ -200,7 +262,7 @@ def record_file_view_api(note_path: NotePath) -> ACKResponse:
 @app.get('/api/v1/tags', tags=['Elements'])
 def fetch_tags(directory_filter: Optional[Subdir] = None
                ) -> WrappedResponse[str]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     if directory_filter == 'ALL':
         directory_filter = None
     tags = server.get_tags(directory_filter=directory_filter)
@@ -212,16 +274,30 @@ def fetch_tags(directory_filter: Optional[Subdir] = None
 def fetch_calendar(mode: CalendarMode = 'recent',
                    directory_filter: Optional[Subdir] = None
                    ) -> Calendar:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     if directory_filter == 'ALL':
         directory_filter = None
     return server.get_calendar(mode=mode, directory_filter=directory_filter)
 
 
+@app.get('/api/v1/elements', tags=['Elements'])
+def fetch_elements(element_types: Annotated[Optional[List[ElementType]],
+                                            Query()] = None,
+                   directory_filter: Optional[Subdir] = None,
+                   calendar_mode: CalendarMode = 'recent'
+                   ) -> Elements:
+    server = get_server()
+    if directory_filter in ['ALL', '']:
+        directory_filter = None
+    return server.get_elements(element_types=element_types,
+                               directory_filter=directory_filter,
+                               calendar_mode=calendar_mode)
+
+
 @app.get('/api/v1/locations', tags=['Elements'])
 def get_gps_locations(directory_filter: Optional[Subdir]
                       ) -> WrappedResponse[Location]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     locations = server.get_locations(directory_filter=directory_filter)
     return wrap_response_data(locations)
 
@@ -235,7 +311,7 @@ def get_current_todos(status: TodoStatus = 'incomplete',
                       suppress_future: bool = True,
                       case_sensitive: bool = False
                       ) -> WrappedResponse[Todo]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if directory_filter in ['ALL', '']:
         directory_filter = None
@@ -258,7 +334,7 @@ def get_current_todos(status: TodoStatus = 'incomplete',
 @app.post('/api/v1/mark_todo', tags=['Elements'], response_class=PlainTextResponse)
 def mark_todo_status(filename: NotePath, line_number: int,
                      status: TodoStatus) -> RawNoteLine:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.mark_todo(note_path=filename, line_number=line_number,
                             status=status)
 
@@ -268,7 +344,7 @@ def mark_todo_status(filename: NotePath, line_number: int,
 def fetch_questions(status: QuestionStatus = 'all',
                     directory_filter: Optional[Subdir] = None
                     ) -> WrappedResponse[dict]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if directory_filter == 'ALL':
         directory_filter = None
@@ -288,7 +364,7 @@ def fetch_definitions(directory_filter: Optional[Subdir] = None,
                       search_term_only: bool = True,
                       include_sub_elements: bool = False
                       ) -> WrappedResponse[Definition]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if directory_filter == 'ALL':
         directory_filter = None
@@ -306,7 +382,7 @@ def fetch_definitions(directory_filter: Optional[Subdir] = None,
 def fetch_definitions_csv(response: Response,
                           directory_filter: Optional[Subdir] = None
                           ) -> CSVData:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if directory_filter == 'ALL':
         directory_filter = None
@@ -323,7 +399,7 @@ def fetch_definitions_csv(response: Response,
 @app.get('/api/v1/record_sets', tags=['Elements'])
 def fetch_record_sets(directory_filter: Optional[Subdir] = None
                       ) -> WrappedResponse[dict]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if directory_filter == 'ALL':
         directory_filter = None
@@ -337,7 +413,7 @@ def fetch_record_sets(directory_filter: Optional[Subdir] = None
 def fetch_record_set(file_path: NotePath, line_number: int,
                      parse: bool = True, include_config: bool = False,
                      parse_format: str = 'json') -> Dict:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_record_set(
         file_path=file_path,
         line_number=line_number,
@@ -350,7 +426,7 @@ def fetch_record_set(file_path: NotePath, line_number: int,
 def filesystem_create(path: InternalAbsolutePath,
                       type: Literal['file', 'directory'] = 'file'
                       ) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if type == 'file':
         server.create_file(path)
@@ -364,7 +440,7 @@ def filesystem_create(path: InternalAbsolutePath,
 @app.post('/api/v1/filesystem/move', tags=['Filesystem'], response_class=PlainTextResponse)
 def filesystem_move(source: InternalAbsolutePath,
                     destination: InternalAbsolutePath) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     server.move_file_or_directory(source, destination)
     return 'ack'
 
@@ -374,7 +450,7 @@ def filesystem_delete(path: InternalAbsolutePath,
                       type: Literal['file', 'directory'] = 'file',
                       recursive: bool = False
                       ) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     if type == 'file':
         server.delete_file(path)
@@ -387,7 +463,7 @@ def filesystem_delete(path: InternalAbsolutePath,
 
 @app.post('/api/v1/filesystem/upload', tags=['Filesystem'], response_class=PlainTextResponse)
 def filesystem_upload(directory: Subdir, file: UploadFile) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
 
     # If the user does not select a file, the browser submits an
     # empty file without a filename.
@@ -400,7 +476,7 @@ def filesystem_upload(directory: Subdir, file: UploadFile) -> ACKResponse:
 
 @app.get('/api/v1/archive', tags=['Notes'])
 def get_archive() -> bytes:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return Response(
         content=server.get_note_archive(),
         media_type="application/x-xz",
@@ -409,15 +485,18 @@ def get_archive() -> bytes:
 
 
 @app.get('/api/v1/edit_timeline', tags=['History'])
-def get_edit_timeline(note_path: NotePath) -> EditTimeline:
-    server = ShorthandServer(settings.config_path)
-    return server.get_edit_timeline(note_path=note_path)
+def get_edit_timeline(note_path: NotePath,
+                      before: Optional[NoteDiffTimestamp] = None,
+                      limit: Optional[int] = None) -> EditTimeline:
+    server = get_server()
+    return server.get_edit_timeline(note_path=note_path, before=before,
+                                    limit=limit)
 
 
 @app.get('/api/v1/note_version', tags=['History'], response_class=PlainTextResponse)
 def get_note_version(note_path: NotePath, timestamp: NoteVersionTimestamp
                      ) -> NoteVersion:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_note_version(note_path=note_path,
                                    version_timestamp=timestamp)
 
@@ -425,40 +504,82 @@ def get_note_version(note_path: NotePath, timestamp: NoteVersionTimestamp
 @app.get('/api/v1/note_diff', tags=['History'], response_class=PlainTextResponse)
 def get_edit_diff(note_path: NotePath, timestamp: NoteVersionTimestamp,
                   diff_type: NoteDiffType) -> NoteDiff:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_note_diff(note_path=note_path,
                                 timestamp=timestamp,
                                 diff_type=diff_type)
 
+
+@app.get('/api/v1/history_queue_depth', tags=['History'])
+def get_history_queue_depth() -> int:
+    server = get_server()
+    return server.get_history_queue_depth()
+
+
+@app.get('/api/v1/note_at', tags=['History'], response_class=PlainTextResponse)
+def get_note_at(note_path: NotePath, timestamp: NoteDiffTimestamp
+                ) -> RawNoteContent:
+    server = get_server()
+    return server.get_note_at(note_path=note_path, timestamp=timestamp)
+
+
+@app.get('/api/v1/note_versions_diff', tags=['History'],
+         response_class=PlainTextResponse)
+def diff_note_versions(note_path: NotePath,
+                       from_timestamp: NoteDiffTimestamp,
+                       to_timestamp: NoteDiffTimestamp) -> NoteDiff:
+    server = get_server()
+    return server.diff_note_versions(note_path=note_path,
+                                     from_timestamp=from_timestamp,
+                                     to_timestamp=to_timestamp)
+
+
+@app.get('/api/v1/note_blame', tags=['History'])
+def get_note_blame(note_path: NotePath) -> List[BlameLine]:
+    server = get_server()
+    return server.get_note_blame(note_path=note_path)
+
+
+@app.post('/api/v1/compact_history', tags=['History'])
+def compact_history(retention_days: int = DEFAULT_HISTORY_RETENTION_DAYS
+                    ) -> HistoryCompactionStats:
+    server = get_server()
+    return server.compact_edit_history(retention_days=retention_days)
+
 # Needs Typing
 @app.get('/frontend-api/rendered-markdown', tags=['Frontend'])
 def send_processed_markdown(path: NotePath) -> RenderedMarkdown:
-    server = ShorthandServer(settings.config_path)
-    file_content = server.get_note(path)
-    return get_rendered_markdown(file_content, path)
+    server = get_server()
+    return server.get_rendered_markdown(path)
+
+
+@app.get('/frontend-api/render-cache-stats', tags=['Frontend'])
+def send_render_cache_stats() -> Optional[RenderCacheStats]:
+    server = get_server()
+    return server.get_render_cache_stats()
 
 
 @app.get('/frontend-api/get-open-files', tags=['Frontend'])
 def send_get_open_files() -> List[NotePath]:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.get_open_files()
 
 
 @app.post('/frontend-api/open-file', tags=['Frontend'], response_class=PlainTextResponse)
 def call_open_file(path: NotePath) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.open_file(path)
 
 
 @app.post('/frontend-api/close-file', tags=['Frontend'], response_class=PlainTextResponse)
 def call_close_file(path: NotePath) -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.close_file(path)
 
 
 @app.post('/frontend-api/clear-open-files', tags=['Frontend'], response_class=PlainTextResponse)
 def call_clear_open_files() -> ACKResponse:
-    server = ShorthandServer(settings.config_path)
+    server = get_server()
     return server.clear_open_files()
 
 
@@ -149,8 +149,7 @@ class ShorthandModel(object):
         return questions
 
     def get_links(self, notes_directory, source=None, target=None, note=None,
-                  include_external=False, include_invalid=False,
-                  grep_path=None):
+                  include_external=False, include_invalid=False):
 
         links = ALL_LINKS
 
@@ -194,7 +193,7 @@ class ShorthandModel(object):
 
         return links
 
-    def get_backlinks(self, notes_directory, note_path, grep_path='grep'):
+    def get_backlinks(self, notes_directory, note_path):
         return self.get_links(notes_directory=notes_directory,
                               target=note_path, include_external=False,
-                              include_invalid=False, grep_path=grep_path)
+                              include_invalid=False)
@@ -0,0 +1,89 @@
+import time
+import logging
+from unittest import mock
+
+from shorthand import edit_history
+from shorthand.blame import _get_note_blame, _load_blame_cache, \
+                            get_blame_cache_path
+from shorthand.edit_history import get_note_history_dir
+from shorthand.history_log import read_history_index
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestBlame(ShorthandTestCase):
+    '''Test annotating the lines of notes with the edits which changed them
+    '''
+
+    def edit_note(self, note_path, content):
+        # Make every edit distinct, and store each one as its own diff
+        time.sleep(0.002)
+        with mock.patch.object(edit_history, 'MERGE_CUTOFF_LIMIT_MIN', 0):
+            self.server.update_note(note_path, content)
+        return self.server.list_diffs_for_note(note_path)[0]['timestamp']
+
+    def get_blame(self, note_path):
+        return [(line['content'], line['timestamp'])
+                for line in self.server.get_note_blame(note_path)]
+
+    def test_blame(self):
+        self.server.create_file('/new.note')
+        first = self.edit_note('/new.note', 'one\ntwo\nthree\n')
+        second = self.edit_note('/new.note', 'one\n2\nthree\nfour\n')
+        assert self.get_blame('/new.note') == [
+            ('one', first), ('2', second), ('three', first), ('four', second)]
+
+        third = self.edit_note('/new.note', 'zero\none\n2\nfour\n')
+        assert self.get_blame('/new.note') == [
+            ('zero', third), ('one', first), ('2', second), ('four', second)]
+        assert self.server.get_note_blame('/new.note')[0]['author'] == \
+            'Unknown'
+
+        # Lines keep their blame when the note is moved
+        self.server.move_file_or_directory('/new.note', '/moved.note')
+        assert self.get_blame('/moved.note') == [
+            ('zero', third), ('one', first), ('2', second), ('four', second)]
+
+    def test_notes_without_history(self):
+        # Notes which existed before their history was stored are blamed
+        # on their first version
+        edit = self.edit_note('/todos.note', 'New first line\n' +
+                              self.server.get_note('/todos.note'))
+        version = self.server.list_note_versions('/todos.note')[0]
+        blame = self.get_blame('/todos.note')
+        assert blame[0] == ('New first line', edit)
+        assert all(timestamp == version for _, timestamp in blame[1:])
+
+        # Changes which aren't in the history yet aren't attributed
+        self.server.update_config({'track_edit_history': False})
+        self.server.update_note('/todos.note', 'Untracked\n')
+        assert self.get_blame('/todos.note') == [('Untracked', None)]
+
+    def test_incremental_blame(self):
+        self.server.create_file('/new.note')
+        timestamps = [self.edit_note('/new.note', f'line {idx}\n' * (idx + 1))
+                      for idx in range(5)]
+        self.get_blame('/new.note')
+
+        # Everything but the latest diff is cached
+        entries = read_history_index(
+            get_note_history_dir(self.notes_dir, '/new.note'))
+        cache = _load_blame_cache(self.notes_dir, '/new.note', entries)
+        assert cache['entry_count'] == len(entries) - 1
+
+        # Only diffs after the cached state are replayed
+        latest = self.edit_note('/new.note', 'line 4\n' * 5 + 'end\n')
+        with mock.patch('shorthand.blame.read_history_record',
+                        wraps=edit_history.read_history_record) as reads:
+            blame = _get_note_blame(self.notes_dir, '/new.note')
+        assert reads.call_count == 2
+        assert [line['timestamp'] for line in blame] == \
+            [timestamps[-1]] * 5 + [latest]
+
+        # The cache is rebuilt when the history log is rewritten
+        with open(get_blame_cache_path(self.notes_dir, '/new.note'), 'w') as f:
+            f.write('not json')
+        assert _get_note_blame(self.notes_dir, '/new.note') == blame
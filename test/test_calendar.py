@@ -15,6 +15,25 @@ class TestCalendar(ShorthandTestCase, reset_per_method=False):
     def test_get_calendar(self):
         calendar = _get_calendar(
             self.notes_dir,
-            directory_filter=None,
-            grep_path=self.grep_path)
+            directory_filter=None)
         assert calendar == CALENDAR
+
+
+class TestDatedHeadings(ShorthandTestCase):
+    """Test adding dated headings to the calendar"""
+
+    def test_dated_heading(self):
+        with open(f'{self.notes_dir}/journal.note', 'w') as f:
+            f.write('# Planning 2024-01-02\n\nSome notes\n')
+
+        for element_index in [False, True]:
+            self.server.update_config({'element_index': element_index})
+            calendar = self.server.get_calendar()
+            assert calendar['2024']['01']['02'] == [{
+                'file_path': '/journal.note',
+                'line_number': '1',
+                'event': 'Planning',
+                'date': '2024-01-02',
+                'element_id': 'Planning-2024-01-02',
+                'type': 'section'
+            }]
@@ -0,0 +1,75 @@
+import random
+import difflib
+import logging
+import unittest
+
+from shorthand.utils.diff import get_opcodes, unified_diff
+from shorthand.utils.patch import apply_patch
+
+
+log = logging.getLogger(__name__)
+
+
+def get_random_edit(rng):
+    vocabulary = [f'line {idx}\n' for idx in range(rng.randint(1, 8))]
+    old = [rng.choice(vocabulary) for _ in range(rng.randint(0, 30))]
+    new = list(old)
+    for _ in range(rng.randint(0, 5)):
+        action = rng.random()
+        if action < 0.4 and new:
+            del new[rng.randrange(len(new))]
+        elif action < 0.8:
+            new.insert(rng.randint(0, len(new)),
+                       rng.choice(vocabulary + ['new line\n']))
+        elif new:
+            new[rng.randrange(len(new))] = 'changed line\n'
+    return old, new
+
+
+class TestDiff(unittest.TestCase):
+    '''Test the line diff used to record edit history
+    '''
+
+    def test_matches_difflib_format(self):
+        old = [f'line {idx}\n' for idx in range(20)]
+        new = list(old)
+        new[2] = 'changed\n'
+        del new[10]
+        new.insert(18, 'added\n')
+        new[-1] = 'no trailing newline'
+        assert list(unified_diff(old, new, 'a', 'b')) == \
+            list(difflib.unified_diff(old, new, 'a', 'b'))
+        assert list(unified_diff(old, old, 'a', 'b')) == []
+        assert list(unified_diff([], [], 'a', 'b')) == []
+        assert list(unified_diff([], ['new\n'], 'a', 'b')) == \
+            list(difflib.unified_diff([], ['new\n'], 'a', 'b'))
+        assert list(unified_diff(old, [], 'a', 'b')) == \
+            list(difflib.unified_diff(old, [], 'a', 'b'))
+
+    def test_random_edits(self):
+        rng = random.Random(0)
+        for _ in range(500):
+            old, new = get_random_edit(rng)
+
+            rebuilt = []
+            for tag, i1, i2, j1, j2 in get_opcodes(old, new):
+                if tag == 'equal':
+                    assert old[i1:i2] == new[j1:j2]
+                rebuilt.extend(new[j1:j2])
+            assert rebuilt == new
+
+            diff = ''.join(unified_diff(old, new, 'a', 'b'))
+            if diff:
+                assert apply_patch(''.join(old), diff) == ''.join(new)
+                assert apply_patch(''.join(new), diff, reverse=True) == \
+                    ''.join(old)
+
+    def test_repeated_lines(self):
+        # Without any unique lines to anchor on, the diff is still minimal
+        old = ['- item\n', '\n'] * 500
+        new = list(old)
+        del new[400]
+        new.insert(700, '- new item\n')
+        diff = list(unified_diff(old, new, 'a', 'b'))
+        assert len([line for line in diff if line[0] in '+-']) == 4
+        assert apply_patch(''.join(old), ''.join(diff)) == ''.join(new)
@@ -2,10 +2,12 @@ import os
 import time
 import logging
 from datetime import datetime, UTC
+from unittest import mock
 
 import pytest
 
-from shorthand.edit_history import HISTORY_PATH, _store_history_for_note_edit, ensure_note_version
+from shorthand import edit_history
+from shorthand.edit_history import HISTORY_PATH, _list_note_checkpoints, _store_history_for_note_edit, apply_diffs, ensure_note_version
 from utils import ShorthandTestCase
 
 
@@ -121,12 +123,12 @@ class TestEditHistory(ShorthandTestCase):
         self.server.create_file('/section/resource.txt')
         self.server.move_file_or_directory('/section', '/newsubdir')
 
-        assert os.path.exists(self.notes_dir + '/.shorthand/history/section/new.note/diffs')
-        assert os.path.exists(self.notes_dir + '/.shorthand/history/section/mixed.note/diffs')
-        assert os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/new.note/diffs')
-        assert os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/mixed.note/diffs')
-        assert not os.path.exists(self.notes_dir + '/.shorthand/history/section/resource.txt/diffs')
-        assert not os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/resource.txt/diffs')
+        assert os.path.exists(self.notes_dir + '/.shorthand/history/section/new.note/history.log')
+        assert os.path.exists(self.notes_dir + '/.shorthand/history/section/mixed.note/history.log')
+        assert os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/new.note/history.log')
+        assert os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/mixed.note/history.log')
+        assert not os.path.exists(self.notes_dir + '/.shorthand/history/section/resource.txt/history.log')
+        assert not os.path.exists(self.notes_dir + '/.shorthand/history/newsubdir/resource.txt/history.log')
 
         assert self.server.list_note_versions('/section/mixed.note')
         assert self.server.list_note_versions('/section/new.note')
@@ -137,6 +139,30 @@ class TestEditHistory(ShorthandTestCase):
         assert self.server.list_diffs_for_note('/newsubdir/mixed.note')
         assert self.server.list_diffs_for_note('/newsubdir/new.note')
 
+    def test_directory_history_progress(self):
+        self.server.create_directory('/section/nested')
+        self.server.create_file('/section/nested/new.note')
+        progress = []
+        self.server.move_file_or_directory(
+            '/section', '/moved',
+            progress_callback=lambda done, total: progress.append((done, total)))
+        assert progress == [(1, 2), (2, 2)]
+
+        # Every move is recorded at the same time
+        move_times = {
+            self.server.list_diffs_for_note(note_path)[0]['timestamp']
+            for note_path in ['/section/mixed.note', '/moved/mixed.note',
+                              '/moved/nested/new.note']}
+        assert len(move_times) == 1
+
+        progress = []
+        self.server.delete_directory(
+            '/moved', recursive=True,
+            progress_callback=lambda done, total: progress.append((done, total)))
+        assert progress == [(1, 2), (2, 2)]
+        assert self.server.list_diffs_for_note(
+            '/moved/nested/new.note')[0]['diff_type'] == 'delete'
+
     def test_storing_delete_diffs(self):
         self.server.create_file('/new.note')
         time.sleep(0.001)
@@ -158,9 +184,20 @@ class TestEditHistory(ShorthandTestCase):
     def test_storing_diffs_for_directory_delete(self):
         self.server.create_file('/section/new.note')
 
-        self.server.delete_directory('/section', recursive=True)
+        os.makedirs(f'{self.notes_dir}/section/.hidden')
+        with open(f'{self.notes_dir}/section/.hidden/skipped.note', 'w') as f:
+            f.write('hidden')
+
+        with mock.patch.object(edit_history, '_write_timeline_manifest',
+                               wraps=edit_history._write_timeline_manifest
+                               ) as write_manifest:
+            self.server.delete_directory('/section', recursive=True)
+            # Each note's version and diff are added to its manifest at once
+            assert write_manifest.call_count == 2
         assert self.server.list_diffs_for_note('/section/mixed.note')
         assert len(self.server.list_diffs_for_note('/section/new.note')) == 2
+        assert not os.path.exists(
+            f'{self.notes_dir}/{HISTORY_PATH}/section/.hidden')
 
     def test_storing_edit_diffs(self):
         _store_history_for_note_edit(
@@ -278,3 +315,78 @@ class TestEditHistory(ShorthandTestCase):
         assert not self.server.list_diffs_for_note('/bugs.note')
         assert not self.server.list_diffs_for_note('/locations.note')
         assert not self.server.list_diffs_for_note('/places.note')
+
+    def get_timestamp(self):
+        # Make sure that changes made before and after this are distinct
+        time.sleep(0.002)
+        timestamp = datetime.now(UTC).isoformat(timespec='milliseconds')
+        time.sleep(0.002)
+        return timestamp
+
+    def test_getting_note_at_timestamp(self):
+        before_create = self.get_timestamp()
+        self.server.create_file('/new.note')
+        after_create = self.get_timestamp()
+
+        states = {}
+        # Disable merging so that every edit is stored as its own diff
+        with mock.patch.object(edit_history, 'MERGE_CUTOFF_LIMIT_MIN', 0):
+            for idx in range(edit_history.MAX_CHECKPOINT_DIFFS + 5):
+                content = '\n'.join(f'line {line}' for line in range(idx)) + \
+                          f'\nedit {idx}\n'
+                self.server.update_note('/new.note', content)
+                states[self.get_timestamp()] = content
+
+        assert _list_note_checkpoints(self.notes_dir, '/new.note')
+        assert self.server.get_note_at('/new.note', after_create) == ''
+        for timestamp, content in states.items():
+            assert self.server.get_note_at('/new.note', timestamp) == content
+        with pytest.raises(ValueError):
+            self.server.get_note_at('/new.note', before_create)
+
+        self.server.move_file_or_directory('/new.note', '/moved.note')
+        after_move = self.get_timestamp()
+        self.server.delete_file('/moved.note')
+        after_delete = self.get_timestamp()
+
+        assert self.server.get_note_at('/moved.note', after_move) == content
+        with pytest.raises(ValueError):
+            self.server.get_note_at('/new.note', after_move)
+        with pytest.raises(ValueError):
+            self.server.get_note_at('/moved.note', after_delete)
+
+    def test_diffing_note_versions(self):
+        self.server.create_file('/new.note')
+        after_create = self.get_timestamp()
+        with mock.patch.object(edit_history, 'MERGE_CUTOFF_LIMIT_MIN', 0):
+            self.server.update_note('/new.note', 'first\nsecond\n')
+            after_first_edit = self.get_timestamp()
+            self.server.update_note('/new.note', 'first\nthird\n')
+            after_second_edit = self.get_timestamp()
+
+        diff = self.server.diff_note_versions('/new.note', after_create,
+                                              after_second_edit)
+        assert '+first\n+third\n' in diff
+        assert 'second' not in diff
+        assert apply_diffs('', [diff]) == 'first\nthird\n'
+
+        # Diffs can also go backwards in time
+        diff = self.server.diff_note_versions('/new.note', after_second_edit,
+                                              after_first_edit)
+        assert '-third\n+second\n' in diff
+
+        # Cached diffs are replaced once more history is stored
+        diff = self.server.diff_note_versions('/new.note', after_create,
+                                              '2999-01-01T00:00:00')
+        assert '+third' in diff
+        time.sleep(0.002)
+        with mock.patch.object(edit_history, 'MERGE_CUTOFF_LIMIT_MIN', 0):
+            self.server.update_note('/new.note', 'first\nfourth\n')
+        diff = self.server.diff_note_versions('/new.note', after_create,
+                                              '2999-01-01T00:00:00')
+        assert '+fourth' in diff
+        assert 'third' not in diff
+
+        with pytest.raises(ValueError):
+            self.server.diff_note_versions('/missing.note', after_create,
+                                           after_second_edit)
@@ -1,10 +1,19 @@
-from datetime import datetime
+from datetime import datetime, UTC
 import os
+import time
 import logging
+from unittest import mock
 
 import pytest
 
+from shorthand import edit_history
+from shorthand.edit_history import _rebuild_timeline_manifest, \
+                                   _store_history_for_note_delete, \
+                                   _store_history_for_note_edit, \
+                                   get_timeline_manifest_path
 from shorthand.edit_timeline import get_edit_timeline
+from shorthand.history_worker import HistoryWorker
+from shorthand.notes import _get_note, _update_note
 from shorthand.types import InternalAbsolutePath
 from utils import ShorthandTestCase
 
@@ -101,3 +110,92 @@ class TestEditHistory(ShorthandTestCase):
         assert len(timeline[0]['diffs'])
         # Check that the day components of the version and diff timestamps match
         assert timeline[0]['diffs'][0]['timestamp'][:10] == timeline[0]['version'][:10]
+
+    def test_timeline_manifest(self):
+        self.server.create_file('/new.note')
+        self.server.update_note('/new.note', 'New Content')
+        self.server.move_file_or_directory('/new.note', '/moved.note')
+        self.server.update_note('/bugs.note', 'Merged')
+        self.server.update_note('/bugs.note', 'Merged Content')
+
+        for note_path in ['/new.note', '/moved.note', '/bugs.note']:
+            assert os.path.exists(
+                get_timeline_manifest_path(self.notes_dir, note_path))
+            timeline = self.server.get_edit_timeline(note_path)
+            os.remove(get_timeline_manifest_path(self.notes_dir, note_path))
+            assert self.server.get_edit_timeline(note_path) == timeline
+
+        manifest = _rebuild_timeline_manifest(self.notes_dir, '/bugs.note')
+        assert len(manifest['diffs']) == 1
+
+    def test_same_millisecond_diff_order(self):
+        '''Test that diffs stored within the same millisecond are listed in
+           the same order, whether the edit was stored by the history
+           worker or directly
+        '''
+        timestamp = datetime(2024, 8, 11, 12, 0, 0, tzinfo=UTC)
+
+        # The edit to the first note is recorded by the history worker
+        worker = HistoryWorker(self.notes_dir)
+        worker.start()
+        with mock.patch('shorthand.history_worker.datetime') as mock_datetime:
+            mock_datetime.now.return_value = timestamp
+            worker.record_edit('/todos.note',
+                               _get_note(self.notes_dir, '/todos.note'),
+                               'Edited\n')
+        _update_note(self.notes_dir, '/todos.note', 'Edited\n')
+        worker.stop()
+        _store_history_for_note_delete(self.notes_dir, '/todos.note',
+                                       timestamp=timestamp)
+
+        # The edit to the second note is stored directly
+        _store_history_for_note_edit(self.notes_dir, '/bugs.note',
+                                     'Edited\n', timestamp=timestamp)
+        _update_note(self.notes_dir, '/bugs.note', 'Edited\n')
+        _store_history_for_note_delete(self.notes_dir, '/bugs.note',
+                                       timestamp=timestamp)
+
+        def get_timeline_order(note_path):
+            return [[(diff['diff_type'], diff['timestamp'])
+                     for diff in entry['diffs']]
+                    for entry in get_edit_timeline(self.notes_dir,
+                                                   note_path)]
+
+        timeline_order = get_timeline_order('/todos.note')
+        assert timeline_order == get_timeline_order('/bugs.note')
+        assert [diff_type for diff_type, _ in timeline_order[0]] == \
+            ['delete', 'edit']
+
+        # Rebuilding the manifests from the stored history keeps the order
+        for note_path in ['/todos.note', '/bugs.note']:
+            os.remove(get_timeline_manifest_path(self.notes_dir, note_path))
+            assert get_timeline_order(note_path) == timeline_order
+
+    def test_paged_timeline(self):
+        self.server.create_file('/new.note')
+        # Disable merging so that every edit is stored as its own diff
+        with mock.patch.object(edit_history, 'MERGE_CUTOFF_LIMIT_MIN', 0):
+            for idx in range(10):
+                time.sleep(0.002)
+                self.server.update_note('/new.note', f'Edit {idx}')
+
+        full_timeline = self.server.get_edit_timeline('/new.note')
+        all_diffs = [diff for entry in full_timeline
+                     for diff in entry['diffs']]
+        assert len(all_diffs) == 11
+
+        paged_diffs = []
+        before = None
+        while True:
+            page = self.server.get_edit_timeline('/new.note', before=before,
+                                                 limit=4)
+            if not page:
+                break
+            page_diffs = [diff for entry in page for diff in entry['diffs']]
+            assert len(page_diffs) <= 4
+            paged_diffs.extend(page_diffs)
+            before = page_diffs[-1]['timestamp']
+        assert paged_diffs == all_diffs
+
+        with pytest.raises(ValueError):
+            self.server.get_edit_timeline('/new.note', limit=0)
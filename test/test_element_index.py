@@ -0,0 +1,137 @@
+import os
+import json
+import logging
+from unittest import mock
+
+from shorthand import element_index
+from shorthand.calendar import _get_calendar
+from shorthand.element_index import ELEMENT_INDEX_PATH, \
+                                    _refresh_element_index, \
+                                    _get_indexed_todos, \
+                                    _get_indexed_questions, \
+                                    _get_indexed_definitions, \
+                                    _get_indexed_locations, \
+                                    _get_indexed_record_sets, \
+                                    _get_indexed_tags, _get_indexed_calendar
+from shorthand.elements.definitions import _get_definitions
+from shorthand.elements.locations import _get_locations
+from shorthand.elements.questions import _get_questions
+from shorthand.elements.record_sets import _get_record_sets
+from shorthand.elements.todos import _get_todos
+from shorthand.tags import _get_tags
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestElementIndex(ShorthandTestCase):
+    '''Test that queries answered by the element index match
+       the results of the grep-based queries
+    '''
+
+    def test_todos_match_grep(self):
+        for todo_status in ['incomplete', 'complete', 'skipped']:
+            for args in [{}, {'directory_filter': 'section'},
+                         {'query_string': 'cooking'},
+                         {'query_string': '"follow up" cooking'},
+                         {'tag': 'baking'}, {'sort_by': 'start_date'},
+                         {'suppress_future': False}]:
+                self.assertCountEqual(
+                    _get_indexed_todos(self.notes_dir, todo_status, **args),
+                    _get_todos(self.notes_dir, todo_status, **args))
+
+    def test_questions_match_grep(self):
+        for question_status in ['all', 'answered', 'unanswered']:
+            for directory_filter in [None, 'section']:
+                self.assertCountEqual(
+                    _get_indexed_questions(self.notes_dir, question_status,
+                                           directory_filter),
+                    _get_questions(self.notes_dir, question_status,
+                                   directory_filter))
+
+    def test_definitions_match_grep(self):
+        for args in [{}, {'directory_filter': 'section'},
+                     {'query_string': 'baking'},
+                     {'query_string': 'baking', 'search_term_only': False},
+                     {'include_sub_elements': True}]:
+            self.assertCountEqual(
+                _get_indexed_definitions(self.notes_dir, **args),
+                _get_definitions(self.notes_dir, **args))
+
+    def test_other_elements_match_grep(self):
+        for directory_filter in [None, 'section']:
+            self.assertCountEqual(
+                _get_indexed_locations(self.notes_dir, directory_filter),
+                _get_locations(self.notes_dir, directory_filter))
+            self.assertCountEqual(
+                _get_indexed_record_sets(self.notes_dir, directory_filter),
+                _get_record_sets(self.notes_dir, directory_filter))
+            self.assertEqual(
+                _get_indexed_tags(self.notes_dir, directory_filter),
+                _get_tags(self.notes_dir, directory_filter))
+
+        for mode in ['recent', 'creation', 'closing', 'wip']:
+            self.assertEqual(
+                _get_indexed_calendar(self.notes_dir, mode),
+                _get_calendar(self.notes_dir, mode))
+
+    def test_incremental_refresh(self):
+        _refresh_element_index(self.notes_dir)
+        assert os.path.exists(f'{self.notes_dir}/{ELEMENT_INDEX_PATH}')
+
+        # Newly created, modified, and deleted notes are picked up
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('# New Note\n- [ ] A brand new todo :newtag:\n')
+        with open(f'{self.notes_dir}/todos.note', 'a') as f:
+            f.write('\n- ? An appended question\n')
+        os.remove(f'{self.notes_dir}/bugs.note')
+
+        index = _refresh_element_index(self.notes_dir)
+        assert '/new.note' in index['notes']
+        assert '/bugs.note' not in index['notes']
+        assert 'newtag' in _get_indexed_tags(self.notes_dir)
+        self.assertCountEqual(
+            _get_indexed_todos(self.notes_dir),
+            _get_todos(self.notes_dir))
+        self.assertCountEqual(
+            _get_indexed_questions(self.notes_dir),
+            _get_questions(self.notes_dir))
+
+        # The index on disk matches the refreshed index
+        with open(f'{self.notes_dir}/{ELEMENT_INDEX_PATH}', 'r') as f:
+            assert json.load(f) == index
+
+    def test_server_uses_index(self):
+        grep_todos = self.server.get_todos()
+        self.server.update_config({'element_index': True})
+        assert self.server.element_index
+        self.assertCountEqual(self.server.get_todos(), grep_todos)
+        assert os.path.exists(f'{self.notes_dir}/{ELEMENT_INDEX_PATH}')
+
+    def test_queries_skip_full_refresh(self):
+        '''Test that only the first query checks every note, and later
+           queries rely on the server keeping the index up to date
+        '''
+        self.server.update_config({'element_index': True})
+        self.server.get_todos()
+
+        with mock.patch.object(element_index, '_list_note_paths') \
+                as list_note_paths:
+            self.server.update_note('/todos.note',
+                                    '- [ ] A todo written by the server\n')
+            todos = self.server.get_todos()
+            assert not list_note_paths.called
+        assert [todo['todo_text'] for todo in todos
+                if todo['file_path'] == '/todos.note'] == \
+            ['A todo written by the server']
+
+        # Changes made outside of the server need an explicit refresh
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('- [ ] An external todo\n')
+        assert not any(todo['file_path'] == '/new.note'
+                       for todo in self.server.get_todos())
+        self.server.refresh_element_index()
+        assert any(todo['file_path'] == '/new.note'
+                   for todo in self.server.get_todos())
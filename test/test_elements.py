@@ -0,0 +1,92 @@
+import logging
+
+from shorthand.calendar import _get_calendar
+from shorthand.element_index import _get_indexed_elements
+from shorthand.elements.combined import ELEMENT_TYPES, _get_elements
+from shorthand.elements.definitions import _get_definitions, \
+                                           get_sub_elements
+from shorthand.elements.extract import extract_note_elements
+from shorthand.elements.locations import _get_locations
+from shorthand.elements.questions import _get_questions
+from shorthand.elements.record_sets import _get_record_sets
+from shorthand.elements.todos import _get_todos
+from shorthand.tags import _get_tags
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestElements(ShorthandTestCase, reset_per_method=False):
+    '''Test fetching several types of elements in a single pass
+    '''
+
+    def test_elements_match_individual_queries(self):
+        for directory_filter in [None, 'section']:
+            elements = _get_elements(self.notes_dir,
+                                     directory_filter=directory_filter)
+            self.assertCountEqual(elements.keys(), ELEMENT_TYPES)
+
+            self.assertCountEqual(
+                elements['todos'],
+                _get_todos(self.notes_dir, 'incomplete', directory_filter) +
+                _get_todos(self.notes_dir, 'complete', directory_filter) +
+                _get_todos(self.notes_dir, 'skipped', directory_filter))
+            self.assertCountEqual(
+                elements['questions'],
+                _get_questions(self.notes_dir, 'all', directory_filter))
+            self.assertCountEqual(
+                elements['definitions'],
+                _get_definitions(self.notes_dir, directory_filter))
+            self.assertCountEqual(
+                elements['locations'],
+                _get_locations(self.notes_dir, directory_filter))
+            self.assertCountEqual(
+                elements['record_sets'],
+                _get_record_sets(self.notes_dir, directory_filter))
+            self.assertEqual(elements['tags'],
+                             _get_tags(self.notes_dir, directory_filter))
+            self.assertEqual(elements['calendar'],
+                             _get_calendar(self.notes_dir, 'recent',
+                                           directory_filter))
+
+    def test_element_types(self):
+        elements = _get_elements(self.notes_dir,
+                                 element_types=['tags', 'questions'])
+        self.assertCountEqual(elements.keys(), ['tags', 'questions'])
+
+        with self.assertRaises(ValueError):
+            _get_elements(self.notes_dir, element_types=['invalid'])
+
+    def test_nested_sub_elements(self):
+        note_content = '\n'.join([
+            '- {outer} Outer term',
+            '  - detail',
+            '  - {inner} Inner term',
+            '    - inner detail',
+            '  - more detail',
+            '- {last} Last term',
+            '    - last detail'])
+        note_lines = note_content.split('\n')
+        definitions = extract_note_elements(note_content)['definitions']
+        assert [definition['term'] for definition in definitions] == \
+            ['outer', 'inner', 'last']
+        for definition in definitions:
+            assert definition['sub_elements'] == \
+                get_sub_elements(note_lines, definition['line_number'])
+        assert definitions[1]['sub_elements'] == '    - inner detail'
+
+    def test_serial_extraction_matches(self):
+        self.assertEqual(_get_elements(self.notes_dir, scan_workers=0),
+                         _get_elements(self.notes_dir, scan_workers=4))
+
+    def test_indexed_elements_match(self):
+        self.assertEqual(_get_indexed_elements(self.notes_dir),
+                         _get_elements(self.notes_dir))
+
+    def test_server_get_elements(self):
+        elements = self.server.get_elements(element_types=['todos'],
+                                            calendar_mode='closing')
+        self.assertCountEqual(elements['todos'],
+                              _get_elements(self.notes_dir)['todos'])
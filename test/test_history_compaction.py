@@ -0,0 +1,118 @@
+import os
+import logging
+from datetime import datetime, UTC, timedelta
+from unittest import mock
+
+from shorthand import history_compaction
+from shorthand.edit_history import HISTORY_PATH, _get_note_version, \
+                                   _list_diffs_for_note, \
+                                   _list_note_versions, \
+                                   _store_history_for_note_edit
+from shorthand.history_compaction import _compact_edit_history, \
+                                         _squash_note_diffs
+from shorthand.notes import _get_note, _update_note
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestHistoryCompaction(ShorthandTestCase):
+    '''Test compacting old edit history
+    '''
+
+    def edit_note(self, note_path, content, timestamp):
+        old_content = _get_note(self.notes_dir, note_path)
+        _store_history_for_note_edit(self.notes_dir, note_path, content,
+                                     old_content=old_content,
+                                     timestamp=timestamp)
+        _update_note(self.notes_dir, note_path, content)
+
+    def test_compacting_history(self):
+        # Edit a note several times a day, on three days of the same week
+        today = datetime.now(UTC).replace(hour=0, minute=0, second=0,
+                                          microsecond=0)
+        monday = today - timedelta(days=today.weekday() + 7 * 8)
+        original_content = _get_note(self.notes_dir, '/todos.note')
+        lines = original_content.split('\n')
+        end_of_day_states = {}
+        for day in range(3):
+            for edit in range(4):
+                timestamp = monday + timedelta(days=day, hours=edit + 1)
+                lines.insert(edit * 3, f'Day {day} edit {edit}')
+                self.edit_note('/todos.note', '\n'.join(lines), timestamp)
+            end_of_day_states[timestamp] = '\n'.join(lines)
+        self.edit_note('/todos.note', 'Recent\n', today)
+        # A copy of a note has a version identical to the original's
+        _update_note(self.notes_dir, '/bugs.note', '\n'.join(lines))
+        self.edit_note('/bugs.note', 'Copied\n', today)
+
+        versions = _list_note_versions(self.notes_dir, '/todos.note')
+        assert len(versions) == 4
+        assert len(_list_diffs_for_note(self.notes_dir, '/todos.note')) == 13
+        history_before = {
+            timestamp: self.server.get_note_at('/todos.note',
+                                               timestamp.isoformat())
+            for timestamp in end_of_day_states}
+
+        stats = _compact_edit_history(self.notes_dir, retention_days=30)
+        assert stats['notes'] == 1
+        assert stats['diffs_squashed'] == 9
+        assert stats['versions_removed'] == 2
+        assert stats['files_compressed'] == 1
+        assert stats['files_deduplicated'] == 1
+        assert stats['bytes_reclaimed'] > 0
+        assert stats['bytes_reclaimed'] == \
+            stats['bytes_before'] - stats['bytes_after']
+
+        # One diff is kept for each day, and one version for the week
+        diffs = _list_diffs_for_note(self.notes_dir, '/todos.note')
+        assert len(diffs) == 4
+        versions = _list_note_versions(self.notes_dir, '/todos.note')
+        assert len(versions) == 2
+        history_dir = f'{self.notes_dir}/{HISTORY_PATH}/todos.note'
+        assert os.path.exists(f'{history_dir}/{versions[0]}.version.xz')
+        assert _get_note_version(self.notes_dir, '/todos.note', versions[0]) \
+            == original_content
+
+        # The state of the note at the end of each day is unchanged
+        for timestamp, content in end_of_day_states.items():
+            assert history_before[timestamp] == content
+            assert self.server.get_note_at(
+                '/todos.note', timestamp.isoformat()) == content
+        assert self.server.get_note_at('/todos.note',
+                                       today.isoformat()) == 'Recent\n'
+
+        # Compaction doesn't change anything when run again
+        stats = _compact_edit_history(self.notes_dir, retention_days=30)
+        assert stats['diffs_squashed'] == 0
+        assert stats['versions_removed'] == 0
+        assert stats['files_compressed'] == 0
+
+    def test_edit_during_compaction(self):
+        '''Test that edits recorded while a note is being compacted
+           aren't lost when its history log is replaced
+        '''
+        today = datetime.now(UTC).replace(microsecond=0)
+        old_day = today - timedelta(days=60)
+        for edit in range(3):
+            self.edit_note('/todos.note', f'Old edit {edit}\n',
+                           old_day + timedelta(hours=edit))
+
+        def squash_after_edit(*args, **kwargs):
+            if squash.call_count == 1:
+                self.edit_note('/todos.note', 'New edit\n', today)
+            return _squash_note_diffs(*args, **kwargs)
+
+        with mock.patch.object(history_compaction, '_squash_note_diffs',
+                               side_effect=squash_after_edit) as squash:
+            stats = _compact_edit_history(self.notes_dir, retention_days=30)
+        assert squash.call_count == 2
+        assert stats['diffs_squashed'] == 2
+        assert self.server.get_note_at('/todos.note',
+                                       today.isoformat()) == 'New edit\n'
+
+    def test_invalid_retention(self):
+        with self.assertRaises(ValueError):
+            self.server.compact_edit_history(retention_days=-1)
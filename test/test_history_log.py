@@ -0,0 +1,134 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from shorthand.edit_history import HISTORY_PATH, _migrate_edit_history
+from shorthand.history_log import HistoryLogRecord, _scan_history_log, \
+                                  append_history_record, \
+                                  delete_history_record, \
+                                  get_history_index_path, \
+                                  get_history_log_path, \
+                                  get_latest_history_entry, \
+                                  read_history_index, read_history_records
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+def get_record(diff_type, timestamp, diff='') -> HistoryLogRecord:
+    return HistoryLogRecord(diff_type, timestamp, 'Unknown',
+                            diff or f'Author: Unknown\nTime: {timestamp}\n')
+
+
+class TestHistoryLog(ShorthandTestCase):
+    '''Test the packed history log which stores the diffs for each note
+    '''
+
+    def setUp(self):
+        self.history_dir = f'{self.notes_dir}/{HISTORY_PATH}/todos.note'
+
+    def test_append_and_read(self):
+        records = [
+            get_record('create', '2024-08-06T01:54:23.789+00:00'),
+            get_record('edit', '2024-08-07T01:54:23.789+00:00',
+                       'Author: Someone\n\n--- a\n+++ b\n@@ -1 +1 @@\n-ü\n+x\n'),
+            get_record('move', '2024-08-08T01:54:23.789+00:00'),
+        ]
+        assert get_latest_history_entry(self.history_dir) is None
+        for record in records:
+            append_history_record(self.history_dir, record)
+
+        assert read_history_records(self.history_dir) == records
+        assert [entry.timestamp for entry in
+                read_history_index(self.history_dir)] == \
+            [record.timestamp for record in records]
+        latest_entry = get_latest_history_entry(self.history_dir)
+        assert latest_entry.diff_type == 'move'
+
+        with self.assertRaises(ValueError):
+            append_history_record(self.history_dir, records[-1])
+
+    def test_replace_and_delete(self):
+        first = get_record('create', '2024-08-06T01:54:23.789+00:00')
+        second = get_record('edit', '2024-08-07T01:54:23.789+00:00')
+        merged = get_record('edit', '2024-08-07T01:59:23.789+00:00')
+        append_history_record(self.history_dir, first)
+        append_history_record(self.history_dir, second)
+        append_history_record(self.history_dir, merged, replace_latest=True)
+        assert read_history_records(self.history_dir) == [first, merged]
+
+        delete_history_record(self.history_dir, 'create', first.timestamp)
+        assert read_history_records(self.history_dir) == [merged]
+        delete_history_record(self.history_dir, 'edit', merged.timestamp)
+        assert read_history_records(self.history_dir) == []
+        with self.assertRaises(ValueError):
+            delete_history_record(self.history_dir, 'edit', merged.timestamp)
+
+    def test_index_recovery(self):
+        records = [get_record('edit', f'2024-08-0{day}T01:54:23.789+00:00')
+                   for day in range(1, 4)]
+        for record in records:
+            append_history_record(self.history_dir, record)
+
+        # A missing index is rebuilt from the log
+        os.remove(get_history_index_path(self.history_dir))
+        assert read_history_records(self.history_dir) == records
+
+        # A record which was only partially written is skipped by readers,
+        # which leave the log as it is, and removed by the next writer
+        log_path = get_history_log_path(self.history_dir)
+        with open(log_path, 'ab') as f:
+            f.write(b'\x00\x00\x01\x00partial')
+        log_size = os.path.getsize(log_path)
+        assert get_latest_history_entry(self.history_dir).timestamp == \
+            records[-1].timestamp
+        assert read_history_records(self.history_dir) == records
+        assert os.path.getsize(log_path) == log_size
+
+        records.append(get_record('edit', '2024-08-05T01:54:23.789+00:00'))
+        append_history_record(self.history_dir, records[-1])
+        assert read_history_records(self.history_dir) == records
+
+    def test_concurrent_appends(self):
+        records = [get_record('edit', f'2024-08-{day:02d}T01:54:23.789+00:00')
+                   for day in range(1, 29)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(
+                lambda record: append_history_record(self.history_dir,
+                                                     record),
+                records))
+        self.assertCountEqual(read_history_records(self.history_dir),
+                              records)
+        # The index matches the records in the log
+        with open(get_history_log_path(self.history_dir), 'rb') as f:
+            assert read_history_index(self.history_dir) == \
+                _scan_history_log(f.read())
+
+    def test_migrating_legacy_diffs(self):
+        legacy_diffs = {
+            '/todos.note': ['2024-08-06T01:54:23.789+00:00.create.diff',
+                            '2024-08-11T08:29:23.789+00:00.edit.diff'],
+            '/section/mixed.note': ['2024-08-07T01:54:23.789+00:00.edit.diff']
+        }
+        for note_path, filenames in legacy_diffs.items():
+            for filename in filenames:
+                day_dir = filename[:10].replace('-', '/')
+                diff_path = f'{self.notes_dir}/{HISTORY_PATH}{note_path}/' + \
+                            f'diffs/{day_dir}/{filename}'
+                os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+                with open(diff_path, 'w') as f:
+                    f.write(f'Author: Someone\nTime: {filename[:29]}\n')
+
+        assert _migrate_edit_history(self.notes_dir) == \
+            ['/section/mixed.note', '/todos.note']
+        assert not os.path.exists(f'{self.history_dir}/diffs')
+        records = read_history_records(self.history_dir)
+        assert [(record.diff_type, record.author) for record in records] == \
+            [('create', 'Someone'), ('edit', 'Someone')]
+        assert _migrate_edit_history(self.notes_dir) == []
+
+        # The server lists the migrated diffs as it would have before
+        diffs = self.server.list_diffs_for_note('/todos.note')
+        assert [diff['diff_type'] for diff in diffs] == ['edit', 'create']
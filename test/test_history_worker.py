@@ -0,0 +1,82 @@
+import logging
+
+from shorthand.edit_history import _get_note_diff, _list_diffs_for_note
+from shorthand.history_worker import HistoryWorker
+from shorthand.notes import _get_note, _update_note
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestHistoryWorker(ShorthandTestCase):
+    '''Test recording edit history in the background
+    '''
+
+    def edit_note(self, worker, note_path, content):
+        old_content = _get_note(self.notes_dir, note_path)
+        worker.record_edit(note_path, old_content, content)
+        _update_note(self.notes_dir, note_path, content)
+
+    def test_coalescing_edits(self):
+        worker = HistoryWorker(self.notes_dir, coalesce_seconds=60)
+        worker.start()
+        try:
+            original_content = _get_note(self.notes_dir, '/todos.note')
+            for idx in range(3):
+                self.edit_note(worker, '/todos.note', f'Edit {idx}\n')
+            self.edit_note(worker, '/bugs.note', 'Fixed\n')
+            assert worker.queue_depth() == 2
+            assert not _list_diffs_for_note(self.notes_dir, '/todos.note')
+
+            assert worker.flush()
+            assert worker.queue_depth() == 0
+        finally:
+            worker.stop()
+
+        diffs = _list_diffs_for_note(self.notes_dir, '/todos.note')
+        assert len(diffs) == 1
+        diff = _get_note_diff(self.notes_dir, '/todos.note',
+                              diffs[0]['timestamp'], 'edit')
+        assert '+Edit 2' in diff
+        assert 'Edit 0' not in diff
+        assert self.server.get_note_at('/todos.note', diffs[0]['timestamp']) \
+            == 'Edit 2\n'
+        assert original_content == self.server.get_note_version(
+            '/todos.note', self.server.list_note_versions('/todos.note')[0])
+        assert len(_list_diffs_for_note(self.notes_dir, '/bugs.note')) == 1
+
+    def test_stop_records_queued_edits(self):
+        worker = HistoryWorker(self.notes_dir, coalesce_seconds=60)
+        worker.start()
+        self.edit_note(worker, '/todos.note', 'New Content\n')
+        worker.stop()
+        assert worker.queue_depth() == 0
+        assert len(_list_diffs_for_note(self.notes_dir, '/todos.note')) == 1
+
+        # Edits which arrive after the worker was stopped aren't lost
+        self.edit_note(worker, '/bugs.note', 'Fixed\n')
+        assert worker.queue_depth() == 0
+        assert len(_list_diffs_for_note(self.notes_dir, '/bugs.note')) == 1
+
+    def test_server_async_history(self):
+        self.server.update_config({'async_history': True})
+        try:
+            assert self.server.history_worker is not None
+            self.server.update_note('/todos.note', 'New Content')
+            self.server.update_note('/todos.note', 'Newer Content')
+            assert self.server.get_history_queue_depth() == 1
+
+            # Reading history waits for queued edits to be recorded
+            diffs = self.server.list_diffs_for_note('/todos.note')
+            assert len(diffs) == 1
+            assert self.server.get_history_queue_depth() == 0
+
+            # Queued edits are recorded before a note is deleted
+            self.server.update_note('/bugs.note', 'Fixed')
+            self.server.delete_file('/bugs.note')
+            diffs = self.server.list_diffs_for_note('/bugs.note')
+            assert [d['diff_type'] for d in diffs] == ['delete', 'edit']
+        finally:
+            self.server.stop_history_worker()
@@ -14,8 +14,7 @@ class TestLocations(ShorthandTestCase, reset_per_method=False):
 
     def fetch_locations(self, directory_filter=None):
         return _get_locations(self.notes_dir,
-                              directory_filter=directory_filter,
-                              grep_path=self.grep_path)
+                              directory_filter=directory_filter)
 
     def test_get_locations(self):
         # Compare returned items ignoring the order
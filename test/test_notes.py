@@ -97,16 +97,14 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
 
     def test_validate_internal_links(self):
         invalid_links = _validate_internal_links(
-            notes_directory=self.notes_dir,
-            grep_path=self.grep_path)
+            notes_directory=self.notes_dir)
         _invalid_links = [link for link in ALL_LINKS if not link['valid']]
         self.assertCountEqual(invalid_links, _invalid_links)
 
         source = '/section/mixed.note'
         invalid_links = _validate_internal_links(
             notes_directory=self.notes_dir,
-            source=source,
-            grep_path=self.grep_path)
+            source=source)
         _invalid_links = [link for link in ALL_LINKS
                           if not link['valid'] and link['source'] == source]
         self.assertCountEqual(invalid_links, _invalid_links)
@@ -116,8 +114,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
         # Test Getting all notes
         all_links = _get_links(notes_directory=self.notes_dir,
                                source=None, target=None, note=None,
-                               include_external=True, include_invalid=True,
-                               grep_path=self.grep_path)
+                               include_external=True, include_invalid=True)
         self.assertCountEqual(all_links, ALL_LINKS)
 
     def test_filtering_links(self):
@@ -130,8 +127,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
                 'target': None,
                 'note': None,
                 'include_external': True,
-                'include_invalid': True,
-                'grep_path': self.grep_path
+                'include_invalid': True
             }
             self.assertCountEqual(_get_links(**params),
                                   MODEL.get_links(**params))
@@ -145,8 +141,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
                 'target': test_target,
                 'note': None,
                 'include_external': True,
-                'include_invalid': True,
-                'grep_path': self.grep_path
+                'include_invalid': True
             }
             self.assertCountEqual(_get_links(**params),
                                   MODEL.get_links(**params))
@@ -159,8 +154,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
                 'target': None,
                 'note': test_note,
                 'include_external': True,
-                'include_invalid': True,
-                'grep_path': self.grep_path
+                'include_invalid': True
             }
             self.assertCountEqual(_get_links(**params),
                                   MODEL.get_links(**params))
@@ -182,8 +176,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
                 'target': random.choice(targets) if not use_note else None,
                 'note': random.choice(notes) if use_note else None,
                 'include_external': random.choice(external_options),
-                'include_invalid': random.choice(invalid_options),
-                'grep_path': self.grep_path
+                'include_invalid': random.choice(invalid_options)
             }
             log.debug(f"args: {args}")
             print(args)
@@ -197,8 +190,7 @@ class TestLinkOperations(ShorthandTestCase, reset_per_method=False):
         for target in targets:
             args = {
                 'notes_directory': self.notes_dir,
-                'note_path': target,
-                'grep_path': self.grep_path
+                'note_path': target
             }
             log.debug(f"args: {args}")
             self.assertCountEqual(_get_backlinks(**args),
@@ -0,0 +1,119 @@
+import shutil
+import logging
+import unittest
+
+from shorthand.edit_history import apply_diffs, get_unified_diff as _diff
+from shorthand.utils.patch import apply_patch, parse_unified_diff
+
+
+log = logging.getLogger(__name__)
+
+
+def get_unified_diff(old, new):
+    return _diff(old, new, path='/test.note')
+
+
+ORIGINAL = '''# Heading
+
+- [ ] A todo
+- [ ] Another todo
+
+Some text
+that spans
+several lines
+
+A few more lines
+to separate
+the changes
+into hunks
+
+## Subheading
+
+More content
+'''
+
+MODIFIED = '''# Heading
+
+- [X] A todo
+- [ ] Another todo
+
+Some text
+that spans
+a few lines
+
+A few more lines
+to separate
+the changes
+into hunks
+
+## Subheading
+
+More content
+and an extra line
+'''
+
+
+class TestPatch(unittest.TestCase):
+
+    def test_round_trip(self):
+        diff = get_unified_diff(ORIGINAL, MODIFIED)
+        assert len(parse_unified_diff(diff)) == 2
+        assert apply_patch(ORIGINAL, diff) == MODIFIED
+        assert apply_patch(MODIFIED, diff, reverse=True) == ORIGINAL
+
+    def test_create_and_delete(self):
+        diff = get_unified_diff('', ORIGINAL)
+        assert apply_patch('', diff) == ORIGINAL
+        assert apply_patch(ORIGINAL, diff, reverse=True) == ''
+
+    def test_missing_trailing_newline(self):
+        diff = get_unified_diff('foo\nbar', 'foo\nbaz')
+        assert apply_patch('foo\nbar', diff) == 'foo\nbaz\n'
+
+    def test_content_that_looks_like_a_diff(self):
+        original = '--- a\n+++ b\n@@ -1 +1 @@\n'
+        modified = '--- a\n+++ c\n@@ -1 +1 @@\n'
+        diff = get_unified_diff(original, modified)
+        assert apply_patch(original, diff) == modified
+        assert apply_patch(modified, diff, reverse=True) == original
+
+    def test_offset(self):
+        diff = get_unified_diff(ORIGINAL, MODIFIED)
+        shifted_original = 'New first line\nAnd a second\n' + ORIGINAL
+        assert apply_patch(shifted_original, diff) == \
+            'New first line\nAnd a second\n' + MODIFIED
+
+    def test_fuzz(self):
+        diff = get_unified_diff(ORIGINAL, MODIFIED)
+        fuzzy_original = ORIGINAL.replace('# Heading', '# Renamed Heading')
+        assert apply_patch(fuzzy_original, diff) == \
+            MODIFIED.replace('# Heading', '# Renamed Heading')
+
+    def test_hunk_does_not_apply(self):
+        diff = get_unified_diff(ORIGINAL, MODIFIED)
+        with self.assertRaises(ValueError):
+            apply_patch('Completely different content\n', diff)
+
+    def test_malformed_hunk(self):
+        diff = get_unified_diff(ORIGINAL, MODIFIED)
+        with self.assertRaises(ValueError):
+            apply_patch(ORIGINAL, diff.replace('@@ -1,', '@@ -1,9'))
+        with self.assertRaises(ValueError):
+            apply_patch(ORIGINAL, diff.replace('\n-', '\n?'))
+
+    def test_apply_multiple_diffs(self):
+        versions = [ORIGINAL, MODIFIED, MODIFIED.replace('extra', 'added'),
+                    'Replaced\n']
+        diffs = [get_unified_diff(old, new)
+                 for old, new in zip(versions, versions[1:])]
+        assert apply_diffs(versions[0], diffs) == versions[-1]
+        assert apply_diffs(versions[-1], diffs[::-1], reverse=True) == \
+            versions[0]
+
+    @unittest.skipUnless(shutil.which('patch'), 'Requires GNU patch')
+    def test_matches_gnu_patch(self):
+        diffs = [get_unified_diff(ORIGINAL, MODIFIED)]
+        for reverse, content in [(False, ORIGINAL), (True, MODIFIED)]:
+            assert apply_diffs(content, diffs, reverse=reverse) == \
+                apply_diffs(content, diffs, patch_path='patch',
+                            reverse=reverse)
@@ -17,8 +17,7 @@ class TestQuestions(ShorthandTestCase, reset_per_method=False):
     def get_question_results(self, question_status='all', directory_filter=None, stamp=False):
         return _get_questions(notes_directory=self.notes_dir,
                               question_status=question_status,
-                              directory_filter=directory_filter,
-                              grep_path=self.grep_path)
+                              directory_filter=directory_filter)
 
     def test_get_unanswered_questions(self):
 
@@ -78,8 +77,7 @@ class TestStampedQuestions(ShorthandTestCase, reset_per_method=False, stamp=True
     def get_question_results(self, question_status='all', directory_filter=None, stamp=False):
         return _get_questions(notes_directory=self.notes_dir,
                               question_status=question_status,
-                              directory_filter=directory_filter,
-                              grep_path=self.grep_path)
+                              directory_filter=directory_filter)
 
     def test_get_unanswered_questions(self):
 
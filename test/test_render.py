@@ -0,0 +1,162 @@
+import os
+import logging
+from unittest import mock
+
+from shorthand.frontend import render, render_cache
+from shorthand.frontend.render import get_line_span, get_rendered_markdown, \
+                                      render_block
+from shorthand.frontend.render_cache import RenderCache, \
+                                            get_render_cache_dir, \
+                                            get_render_cache_key
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+def rendered(content):
+    return {'file_content': content, 'toc_content': ''}
+
+
+class TestRenderCache(ShorthandTestCase):
+    '''Test caching rendered notes
+    '''
+
+    def test_cached_rendering(self):
+        expected = get_rendered_markdown(self.server.get_note('/todos.note'),
+                                         '/todos.note')
+        with mock.patch.object(render_cache, 'get_rendered_markdown',
+                               wraps=get_rendered_markdown) as render:
+            assert self.server.get_rendered_markdown('/todos.note') == \
+                expected
+            assert self.server.get_rendered_markdown('/todos.note') == \
+                expected
+            assert render.call_count == 1
+
+            # Edited notes are rendered again
+            self.server.update_note('/todos.note', '# Heading\n')
+            assert self.server.get_rendered_markdown('/todos.note') == \
+                get_rendered_markdown('# Heading\n', '/todos.note')
+            assert render.call_count == 2
+
+        stats = self.server.get_render_cache_stats()
+        assert (stats['hits'], stats['misses']) == (1, 2)
+
+        # Renderings are keyed by the note path and renderer version
+        key = get_render_cache_key('/todos.note', '# Heading\n')
+        assert key != get_render_cache_key('/other.note', '# Heading\n')
+        with mock.patch.object(render_cache, 'RENDERER_VERSION', -1):
+            assert key != get_render_cache_key('/todos.note', '# Heading\n')
+
+        self.server.update_config({'render_cache_bytes': 0})
+        assert self.server.get_render_cache_stats() is None
+
+    def test_eviction(self):
+        cache = RenderCache(max_size=10)
+        cache.put('a', rendered('aaaa'))
+        cache.put('b', rendered('bbbb'))
+        assert cache.get('a') == rendered('aaaa')
+        # The least recently used entry is evicted first
+        cache.put('c', rendered('cccc'))
+        assert cache.get('b') is None
+        assert cache.get('a') == rendered('aaaa')
+        # Entries larger than the cache aren't stored
+        cache.put('d', rendered('d' * 11))
+        assert cache.get('d') is None
+        assert cache.get_stats()['size'] == 8
+
+    def test_spilling(self):
+        spill_dir = get_render_cache_dir(self.notes_dir)
+        cache = RenderCache(max_size=100, spill_dir=spill_dir)
+        cache.put('a', rendered('a' * 60))
+        cache.put('b', rendered('b' * 60))
+        assert os.listdir(spill_dir) == ['a.json']
+
+        # Spilled entries are loaded back into memory
+        assert cache.get('a') == rendered('a' * 60)
+        assert cache.get_stats()['spill_hits'] == 1
+        assert sorted(os.listdir(spill_dir)) == ['a.json', 'b.json']
+
+        # The least recently spilled entries are removed from disk
+        for key in 'cdefghijkl':
+            cache.put(key, rendered(key * 60))
+        spill_size = sum(os.path.getsize(f'{spill_dir}/{name}')
+                         for name in os.listdir(spill_dir))
+        assert 0 < spill_size <= cache.max_spill_size
+        assert 'a.json' not in os.listdir(spill_dir)
+
+
+def render_whole_note(content, note_path):
+    '''Render a note as a single block, without any caching
+    '''
+    block = render_block(content.split('\n'), note_path)
+    html_lines = list(block.html_lines)
+    for html_idx, span_whitespace, line_idx in block.line_spans:
+        html_lines[html_idx] = get_line_span(span_whitespace, line_idx + 1)
+    return {'file_content': '\n'.join(html_lines),
+            'toc_content': '\n'.join(block.toc_lines)}
+
+
+class TestBlockRendering(ShorthandTestCase):
+    '''Test rendering notes in separately cached blocks
+    '''
+
+    def setup_method(self, method):
+        super().setup_method(method)
+        render._rendered_block_cache.clear()
+
+    def get_note_content(self):
+        sections = []
+        for idx in range(20):
+            sections.append(f'# Section {idx}\n' +
+                            '\n'.join(f'- line {line} of {idx} :tag:'
+                                      for line in range(60)) +
+                            f'\n[ ] todo {idx}\n```\n# not a heading\n```\n'
+                            f'$$\nx = {idx}\n$$\n')
+        return '\n'.join(sections)
+
+    def test_matches_full_render(self):
+        for note_path in ['/todos.note', '/questions.note',
+                          '/definitions.note', '/rec.note',
+                          '/section/mixed.note']:
+            content = self.server.get_note(note_path)
+            assert get_rendered_markdown(content, note_path) == \
+                render_whole_note(content, note_path)
+
+        content = self.get_note_content()
+        assert get_rendered_markdown(content, '/a.note') == \
+            render_whole_note(content, '/a.note')
+        # An unclosed fence changes how every block after it is rendered
+        content = content.replace('[ ] todo 3\n', '[ ] todo 3\n```\n')
+        assert get_rendered_markdown(content, '/a.note') == \
+            render_whole_note(content, '/a.note')
+
+    def test_only_changed_blocks_rendered(self):
+        content = self.get_note_content()
+        get_rendered_markdown(content, '/a.note')
+
+        with mock.patch.object(render, 'render_block',
+                               wraps=render_block) as rendered_blocks:
+            # Lines after the edit are renumbered without rendering them
+            content = 'New first line\n' + \
+                content.replace('line 30 of 10', 'edited line')
+            assert get_rendered_markdown(content, '/a.note') == \
+                render_whole_note(content, '/a.note')
+            assert rendered_blocks.call_count == 2
+
+    def test_insert_without_headings(self):
+        # Blocks are split from their content rather than their position,
+        # so inserting a line only changes the blocks around it
+        lines = []
+        for idx in range(2000):
+            lines.append(f'- item {idx} :tag:' if idx % 7 else '')
+        content = '\n'.join(lines)
+        get_rendered_markdown(content, '/a.note')
+
+        with mock.patch.object(render, 'render_block',
+                               wraps=render_block) as rendered_blocks:
+            content = 'New first line\n' + content
+            assert get_rendered_markdown(content, '/a.note') == \
+                render_whole_note(content, '/a.note')
+            assert rendered_blocks.call_count <= 2
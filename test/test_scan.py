@@ -0,0 +1,83 @@
+import os
+import logging
+
+from shorthand.utils.patterns import ALL_QUESTIONS, CATCH_ALL_PATTERN, \
+                                     VALID_INCOMPLETE_PATTERN, \
+                                     VALID_COMPLETE_PATTERN
+from shorthand.utils.scan import ScanMatch, literal_filters, scan_notes
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestScan(ShorthandTestCase, reset_per_method=False):
+    '''Test the in-process scan engine used in place of grep
+    '''
+
+    def test_matches_are_ordered(self):
+        matches = list(scan_notes(self.notes_dir, CATCH_ALL_PATTERN))
+        self.assertTrue(matches)
+        self.assertEqual(
+            matches,
+            sorted(matches, key=lambda match: (match.file_path,
+                                               match.line_number)))
+        for match in matches:
+            self.assertIsInstance(match, ScanMatch)
+            self.assertTrue(match.file_path.startswith('/'))
+
+    def test_serial_and_threaded_scans_match(self):
+        serial = list(scan_notes(self.notes_dir, r'\w', workers=0))
+        threaded = list(scan_notes(self.notes_dir, r'\w', workers=3))
+        self.assertEqual(serial, threaded)
+
+    def test_directory_filter(self):
+        matches = list(scan_notes(self.notes_dir, r'\w',
+                                  directory_filter='section'))
+        self.assertTrue(matches)
+        for match in matches:
+            self.assertTrue(match.file_path.startswith('/section/'))
+
+    def test_note_paths(self):
+        matches = list(scan_notes(self.notes_dir, r'\w',
+                                  note_paths=['/todos.note']))
+        self.assertTrue(matches)
+        self.assertEqual({match.file_path for match in matches},
+                         {'/todos.note'})
+
+    def test_filters_and_excludes(self):
+        filters = literal_filters(['cooking'])
+        for match in scan_notes(self.notes_dir, CATCH_ALL_PATTERN,
+                                filters=filters):
+            self.assertIn('cooking', match.line.lower())
+
+        excludes = [VALID_INCOMPLETE_PATTERN, VALID_COMPLETE_PATTERN]
+        all_todos = list(scan_notes(self.notes_dir, CATCH_ALL_PATTERN))
+        unstamped_todos = list(scan_notes(self.notes_dir, CATCH_ALL_PATTERN,
+                                          excludes=excludes))
+        self.assertLess(len(unstamped_todos), len(all_todos))
+
+    def test_next_line(self):
+        with open(os.path.join(self.notes_dir, 'questions.note')) as f:
+            lines = f.read().split('\n')
+
+        for match in scan_notes(self.notes_dir, ALL_QUESTIONS,
+                                note_paths=['/questions.note'],
+                                with_next_line=True):
+            self.assertEqual(match.line, lines[match.line_number - 1])
+            if match.line_number < len(lines):
+                self.assertEqual(match.next_line, lines[match.line_number])
+
+    def test_hidden_directories_are_skipped(self):
+        hidden_dir = os.path.join(self.notes_dir, '.hidden')
+        os.makedirs(hidden_dir, exist_ok=True)
+        with open(os.path.join(hidden_dir, 'secret.note'), 'w') as f:
+            f.write('- [ ] a hidden todo\n')
+
+        try:
+            matches = list(scan_notes(self.notes_dir, 'a hidden todo'))
+            self.assertEqual(matches, [])
+        finally:
+            os.remove(os.path.join(hidden_dir, 'secret.note'))
+            os.rmdir(hidden_dir)
@@ -1,10 +1,32 @@
 import os
-import nltk
+import shutil
+import sqlite3
 import logging
+from collections import Counter
+from unittest import mock
 
 from shorthand.search import _search_full_text, _search_filenames, \
                              _record_file_view
-from shorthand.frontend.typeahead import _get_typeahead_suggestions, _update_ngram_database
+from shorthand.search_index import TermVocabulary, \
+                                   _search_full_text_indexed, \
+                                   _refresh_search_index, \
+                                   _sync_search_index_path
+from shorthand.search_sqlite import _search_full_text_sqlite, \
+                                    _sync_sqlite_search_path, \
+                                    get_match_highlights, get_search_db_path
+from shorthand.elements.extract import _extract_note
+from shorthand.frontend.tokenize import tokenize_sentences
+from shorthand.frontend.typeahead import NgramCountReducer, PrefixIndex, \
+                                         _count_ngrams, \
+                                         _get_typeahead_suggestions, \
+                                         _update_ngram_database, \
+                                         _write_ngram_generation, \
+                                         count_note_ngrams, \
+                                         get_ngram_db_dir, \
+                                         get_ngram_state_path
+from shorthand.frontend.typeahead_sources import _get_typeahead_completions, \
+                                                 _sync_typeahead_sources
+from shorthand.utils.paths import _list_note_paths
 
 from utils import ShorthandTestCase, setup_environment
 from results_unstamped import SEARCH_RESULTS_FOOD, \
@@ -91,14 +113,201 @@ class TestSearch(ShorthandTestCase, reset_per_method=False):
         # TODO- Test directory filter
 
 
+class TestIndexedSearch(TestSearch, reset_per_method=False):
+    """Test full-text search using the search index"""
+
+    def get_search_results(self, query_string, case_sensitive):
+        return _search_full_text_indexed(
+                    notes_directory=self.notes_dir,
+                    query_string=query_string,
+                    case_sensitive=case_sensitive)
+
+    def test_matches_grep(self):
+        '''Test that partial words, phrases, and punctuation
+           match the same lines as the grep-based search
+        '''
+        test_queries = ['foo', 'ood', 'Diet', '"ced die"', '"part of"',
+                        '#', '"# " the', 'note the', 'zzzz']
+        for query_string in test_queries:
+            for case_sensitive in [False, True]:
+                assert _search_full_text_indexed(
+                    self.notes_dir, query_string, case_sensitive) == \
+                    _search_full_text(self.notes_dir, query_string,
+                                      case_sensitive,
+                                      grep_path=self.grep_path)
+
+    def test_aggregated_ranking(self):
+        '''Test that aggregated results cover the same matches
+           and are ordered by relevance
+        '''
+        indexed_results = _search_full_text_indexed(
+            self.notes_dir, 'food', aggregate_by_file=True)
+        grep_results = _search_full_text(
+            self.notes_dir, 'food', aggregate_by_file=True,
+            grep_path=self.grep_path)
+        self.assertCountEqual(indexed_results, grep_results)
+
+    def test_incremental_update(self):
+        '''Test that synced changes to notes are picked up by the index
+        '''
+        _refresh_search_index(self.notes_dir)
+        assert os.path.exists(f'{self.notes_dir}/.shorthand/search/files.json')
+
+        new_note_path = f'{self.notes_dir}/indexed-search.note'
+        with open(new_note_path, 'w') as f:
+            f.write('# Indexing\nA quixotic new line\n')
+        # Notes are only re-indexed once their path is synced
+        assert self.get_search_results('quixotic', False) == []
+        _sync_search_index_path(self.notes_dir, '/indexed-search.note')
+        assert self.get_search_results('quixotic', False) == [{
+            'file_path': '/indexed-search.note',
+            'line_number': '2',
+            'match_content': 'A quixotic new line'
+        }]
+
+        os.makedirs(f'{self.notes_dir}/indexed')
+        os.rename(new_note_path, f'{self.notes_dir}/indexed/moved.note')
+        _sync_search_index_path(self.notes_dir, '/indexed-search.note')
+        _sync_search_index_path(self.notes_dir, '/indexed')
+        assert self.get_search_results('quixotic', False) == [{
+            'file_path': '/indexed/moved.note',
+            'line_number': '2',
+            'match_content': 'A quixotic new line'
+        }]
+
+        shutil.rmtree(f'{self.notes_dir}/indexed')
+        _sync_search_index_path(self.notes_dir, '/indexed')
+        assert self.get_search_results('quixotic', False) == []
+
+    def test_vocabulary(self):
+        '''Test that query terms expand to the same indexed terms
+           as checking every term
+        '''
+        terms = ['food', 'seafood', 'foodie', 'fool', 'of', 'odd', 'do']
+        vocabulary = TermVocabulary(terms[:4])
+        for term in terms[4:]:
+            vocabulary.add(term)
+        vocabulary.remove('foodie')
+        terms.remove('foodie')
+
+        for query_term in ['food', 'foo', 'od', 'o', 'eaf', 'zzz']:
+            assert sorted(vocabulary.expand(query_term)) == \
+                sorted(term for term in terms if query_term in term)
+            assert sorted(vocabulary.expand(query_term, 'prefix')) == \
+                sorted(term for term in terms if term.startswith(query_term))
+            assert sorted(vocabulary.expand(query_term, 'suffix')) == \
+                sorted(term for term in terms if term.endswith(query_term))
+
+
+class TestSqliteSearch(TestSearch, reset_per_method=False):
+    """Test full-text search using the SQLite search backend"""
+
+    def get_search_results(self, query_string, case_sensitive):
+        return _search_full_text_sqlite(
+                    notes_directory=self.notes_dir,
+                    query_string=query_string,
+                    case_sensitive=case_sensitive)
+
+    def test_matches_grep(self):
+        '''Test that partial words, phrases, and punctuation
+           match the same lines as the grep-based search
+        '''
+        test_queries = ['foo', 'ood', 'Diet', '"ced die"', '"part of"',
+                        '#', '"# " the', 'note the', '100%', 'zzzz']
+        for query_string in test_queries:
+            for case_sensitive in [False, True]:
+                assert _search_full_text_sqlite(
+                    self.notes_dir, query_string, case_sensitive) == \
+                    _search_full_text(self.notes_dir, query_string,
+                                      case_sensitive,
+                                      grep_path=self.grep_path)
+        self.assertCountEqual(
+            _search_full_text_sqlite(self.notes_dir, 'food',
+                                     aggregate_by_file=True),
+            _search_full_text(self.notes_dir, 'food', aggregate_by_file=True,
+                              grep_path=self.grep_path))
+
+    def test_highlights(self):
+        assert get_match_highlights('Food, glorious food', ['food']) == \
+            [(0, 4), (15, 19)]
+        assert get_match_highlights('Food, glorious food', ['food'],
+                                    case_sensitive=True) == [(15, 19)]
+        assert get_match_highlights('balanced diet', ['balanced', 'ced d']) \
+            == [(0, 10)]
+
+        search_results = _search_full_text_sqlite(
+            self.notes_dir, '"balanced diet"', include_highlights=True)
+        assert search_results
+        for result in search_results:
+            start, end = result['highlights'][0]
+            assert result['match_content'][start:end].lower() == \
+                'balanced diet'
+
+    def test_sync(self):
+        '''Test that notes changed on disk are picked up once synced
+        '''
+        _search_full_text_sqlite(self.notes_dir, 'food')
+        new_note_path = f'{self.notes_dir}/sqlite-search.note'
+        with open(new_note_path, 'w') as f:
+            f.write('# Indexing\nA quixotic new line\n')
+        assert self.get_search_results('quixotic', False) == []
+
+        _sync_sqlite_search_path(self.notes_dir, '/sqlite-search.note')
+        assert self.get_search_results('quixotic', False) == [{
+            'file_path': '/sqlite-search.note',
+            'line_number': '2',
+            'match_content': 'A quixotic new line'
+        }]
+
+        os.remove(new_note_path)
+        _sync_sqlite_search_path(self.notes_dir, '/sqlite-search.note')
+        assert self.get_search_results('quixotic', False) == []
+
+    def test_sync_before_build(self):
+        '''Test that syncing a note before the first search doesn't
+           leave the database holding only that note
+        '''
+        for suffix in ['', '-wal', '-shm']:
+            db_path = get_search_db_path(self.notes_dir) + suffix
+            if os.path.exists(db_path):
+                os.remove(db_path)
+        new_note_path = f'{self.notes_dir}/sqlite-unbuilt.note'
+        with open(new_note_path, 'w') as f:
+            f.write('A quixotic unbuilt note\n')
+        try:
+            _sync_sqlite_search_path(self.notes_dir, '/sqlite-unbuilt.note')
+            assert self.get_search_results('food', False) == \
+                _search_full_text(self.notes_dir, 'food',
+                                  grep_path=self.grep_path)
+            assert len(self.get_search_results('quixotic', False)) == 1
+        finally:
+            os.remove(new_note_path)
+            _sync_sqlite_search_path(self.notes_dir, '/sqlite-unbuilt.note')
+
+    def test_server_sync(self):
+        '''Test that changes made through the server are synced
+        '''
+        self.server.update_config({'search_backend': 'sqlite'})
+        self.server.create_file('/server-sync.note')
+        self.server.update_note('/server-sync.note', 'A quixotic note')
+        assert len(self.server.search_full_text('quixotic')) == 1
+
+        self.server.move_file_or_directory('/server-sync.note',
+                                           '/section/server-sync.note')
+        assert self.server.search_full_text('quixotic')[0]['file_path'] == \
+            '/section/server-sync.note'
+
+        self.server.delete_file('/section/server-sync.note')
+        assert self.server.search_full_text('quixotic') == []
+
+
 class TestFileFinder(ShorthandTestCase, reset_per_method=False):
 
     def get_file_search_results(self, prefer_recent, query_string, case_sensitive):
         return _search_filenames(
                     notes_directory=self.notes_dir,
                     prefer_recent_files=prefer_recent,
-                    query_string=query_string, case_sensitive=case_sensitive,
-                    grep_path=self.grep_path)
+                    query_string=query_string, case_sensitive=case_sensitive)
 
     def search_helper(self, query_string, case_sensitive=False):
         '''A sort-of model to test the implementation against
@@ -196,7 +405,6 @@ class TestTypeahead(ShorthandTestCase, reset_per_method=False):
         cls.notes_dir = cls.config['notes_directory']
         cls.grep_path = cls.config['grep_path']
         cls.find_path = cls.config['find_path']
-        nltk.download('punkt_tab')
         _update_ngram_database(cls.notes_dir)
 
     def get_typeahead_results(self, string):
@@ -227,3 +435,204 @@ class TestTypeahead(ShorthandTestCase, reset_per_method=False):
 
         results = self.get_typeahead_results('"the best apple p')
         assert results == []
+
+
+class TestTypeaheadSources(ShorthandTestCase):
+
+    def get_completions(self, query_string, **sources):
+        return _get_typeahead_completions(self.notes_dir, query_string,
+                                          sources)
+
+    def test_sources(self):
+        completions = self.get_completions('', paths=20, tags=20,
+                                           definitions=20)
+        assert set(completions['paths']) == \
+            set(_list_note_paths(self.notes_dir))
+        assert set(completions['tags']) == set(self.server.get_tags())
+        assert set(completions['definitions']) == set(
+            definition['term'] for definition in self.server.get_definitions())
+
+        # Each source has its own limit
+        completions = self.get_completions('f', tags=1, definitions=5)
+        assert completions == {'tags': ['food'], 'definitions': ['food']}
+        assert self.get_completions(':fo', tags=5) == \
+            {'tags': ['food', 'foo']}
+        assert self.get_completions('sec', paths=5) == \
+            {'paths': ['/section/mixed.note']}
+
+        with self.assertRaises(ValueError):
+            self.get_completions('f', unknown=5)
+
+    def test_recent_paths(self):
+        assert self.get_completions('/', paths=2)['paths'] == \
+            ['/bugs.note', '/definitions.note']
+        self.server.record_file_view('/todos.note')
+        assert self.get_completions('/', paths=2)['paths'] == \
+            ['/todos.note', '/bugs.note']
+
+    def test_incremental_refresh(self):
+        self.get_completions('', tags=5)
+
+        # Only changed notes are parsed again
+        self.server.create_file('/new.note')
+        self.server.update_note('/new.note', '- {zebra} An animal :zoology:')
+        with mock.patch('shorthand.frontend.typeahead_sources._extract_note',
+                        wraps=_extract_note) as extract:
+            completions = self.get_completions('z', paths=5, tags=5,
+                                               definitions=5)
+        assert extract.call_count == 1
+        assert completions == {'paths': [], 'tags': ['zoology'],
+                               'definitions': ['zebra']}
+
+        # Terms are removed along with the notes they were in
+        self.server.delete_file('/new.note')
+        assert self.get_completions('z', tags=5, definitions=5) == \
+            {'tags': [], 'definitions': []}
+
+    def test_reported_changes(self):
+        self.get_completions('', tags=5)
+
+        # Notes changed outside of the server are only checked once they
+        # are reported, without listing every note
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('- {zebra} An animal :zoology:')
+        with mock.patch('shorthand.frontend.typeahead_sources.'
+                        '_list_note_paths') as list_note_paths:
+            assert self.get_completions('z', tags=5) == {'tags': []}
+            _sync_typeahead_sources(self.notes_dir, ['/new.note'])
+            assert self.get_completions('z', paths=5, tags=5) == \
+                {'paths': [], 'tags': ['zoology']}
+            assert not list_note_paths.called
+
+        # Every note is checked again once in a while
+        os.remove(f'{self.notes_dir}/new.note')
+        with mock.patch('shorthand.frontend.typeahead_sources.'
+                        'TYPEAHEAD_RESCAN_SECONDS', 0):
+            assert self.get_completions('z', tags=5) == {'tags': []}
+
+
+class TestPrefixIndex(ShorthandTestCase):
+
+    def test_prefix_search(self):
+        ranked_terms = ['the', 'to', 'then', 'that', 'tomato', 'tomb',
+                        'apple', 'tom']
+        index = PrefixIndex(ranked_terms, top_k=3)
+        assert index.search('t', limit=3) == ['the', 'to', 'then']
+        assert index.search('t', limit=5) == ranked_terms[:5]
+        assert index.search('tom', limit=3) == ['tomato', 'tomb', 'tom']
+        assert index.search('toma', limit=3) == ['tomato']
+        assert index.search('', limit=2) == ['the', 'to']
+        assert index.search('x') == []
+        assert index.search('t', limit=0) == []
+
+        # Longer prefixes give the same results as a full scan
+        for prefix in ['tom', 'tomb', 'th', 'the', 'then', 'thenx']:
+            assert index.search(prefix, limit=10) == \
+                [term for term in ranked_terms if term.startswith(prefix)]
+
+    def test_reloading_generations(self):
+        ngram_db_dir = get_ngram_db_dir(self.notes_dir)
+        os.makedirs(ngram_db_dir)
+        assert _get_typeahead_suggestions(self.notes_dir, 'ap') == []
+
+        def write_database(unigrams):
+            for ngram_type, terms in [('unigrams', unigrams),
+                                      ('bigrams', []), ('trigrams', [])]:
+                with open(f'{ngram_db_dir}/{ngram_type}.txt', 'w') as f:
+                    f.write(''.join(f'{term}\n' for term in terms))
+            _write_ngram_generation(ngram_db_dir)
+
+        write_database(['apple', 'apricot'])
+        assert _get_typeahead_suggestions(self.notes_dir, 'ap') == \
+            ['apple', 'apricot']
+        assert _get_typeahead_suggestions(self.notes_dir, 'eat ap',
+                                          limit=1) == ['eat apple']
+
+        write_database(['apricot', 'apple', 'application'])
+        assert _get_typeahead_suggestions(self.notes_dir, 'ap') == \
+            ['apricot', 'apple', 'application']
+
+
+class TestNgramUpdates(ShorthandTestCase):
+
+    def get_unigrams(self):
+        with open(f'{get_ngram_db_dir(self.notes_dir)}/unigrams.txt') as f:
+            return f.read().splitlines()
+
+    def test_incremental_updates(self):
+        _update_ngram_database(self.notes_dir)
+        ngram_db_dir = get_ngram_db_dir(self.notes_dir)
+        generation_path = f'{ngram_db_dir}/generation'
+        generation_mtime = os.stat(generation_path).st_mtime_ns
+        assert 'zucchini' not in self.get_unigrams()
+
+        # Only changed notes are counted again
+        self.server.update_note('/todos.note', 'zucchini zucchini zucchini '
+                                               'zucchini zucchini zucchini')
+        with mock.patch('shorthand.frontend.typeahead.count_note_ngrams',
+                        wraps=count_note_ngrams) as count:
+            _update_ngram_database(self.notes_dir)
+        assert count.call_count == 1
+        assert 'zucchini' in self.get_unigrams()
+        assert os.stat(generation_path).st_mtime_ns != generation_mtime
+        assert _get_typeahead_suggestions(self.notes_dir, 'zucc') == \
+            ['zucchini']
+
+        # Nothing is rewritten when nothing changed
+        generation_mtime = os.stat(generation_path).st_mtime_ns
+        _update_ngram_database(self.notes_dir)
+        assert os.stat(generation_path).st_mtime_ns == generation_mtime
+
+        # The counts for deleted notes are removed, and only the reported
+        # paths are checked
+        self.server.delete_file('/todos.note')
+        with mock.patch('shorthand.frontend.typeahead._list_note_paths') \
+                as list_note_paths:
+            _update_ngram_database(self.notes_dir, paths=['/todos.note'])
+            assert not list_note_paths.called
+        assert 'zucchini' not in self.get_unigrams()
+        connection = sqlite3.connect(get_ngram_state_path(ngram_db_dir))
+        try:
+            note_paths = {path for path, in connection.execute(
+                'SELECT path FROM notes')}
+        finally:
+            connection.close()
+        assert note_paths == set(_list_note_paths(self.notes_dir))
+
+    def test_parallel_counts(self):
+        note_sizes = {note_path: os.path.getsize(f'{self.notes_dir}{note_path}')
+                      for note_path in _list_note_paths(self.notes_dir)}
+        sequential_notes, sequential_totals = _count_ngrams(
+            self.notes_dir, note_sizes, workers=1)
+
+        # Small shards split the notes across several worker processes
+        parallel_notes, parallel_totals = _count_ngrams(
+            self.notes_dir, note_sizes, workers=2, max_shard_bytes=256)
+        assert parallel_notes == sequential_notes
+        assert parallel_totals == sequential_totals
+        assert sequential_totals['unigrams']
+
+    def test_count_reduction(self):
+        reducer = NgramCountReducer()
+        for idx in range(7):
+            reducer.add({'unigrams': Counter({'a': 1, str(idx): idx}),
+                         'bigrams': Counter(), 'trigrams': Counter()})
+        # Partial totals are merged with others of the same size
+        assert [counts is not None for counts in reducer.levels] == \
+            [True, True, True]
+        totals = reducer.result()
+        assert totals['unigrams'] == Counter(
+            {'a': 7, **{str(idx): idx for idx in range(1, 7)}})
+
+    def test_regex_tokenizer(self):
+        content = 'First line. Has two sentences!\n\n   \nwhat is this?  ok\n'
+        assert list(tokenize_sentences(content)) == [
+            ['First', 'line.'], ['Has', 'two', 'sentences!'],
+            ['what', 'is', 'this?'], ['ok']]
+        counts = count_note_ngrams(content)
+        assert counts['unigrams'] == {'first': 1, 'has': 1, 'two': 1,
+                                      'what': 1, 'is': 1, 'ok': 1}
+        assert counts['bigrams'] == {'has two': 1, 'what is': 1}
+        assert counts['trigrams'] == {}
+        with self.assertRaises(ValueError):
+            list(tokenize_sentences(content, 'unknown'))
@@ -45,6 +45,26 @@ class TestServerClass(ShorthandTestCase):
         # Ensure the config is not actually updated
         assert self.server.get_config() == clean_and_validate_config(new_config)
 
+    def test_reload_config_if_changed(self):
+        # Nothing changed since the server was created
+        handlers = list(self.server.log.handlers)
+        assert not self.server.reload_config_if_changed()
+
+        # Reloading without changes to the logging config keeps the
+        # existing log handlers
+        self.server.reload_config()
+        assert self.server.log.handlers == handlers
+
+        # Changes to the config file are picked up
+        new_config = copy.deepcopy(self.config)
+        new_config['log_level'] = 'warning'
+        self.write_config(new_config)
+        os.utime(self.server_config_path,
+                 ns=(0, self.server.config_mtime + 1_000_000_000))
+        assert self.server.reload_config_if_changed()
+        assert self.server.get_config() == clean_and_validate_config(new_config)
+        assert not self.server.reload_config_if_changed()
+
     def test_update_config(self):
         # Test a valid update
         update = {
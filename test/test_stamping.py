@@ -1,9 +1,11 @@
+import os
 import logging
 from datetime import datetime
 
 from shorthand.elements.todos import _get_todos
 from shorthand.elements.questions import _get_questions
-from shorthand.stamping import _stamp_notes, _stamp_raw_note
+from shorthand.stamping import STAMPING_MANIFEST_PATH, _stamp_notes, \
+                               _stamp_raw_note
 from shorthand.notes import _get_note
 
 from utils import ShorthandTestCase
@@ -20,8 +22,7 @@ class TestStamping(ShorthandTestCase, stamp=True, reset_per_method=False):
     def test_todos_stamped(self):
         incomplete_todos = _get_todos(
             notes_directory=self.notes_dir,
-            todo_status='incomplete',
-            grep_path=self.grep_path)
+            todo_status='incomplete')
 
         for todo in incomplete_todos:
             assert todo.get('start_date')
@@ -29,12 +30,10 @@ class TestStamping(ShorthandTestCase, stamp=True, reset_per_method=False):
 
         complete_todos = _get_todos(
             notes_directory=self.notes_dir,
-            todo_status='complete',
-            grep_path=self.grep_path)
+            todo_status='complete')
         skipped_todos = _get_todos(
             notes_directory=self.notes_dir,
-            todo_status='skipped',
-            grep_path=self.grep_path)
+            todo_status='skipped')
 
         for todo in complete_todos + skipped_todos:
             assert todo.get('start_date')
@@ -49,8 +48,7 @@ class TestStamping(ShorthandTestCase, stamp=True, reset_per_method=False):
 
         unanswered_qs = _get_questions(
             notes_directory=self.notes_dir,
-            question_status='unanswered',
-            grep_path=self.grep_path)
+            question_status='unanswered')
 
         for question in unanswered_qs:
             assert question.get('question_date')
@@ -58,8 +56,7 @@ class TestStamping(ShorthandTestCase, stamp=True, reset_per_method=False):
 
         answered_qs = _get_questions(
             notes_directory=self.notes_dir,
-            question_status='answered',
-            grep_path=self.grep_path)
+            question_status='answered')
 
         for question in answered_qs:
             assert question.get('question_date')
@@ -68,8 +65,7 @@ class TestStamping(ShorthandTestCase, stamp=True, reset_per_method=False):
     def test_restamp(self):
         changes = _stamp_notes(self.notes_dir,
                                stamp_todos=True, stamp_today=True,
-                               stamp_questions=True, stamp_answers=True,
-                               grep_path=self.grep_path)
+                               stamp_questions=True, stamp_answers=True)
         assert not changes
 
     def test_stamp_raw_note(self):
@@ -88,3 +84,29 @@ Some text to keep'''
         * @ ({date}) An Answer
 - [X] ({date} -> {date}) A completed Todo
 Some text to keep'''.format(date=datetime.now().isoformat()[:10])
+
+    def test_incremental_stamping(self):
+        assert os.path.exists(f'{self.notes_dir}/{STAMPING_MANIFEST_PATH}')
+        date = datetime.now().isoformat()[:10]
+
+        new_note_path = f'{self.notes_dir}/incremental.note'
+        with open(new_note_path, 'w') as f:
+            f.write('# Incremental \\today\n- [] A new todo\n'
+                    '- ? A new question\n')
+
+        # Only the new note is changed, with all stamps applied at once
+        changes = _stamp_notes(self.notes_dir, stamp_questions=False)
+        assert list(changes.keys()) == [new_note_path]
+        assert [change['type'] for change in changes[new_note_path]] == \
+            ['incomplete_todo', 'date_placeholder']
+        assert not _stamp_notes(self.notes_dir, stamp_questions=False)
+
+        # Enabling another type of stamp checks unchanged notes again
+        changes = _stamp_notes(self.notes_dir)
+        assert changes == {new_note_path: [{
+            'type': 'question',
+            'line_number': 3,
+            'before': '- ? A new question',
+            'after': f'- ? ({date}) A new question'
+        }]}
+        assert not _stamp_notes(self.notes_dir)
@@ -0,0 +1,164 @@
+import os
+import time
+import logging
+import unittest
+from unittest import mock
+
+from shorthand import element_index
+from shorthand.notes import _get_note
+from shorthand.utils.paths import _get_changed_note_paths
+from shorthand.watcher import NotesWatcher, coalesce_changes, \
+                              is_inotify_supported
+
+from utils import ShorthandTestCase
+
+
+log = logging.getLogger(__name__)
+
+
+class TestCoalesceChanges(unittest.TestCase):
+
+    def test_coalesce_changes(self):
+        events = coalesce_changes([
+            ('created', '/new.note', None, False),
+            ('modified', '/new.note', None, False),
+            ('modified', '/todos.note', None, False),
+            ('modified', '/todos.note', None, False),
+            ('created', '/temp.txt', None, False),
+            ('deleted', '/temp.txt', None, False),
+            ('deleted', '/image.png', None, False),
+            ('created', '/image.png', None, False),
+            ('moved', '/section', '/renamed', True),
+        ])
+        assert events == [
+            {'type': 'created', 'target': 'note', 'path': '/new.note',
+             'dest_path': None},
+            {'type': 'modified', 'target': 'note', 'path': '/todos.note',
+             'dest_path': None},
+            {'type': 'modified', 'target': 'resource',
+             'path': '/image.png', 'dest_path': None},
+            {'type': 'moved', 'target': 'directory', 'path': '/section',
+             'dest_path': '/renamed'},
+        ]
+
+
+class TestWatcher(ShorthandTestCase):
+
+    def check_backend(self, use_inotify):
+        watcher = NotesWatcher(self.notes_dir, debounce_seconds=0,
+                               use_inotify=use_inotify, poll_interval=0)
+        published = []
+        watcher.subscribe(published.extend)
+
+        try:
+            # Make sure that the changes get a new mtime when polling
+            time.sleep(0.01)
+            with open(f'{self.notes_dir}/new.note', 'w') as f:
+                f.write('# New Note\n')
+            with open(f'{self.notes_dir}/todos.note', 'a') as f:
+                f.write('\n- [] Another todo\n')
+            os.rename(f'{self.notes_dir}/section',
+                      f'{self.notes_dir}/renamed')
+            os.remove(f'{self.notes_dir}/bugs.note')
+            os.makedirs(f'{self.notes_dir}/.shorthand/state', exist_ok=True)
+            with open(f'{self.notes_dir}/.shorthand/state/hidden.json',
+                      'w') as f:
+                f.write('{}')
+
+            for _ in range(5):
+                watcher.process_changes(timeout=0.1)
+        finally:
+            watcher.backend.close()
+
+        self.assertCountEqual(published, [
+            {'type': 'created', 'target': 'note', 'path': '/new.note',
+             'dest_path': None},
+            {'type': 'modified', 'target': 'note', 'path': '/todos.note',
+             'dest_path': None},
+            {'type': 'moved', 'target': 'directory', 'path': '/section',
+             'dest_path': '/renamed'},
+            {'type': 'deleted', 'target': 'note', 'path': '/bugs.note',
+             'dest_path': None},
+        ])
+
+    def test_polling_backend(self):
+        self.check_backend(use_inotify=False)
+
+    @unittest.skipUnless(is_inotify_supported(), 'Requires inotify')
+    def test_inotify_backend(self):
+        self.check_backend(use_inotify=True)
+
+    def test_server_handles_changes(self):
+        self.server.update_config({'stamp_on_change': True})
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('- [] An unstamped todo\n')
+        with open(f'{self.notes_dir}/todos.note', 'a') as f:
+            f.write('- [] Not reported as changed\n')
+
+        self.server.handle_note_changes([
+            {'type': 'created', 'target': 'note', 'path': '/new.note',
+             'dest_path': None}])
+
+        assert '- [] ' not in _get_note(self.notes_dir, '/new.note')
+        assert '- [] Not reported' in _get_note(self.notes_dir,
+                                                '/todos.note')
+
+    def test_server_updates_changed_paths(self):
+        self.server.update_config({'element_index': True})
+        self.server.refresh_element_index()
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('[ ] A new todo\n')
+
+        # Only the changed notes are checked, without listing every note
+        with mock.patch.object(element_index, '_list_note_paths') \
+                as list_note_paths:
+            self.server.handle_note_changes([
+                {'type': 'created', 'target': 'note', 'path': '/new.note',
+                 'dest_path': None}])
+            assert not list_note_paths.called
+        index = element_index._load_element_index(self.notes_dir)
+        assert '/new.note' in index['notes']
+
+        os.remove(f'{self.notes_dir}/new.note')
+        self.server.handle_note_changes([
+            {'type': 'deleted', 'target': 'note', 'path': '/new.note',
+             'dest_path': None}])
+        index = element_index._load_element_index(self.notes_dir)
+        assert '/new.note' not in index['notes']
+
+    def test_stamped_notes_use_relative_paths(self):
+        '''Test that notes stamped after a change are indexed under their
+           path within the notes directory, not their full path
+        '''
+        self.server.update_config({'stamp_on_change': True,
+                                   'element_index': True})
+        self.server.refresh_element_index()
+        with open(f'{self.notes_dir}/new.note', 'w') as f:
+            f.write('- [] An unstamped todo\n')
+
+        self.server.handle_note_changes([
+            {'type': 'created', 'target': 'note', 'path': '/new.note',
+             'dest_path': None}])
+
+        index = element_index._load_element_index(self.notes_dir)
+        assert '/new.note' in index['notes']
+        assert not any(note_path.startswith(self.notes_dir)
+                       for note_path in index['notes'])
+
+    def test_changed_paths_outside_notes_directory(self):
+        known_note_paths = ['/todos.note', '/section/mixed.note']
+        assert _get_changed_note_paths(
+            self.notes_dir, [f'{self.notes_dir}/todos.note'],
+            known_note_paths) == {'/todos.note'}
+        assert _get_changed_note_paths(
+            self.notes_dir, ['/section/../../outside.note'],
+            known_note_paths) == set()
+
+    def test_enabling_watcher(self):
+        assert self.server.watcher is None
+        try:
+            self.server.update_config({'watch_notes': True})
+            assert self.server.watcher is not None
+        finally:
+            self.server.update_config({'watch_notes': False})
+        assert self.server.watcher is None
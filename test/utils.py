@@ -25,13 +25,23 @@ TEST_CONFIG: ShorthandConfig = {
     "log_level": "info",
     "grep_path": "grep",
     "find_path": "find",
-    "patch_path": "patch",
+    "patch_path": None,
     "default_directory": None,
     "frontend": {
         "view_history_limit": 1,
         "map_tileserver_url": 'https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
     },
-    "track_edit_history": True
+    "track_edit_history": True,
+    "element_index": False,
+    "search_backend": "grep",
+    "scan_workers": 4,
+    "watch_notes": False,
+    "stamp_on_change": False,
+    "async_history": False,
+    "typeahead_tokenizer": "regex",
+    "ngram_workers": 4,
+    "render_cache_bytes": 1048576,
+    "render_cache_spill": False
 }
 TEST_CONFIG_PATH = TEMP_DIR + '/config.json'
 